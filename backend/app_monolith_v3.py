@@ -8,11 +8,13 @@ import logging
 import sys
 import asyncio
 import json
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 from pathlib import Path
 import time
 import hashlib
+import random
+import uuid
 
 # Загружаем переменные окружения из .env файла
 from dotenv import load_dotenv
@@ -20,7 +22,7 @@ load_dotenv()
 
 # FastAPI и зависимости
 from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, UploadFile, File, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import uvicorn
@@ -69,6 +71,33 @@ except ImportError as e:
     logger.warning(f"Database modules not available: {e}")
     DATABASE_AVAILABLE = False
 
+# Общий пул клиентов AI провайдеров и кеш ответов LLM
+from services.llm.client_pool import get_client_pool
+from services.llm.response_cache import build_cache_key, get_response_cache
+from services.llm.single_flight import get_single_flight
+from services.llm.prompt_cache import cacheable_system, build_user_content, cache_usage
+from services.llm.json_stream import parse_json_response, StreamingJSONParser
+from services.llm.event_stream import get_event_broker, format_sse, parse_last_event_id, EVENT_SUBSCRIBE_WAIT, StreamInUse
+from services.llm.cancellation import CancellationToken, RequestCancelled, current_token
+from services.llm.tokenizer import count_tokens
+from services.llm.scheduler import (
+    get_scheduler, parse_deadline, PRIORITY_INTERACTIVE,
+    SchedulerOverloaded, DeadlineExceeded
+)
+from services.documents.core.document_chunker import split_into_chunks, needs_chunking, analyze_in_chunks
+from services.documents.core.extraction_pool import get_extraction_pool, ExtractionTimeout, ExtractionFailed
+from services.documents.core.page_sharding import (
+    count_pages, page_batches, merge_page_results, summarize_pages, extract_best_text_pages
+)
+from services.documents.core.page_ocr import ocr_job, ocr_pages, apply_ocr, image_only_pages
+from services.documents.core.extraction_cache import get_extraction_cache, file_hash
+from services.llm.metrics import register_scheduler_metrics, render_metrics
+from services.documents.core.extraction_metrics import register_extraction_metrics
+
+# Монолит запускает и планировщик LLM, и пул извлечения: обе очереди в /metrics
+register_scheduler_metrics()
+register_extraction_metrics()
+
 # ========================================
 # УТИЛИТЫ ДЛЯ ИЗВЛЕЧЕНИЯ ТЕКСТА
 # ========================================
@@ -76,102 +105,28 @@ except ImportError as e:
 def extract_text_from_pdf(file_path):
     """
     Reliable PDF text extraction with Cyrillic support
-    Chain: PyMuPDF (various modes) -> PyMuPDF OCR -> pdfplumber -> PyPDF2 -> OCR Tesseract
+    Chain: PyMuPDF (various modes) + OCR of image-only pages -> pdfplumber -> PyPDF2 -> OCR Tesseract
     """
     
     # Метод 1: PyMuPDF с улучшенными настройками для кириллицы
     try:
-        import fitz  # PyMuPDF
         logger.info("🔍 PyMuPDF: Начинаем извлечение с оптимизацией для кириллицы...")
         
-        doc = fitz.open(file_path)
-        text_content = []
-        total_chars = 0
-        
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            
-            # Попробуем разные методы извлечения из PyMuPDF
-            methods = [
-                ("get_text()", lambda p: p.get_text()),
-                ("get_text('text')", lambda p: p.get_text("text")),
-                ("get_text('dict')", lambda p: extract_text_from_dict(p.get_text("dict"))),
-                ("get_text('blocks')", lambda p: extract_text_from_blocks(p.get_text("blocks"))),
-            ]
-            
-            best_text = ""
-            best_score = 0
-            
-            for method_name, method in methods:
-                try:
-                    text = method(page)
-                    if text and text.strip():
-                        # Оценка качества: больше кириллических символов = лучше
-                        cyrillic_count = sum(1 for c in text if '\u0400' <= c <= '\u04FF')
-                        score = cyrillic_count * 2 + len(text.strip())
-                        
-                        if score > best_score:
-                            best_text = text
-                            best_score = score
-                            logger.info(f"  ✓ {method_name}: {len(text)} символов, кириллица: {cyrillic_count}")
-                        
-                except Exception as e:
-                    logger.debug(f"  ✗ {method_name} не сработал: {e}")
-            
-            if best_text:
-                text_content.append(best_text)
-                total_chars += len(best_text)
-        
-        doc.close()
-        
-        if text_content and total_chars > 50:  # Минимальный порог для осмысленного текста
-            result_text = '\n'.join(text_content)
-            cyrillic_count = sum(1 for c in result_text if '\u0400' <= c <= '\u04FF')
-            logger.info(f"🎉 PyMuPDF: Извлечено {total_chars} символов (кириллица: {cyrillic_count})")
-            
-            # Если кириллицы достаточно, возвращаем результат
-            if cyrillic_count > 10 or total_chars > 200:
-                return result_text
-    
-    except Exception as e:
-        logger.warning(f"⚠️ PyMuPDF основной метод не сработал: {e}")
-    
-    # Метод 2: PyMuPDF с растеризацией и OCR (для сканированных PDF)
-    try:
-        import fitz
-        import pytesseract
-        from PIL import Image
-        import io
-        
-        logger.info("🔍 PyMuPDF + OCR: Пробуем распознать изображения...")
-        
-        doc = fitz.open(file_path)
-        ocr_text_content = []
+        # Лучший из режимов PyMuPDF на каждой странице (общая реализация с шардированным разбором)
+        pages = extract_best_text_pages(file_path)
         
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            
-            # Конвертируем страницу в изображение
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom для лучшего качества
-            img_data = pix.tobytes("png")
-            
-            # OCR с tesseract
-            img = Image.open(io.BytesIO(img_data))
-            text = pytesseract.image_to_string(img, lang='rus+eng', config='--psm 1')
-            
-            if text and text.strip():
-                ocr_text_content.append(text.strip())
-                logger.info(f"  ✓ OCR страница {page_num + 1}: {len(text)} символов")
-        
-        doc.close()
+        # Метод 2: OCR только страниц без текстового слоя (сканы, в том числе приложения)
+        scanned_pages = image_only_pages(pages)
+        if scanned_pages:
+            logger.info(f"🔍 OCR: {len(scanned_pages)} страниц без текстового слоя")
+            apply_ocr(pages, ocr_job(file_path, scanned_pages))
         
-        if ocr_text_content:
-            result_text = '\n'.join(ocr_text_content)
-            logger.info(f"🎉 PyMuPDF + OCR: Извлечено {len(result_text)} символов")
+        result_text = pymupdf_pages_text(pages)
+        if result_text:
             return result_text
     
     except Exception as e:
-        logger.warning(f"⚠️ PyMuPDF + OCR не сработал: {e}")
+        logger.warning(f"⚠️ PyMuPDF основной метод не сработал: {e}")
     
     # Метод 3: pdfplumber для структурированных документов
     try:
@@ -269,33 +224,60 @@ def extract_text_from_pdf(file_path):
     logger.error("❌ Все методы извлечения текста из PDF не сработали!")
     raise Exception("Не удалось извлечь текст из PDF файла. PDF может быть поврежден, защищен паролем или содержать только изображения низкого качества.")
 
-def extract_text_from_dict(text_dict):
-    """Extract text from PyMuPDF dictionary"""
-    text_parts = []
-    try:
-        for block in text_dict.get("blocks", []):
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line.get("spans", []):
-                        text = span.get("text", "")
-                        if text.strip():
-                            text_parts.append(text)
-    except:
-        pass
-    return "\n".join(text_parts)
+def pymupdf_pages_text(pages: List[Dict[str, Any]]) -> Optional[str]:
+    """Text of the PyMuPDF pass if it is meaningful (otherwise the next method in the chain is tried)"""
+    text_content = [page["text"] for page in pages if page["text"]]
+    total_chars = sum(page["chars"] for page in pages)
+    if not text_content or total_chars <= 50:  # Минимальный порог для осмысленного текста
+        return None
+    
+    result_text = '\n'.join(text_content)
+    cyrillic_count = sum(1 for c in result_text if '\u0400' <= c <= '\u04FF')
+    logger.info(f"🎉 PyMuPDF: Извлечено {total_chars} символов (кириллица: {cyrillic_count}), "
+                f"режимы по страницам: {summarize_pages(pages)['methods']}")
+    
+    # Если кириллицы достаточно, возвращаем результат
+    if cyrillic_count > 10 or total_chars > 200:
+        return result_text
+    return None
 
-def extract_text_from_blocks(blocks):
-    """Extract text from PyMuPDF blocks"""
-    text_parts = []
-    try:
-        for block in blocks:
-            if len(block) >= 5 and isinstance(block[4], str):
-                text = block[4].strip()
-                if text:
-                    text_parts.append(text)
-    except:
-        pass
-    return "\n".join(text_parts)
+# Версия результата extract_text_from_pdf для ключа кеша извлечения
+PDF_TEXT_VERSION = "2"
+
+async def extract_text_from_pdf_async(file_path) -> str:
+    """
+    extract_text_from_pdf without blocking the event loop: the PyMuPDF pass is
+    sharded by page ranges across the extraction pool, image-only pages are then
+    OCR'd in parallel; the fallback chain (pdfplumber, PyPDF2, full OCR) runs in
+    a thread only if that pass finds no usable text. The text is cached by file
+    content, so re-uploads and re-analyses of the same PDF skip extraction
+    """
+    cache = get_extraction_cache()
+    cache_key = cache.make_key(await asyncio.to_thread(file_hash, file_path), "monolith_pdf_text", PDF_TEXT_VERSION)
+    cached_text = await asyncio.to_thread(cache.get, cache_key)
+    if cached_text is not None:
+        logger.info(f"📦 PDF text from extraction cache: {len(cached_text)} символов")
+        return cached_text
+    
+    result_text = None
+    pool = get_extraction_pool()
+    # Opening a damaged PDF repairs its xref by scanning the whole file - off the loop
+    batches = page_batches(await asyncio.to_thread(count_pages, file_path), pool.workers)
+    if batches:
+        try:
+            results = await asyncio.gather(*[
+                pool.run(extract_best_text_pages, str(file_path), start, end) for start, end in batches
+            ])
+            pages = merge_page_results(results)
+            apply_ocr(pages, await ocr_pages(str(file_path), image_only_pages(pages)))
+            result_text = pymupdf_pages_text(pages)
+        except (ExtractionTimeout, ExtractionFailed) as e:
+            logger.warning(f"⚠️ Sharded PyMuPDF extraction failed: {e}")
+    
+    if not result_text:
+        result_text = await asyncio.to_thread(extract_text_from_pdf, file_path)
+    await asyncio.to_thread(cache.put, cache_key, result_text)
+    return result_text
 
 def extract_text_from_docx(file_path):
     """Extract text from DOCX file using zipfile and xml"""
@@ -638,8 +620,12 @@ class AIProviderManager:
         except Exception as e:
             logger.error(f"❌ Error initializing AI clients: {e}")
     
-    async def analyze_with_claude(self, prompt: str, content: str, model: str = "claude-3-haiku-20240307") -> Dict[str, Any]:
-        """Enhanced Claude API integration for KP analysis"""
+    async def analyze_with_claude(self, prompt: str, content: str, model: str = "claude-3-haiku-20240307",
+                                  context: Optional[str] = None) -> Dict[str, Any]:
+        """Enhanced Claude API integration for KP analysis
+
+        context - stable text shared between calls (e.g. TZ), sent as a cached prefix
+        """
         if not self.anthropic_client:
             raise HTTPException(status_code=500, detail="Anthropic client not available")
         
@@ -666,15 +652,18 @@ class AIProviderManager:
             
             full_prompt = f"""{prompt}\n\nТекст коммерческого предложения:\n{content}"""
             
-            response = await asyncio.create_task(
-                asyncio.to_thread(
+            # Stable prefix first (system prompt, shared context) so it is served from the prompt cache
+            # Interactive slot: the user is waiting, background work yields to it
+            response = await get_scheduler().run(
+                lambda: asyncio.to_thread(
                     self.anthropic_client.messages.create,
                     model=model,
                     max_tokens=4000,
                     temperature=0.3,
-                    system=system_prompt,
-                    messages=[{"role": "user", "content": full_prompt}]
-                )
+                    system=cacheable_system(system_prompt),
+                    messages=[{"role": "user", "content": build_user_content(full_prompt, [context] if context else None)}]
+                ),
+                priority=PRIORITY_INTERACTIVE
             )
             
             result_text = response.content[0].text
@@ -682,11 +671,17 @@ class AIProviderManager:
             
             # Try to parse as JSON, fallback to structured analysis
             try:
-                return json.loads(result_text)
+                result = json.loads(result_text)
             except json.JSONDecodeError:
                 # Parse structured text response
-                return self._parse_structured_response(result_text)
+                result = self._parse_structured_response(result_text)
+            
+            if isinstance(result, dict):
+                result["usage"] = claude_usage_metadata(getattr(response, "usage", None))
+            return result
                 
+        except SchedulerOverloaded as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
         except Exception as e:
             logger.error(f"❌ Claude API error: {e}")
             raise HTTPException(status_code=500, detail=f"Claude API error: {str(e)}")
@@ -1377,7 +1372,7 @@ class DocumentsManager:
                 document_content = extract_text_from_docx(document_file)
                 logger.info(f"DOCX текст извлечен, длина: {len(document_content)} символов")
             elif file_extension == 'pdf':
-                document_content = extract_text_from_pdf(document_file)
+                document_content = await extract_text_from_pdf_async(document_file)
                 logger.info(f"PDF текст извлечен, длина: {len(document_content)} символов")
             else:
                 with open(document_file, 'r', encoding='utf-8') as f:
@@ -1643,6 +1638,16 @@ app.add_middleware(
     allow_headers=allowed_headers,
 )
 
+@app.on_event("startup")
+async def start_llm_client_pool():
+    """Запуск фоновой очистки простаивающих AI клиентов"""
+    get_client_pool().start()
+
+@app.on_event("shutdown")
+async def close_llm_client_pool():
+    """Закрытие соединений AI клиентов"""
+    await get_client_pool().aclose()
+
 # ========================================
 # STORAGE (IN-MEMORY FOR DEMO)
 # ========================================
@@ -1860,6 +1865,15 @@ async def health_check():
         anthropic_key_prefix=api_key[:20] if api_key != 'NOT_SET' else 'NOT_SET'
     )
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: LLM scheduler queues and the document extraction pool"""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    payload, content_type = rendered
+    return Response(content=payload, media_type=content_type)
+
 # ========================================
 # AUTHENTICATION API
 # ========================================
@@ -2206,17 +2220,13 @@ async def test_claude_direct():
     """Direct test of Claude API - Enhanced with better debugging"""
     try:
         print("DEBUG: Starting Claude API test")
-        import anthropic
-        from dotenv import load_dotenv
-        
-        # Reload environment
-        load_dotenv(override=True)
         
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             return {"error": "API key not found"}
         
-        client = anthropic.AsyncAnthropic(api_key=api_key)
+        # Общий клиент пула (.env прочитан при старте)
+        client = get_client_pool().get_anthropic(api_key)
         
         response = await client.messages.create(
             model='claude-3-haiku-20240307',
@@ -2286,6 +2296,8 @@ async def check_llm_health():
             "success": True,
             "overall_status": "healthy" if overall_healthy else "no_providers_configured",
             "providers": health_status,
+            "client_pool": get_client_pool().get_stats(),
+            "cache": get_response_cache().get_stats(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -2643,10 +2655,12 @@ async def extract_text_from_document(file: UploadFile = File(...)):
                 try:
                     from services.documents.core.text_extractor import TextExtractor
                     extractor = TextExtractor()
-                    extracted_text = extractor.extract_text_sync(temp_path)
+                    # Разбор в пуле процессов (пока парсится большой PDF, остальные запросы
+                    # обслуживаются), повторная загрузка того же файла - из кеша извлечения
+                    extracted_text = await extractor.extract_text_async(temp_path)
                 except ImportError:
                     # Fallback: используем встроенную функцию
-                    extracted_text = extract_text_from_pdf(str(temp_path))
+                    extracted_text = await extract_text_from_pdf_async(str(temp_path))
             except Exception as e:
                 logger.error(f"Ошибка извлечения текста из PDF: {e}")
                 extracted_text = f"Ошибка извлечения текста из PDF: {str(e)}"
@@ -2702,7 +2716,7 @@ async def extract_kp_summary(data: dict):
         logger.info(f"Starting AI analysis for file: {file_name}")
         try:
             # Формируем промпт для извлечения данных КП
-            prompt = f"""
+            prompt_template = """
 Проанализируй коммерческое предложение и извлеки следующую информацию в JSON формате:
 
 Коммерческое предложение:
@@ -2724,57 +2738,69 @@ async def extract_kp_summary(data: dict):
 Верни результат строго в JSON формате без дополнительного текста.
 """
             
-            # Отправляем запрос к AI
-            logger.info("Sending request to AI service")
             import httpx
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "http://localhost:8000/api/llm/analyze",
-                    json={
-                        "prompt": prompt,
-                        "model": "claude-3-5-sonnet-20240620",
-                        "max_tokens": 2000,
-                        "temperature": 0.1
-                    }
-                )
-                
-                if response.status_code == 200:
-                    logger.info("AI request successful")
-                    ai_response = response.json()
-                    ai_content = ai_response.get('content', '')
-                    logger.info(f"AI response content: {ai_content[:200]}...")
-                    
-                    # Парсим JSON ответ от AI
-                    import json
-                    try:
-                        ai_data = json.loads(ai_content)
-                        logger.info("Successfully parsed AI response as JSON")
-                        
-                        # Преобразуем в нужный формат, безопасно обрабатывая None значения
-                        contractor_details = ai_data.get('contractor_details') or {}
-                        company_info = ai_data.get('company_info') or {}
-                        
-                        summary = {
-                            "company_name": contractor_details.get('name') or file_name.replace('.pdf', '').replace('.docx', ''),
-                            "tech_stack": ai_data.get('materials') or 'Не указано',
-                            "pricing": f"{ai_data.get('total_cost', 'Не указано')} {ai_data.get('currency', '')}".strip(),
-                            "timeline": ai_data.get('timeline') or 'Не указано',
-                            "team_size": company_info.get('team_size') or 'Не указано',
-                            "experience": company_info.get('experience') or 'Не указано',
-                            "key_features": ai_data.get('work_description') or 'Не указано',
-                            "contact_info": contractor_details.get('contact') or 'Не указано',
-                            "total_cost": ai_data.get('total_cost', 0),
-                            "currency": ai_data.get('currency', 'руб.'),
-                            "cost_breakdown": ai_data.get('cost_breakdown') or {},
-                            "pricing_details": ai_data.get('pricing_details') or 'Не указано'
+            import json
+            
+            async def request_kp_data(kp_fragment: str) -> Dict[str, Any]:
+                """Запрос к AI для текста КП целиком или его фрагмента"""
+                async with httpx.AsyncClient() as client:
+                    response = await client.post(
+                        "http://localhost:8000/api/llm/analyze",
+                        json={
+                            "prompt": prompt_template.format(kp_text=kp_fragment),
+                            "model": "claude-3-5-sonnet-20240620",
+                            "max_tokens": 2000,
+                            "temperature": 0.1
                         }
-                        
-                        logger.info(f"Returning AI-generated summary: {summary}")
-                        return summary
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Failed to parse AI response as JSON: {e}, using fallback")
+                    )
+                
+                if response.status_code != 200:
+                    raise Exception(f"AI request failed with status: {response.status_code}")
+                
+                logger.info("AI request successful")
+                ai_content = response.json().get('content', '')
+                logger.info(f"AI response content: {ai_content[:200]}...")
+                return json.loads(ai_content)
+            
+            # Отправляем запрос к AI
+            logger.info("Sending request to AI service")
+            try:
+                if needs_chunking(kp_text):
+                    # КП с приложениями не помещается в один запрос - извлечение по фрагментам и свод
+                    chunks = split_into_chunks(kp_text)
+                    logger.info(f"KP text is too large for one request, split into {len(chunks)} chunks")
+                    ai_data = await analyze_in_chunks(chunks, lambda chunk: request_kp_data(chunk["text"]))
                 else:
-                    logger.warning(f"AI request failed with status: {response.status_code}")
+                    ai_data = await request_kp_data(kp_text)
+                logger.info("Successfully parsed AI response as JSON")
+                
+                # Преобразуем в нужный формат, безопасно обрабатывая None значения
+                contractor_details = ai_data.get('contractor_details') or {}
+                company_info = ai_data.get('company_info') or {}
+                
+                summary = {
+                    "company_name": contractor_details.get('name') or file_name.replace('.pdf', '').replace('.docx', ''),
+                    "tech_stack": ai_data.get('materials') or 'Не указано',
+                    "pricing": f"{ai_data.get('total_cost', 'Не указано')} {ai_data.get('currency', '')}".strip(),
+                    "timeline": ai_data.get('timeline') or 'Не указано',
+                    "team_size": company_info.get('team_size') or 'Не указано',
+                    "experience": company_info.get('experience') or 'Не указано',
+                    "key_features": ai_data.get('work_description') or 'Не указано',
+                    "contact_info": contractor_details.get('contact') or 'Не указано',
+                    "total_cost": ai_data.get('total_cost', 0),
+                    "currency": ai_data.get('currency', 'руб.'),
+                    "cost_breakdown": ai_data.get('cost_breakdown') or {},
+                    "pricing_details": ai_data.get('pricing_details') or 'Не указано'
+                }
+                
+                if "chunks" in ai_data:
+                    summary["source_pages"] = ai_data.get("source_pages", {})
+                    summary["chunks"] = ai_data["chunks"]
+                
+                logger.info(f"Returning AI-generated summary: {summary}")
+                return summary
+            except json.JSONDecodeError as e:
+                logger.warning(f"Failed to parse AI response as JSON: {e}, using fallback")
                         
         except Exception as e:
             logger.error(f"AI analysis failed: {e}", exc_info=True)
@@ -2861,19 +2887,90 @@ async def compare_tz_kp(data: dict):
         logger.error(f"Ошибка сравнения ТЗ и КП: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Версия промпта /api/llm/analyze - входит в ключ кеша ответов
+LLM_ANALYZE_PROMPT_VERSION = "llm_analyze_v2"
+
+# Цены Claude за 1K токенов (input, output) - для учета прерванных вызовов
+CLAUDE_PRICING_PER_1K = {
+    "haiku": (0.00025, 0.00125),
+    "sonnet": (0.003, 0.015),
+    "opus": (0.015, 0.075)
+}
+
+def record_interrupted_claude_call(model: str, prompt_text: str, output_text: str = "") -> None:
+    """
+    Вызов Claude прерван отменой запроса: промпт уже отправлен и оплачивается,
+    расход (оценка по токенизатору) записывается в токен отмены
+    """
+    token = current_token()
+    if token is None or not token.cancelled:
+        return
+    prompt_tokens = count_tokens(prompt_text, model, "anthropic")
+    completion_tokens = count_tokens(output_text, model, "anthropic") if output_text else 0
+    input_price, output_price = next(
+        (price for family, price in CLAUDE_PRICING_PER_1K.items() if family in model), (0.0, 0.0)
+    )
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1000
+    token.record_usage("anthropic", model, prompt_tokens, completion_tokens, cost)
+
+def claude_usage_metadata(usage: Any) -> Dict[str, int]:
+    """
+    Расход ответа Claude с токенами записи и чтения кеша промпта
+    (input_tokens Anthropic их не включает), как в AnthropicProvider
+    """
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                "cache_write_tokens": 0, "cache_read_tokens": 0}
+    cached = cache_usage(usage)
+    prompt_tokens = usage.input_tokens + cached["cache_write_tokens"] + cached["cache_read_tokens"]
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": usage.output_tokens,
+        "total_tokens": prompt_tokens + usage.output_tokens,
+        **cached
+    }
+
+# Comprehensive analysis prompt for /api/llm/analyze ({prompt} - the document text)
+KP_JSON_ANALYSIS_PROMPT = """Проанализируй коммерческое предложение и верни результат в формате JSON:
+
+ДОКУМЕНТ:
+{prompt}
+
+Верни анализ в следующем JSON формате:
+{{
+  "company_name": "название компании",
+  "compliance_score": число от 0 до 100,
+  "overall_assessment": "общая оценка в 2-3 предложениях",
+  "key_advantages": ["преимущество 1", "преимущество 2", "преимущество 3"],
+  "critical_risks": ["риск 1", "риск 2"],
+  "recommendation": "принять/доработать/отклонить",
+  "budget_analysis": {{
+    "total_budget": число_или_null,
+    "currency": "валюта если найдена",
+    "cost_breakdown": "анализ структуры стоимости"
+  }},
+  "timeline_analysis": {{
+    "total_duration": "общий срок выполнения",
+    "phases": ["этап 1", "этап 2"]
+  }},
+  "technical_analysis": {{
+    "technical_score": число от 0 до 100,
+    "technologies": ["технология 1", "технология 2"],
+    "complexity_level": "низкий/средний/высокий"
+  }}
+}}
+
+Отвечай ТОЛЬКО JSON без дополнительного текста."""
+
 @app.post("/api/llm/analyze")
-async def ai_analyze_working_claude_v2_fixed(data: dict):
+async def ai_analyze_working_claude_v2_fixed(data: dict, request: Request):
     """
     🔥 FIXED Claude API Analysis System with Timeout, Retry and Fallback
     """
     import time
     import asyncio
-    import anthropic
     import signal
     import json
-    from dotenv import load_dotenv
-    
-    load_dotenv('.env', override=True)
     
     prompt = data.get('prompt', '')
     model = data.get('model', 'claude-3-haiku-20240307')
@@ -2883,10 +2980,30 @@ async def ai_analyze_working_claude_v2_fixed(data: dict):
     start_time = time.time()
     logger.info(f"🚀 FIXED: Starting Claude API analysis: {len(prompt)} chars, model: {model}")
     
+    # Повторный анализ того же КП (например, после обновления страницы) берем из кеша
+    response_cache = get_response_cache()
+    cache_key = build_cache_key(
+        task_type="llm_analyze",
+        content=prompt,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        prompt_version=LLM_ANALYZE_PROMPT_VERSION
+    )
+    cached_result = await response_cache.get(cache_key)
+    if cached_result:
+        logger.info(f"✅ Claude analysis served from cache in {time.time() - start_time:.3f}s")
+        return {**cached_result, "cached": True, "processing_time": f"{time.time() - start_time:.1f}s"}
+    
     # 🚨 КРИТИЧЕСКИ ВАЖНО: Ограничиваем время выполнения
     TIMEOUT_SECONDS = 60  # 60 секунд максимум
     MAX_RETRIES = 3
     
+    # Очередь LLM: интерактивные вызовы впереди фоновых, дедлайн вызывающего - общий на все попытки
+    priority = data.get('priority', PRIORITY_INTERACTIVE)
+    tenant = data.get('tenant') or data.get('user_id')
+    deadline = parse_deadline(request.headers, default_timeout=TIMEOUT_SECONDS * MAX_RETRIES)
+    
     # Fallback анализ для экстренных случаев
     def generate_fallback_analysis():
         logger.warning("🔄 Generating fallback analysis due to API failure")
@@ -2933,111 +3050,119 @@ async def ai_analyze_working_claude_v2_fixed(data: dict):
             }
         }
     
-    # Основная логика с timeout и retry
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.info(f"📡 Attempt {attempt + 1}/{MAX_RETRIES} - Calling Claude API...")
+    async def analyze_uncached():
+        """Вызов Claude с retry и fallback - выполняется один раз на ключ кеша"""
+        # Основная логика с timeout и retry
+        for attempt in range(MAX_RETRIES):
+            try:
+                logger.info(f"📡 Attempt {attempt + 1}/{MAX_RETRIES} - Calling Claude API...")
             
-            api_key = os.getenv('ANTHROPIC_API_KEY')
-            if not api_key or api_key.strip() == '':
-                logger.error("❌ No ANTHROPIC_API_KEY found - falling back to local analysis")
-                raise Exception("API key not configured")
+                api_key = os.getenv('ANTHROPIC_API_KEY')
+                if not api_key or api_key.strip() == '':
+                    logger.error("❌ No ANTHROPIC_API_KEY found - falling back to local analysis")
+                    raise Exception("API key not configured")
                 
-            client = anthropic.AsyncAnthropic(api_key=api_key.strip())
+                client = get_client_pool().get_anthropic(api_key)
             
-            # Comprehensive analysis prompt
-            analysis_prompt = f"""Проанализируй коммерческое предложение и верни результат в формате JSON:
-
-ДОКУМЕНТ:
-{prompt}
-
-Верни анализ в следующем JSON формате:
-{{
-  "company_name": "название компании",
-  "compliance_score": число от 0 до 100,
-  "overall_assessment": "общая оценка в 2-3 предложениях",
-  "key_advantages": ["преимущество 1", "преимущество 2", "преимущество 3"],
-  "critical_risks": ["риск 1", "риск 2"],
-  "recommendation": "принять/доработать/отклонить",
-  "budget_analysis": {{
-    "total_budget": число_или_null,
-    "currency": "валюта если найдена",
-    "cost_breakdown": "анализ структуры стоимости"
-  }},
-  "timeline_analysis": {{
-    "total_duration": "общий срок выполнения",
-    "phases": ["этап 1", "этап 2"]
-  }},
-  "technical_analysis": {{
-    "technical_score": число от 0 до 100,
-    "technologies": ["технология 1", "технология 2"],
-    "complexity_level": "низкий/средний/высокий"
-  }}
-}}
-
-Отвечай ТОЛЬКО JSON без дополнительного текста."""
+                # Comprehensive analysis prompt
+                analysis_prompt = KP_JSON_ANALYSIS_PROMPT.format(prompt=prompt)
             
-            # 🚨 КРИТИЧЕСКИ ВАЖНО: Применяем timeout к Claude API запросу
-            try:
-                response = await asyncio.wait_for(
-                    client.messages.create(
-                        model=model,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        messages=[{"role": "user", "content": analysis_prompt}]
-                    ),
-                    timeout=TIMEOUT_SECONDS
-                )
+                # 🚨 КРИТИЧЕСКИ ВАЖНО: Применяем timeout к Claude API запросу
+                try:
+                    response = await get_scheduler().run(
+                        lambda: asyncio.wait_for(
+                            client.messages.create(
+                                model=model,
+                                max_tokens=max_tokens,
+                                temperature=temperature,
+                                messages=[{"role": "user", "content": analysis_prompt}]
+                            ),
+                            timeout=TIMEOUT_SECONDS
+                        ),
+                        priority=priority,
+                        tenant=tenant,
+                        deadline=deadline
+                    )
                 
-                content = response.content[0].text.strip()
-                processing_time = time.time() - start_time
+                    content = response.content[0].text.strip()
+                    processing_time = time.time() - start_time
                 
-                logger.info(f"✅ Claude analysis SUCCESS in {processing_time:.1f}s on attempt {attempt + 1}")
+                    logger.info(f"✅ Claude analysis SUCCESS in {processing_time:.1f}s on attempt {attempt + 1}")
                 
-                return {
-                    "content": content,
-                    "model": model,
-                    "processing_time": f"{processing_time:.1f}s",
-                    "fallback_mode": False,
-                    "analysis_quality": "claude_comprehensive",
-                    "success": True,
-                    "attempt": attempt + 1
-                }
+                    result = {
+                        "content": content,
+                        "model": model,
+                        "processing_time": f"{processing_time:.1f}s",
+                        "fallback_mode": False,
+                        "analysis_quality": "claude_comprehensive",
+                        "success": True,
+                        "attempt": attempt + 1
+                    }
+                    # Fallback ответы не кешируем - только реальный анализ
+                    await response_cache.set(cache_key, result)
+                    return result
                 
-            except asyncio.TimeoutError:
-                logger.warning(f"⏰ Claude API timeout on attempt {attempt + 1} after {TIMEOUT_SECONDS}s")
+                except asyncio.CancelledError:
+                    # Клиент ушел во время вызова - учитываем отправленный промпт
+                    record_interrupted_claude_call(model, analysis_prompt)
+                    raise
+                except asyncio.TimeoutError:
+                    logger.warning(f"⏰ Claude API timeout on attempt {attempt + 1} after {TIMEOUT_SECONDS}s")
+                    if attempt < MAX_RETRIES - 1:
+                        await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                        continue
+                    else:
+                        raise Exception(f"Claude API timeout after {MAX_RETRIES} attempts")
+                    
+            except (SchedulerOverloaded, DeadlineExceeded):
+                # Очередь переполнена или вызывающий больше не ждет - повторы и fallback не нужны
+                raise
+            except Exception as e:
+                logger.error(f"❌ Claude API error on attempt {attempt + 1}: {str(e)}")
+            
                 if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                    # Exponential backoff перед следующей попыткой
+                    backoff_time = min(2 ** attempt, 10)  # Максимум 10 секунд
+                    logger.info(f"⏳ Waiting {backoff_time}s before retry...")
+                    await asyncio.sleep(backoff_time)
                     continue
                 else:
-                    raise Exception(f"Claude API timeout after {MAX_RETRIES} attempts")
-                    
-        except Exception as e:
-            logger.error(f"❌ Claude API error on attempt {attempt + 1}: {str(e)}")
-            
-            if attempt < MAX_RETRIES - 1:
-                # Exponential backoff перед следующей попыткой
-                backoff_time = min(2 ** attempt, 10)  # Максимум 10 секунд
-                logger.info(f"⏳ Waiting {backoff_time}s before retry...")
-                await asyncio.sleep(backoff_time)
-                continue
-            else:
-                logger.error(f"🚨 All Claude API attempts failed - generating fallback analysis")
-                break
+                    logger.error(f"🚨 All Claude API attempts failed - generating fallback analysis")
+                    break
     
-    # Если все попытки неудачны - возвращаем fallback анализ
-    processing_time = time.time() - start_time
-    fallback_data = generate_fallback_analysis()
+        # Если все попытки неудачны - возвращаем fallback анализ
+        processing_time = time.time() - start_time
+        fallback_data = generate_fallback_analysis()
     
-    return {
-        "content": json.dumps(fallback_data, ensure_ascii=False, indent=2),
-        "model": f"{model}_fallback",
-        "processing_time": f"{processing_time:.1f}s",
-        "fallback_mode": True,
-        "analysis_quality": "fallback_comprehensive",
-        "success": True,
-        "warning": "Generated fallback analysis due to API issues"
-    }
+        return {
+            "content": json.dumps(fallback_data, ensure_ascii=False, indent=2),
+            "model": f"{model}_fallback",
+            "processing_time": f"{processing_time:.1f}s",
+            "fallback_mode": True,
+            "analysis_quality": "fallback_comprehensive",
+            "success": True,
+            "warning": "Generated fallback analysis due to API issues"
+        }
+
+    # Одинаковые одновременные запросы (повторная отправка, коллеги с тем же КП) ждут один вызов;
+    # ушедший клиент отменяет свое ожидание, общий вызов прерывается, когда не остается ни одного
+    token = CancellationToken()
+    watcher = token.watch(request.is_disconnected)
+    try:
+        result, coalesced = await token.run(get_single_flight().do(cache_key, analyze_uncached))
+    except SchedulerOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RequestCancelled as e:
+        logger.info(f"🔌 Claude analysis cancelled: {e.reason}, partial cost ${token.partial_cost:.4f}")
+        raise HTTPException(status_code=499, detail=str(e))
+    finally:
+        watcher.cancel()
+    if coalesced:
+        logger.info("🔗 Claude analysis shared with identical in-flight request")
+        return {**result, "coalesced": True}
+    return result
 
 
 # ========================================
@@ -3283,88 +3408,69 @@ class WebSocketAnalysisManager:
 
 
 async def extract_json_from_response(response_text: str) -> dict:
-    """Helper function to extract JSON from Claude response"""
-    import json
-    import re
+    """Helper function to extract JSON from Claude response
     
-    try:
-        # Try direct JSON parsing first
-        if response_text.strip().startswith('{'):
-            return json.loads(response_text)
-        
-        # Find JSON block in response
-        json_match = re.search(r'\{.*?\}', response_text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-        
-        # If no JSON found, return empty dict
+    Balanced-bracket parsing keeps nested objects intact; code fences and trailing
+    prose are skipped, truncated output is repaired instead of re-calling the model.
+    """
+    result = parse_json_response(response_text)
+    if not result:
         logger.warning("No valid JSON found in Claude response")
-        return {}
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {e}")
-        return {}
+    return result
 
 
 class WebSocketAnalysisManager:
-    """Manager for WebSocket connections during analysis"""
+    """Analysis events for WebSocket and SSE clients
+
+    Events are published to the shared event broker and numbered: a client that
+    connects after the analysis started, or reconnects with last_event_id, first
+    receives the missed events from the replay buffer, then live ones.
+    """
     
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.broker = get_event_broker()
+        self.active_connections: Dict[str, int] = {}
     
     async def connect(self, websocket: WebSocket, analysis_id: str):
         await websocket.accept()
-        self.active_connections[analysis_id] = websocket
+        self.active_connections[analysis_id] = self.active_connections.get(analysis_id, 0) + 1
         logger.info(f"WebSocket connected for analysis {analysis_id}")
     
     def disconnect(self, analysis_id: str):
         if analysis_id in self.active_connections:
-            del self.active_connections[analysis_id]
+            self.active_connections[analysis_id] -= 1
+            if not self.active_connections[analysis_id]:
+                del self.active_connections[analysis_id]
             logger.info(f"WebSocket disconnected for analysis {analysis_id}")
     
+    def publish(self, analysis_id: str, event_type: str, data: dict):
+        self.broker.publish(analysis_id, event_type, {**data, "timestamp": datetime.now().isoformat()})
+    
     async def send_progress(self, analysis_id: str, stage: str, message: str, progress: int):
-        if analysis_id in self.active_connections:
-            try:
-                await self.active_connections[analysis_id].send_json({
-                    "type": "progress",
-                    "stage": stage,
-                    "message": message,
-                    "progress": progress,
-                    "timestamp": datetime.now().isoformat()
-                })
-            except WebSocketDisconnect:
-                self.disconnect(analysis_id)
-            except Exception as e:
-                logger.error(f"Error sending WebSocket message: {e}")
-                self.disconnect(analysis_id)
+        self.publish(analysis_id, "progress", {"stage": stage, "message": message, "progress": progress})
+    
+    async def send_partial(self, analysis_id: str, stage: str, fields: dict):
+        """JSON fields of a stage closed in the model stream so far"""
+        self.publish(analysis_id, "partial", {"stage": stage, "fields": fields})
+    
+    async def send_section(self, analysis_id: str, section: str, data: dict):
+        """Completed stage/section - the client can render it before the whole report is ready"""
+        self.publish(analysis_id, "section", {"section": section, "data": data})
     
     async def send_result(self, analysis_id: str, result: dict):
-        if analysis_id in self.active_connections:
-            try:
-                await self.active_connections[analysis_id].send_json({
-                    "type": "completed",
-                    "result": result,
-                    "timestamp": datetime.now().isoformat()
-                })
-            except WebSocketDisconnect:
-                self.disconnect(analysis_id)
-            except Exception as e:
-                logger.error(f"Error sending WebSocket result: {e}")
-                self.disconnect(analysis_id)
+        self.publish(analysis_id, "completed", {"result": result})
     
     async def send_error(self, analysis_id: str, error: str):
-        if analysis_id in self.active_connections:
-            try:
-                await self.active_connections[analysis_id].send_json({
-                    "type": "error",
-                    "error": error,
-                    "timestamp": datetime.now().isoformat()
-                })
-            except WebSocketDisconnect:
-                self.disconnect(analysis_id)
-            except Exception as e:
-                logger.error(f"Error sending WebSocket error: {e}")
-                self.disconnect(analysis_id)
+        self.publish(analysis_id, "error", {"error": error})
+    
+    async def send_cancelled(self, analysis_id: str, reason: str, partial_cost: float = 0.0):
+        """Analysis aborted - outstanding model calls were cancelled"""
+        self.publish(analysis_id, "cancelled", {"reason": reason, "partial_cost_usd": round(partial_cost, 6)})
+    
+    async def forward(self, websocket: WebSocket, analysis_id: str, last_event_id: int = 0):
+        """Send missed and live events to the socket until the analysis ends"""
+        async for event in self.broker.subscribe(analysis_id, last_event_id):
+            await websocket.send_json(event.to_message())
 
 
 # Global WebSocket manager
@@ -3372,44 +3478,100 @@ ws_manager = WebSocketAnalysisManager()
 
 
 @app.websocket("/ws/analysis/{analysis_id}")
-async def websocket_analysis_progress(websocket: WebSocket, analysis_id: str):
-    """WebSocket endpoint for real-time analysis progress updates"""
+async def websocket_analysis_progress(websocket: WebSocket, analysis_id: str, last_event_id: Optional[str] = None):
+    """WebSocket endpoint for real-time analysis progress, partial results and resume by last_event_id"""
+    # The client may connect just before the analysis starts; unknown ids are rejected after the wait
+    if await ws_manager.broker.wait_for(analysis_id, EVENT_SUBSCRIBE_WAIT) is None:
+        await websocket.close(code=4404)
+        return
     await ws_manager.connect(websocket, analysis_id)
+    forwarder = asyncio.create_task(ws_manager.forward(websocket, analysis_id, parse_last_event_id(last_event_id)))
     
     try:
-        # Keep connection alive and handle any client messages
+        # Forward analysis events while handling client messages (ping, etc.)
         while True:
-            try:
-                # Wait for client message or timeout after 30 seconds
-                message = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
-                
-                # Handle client messages (ping, etc.)
-                if message == "ping":
-                    await websocket.send_text("pong")
-                    
-            except asyncio.TimeoutError:
-                # Send keepalive ping
-                try:
-                    await websocket.send_json({
-                        "type": "keepalive",
-                        "timestamp": datetime.now().isoformat()
-                    })
-                except:
-                    break
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                logger.error(f"WebSocket error: {e}")
+            receiver = asyncio.ensure_future(websocket.receive_text())
+            done, _ = await asyncio.wait({receiver, forwarder}, timeout=30.0, return_when=asyncio.FIRST_COMPLETED)
+            
+            if forwarder in done:
+                # Analysis finished (or the socket failed) - all events are delivered
+                receiver.cancel()
+                if not forwarder.exception():
+                    await websocket.close()
                 break
+            
+            if not done:
+                # Send keepalive ping
+                receiver.cancel()
+                await websocket.send_json({
+                    "type": "keepalive",
+                    "timestamp": datetime.now().isoformat()
+                })
+                continue
+            
+            if receiver.result() == "ping":
+                await websocket.send_text("pong")
                 
     except WebSocketDisconnect:
         pass
+    except Exception as e:
+        logger.error(f"WebSocket error: {e}")
     finally:
+        forwarder.cancel()
         ws_manager.disconnect(analysis_id)
 
 
+@app.get("/api/llm/analysis/{analysis_id}/events")
+async def analysis_events_sse(analysis_id: str, request: Request, last_event_id: Optional[str] = None):
+    """SSE alternative to /ws/analysis: same events, resumable via the Last-Event-ID header"""
+    from fastapi.responses import StreamingResponse
+    
+    last_id = parse_last_event_id(request.headers.get("last-event-id") or last_event_id)
+    
+    if await ws_manager.broker.wait_for(analysis_id, EVENT_SUBSCRIBE_WAIT) is None:
+        raise HTTPException(status_code=404, detail="Analysis not found or expired")
+    
+    async def event_source():
+        async for event in ws_manager.broker.subscribe(analysis_id, last_id, heartbeat=15.0):
+            yield format_sse(event)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def stream_claude_stage(client, analysis_id: str, stage: str, tenant: Any = None, **params) -> Tuple[str, int]:
+    """
+    One analysis stage as a Claude stream: top-level JSON fields are published
+    as soon as the model closes them. Returns (full text, output tokens).
+    """
+    parser = StreamingJSONParser()
+    streamed: Optional[List[str]] = None
+    try:
+        async with get_scheduler().slot(PRIORITY_INTERACTIVE, tenant or analysis_id):
+            async with client.messages.stream(**params) as stream:
+                streamed = []
+                async for text in stream.text_stream:
+                    streamed.append(text)
+                    fields = parser.feed(text)
+                    if fields:
+                        await ws_manager.send_partial(analysis_id, stage, fields)
+                message = await stream.get_final_message()
+    except asyncio.CancelledError:
+        if streamed is not None:
+            # Cancelled mid-stream: the prompt and the generated part are billed
+            prompt_text = "".join(str(item.get("content", "")) for item in params.get("messages", []))
+            record_interrupted_claude_call(params.get("model", ""), prompt_text, "".join(streamed))
+        raise
+    
+    content = "".join(block.text for block in message.content if getattr(block, "text", None))
+    return content.strip(), getattr(getattr(message, "usage", None), "output_tokens", 0)
+
+
 @app.post("/api/llm/analyze-with-progress")
-async def ai_analyze_with_realtime_progress(data: dict):
+async def ai_analyze_with_realtime_progress(data: dict, request: Request):
     """
     Enhanced AI Analysis with Real-time WebSocket Progress Updates
     
@@ -3417,7 +3579,6 @@ async def ai_analyze_with_realtime_progress(data: dict):
     but streams progress updates through WebSocket connection for better UX.
     """
     import time
-    import asyncio
     import uuid
     
     prompt = data.get('prompt', '')
@@ -3425,23 +3586,30 @@ async def ai_analyze_with_realtime_progress(data: dict):
     max_tokens = data.get('max_tokens', 2000)
     temperature = data.get('temperature', 0.1)
     
-    # Generate unique analysis ID
-    analysis_id = str(uuid.uuid4())
+    # Client-provided ID lets the browser subscribe (WS/SSE) before the analysis starts;
+    # an ID that already has a stream belongs to another analysis and is rejected
+    analysis_id = data.get('analysis_id') or str(uuid.uuid4())
+    try:
+        ws_manager.broker.create(analysis_id)
+    except StreamInUse:
+        raise HTTPException(status_code=409, detail=f"Analysis {analysis_id} already exists")
+    tenant = data.get('tenant') or data.get('user_id')
     
     start_time = time.time()
     logger.info(f"🚀 REAL-TIME ANALYSIS STARTED: {analysis_id}, {len(prompt)} chars")
     
+    # Stages run under the request's cancellation token: if the caller disconnects,
+    # the running Claude stream is aborted instead of being generated to the end
+    token = CancellationToken()
+    watcher = token.watch(request.is_disconnected)
+    
     try:
-        import anthropic
-        from dotenv import load_dotenv
-        load_dotenv('.env', override=True)
-        
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             await ws_manager.send_error(analysis_id, "No ANTHROPIC_API_KEY found")
             raise Exception("No ANTHROPIC_API_KEY found")
             
-        client = anthropic.AsyncAnthropic(api_key=api_key.strip())
+        client = get_client_pool().get_anthropic(api_key)
         
         # STAGE 1: Document Structure Analysis with progress updates
         await ws_manager.send_progress(analysis_id, "extracting", "Анализ структуры документа...", 10)
@@ -3469,18 +3637,18 @@ async def ai_analyze_with_realtime_progress(data: dict):
   "initial_impression": "первичная оценка качества документа"
 }}"""
         
-        stage1_response = await client.messages.create(
+        # Streamed: fields reach the client while the model is still writing
+        stage1_content, stage1_tokens = await token.run(stream_claude_stage(
+            client, analysis_id, "structure", tenant,
             model=model,
             max_tokens=1200,
             temperature=temperature,
             messages=[{"role": "user", "content": stage1_prompt}]
-        )
-        
-        stage1_content = stage1_response.content[0].text.strip()
+        ))
         stage1_data = await extract_json_from_response(stage1_content)
+        await ws_manager.send_section(analysis_id, "structure", stage1_data)
         
         await ws_manager.send_progress(analysis_id, "analyzing", f"Найдено: {stage1_data.get('company_name', 'компания не определена')}", 25)
-        await asyncio.sleep(1.0)
         
         # STAGE 2: Technical and Commercial Deep Analysis
         await ws_manager.send_progress(analysis_id, "analyzing", "Глубокий технический и коммерческий анализ...", 40)
@@ -3517,18 +3685,17 @@ async def ai_analyze_with_realtime_progress(data: dict):
   "commercial_score": число от 0 до 100
 }}"""
         
-        stage2_response = await client.messages.create(
+        stage2_content, stage2_tokens = await token.run(stream_claude_stage(
+            client, analysis_id, "technical_commercial", tenant,
             model=model,
             max_tokens=1500,
             temperature=temperature,
             messages=[{"role": "user", "content": stage2_prompt}]
-        )
-        
-        stage2_content = stage2_response.content[0].text.strip()
+        ))
         stage2_data = await extract_json_from_response(stage2_content)
+        await ws_manager.send_section(analysis_id, "technical_commercial", stage2_data)
         
         await ws_manager.send_progress(analysis_id, "evaluating", "Оценка рисков и бизнес-анализ...", 60)
-        await asyncio.sleep(1.2)
         
         # STAGE 3: Risk Assessment and Business Analysis
         stage3_prompt = f"""Проведи комплексную оценку рисков и бизнес-анализ предложения:
@@ -3560,18 +3727,17 @@ async def ai_analyze_with_realtime_progress(data: dict):
   "overall_risk_level": "низкий/средний/высокий"
 }}"""
         
-        stage3_response = await client.messages.create(
+        stage3_content, stage3_tokens = await token.run(stream_claude_stage(
+            client, analysis_id, "risks", tenant,
             model=model,
             max_tokens=1500,
             temperature=temperature,
             messages=[{"role": "user", "content": stage3_prompt}]
-        )
-        
-        stage3_content = stage3_response.content[0].text.strip()
+        ))
         stage3_data = await extract_json_from_response(stage3_content)
+        await ws_manager.send_section(analysis_id, "risks", stage3_data)
         
         await ws_manager.send_progress(analysis_id, "generating", "Формирование итогового заключения...", 80)
-        await asyncio.sleep(1.5)
         
         # STAGE 4: Final Comprehensive Assessment and Recommendations
         final_prompt = f"""На основе многоэтапного анализа сформируй итоговое экспертное заключение:
@@ -3600,15 +3766,15 @@ async def ai_analyze_with_realtime_progress(data: dict):
   "executive_summary": "резюме для руководства в 2-3 предложениях"
 }}"""
         
-        final_response = await client.messages.create(
+        final_content, final_tokens = await token.run(stream_claude_stage(
+            client, analysis_id, "final", tenant,
             model=model,
             max_tokens=2000,
             temperature=0.05,
             messages=[{"role": "user", "content": final_prompt}]
-        )
-        
-        final_content = final_response.content[0].text.strip()
+        ))
         final_data = await extract_json_from_response(final_content)
+        await ws_manager.send_section(analysis_id, "final", final_data)
         
         # Calculate processing time
         processing_time = time.time() - start_time
@@ -3649,16 +3815,23 @@ async def ai_analyze_with_realtime_progress(data: dict):
             "model": model,
             "processing_time": f"{processing_time:.1f}s", 
             "analysis_stages": 4,
-            "tokens_used": (
-                stage1_response.usage.output_tokens + 
-                stage2_response.usage.output_tokens + 
-                stage3_response.usage.output_tokens + 
-                final_response.usage.output_tokens
-            ) if all(hasattr(resp, 'usage') for resp in [stage1_response, stage2_response, stage3_response, final_response]) else 0,
+            "tokens_used": stage1_tokens + stage2_tokens + stage3_tokens + final_tokens,
             "fallback_mode": False,
             "analysis_quality": "comprehensive_multi_stage_with_progress"
         }
         
+    except RequestCancelled as e:
+        logger.info(f"🔌 Real-time analysis {analysis_id} cancelled: {e.reason}, partial cost ${token.partial_cost:.4f}")
+        await ws_manager.send_cancelled(analysis_id, e.reason, token.partial_cost)
+        
+        return {
+            "success": False,
+            "status": "cancelled",
+            "analysis_id": analysis_id,
+            "partial_cost_usd": round(token.partial_cost, 6),
+            "processing_time": f"{time.time() - start_time:.1f}s"
+        }
+        
     except Exception as e:
         logger.error(f"Real-time AI analysis failed: {e}")
         await ws_manager.send_error(analysis_id, f"Analysis failed: {str(e)}")
@@ -3670,6 +3843,8 @@ async def ai_analyze_with_realtime_progress(data: dict):
             "analysis_id": analysis_id,
             "processing_time": f"{time.time() - start_time:.1f}s"
         }
+    finally:
+        watcher.cancel()
 
 
 @app.post("/api/llm/test-claude")
@@ -3678,15 +3853,11 @@ async def test_claude_direct(data: dict):
     prompt = data.get('prompt', 'Hello, Claude!')
     
     try:
-        import anthropic
-        from dotenv import load_dotenv
-        load_dotenv(override=True)
-        
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             return {"error": "No API key", "success": False}
             
-        client = anthropic.AsyncAnthropic(api_key=api_key.strip())
+        client = get_client_pool().get_anthropic(api_key.strip())
         
         response = await client.messages.create(
             model="claude-3-haiku-20240307",
@@ -3762,11 +3933,10 @@ async def analyze_kp_detailed_10_sections(data: dict):
     10. Additional Value
     """
     import time
-    import json
     import re
     from datetime import datetime
     
-    tz_content = data.get('tz_content', '')
+    tz_content = data.get('tz_content') or ''
     kp_content = data.get('kp_content', '')
     model = data.get('model', 'claude-3-5-sonnet-20241022')
     
@@ -3777,15 +3947,11 @@ async def analyze_kp_detailed_10_sections(data: dict):
     logger.info(f"🎯 DETAILED 10-SECTION KP ANALYSIS STARTED")
     
     try:
-        import anthropic
-        from dotenv import load_dotenv
-        load_dotenv('.env', override=True)
-        
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             raise Exception("No ANTHROPIC_API_KEY found")
             
-        client = anthropic.AsyncAnthropic(api_key=api_key.strip())
+        client = get_client_pool().get_anthropic(api_key)
         
         # Get the comprehensive analysis prompt from config
         from services.llm.config import KP_ANALYZER_PROMPTS
@@ -3794,10 +3960,12 @@ async def analyze_kp_detailed_10_sections(data: dict):
         if not prompt_config:
             raise Exception("Comprehensive analysis prompt not found")
         
-        # Format the prompt with actual content
+        # Format the prompt with actual content.
+        # TZ is the same for every KP in a comparison - it goes first as a cached block
         system_prompt = prompt_config["system"]
+        tz_context = [f"Техническое задание:\n{tz_content}"] if tz_content.strip() else None
         user_prompt = prompt_config["user"].format(
-            tz_content=tz_content or "Техническое задание не предоставлено",
+            tz_content="см. техническое задание выше" if tz_context else "Техническое задание не предоставлено",
             kp_content=kp_content
         )
         
@@ -3808,24 +3976,16 @@ async def analyze_kp_detailed_10_sections(data: dict):
             model=model,
             max_tokens=4000,  # Increased for detailed analysis
             temperature=0.1,   # Low temperature for consistent analysis
-            system=system_prompt,
-            messages=[{"role": "user", "content": user_prompt}]
+            system=cacheable_system(system_prompt),
+            messages=[{"role": "user", "content": build_user_content(user_prompt, tz_context)}]
         )
         
         response_content = response.content[0].text.strip()
         
-        # Parse JSON response
-        try:
-            # Clean the response if it has markdown code blocks
-            if response_content.startswith("```json"):
-                response_content = response_content[7:-3].strip()
-            elif response_content.startswith("```"):
-                response_content = response_content[3:-3].strip()
-            
-            analysis_result = json.loads(response_content)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON response: {e}")
+        # Parse JSON response (code fences, trailing prose and truncated output are handled)
+        analysis_result = parse_json_response(response_content)
+        if not analysis_result:
+            logger.error("Failed to parse JSON response")
             # Return a fallback structured response
             analysis_result = create_fallback_detailed_analysis(kp_content, tz_content)
         
@@ -3845,7 +4005,8 @@ async def analyze_kp_detailed_10_sections(data: dict):
                 "kp_length": len(kp_content),
                 "tz_length": len(tz_content) if tz_content else 0,
                 "has_tz": bool(tz_content),
-                "analysis_version": "v2.0"
+                "analysis_version": "v2.0",
+                "usage": claude_usage_metadata(getattr(response, "usage", None))
             }
         }
         
@@ -3978,12 +4139,6 @@ async def call_anthropic_api(prompt: str, model: str, max_tokens: int, temperatu
     """Вызов Anthropic Claude API"""
     print(f"DEBUG: call_anthropic_api started with model {model}")  # Для отладки
     try:
-        import anthropic
-        
-        # Перезагружаем .env файл для отладки
-        from dotenv import load_dotenv
-        load_dotenv(override=True)
-        
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             raise Exception("ANTHROPIC_API_KEY не настроен")
@@ -3994,8 +4149,8 @@ async def call_anthropic_api(prompt: str, model: str, max_tokens: int, temperatu
         # Логируем для отладки
         logger.info(f"Using API key: {api_key[:20]}... (length: {len(api_key)})")
         
-        # Используем асинхронный клиент
-        client = anthropic.AsyncAnthropic(api_key=api_key)
+        # Общий асинхронный клиент из пула (keep-alive соединения)
+        client = get_client_pool().get_anthropic(api_key)
         
         # Маппинг моделей (обновленные версии)
         model_mapping = {
@@ -4051,7 +4206,8 @@ async def call_anthropic_api(prompt: str, model: str, max_tokens: int, temperatu
         return {
             "content": ai_text,
             "model": actual_model,
-            "tokens_used": response.usage.output_tokens if hasattr(response, 'usage') else 0
+            "tokens_used": response.usage.output_tokens if hasattr(response, 'usage') else 0,
+            "usage": claude_usage_metadata(getattr(response, "usage", None))
         }
         
     except Exception as e:
@@ -4062,13 +4218,12 @@ async def call_anthropic_api(prompt: str, model: str, max_tokens: int, temperatu
 async def call_openai_api(prompt: str, model: str, max_tokens: int, temperature: float):
     """Вызов OpenAI GPT API"""
     try:
-        import openai
-        
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise HTTPException(status_code=500, detail="OPENAI_API_KEY не настроен")
         
-        client = openai.OpenAI(api_key=api_key)
+        # Общий асинхронный клиент из пула (keep-alive соединения)
+        client = get_client_pool().get_openai(api_key)
         
         # Маппинг моделей
         model_mapping = {
@@ -4080,7 +4235,7 @@ async def call_openai_api(prompt: str, model: str, max_tokens: int, temperature:
         
         actual_model = model_mapping.get(model, 'gpt-4o')
         
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=actual_model,
             messages=[
                 {"role": "user", "content": prompt}
@@ -4393,7 +4548,7 @@ async def upload_document_v2(file: UploadFile = File(...)):
         # Extract text based on file type
         extracted_text = ""
         if file.content_type == 'application/pdf':
-            extracted_text = extract_text_from_pdf(file_path)
+            extracted_text = await extract_text_from_pdf_async(file_path)
         elif file.content_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'application/msword']:
             extracted_text = extract_text_from_docx(file_path)
         elif file.content_type == 'text/plain':
@@ -4427,7 +4582,7 @@ async def start_analysis_v2(request: dict):
     Start comprehensive KP analysis v2 with real Claude AI integration
     """
     try:
-        session_id = request.get("session_id", f"session_{int(time.time())}")
+        session_id = request.get("session_id") or f"session_{uuid.uuid4().hex}"
         document_id = request.get("document_id")
         tz_content = request.get("tz_content")
         analysis_options = request.get("analysis_options", {})
@@ -4445,7 +4600,7 @@ async def start_analysis_v2(request: dict):
                         document_text = f.read()
                         break
                 elif file_path.name.endswith('.pdf'):
-                    document_text = extract_text_from_pdf(str(file_path))
+                    document_text = await extract_text_from_pdf_async(str(file_path))
                     break
                 elif file_path.name.endswith(('.docx', '.doc')):
                     document_text = extract_text_from_docx(str(file_path))
@@ -4457,6 +4612,13 @@ async def start_analysis_v2(request: dict):
         if not document_text:
             document_text = generate_realistic_kp_content_v2("demo_kp.txt")
         
+        # The session's event stream is created here: a session ID that already has
+        # a stream belongs to another analysis and is rejected
+        try:
+            ws_manager.broker.create(session_id)
+        except StreamInUse:
+            raise HTTPException(status_code=409, detail=f"Session {session_id} already exists")
+        
         # Start background analysis task
         asyncio.create_task(process_analysis_v2_background(
             session_id, document_text, tz_content, analysis_options
@@ -4468,20 +4630,87 @@ async def start_analysis_v2(request: dict):
             "success": True,
             "session_id": session_id,
             "message": "Анализ запущен",
-            "estimated_duration": "15-45 секунд"
+            "estimated_duration": "5-15 секунд"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Analysis start error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Global storage for analysis sessions (in production, use Redis/database)
 analysis_sessions_v2 = {}
+# Токены отмены выполняющихся анализов: отмена по запросу клиента или по уходу всех наблюдателей
+analysis_tokens_v2: Dict[str, CancellationToken] = {}
+
+# Анализ без подписчиков WS/SSE и без опросов прогресса дольше этого времени прерывается
+V2_ABANDON_GRACE = float(os.getenv("V2_ABANDON_GRACE", "60"))
+
+def is_session_abandoned_v2(session_id: str) -> bool:
+    """Никто не следит за анализом: нет подписчиков потока событий и давно не было опроса прогресса"""
+    stream = ws_manager.broker.get(session_id)
+    if stream is not None and stream.subscribers:
+        return False
+    last_seen = analysis_sessions_v2.get(session_id, {}).get("last_seen", time.time())
+    return time.time() - last_seen > V2_ABANDON_GRACE
+
+# Ограничения параллелизма для секционного анализа v2:
+# на один анализ и суммарно на все анализы процесса
+V2_SECTION_CONCURRENCY = int(os.getenv("V2_SECTION_CONCURRENCY", "10"))
+V2_GLOBAL_SECTION_CONCURRENCY = int(os.getenv("V2_GLOBAL_SECTION_CONCURRENCY", "20"))
+_v2_global_section_semaphore = asyncio.Semaphore(max(1, V2_GLOBAL_SECTION_CONCURRENCY))
+
+async def run_sections_v2(session_id: str, section_keys: List[str], document_text: str,
+                          tz_content: str = None, options: dict = {}) -> Dict[str, Any]:
+    """
+    Параллельный анализ разделов с ограничением конкурентности.
+    Прогресс обновляется по мере завершения каждого раздела,
+    результат возвращается в исходном порядке section_keys.
+    Оценка раздела синхронная, поэтому выполняется в потоке: цикл событий
+    не блокируется (ускорения самой оценки под GIL нет).
+    """
+    per_analysis_limit = max(1, int(options.get("max_concurrency", V2_SECTION_CONCURRENCY)))
+    analysis_semaphore = asyncio.Semaphore(per_analysis_limit)
+    total = len(section_keys)
+    completed = 0
+
+    async def run_section(section_key: str):
+        nonlocal completed
+        async with analysis_semaphore, _v2_global_section_semaphore:
+            # Анализ отменен, пока раздел ждал слот - не начинаем
+            token = current_token()
+            if token is not None:
+                token.raise_if_cancelled()
+            section_result = await asyncio.to_thread(
+                analyze_section_with_claude_v2, section_key, document_text, tz_content, options
+            )
+        completed += 1
+        # Готовый раздел сразу уходит клиенту (WS/SSE), не дожидаясь остальных
+        await ws_manager.send_section(session_id, section_key, section_result)
+        update_session_progress(session_id, 25 + (completed / total) * 65, "analysis",
+                                f"Раздел готов: {get_section_title(section_key)} ({completed}/{total})",
+                                section_key)
+        return section_result
+
+    tasks = [asyncio.create_task(run_section(key)) for key in section_keys]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # Один раздел упал - не тратим квоту на остальные
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return dict(zip(section_keys, results))
 
 async def process_analysis_v2_background(session_id: str, document_text: str, tz_content: str = None, options: dict = {}):
     """
     Background task for comprehensive analysis with real timing and Claude integration
     """
+    token = analysis_tokens_v2[session_id] = CancellationToken()
+    watcher = token.watch_idle(lambda: is_session_abandoned_v2(session_id), grace=0)
     try:
         start_time = time.time()
         
@@ -4491,41 +4720,25 @@ async def process_analysis_v2_background(session_id: str, document_text: str, tz
             "progress": 0,
             "stage": "extraction",
             "message": "Извлечение финансовых данных...",
-            "start_time": start_time
+            "start_time": start_time,
+            "last_seen": start_time
         }
         
-        # Stage 1: Financial extraction (5 seconds)
-        await asyncio.sleep(2)
+        # Stage 1: Financial extraction
         financials = extract_financials_v2(document_text)
         update_session_progress(session_id, 15, "extraction", "Финансовые данные извлечены")
         
-        # Stage 2: Prepare for Claude analysis (3 seconds) 
-        await asyncio.sleep(3)
+        # Stage 2: Prepare for Claude analysis
         update_session_progress(session_id, 25, "analysis", "Подготовка к AI анализу...")
         
-        # Stage 3: Run comprehensive analysis (25-35 seconds)
-        sections = {}
+        # Stage 3: Run comprehensive analysis - все разделы параллельно
         section_keys = ["budget", "timeline", "technical", "team", "functional", 
                        "security", "methodology", "scalability", "communication", "value"]
+        # Под токеном отмены: при отмене незавершенные разделы прерываются
+        sections = await token.run(run_sections_v2(session_id, section_keys, document_text, tz_content, options))
         
-        for i, section_key in enumerate(section_keys):
-            # Update progress for current section
-            progress = 25 + (i / len(section_keys)) * 65
-            update_session_progress(session_id, progress, "analysis", 
-                                  f"Анализ раздела: {get_section_title(section_key)}", section_key)
-            
-            # Analyze section with Claude (if available) or generate detailed analysis
-            section_result = await analyze_section_with_claude_v2(
-                section_key, document_text, tz_content, options
-            )
-            sections[section_key] = section_result
-            
-            # Realistic processing time per section (2.5-4 seconds)
-            await asyncio.sleep(2.5 + random.random() * 1.5)
-        
-        # Stage 4: Compilation (5 seconds)
+        # Stage 4: Compilation
         update_session_progress(session_id, 95, "compilation", "Формирование итогового отчета...")
-        await asyncio.sleep(3)
         
         # Generate final result
         overall_score = calculate_overall_score_v2(sections)
@@ -4560,9 +4773,20 @@ async def process_analysis_v2_background(session_id: str, document_text: str, tz
             "result": result,
             "processing_time": int(time.time() - start_time)
         }
+        await ws_manager.send_result(session_id, result)
         
         logger.info(f"Analysis v2 completed: {session_id}, duration: {int(time.time() - start_time)}s")
         
+    except RequestCancelled as e:
+        logger.info(f"Analysis v2 cancelled: {session_id}, {e.reason}, partial cost ${token.partial_cost:.4f}")
+        analysis_sessions_v2[session_id] = {
+            "status": "cancelled",
+            "reason": e.reason,
+            "progress": analysis_sessions_v2.get(session_id, {}).get("progress", 0),
+            "partial_cost_usd": round(token.partial_cost, 6)
+        }
+        await ws_manager.send_cancelled(session_id, e.reason, token.partial_cost)
+        
     except Exception as e:
         logger.error(f"Analysis v2 background error: {e}")
         analysis_sessions_v2[session_id] = {
@@ -4570,6 +4794,10 @@ async def process_analysis_v2_background(session_id: str, document_text: str, tz
             "error": str(e),
             "progress": 0
         }
+        await ws_manager.send_error(session_id, str(e))
+    finally:
+        watcher.cancel()
+        analysis_tokens_v2.pop(session_id, None)
 
 def update_session_progress(session_id: str, progress: float, stage: str, message: str, current_section: str = None):
     """Update analysis session progress"""
@@ -4583,6 +4811,12 @@ def update_session_progress(session_id: str, progress: float, stage: str, messag
         })
         if current_section:
             session["currentSection"] = current_section
+        ws_manager.publish(session_id, "progress", {
+            "stage": stage,
+            "message": message,
+            "progress": progress,
+            "currentSection": current_section
+        })
 
 @app.get("/api/v2/kp-analyzer/progress/{session_id}")
 async def get_analysis_progress_v2(session_id: str):
@@ -4592,6 +4826,8 @@ async def get_analysis_progress_v2(session_id: str):
             raise HTTPException(status_code=404, detail="Сессия не найдена")
         
         session = analysis_sessions_v2[session_id]
+        # Опрос прогресса - признак того, что результат еще ждут
+        session["last_seen"] = time.time()
         return {
             "success": True,
             "session_id": session_id,
@@ -4611,6 +4847,24 @@ async def get_analysis_progress_v2(session_id: str):
         logger.error(f"Progress fetch error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/v2/kp-analyzer/cancel/{session_id}")
+async def cancel_analysis_v2(session_id: str):
+    """Cancel a running analysis: outstanding section calls are aborted"""
+    if session_id not in analysis_sessions_v2:
+        raise HTTPException(status_code=404, detail="Сессия не найдена")
+    
+    token = analysis_tokens_v2.get(session_id)
+    if token is None:
+        # Анализ уже завершен
+        return {
+            "success": False,
+            "session_id": session_id,
+            "status": analysis_sessions_v2[session_id].get("status", "unknown")
+        }
+    
+    token.cancel("cancelled by user")
+    return {"success": True, "session_id": session_id, "status": "cancelling"}
+
 @app.get("/api/v2/kp-analyzer/results/{session_id}")
 async def get_analysis_results_v2(session_id: str):
     """Get comprehensive analysis results"""
@@ -4851,10 +5105,12 @@ def extract_financials_v2(text: str) -> dict:
         'financialNotes': []
     }
 
-async def analyze_section_with_claude_v2(section_key: str, document_text: str, tz_content: str = None, options: dict = {}):
+def analyze_section_with_claude_v2(section_key: str, document_text: str, tz_content: str = None, options: dict = {}):
     """
     Analyze individual section with enhanced AI processing
     In production, this would use real Claude API calls
+
+    Synchronous (local keyword scoring): run_sections_v2 calls it through asyncio.to_thread
     """
     section_config = {
         'budget': {'title': 'Бюджетный анализ', 'weight': 0.15},
@@ -5846,6 +6102,15 @@ async def analyze_v3(request: V3AnalysisRequest, current_user: Dict[str, Any] =
         primary_doc = file_content_storage[request.document_ids[0]]
         content = primary_doc["content"].decode('utf-8', errors='ignore')
         
+        # TZ is the same for every KP of the tender - sent as a cached prefix
+        tz_context = None
+        if request.tz_document_id is not None:
+            if request.tz_document_id not in file_content_storage:
+                raise HTTPException(status_code=404, detail=f"Document {request.tz_document_id} not found")
+            tz_content = file_content_storage[request.tz_document_id]["content"].decode('utf-8', errors='ignore')
+            if tz_content.strip():
+                tz_context = f"Техническое задание:\n{tz_content}"
+        
         # Get configuration
         weights = CriteriaWeight()
         if request.analysis_config:
@@ -5868,7 +6133,7 @@ async def analyze_v3(request: V3AnalysisRequest, current_user: Dict[str, Any] =
 - risk_assessment: оценка рисков
 """
         
-        ai_result = await ai_provider.analyze_with_claude(ai_prompt, content)
+        ai_result = await ai_provider.analyze_with_claude(ai_prompt, content, context=tz_context)
         
         # Extract advanced data
         extraction_data = primary_doc.get("extraction_data", {})
@@ -72,6 +72,20 @@ SYSTEM_CPU = Gauge('system_cpu_percent', 'CPU usage percentage')
 SYSTEM_MEMORY = Gauge('system_memory_percent', 'Memory usage percentage')
 SYSTEM_DISK = Gauge('system_disk_percent', 'Disk usage percentage')
 
+# Очереди LLM планировщика и пула извлечения: сборщики живут в сервисах, которые их
+# регистрируют и на своем /metrics (LLM Service, Documents Service, монолит)
+try:
+    from services.llm.metrics import register_scheduler_metrics
+    register_scheduler_metrics()
+except ImportError:
+    pass
+
+try:
+    from services.documents.core.extraction_metrics import register_extraction_metrics
+    register_extraction_metrics()
+except ImportError:
+    pass
+
 class PerformanceTracker:
     """Трекер производительности"""
     
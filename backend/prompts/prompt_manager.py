@@ -4,12 +4,19 @@
 """
 import json
 import logging
+import os
+import time
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 from datetime import datetime
 
+from shared.prompt_registry import get_prompt_registry, content_version, PromptTemplateError
+
 logger = logging.getLogger(__name__)
 
+# Как часто проверять изменение файлов промптов (секунды); 0 - только явная перезагрузка
+CHECK_INTERVAL = float(os.getenv("PROMPTS_CHECK_INTERVAL", "5"))
+
 class PromptManager:
     """Менеджер для загрузки и управления промптами"""
     
@@ -29,8 +36,13 @@ class PromptManager:
             
         self._cache = {}  # Кэш загруженных промптов
         self._last_modified = {}  # Время последнего изменения файлов
+        self._last_check = time.monotonic()
+        self.registry = get_prompt_registry()
         
         logger.info(f"PromptManager initialized with directory: {self.prompts_dir}")
+        
+        # Все промпты загружаются и компилируются один раз при запуске
+        self.reload_all_prompts()
     
     def load_prompt_config(self, prompt_type: str, force_reload: bool = False) -> Optional[Dict[str, Any]]:
         """
@@ -44,20 +56,20 @@ class PromptManager:
             Словарь с конфигурацией промпта или None при ошибке
         """
         prompt_file = self.prompts_dir / f"{prompt_type}.json"
+        cache_key = str(prompt_file)
+        
+        if not force_reload and cache_key in self._cache:
+            # Без stat файла на каждый запрос - изменения проверяются раз в CHECK_INTERVAL
+            if CHECK_INTERVAL and time.monotonic() - self._last_check >= CHECK_INTERVAL:
+                self.check_for_changes()
+            return self._cache.get(cache_key)
         
         if not prompt_file.exists():
             logger.error(f"Prompt file not found: {prompt_file}")
             return None
         
         try:
-            # Проверка необходимости перезагрузки
             current_modified = prompt_file.stat().st_mtime
-            cache_key = str(prompt_file)
-            
-            if not force_reload and cache_key in self._cache:
-                if self._last_modified.get(cache_key, 0) >= current_modified:
-                    logger.debug(f"Using cached prompt config for {prompt_type}")
-                    return self._cache[cache_key]
             
             # Загрузка из файла
             with open(prompt_file, 'r', encoding='utf-8') as f:
@@ -68,6 +80,8 @@ class PromptManager:
                 logger.error(f"Invalid prompt configuration in {prompt_file}")
                 return None
             
+            self._compile_prompts(prompt_type, config)
+            
             # Обновление кэша
             self._cache[cache_key] = config
             self._last_modified[cache_key] = current_modified
@@ -82,6 +96,61 @@ class PromptManager:
             logger.error(f"Error loading prompt config {prompt_file}: {str(e)}")
             return None
     
+    def _compile_prompts(self, prompt_type: str, config: Dict[str, Any]):
+        """Регистрация промптов файла в общем реестре (версия - хеш содержимого)"""
+        self.registry.unregister_prefix(f"{prompt_type}/")
+        
+        for prompt_name, prompt_data in config.get('prompts', {}).items():
+            if not isinstance(prompt_data, dict) or 'text' not in prompt_data:
+                continue
+            try:
+                self.registry.register(f"{prompt_type}/{prompt_name}", prompt_data['text'])
+            except PromptTemplateError as e:
+                # Промпт используется как есть, без подстановки - не критично
+                logger.warning(f"Prompt {prompt_type}/{prompt_name} is not a valid template: {e}")
+    
+    def check_for_changes(self) -> List[str]:
+        """
+        Перезагрузить промпты, файлы которых изменились
+        
+        Returns:
+            Список перезагруженных типов промптов
+        """
+        self._last_check = time.monotonic()
+        reloaded = []
+        
+        for cache_key in list(self._cache):
+            prompt_file = Path(cache_key)
+            try:
+                current_modified = prompt_file.stat().st_mtime
+            except OSError:
+                continue
+            
+            if current_modified > self._last_modified.get(cache_key, 0):
+                if self.load_prompt_config(prompt_file.stem, force_reload=True):
+                    reloaded.append(prompt_file.stem)
+        
+        if reloaded:
+            logger.info(f"Prompt files changed, reloaded: {reloaded}")
+        return reloaded
+    
+    def get_prompt_version(self, prompt_type: str) -> Optional[str]:
+        """
+        Версия набора промптов для ключа кеша ответов LLM
+        
+        Args:
+            prompt_type: Тип промпта
+            
+        Returns:
+            Хеш содержимого промптов или None
+        """
+        config = self.load_prompt_config(prompt_type)
+        if not config:
+            return None
+        
+        prompts = self.get_all_prompts(prompt_type)
+        return content_version(*(f"{name}:{text}" for name, text in sorted(prompts.items())))
+    
     def get_system_prompt(self, prompt_type: str) -> Optional[str]:
         """
         Получить системный промпт для указанного типа документа
@@ -358,7 +427,8 @@ def get_prompts_for_document_type(document_type: str) -> Dict[str, str]:
     
     return {
         'system_prompt': system_prompt,
-        'user_prompt': user_prompt
+        'user_prompt': user_prompt,
+        'prompt_version': prompt_manager.get_prompt_version(prompt_type)
     }
 
 
@@ -0,0 +1,294 @@
+"""
+Разбиение больших документов на фрагменты и map-reduce анализ
+Текст делится по структурным границам (страницы, заголовки, таблицы
+EnhancedPDFExtractor), фрагменты анализируются параллельно с ограничением
+числа одновременных запросов, частичные JSON-результаты сводятся в один
+со ссылками на страницы источника.
+"""
+import asyncio
+import copy
+import logging
+import os
+import re
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# Используется и монолитом, поэтому настройки из окружения
+CHUNK_MAX_TOKENS = int(os.getenv("DOCUMENT_CHUNK_MAX_TOKENS", "6000"))
+CHUNK_CONCURRENCY = int(os.getenv("DOCUMENT_CHUNK_CONCURRENCY", "4"))
+
+# Оценка без токенизатора провайдера: ~3 символа на токен для русского текста
+CHARS_PER_TOKEN = 3
+
+# Разделитель страниц в извлеченном тексте (form feed)
+PAGE_SEPARATOR = "\f"
+
+_NUMBERED_HEADING = re.compile(r"^\s*\d+(?:\.\d+)*\.?\s+[A-Za-zА-Яа-яЁё]")
+_KEYWORD_HEADING = re.compile(r"^\s*(?:раздел|глава|приложение|section|appendix)\b", re.IGNORECASE)
+_MAX_HEADING_LENGTH = 120
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительное число токенов текста"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def needs_chunking(text: str, max_tokens: int = CHUNK_MAX_TOKENS) -> bool:
+    """Не помещается ли текст в один запрос"""
+    return estimate_tokens(text) > max_tokens
+
+
+def _is_heading(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or len(stripped) > _MAX_HEADING_LENGTH:
+        return False
+    if _NUMBERED_HEADING.match(stripped) or _KEYWORD_HEADING.match(stripped):
+        return True
+    # Строка заглавными буквами ("ТЕХНИЧЕСКИЕ ТРЕБОВАНИЯ")
+    return len(stripped) >= 6 and stripped.isupper()
+
+
+def _split_sections(text: str) -> List[str]:
+    """Разбиение текста на разделы по заголовкам"""
+    sections = []
+    current: List[str] = []
+    for line in text.splitlines():
+        if current and _is_heading(line):
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("\n".join(current))
+    return [section for section in sections if section.strip()]
+
+
+def _split_oversized(text: str, max_chars: int) -> List[str]:
+    """Раздел больше лимита - по абзацам, слишком длинный абзац - по строкам"""
+    pieces = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind("\n", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip("\n")
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            pieces.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def format_table(table: Dict[str, Any]) -> str:
+    """Таблица EnhancedPDFExtractor в текстовом виде"""
+    header = f"[Таблица, стр. {table['page']}]" if table.get("page") else "[Таблица]"
+    rows = [" | ".join(str(cell or "").strip() for cell in row) for row in table.get("data") or []]
+    return "\n".join([header] + rows)
+
+
+def _normalize_line(text: str) -> str:
+    return " ".join(text.split())
+
+
+def strip_table_text(page_text: str, page_tables: List[Dict[str, Any]]) -> str:
+    """
+    Убрать из текста страницы строки ее таблиц: таблицы идут отдельными
+    фрагментами, иначе их текст попадает в анализ дважды
+
+    Текстовый слой отдает строку таблицы целиком или по ячейкам. Строка
+    таблицы из нескольких ячеек убирается всегда, отдельные ячейки - только
+    подряд идущими группами, чтобы не задеть совпадающий с ячейкой заголовок.
+    """
+    rows = set()
+    cells = set()
+    for table in page_tables:
+        for row in table.get("data") or []:
+            values = [_normalize_line(str(cell or "")) for cell in row]
+            if sum(1 for value in values if value) > 1:
+                rows.add(" ".join(value for value in values if value))
+            for cell in row:
+                cells.update(_normalize_line(line) for line in str(cell or "").splitlines())
+    cells.discard("")
+    if not rows and not cells:
+        return page_text
+
+    lines = page_text.splitlines()
+    dropped = set()
+    run: List[int] = []
+    for index, line in enumerate(lines + [None]):
+        normalized = _normalize_line(line) if line is not None else None
+        if normalized in rows:
+            dropped.add(index)
+        if normalized in cells or normalized in rows:
+            run.append(index)
+        elif normalized != "":
+            if len(run) > 1:
+                dropped.update(run)
+            run = []
+    return "\n".join(line for index, line in enumerate(lines) if index not in dropped)
+
+
+def split_into_chunks(
+    text: str = "",
+    pages: Optional[List[str]] = None,
+    tables: Optional[List[Dict[str, Any]]] = None,
+    max_tokens: int = CHUNK_MAX_TOKENS
+) -> List[Dict[str, Any]]:
+    """
+    Разбить документ на фрагменты не больше max_tokens
+
+    Args:
+        text: Извлеченный текст (страницы могут быть разделены form feed)
+        pages: Текст по страницам, если экстрактор его отдает
+        tables: Таблицы EnhancedPDFExtractor (с номером страницы); их
+            строки убираются из текста страницы
+        max_tokens: Лимит токенов на фрагмент
+
+    Returns:
+        Фрагменты {"index", "kind": "text"|"table", "text", "pages"}
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+
+    numbered = pages is not None or PAGE_SEPARATOR in text
+    if pages is None:
+        pages = text.split(PAGE_SEPARATOR)
+
+    tables_by_page: Dict[int, List[Dict[str, Any]]] = {}
+    for table in tables or []:
+        if table.get("page") is not None:
+            tables_by_page.setdefault(table["page"], []).append(table)
+
+    units: List[Tuple[Optional[int], str, str]] = []
+    for page_number, page_text in enumerate(pages, start=1):
+        if numbered and page_number in tables_by_page:
+            page_text = strip_table_text(page_text, tables_by_page[page_number])
+        for section in _split_sections(page_text):
+            for piece in _split_oversized(section, max_chars):
+                units.append((page_number if numbered else None, "text", piece))
+
+    # Таблицы - отдельными фрагментами, чтобы строки не разрывались посреди текста
+    for table in tables or []:
+        for piece in _split_oversized(format_table(table), max_chars):
+            units.append((table.get("page"), "table", piece))
+
+    chunks: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for page, kind, piece in units:
+        if current and (current["kind"] != kind or len(current["text"]) + len(piece) + 2 > max_chars):
+            chunks.append(current)
+            current = None
+        if current is None:
+            current = {"index": len(chunks), "kind": kind, "text": piece, "pages": []}
+        else:
+            current["text"] += "\n\n" + piece
+        if page is not None and page not in current["pages"]:
+            current["pages"].append(page)
+    if current:
+        chunks.append(current)
+
+    return chunks
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _merge_into(target: Dict[str, Any], data: Dict[str, Any], conflicts: Dict[str, List[Any]], path: str = ""):
+    for key, value in data.items():
+        if _is_empty(value):
+            continue
+        field = f"{path}{key}"
+        current = target.get(key)
+        if _is_empty(current):
+            target[key] = copy.deepcopy(value)
+        elif isinstance(current, dict) and isinstance(value, dict):
+            _merge_into(current, value, conflicts, f"{field}.")
+        elif isinstance(current, list) and isinstance(value, list):
+            current.extend(copy.deepcopy(item) for item in value if item not in current)
+        elif current != value:
+            # Первое найденное значение остается, расхождения сохраняются для проверки
+            alternatives = conflicts.setdefault(field, [current])
+            if value not in alternatives:
+                alternatives.append(value)
+
+
+def merge_partial_results(partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Свести частичные результаты фрагментов в один
+
+    Списки объединяются без повторов, вложенные словари сливаются рекурсивно,
+    для скаляров берется первое непустое значение (в порядке документа).
+    В source_pages для каждого поля - страницы фрагментов, где оно найдено.
+
+    Args:
+        partials: [{"data": dict, "pages": [int]}] в порядке фрагментов
+    """
+    merged: Dict[str, Any] = {}
+    conflicts: Dict[str, List[Any]] = {}
+    source_pages: Dict[str, List[int]] = {}
+
+    for partial in partials:
+        data = partial["data"]
+        _merge_into(merged, data, conflicts)
+        for key, value in data.items():
+            if _is_empty(value):
+                continue
+            field_pages = source_pages.setdefault(key, [])
+            field_pages.extend(page for page in partial["pages"] if page not in field_pages)
+
+    merged["source_pages"] = {key: sorted(pages) for key, pages in source_pages.items()}
+    if conflicts:
+        merged["conflicts"] = conflicts
+    return merged
+
+
+async def analyze_in_chunks(
+    chunks: List[Dict[str, Any]],
+    analyze_chunk: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+    concurrency: int = CHUNK_CONCURRENCY
+) -> Dict[str, Any]:
+    """
+    Map-reduce анализ: analyze_chunk для каждого фрагмента (не больше
+    concurrency одновременно), затем свод результатов
+
+    Args:
+        chunks: Фрагменты split_into_chunks
+        analyze_chunk: Извлечение JSON из одного фрагмента
+        concurrency: Лимит одновременных запросов к LLM
+
+    Returns:
+        Сводный результат с source_pages и сведениями о фрагментах в "chunks"
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chunk: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                data = await analyze_chunk(chunk)
+            except Exception as e:
+                logger.warning(f"Chunk {chunk['index']} analysis failed: {e}")
+                return {"error": str(e), "index": chunk["index"]}
+            if not isinstance(data, dict):
+                return {"error": "chunk result is not a JSON object", "index": chunk["index"]}
+            return {"data": data, "pages": chunk["pages"], "index": chunk["index"]}
+
+    results = await asyncio.gather(*(run(chunk) for chunk in chunks))
+    partials = [result for result in results if "data" in result]
+    failed = [result["index"] for result in results if "error" in result]
+
+    if not partials:
+        raise ValueError(f"All {len(chunks)} chunks failed to analyze")
+
+    logger.info(f"Chunked analysis: {len(partials)}/{len(chunks)} chunks succeeded")
+
+    merged = merge_partial_results(partials)
+    merged["chunks"] = {"total": len(chunks), "failed": failed}
+    return merged
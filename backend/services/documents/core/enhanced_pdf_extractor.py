@@ -6,35 +6,46 @@ Features:
 - Множественные методы извлечения (PyMuPDF -> pdfplumber -> camelot -> OCR)
 - Продвинутое извлечение таблиц
 - Улучшенное распознавание сумм и чисел
-- Обработка сканированных документов
-- Кэширование результатов
+- Обработка сканированных документов: OCR только страниц без текстового слоя
+- Кэширование результатов по содержимому файла (общий кеш извлечения)
+- Разбор в пуле процессов - event loop не блокируется
+- Параллельный разбор диапазонов страниц с происхождением каждой страницы
+- Один разбор PyMuPDF на страницу; pdfplumber/camelot - только для страниц с таблицами
 - Детальное логирование и валидация
 """
 
 import os
 import re
-import json
+import shutil
+import tempfile
+import importlib.util
 import logging
-import hashlib
 from typing import Dict, List, Any, Optional, Tuple
 from pathlib import Path
 from io import BytesIO
 import asyncio
+import time
 from datetime import datetime
 
+from .extraction_pool import get_extraction_pool, ExtractionTimeout, ExtractionFailed
+from .extraction_cache import ExtractionCache, get_extraction_cache, content_hash
+from .page_sharding import count_pages, page_batches, merge_page_results, summarize_pages, page_layout, page_record
+from .page_ocr import ocr_pages, apply_ocr, image_only_pages
+
 # Core PDF libraries
 import PyPDF2
 import pdfplumber
 import fitz  # PyMuPDF
-import camelot
 
 # Optional imports with fallbacks
 try:
-    import pytesseract
-    from PIL import Image
-    OCR_AVAILABLE = True
+    import camelot
+    CAMELOT_AVAILABLE = True
 except ImportError:
-    OCR_AVAILABLE = False
+    CAMELOT_AVAILABLE = False
+
+# OCR itself runs in page_ocr workers; here only whether it is worth dispatching
+OCR_AVAILABLE = importlib.util.find_spec("pytesseract") is not None
 
 try:
     import chardet
@@ -44,6 +55,12 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Версия результата для ключа кеша - меняется при изменении состава результата
+EXTRACTOR_VERSION = "4"
+
+# Диапазон страниц [start, end), end=None - до конца документа
+PageRange = Tuple[int, Optional[int]]
+
 class EnhancedPDFExtractor:
     """Улучшенный экстрактор PDF с множественными методами извлечения"""
     
@@ -52,10 +69,9 @@ class EnhancedPDFExtractor:
         Initialize extractor
         
         Args:
-            cache_dir: Directory for caching extraction results
+            cache_dir: Directory for caching extraction results (the shared extraction cache by default)
         """
-        self.cache_dir = cache_dir or Path("/tmp/pdf_cache")
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = ExtractionCache(cache_dir) if cache_dir else get_extraction_cache()
         
         # Number format patterns for better recognition
         self.number_patterns = [
@@ -115,11 +131,13 @@ class EnhancedPDFExtractor:
             Dict with extracted data including text, tables, budgets, etc.
         """
         # Check cache first
-        cache_key = self._get_cache_key(file_content, filename)
+        cache_key = self._get_cache_key(file_content)
         if use_cache:
             cached_result = await self._load_from_cache(cache_key)
             if cached_result:
                 logger.info(f"📦 Using cached data for {filename}")
+                # The same content may have been uploaded under another name
+                cached_result['filename'] = filename
                 return cached_result
         
         logger.info(f"🔍 Starting comprehensive PDF extraction for {filename}")
@@ -129,6 +147,8 @@ class EnhancedPDFExtractor:
             "extraction_timestamp": datetime.now().isoformat(),
             "extraction_methods": [],
             "text": "",
+            "pages": [],
+            "page_details": [],
             "tables": [],
             "budgets": [],
             "currencies": [],
@@ -144,29 +164,58 @@ class EnhancedPDFExtractor:
         start_time = datetime.now()
         
         try:
-            # Step 1: Try PyMuPDF for modern PDFs
-            pymupdf_result = await self._extract_with_pymupdf(file_content)
-            if pymupdf_result['success']:
-                extraction_result['text'] = pymupdf_result['text']
-                extraction_result['metadata']['page_count'] = pymupdf_result['page_count']
-                extraction_result['extraction_methods'].append('pymupdf')
-                logger.info("✅ PyMuPDF extraction successful")
-            
-            # Step 2: Use pdfplumber for table extraction
-            pdfplumber_result = await self._extract_tables_with_pdfplumber(file_content)
-            if pdfplumber_result['success']:
-                extraction_result['tables'].extend(pdfplumber_result['tables'])
-                if not extraction_result['text']:  # Fallback text
-                    extraction_result['text'] = pdfplumber_result['text']
-                extraction_result['extraction_methods'].append('pdfplumber')
-                logger.info(f"✅ pdfplumber: extracted {len(pdfplumber_result['tables'])} tables")
+            # Steps 1-3: page ranges are extracted concurrently in worker processes,
+            # each page parsed once by PyMuPDF; table extractors and OCR run only on
+            # the pages that need them. Results are merged back in page order
+            # Opening a damaged PDF repairs its xref by scanning the whole file - off the loop
+            page_count = await asyncio.to_thread(count_pages, file_content)
+            batches = page_batches(page_count, get_extraction_pool().workers) or [(0, None)]
+            batch_results = await asyncio.gather(*[
+                self._run_in_pool(
+                    f"pages {start + 1}-{end or 'end'}", self._page_batch_job, file_content, filename, start, end
+                )
+                for start, end in batches
+            ])
+            
+            pages = merge_page_results([result['pages'] for result in batch_results if result['success']])
+            
+            # OCR only for image-only pages (scanned appendices of typed documents),
+            # spread across the pool workers
+            scanned_pages = image_only_pages(pages)
+            if scanned_pages and OCR_AVAILABLE:
+                ocr_results = await ocr_pages(file_content, scanned_pages)
+                recognized = apply_ocr(pages, ocr_results)
+                logger.info(f"✅ OCR: {recognized}/{len(scanned_pages)} image-only pages recognized "
+                           f"({sum(1 for result in ocr_results if result['cached'])} from cache)")
+            methods = set()
+            for result in batch_results:
+                if result['success']:
+                    extraction_result['tables'].extend(result['tables'])
+                    methods.update(result['methods'])
+            methods.update(page['method'] for page in pages if page['method'])
+            
+            if pages:
+                extraction_result['text'] = "\n".join(page['text'] for page in pages if page['text']).strip()
+                extraction_result['pages'] = [page['text'] for page in pages]
+                extraction_result['page_details'] = [
+                    {key: value for key, value in page.items() if key != 'text'} for page in pages
+                ]
+                extraction_result['metadata']['page_count'] = page_count or len(pages)
+                extraction_result['metadata']['pages'] = summarize_pages(pages)
+            
+            failed_batches = [
+                f"{start + 1}-{end or 'end'}"
+                for (start, end), result in zip(batches, batch_results) if not result['success']
+            ]
+            if failed_batches:
+                extraction_result['metadata']['failed_page_ranges'] = failed_batches
             
-            # Step 3: Try camelot for advanced table extraction
-            camelot_result = await self._extract_tables_with_camelot(file_content, filename)
-            if camelot_result['success']:
-                extraction_result['tables'].extend(camelot_result['tables'])
-                extraction_result['extraction_methods'].append('camelot')
-                logger.info(f"✅ camelot: extracted {len(camelot_result['tables'])} additional tables")
+            extraction_result['extraction_methods'] = [
+                method for method in ('pymupdf', 'pdfplumber', 'camelot', 'ocr') if method in methods
+            ]
+            table_pages = sum(1 for page in pages if page['table_hint'])
+            logger.info(f"✅ {len(pages)} pages in {len(batches)} ranges, {table_pages} with tables, "
+                       f"{len(extraction_result['tables'])} tables, methods: {extraction_result['extraction_methods']}")
             
             # Step 4: Fallback to PyPDF2 if needed
             if not extraction_result['text']:
@@ -176,26 +225,16 @@ class EnhancedPDFExtractor:
                     extraction_result['extraction_methods'].append('pypdf2')
                     logger.info("✅ PyPDF2 fallback successful")
             
-            # Step 5: OCR fallback for scanned documents
-            if not extraction_result['text'] and OCR_AVAILABLE:
-                ocr_result = await self._extract_with_ocr(file_content)
-                if ocr_result['success']:
-                    extraction_result['text'] = ocr_result['text']
-                    extraction_result['extraction_methods'].append('ocr')
-                    logger.info("✅ OCR extraction successful")
-            
-            # Step 6: Extract financial data
+            # Step 5: Extract financial data
             if extraction_result['text']:
-                extraction_result['budgets'] = self._extract_budget_data(
-                    extraction_result['text'], 
-                    extraction_result['tables']
-                )
-                extraction_result['currencies'] = self._extract_currencies(extraction_result['text'])
-                extraction_result['structured_data'] = self._structure_financial_data(
-                    extraction_result['text'],
-                    extraction_result['tables'],
-                    extraction_result['budgets']
+                financial_result = await self._run_in_pool(
+                    "financial", self._financial_job,
+                    extraction_result['text'], extraction_result['tables']
                 )
+                if financial_result['success']:
+                    extraction_result['budgets'] = financial_result['budgets']
+                    extraction_result['currencies'] = financial_result['currencies']
+                    extraction_result['structured_data'] = financial_result['structured_data']
             
             # Mark as successful if we extracted anything meaningful
             extraction_result['metadata']['extraction_success'] = bool(
@@ -222,38 +261,74 @@ class EnhancedPDFExtractor:
         
         return extraction_result
     
-    async def _extract_with_pymupdf(self, file_content: bytes) -> Dict[str, Any]:
-        """Extract text using PyMuPDF (fitz)"""
+    def _page_batch_job(self, file_content: bytes, filename: str, start: int, end: Optional[int]) -> Dict[str, Any]:
+        """
+        One shard of the document, pages [start, end), parsed once with PyMuPDF:
+        text and table hints come from the same layout. pdfplumber only sees the
+        pages that look like tables, camelot only those where pdfplumber found
+        nothing. Pages without a text layer are only classified here - they are
+        OCR'd afterwards across the pool. Every page carries its provenance:
+        method, char count, text layer and time spent.
+        """
         try:
             pdf_document = fitz.open(stream=file_content, filetype="pdf")
-            text = ""
-            
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                page_text = page.get_text()
-                if page_text:
-                    text += page_text + "\n"
-            
-            pdf_document.close()
-            
-            return {
-                'success': True,
-                'text': text.strip(),
-                'page_count': pdf_document.page_count if 'pdf_document' in locals() else 0
-            }
-            
         except Exception as e:
-            logger.warning(f"⚠️ PyMuPDF extraction failed: {e}")
+            logger.warning(f"⚠️ PyMuPDF could not open document: {e}")
             return {'success': False, 'error': str(e)}
+        
+        records: Dict[int, Dict[str, Any]] = {}
+        table_pages = []
+        methods = ['pymupdf']
+        try:
+            page_numbers = self._page_numbers(pdf_document.page_count, (start, end))
+            for page_num in page_numbers:
+                started = time.perf_counter()
+                layout = page_layout(pdf_document[page_num])
+                records[page_num] = page_record(
+                    page_num + 1, layout['text'], 'pymupdf' if layout['view'] else None, started
+                )
+                records[page_num]['text_layer'] = layout['text_layer']
+                records[page_num]['table_hint'] = layout['table_hint']
+                if layout['table_hint']:
+                    table_pages.append(page_num)
+        finally:
+            pdf_document.close()
+        
+        tables = []
+        if table_pages:
+            pdfplumber_result = self._pdfplumber_job(file_content, table_pages)
+            if pdfplumber_result['success']:
+                tables.extend(pdfplumber_result['tables'])
+                methods.append('pdfplumber')
+            
+            # camelot (ghostscript rendering) - only for table pages pdfplumber could not read
+            found = {table['page'] for table in tables}
+            camelot_pages = [page_num for page_num in table_pages if page_num + 1 not in found]
+            if camelot_pages and CAMELOT_AVAILABLE:
+                camelot_result = self._camelot_job(file_content, filename, camelot_pages)
+                if camelot_result['success'] and camelot_result['tables']:
+                    tables.extend(camelot_result['tables'])
+                    methods.append('camelot')
+        
+        return {
+            'success': True,
+            'pages': [records[page_num] for page_num in sorted(records)],
+            'tables': tables,
+            'methods': methods
+        }
     
-    async def _extract_tables_with_pdfplumber(self, file_content: bytes) -> Dict[str, Any]:
-        """Extract tables and text using pdfplumber"""
+    def _pdfplumber_job(self, file_content: bytes, page_numbers: Optional[List[int]] = None) -> Dict[str, Any]:
+        """Extract tables and text using pdfplumber (all pages or the given 0-based page numbers)"""
         try:
             tables = []
             text = ""
             
             with pdfplumber.open(BytesIO(file_content)) as pdf:
-                for page_num, page in enumerate(pdf.pages):
+                if page_numbers is None:
+                    page_numbers = list(range(len(pdf.pages)))
+                for page_num in page_numbers:
+                    page = pdf.pages[page_num]
+                    
                     # Extract text
                     page_text = page.extract_text()
                     if page_text:
@@ -292,13 +367,17 @@ class EnhancedPDFExtractor:
             logger.warning(f"⚠️ pdfplumber extraction failed: {e}")
             return {'success': False, 'error': str(e)}
     
-    async def _extract_tables_with_camelot(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Extract tables using camelot-py for advanced table detection"""
+    def _camelot_job(self, file_content: bytes, filename: str, page_numbers: Optional[List[int]] = None) -> Dict[str, Any]:
+        """Extract tables using camelot-py for advanced table detection (all pages or the given ones)"""
         try:
             # Save to temporary file (camelot requires file path)
-            temp_file = self.cache_dir / f"temp_{hash(filename)}_{datetime.now().timestamp()}.pdf"
+            temp_dir = tempfile.mkdtemp(prefix="camelot_")
+            temp_file = Path(temp_dir) / "document.pdf"
             temp_file.write_bytes(file_content)
             
+            pages = ",".join(str(page_num + 1) for page_num in page_numbers) if page_numbers else 'all'
+            id_prefix = f"p{page_numbers[0] + 1}_" if page_numbers else ""
+            
             tables = []
             
             try:
@@ -306,7 +385,7 @@ class EnhancedPDFExtractor:
                 camelot_tables = camelot.read_pdf(
                     str(temp_file), 
                     flavor='lattice',
-                    pages='all'
+                    pages=pages
                 )
                 
                 for i, table in enumerate(camelot_tables):
@@ -320,7 +399,8 @@ class EnhancedPDFExtractor:
                             
                             tables.append({
                                 "source": "camelot_lattice",
-                                "table_id": f"camelot_lattice_{i}",
+                                "page": self._camelot_page(table),
+                                "table_id": f"camelot_lattice_{id_prefix}{i}",
                                 "data": table_data,
                                 "row_count": len(table_data),
                                 "col_count": len(table_data[0]) if table_data else 0,
@@ -333,7 +413,7 @@ class EnhancedPDFExtractor:
                     camelot_tables = camelot.read_pdf(
                         str(temp_file), 
                         flavor='stream',
-                        pages='all'
+                        pages=pages
                     )
                     
                     for i, table in enumerate(camelot_tables):
@@ -343,7 +423,8 @@ class EnhancedPDFExtractor:
                                 table_data = df.values.tolist()
                                 tables.append({
                                     "source": "camelot_stream",
-                                    "table_id": f"camelot_stream_{i}",
+                                    "page": self._camelot_page(table),
+                                    "table_id": f"camelot_stream_{id_prefix}{i}",
                                     "data": table_data,
                                     "row_count": len(table_data),
                                     "col_count": len(table_data[0]) if table_data else 0,
@@ -353,8 +434,7 @@ class EnhancedPDFExtractor:
                 
             finally:
                 # Cleanup temp file
-                if temp_file.exists():
-                    temp_file.unlink()
+                shutil.rmtree(temp_dir, ignore_errors=True)
             
             return {
                 'success': True,
@@ -366,6 +446,10 @@ class EnhancedPDFExtractor:
             return {'success': False, 'error': str(e)}
     
     async def _extract_with_pypdf2(self, file_content: bytes) -> Dict[str, Any]:
+        """Fallback extraction with PyPDF2 in the extraction pool"""
+        return await self._run_in_pool("PyPDF2", self._pypdf2_job, file_content)
+    
+    def _pypdf2_job(self, file_content: bytes) -> Dict[str, Any]:
         """Fallback extraction with PyPDF2"""
         try:
             pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
@@ -385,43 +469,45 @@ class EnhancedPDFExtractor:
             logger.warning(f"⚠️ PyPDF2 extraction failed: {e}")
             return {'success': False, 'error': str(e)}
     
-    async def _extract_with_ocr(self, file_content: bytes) -> Dict[str, Any]:
-        """OCR extraction for scanned PDFs"""
-        if not OCR_AVAILABLE:
-            return {'success': False, 'error': 'OCR not available'}
-        
+    @staticmethod
+    def _page_numbers(page_count: int, page_range: Optional[PageRange]) -> List[int]:
+        """0-based page numbers of [start, end) clipped to the document (all pages without a range)"""
+        start, end = page_range or (0, None)
+        return list(range(start, page_count if end is None else min(end, page_count)))
+    
+    @staticmethod
+    def _camelot_page(table) -> Optional[int]:
         try:
-            # Convert PDF to images and OCR each page
-            pdf_document = fitz.open(stream=file_content, filetype="pdf")
-            text = ""
-            
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                
-                # Convert to image
-                pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))  # High resolution
-                img_data = pix.tobytes("png")
-                img = Image.open(BytesIO(img_data))
-                
-                # OCR the image
-                page_text = pytesseract.image_to_string(
-                    img, 
-                    lang='rus+eng',  # Support Russian and English
-                    config='--psm 6'  # Assume uniform block of text
-                )
-                
-                if page_text.strip():
-                    text += page_text + "\n"
-            
-            pdf_document.close()
-            
-            return {
-                'success': True,
-                'text': text.strip()
-            }
-            
-        except Exception as e:
-            logger.warning(f"⚠️ OCR extraction failed: {e}")
+            return int(table.page)
+        except (AttributeError, TypeError, ValueError):
+            return None
+    
+    def _financial_job(self, text: str, tables: List[Dict]) -> Dict[str, Any]:
+        """Budgets, currencies and structured financial data (regex-heavy on long texts)"""
+        budgets = self._extract_budget_data(text, tables)
+        return {
+            'success': True,
+            'budgets': budgets,
+            'currencies': self._extract_currencies(text),
+            'structured_data': self._structure_financial_data(text, tables, budgets)
+        }
+    
+    def __getstate__(self) -> Dict[str, Any]:
+        """Pool jobs are bound methods: the extractor is pickled without its cache (it holds a lock)"""
+        state = self.__dict__.copy()
+        state.pop('cache', None)
+        return state
+    
+    async def _run_in_pool(self, step: str, job, *args) -> Dict[str, Any]:
+        """
+        Run a CPU-bound extraction step in the process pool so that parsing a
+        large document does not block other requests. A timed out or crashed
+        step is reported like any other failed method.
+        """
+        try:
+            return await get_extraction_pool().run(job, *args)
+        except (ExtractionTimeout, ExtractionFailed) as e:
+            logger.warning(f"⚠️ {step} extraction failed: {e}")
             return {'success': False, 'error': str(e)}
     
     def _clean_table_data(self, table_data: List[List[str]]) -> List[List[str]]:
@@ -698,34 +784,18 @@ class EnhancedPDFExtractor:
         
         return unique_budgets
     
-    def _get_cache_key(self, file_content: bytes, filename: str) -> str:
-        """Generate cache key for file"""
-        content_hash = hashlib.md5(file_content).hexdigest()
-        return f"{filename}_{content_hash}.json"
+    def _get_cache_key(self, file_content: bytes) -> str:
+        """Cache key: content hash and extractor version (the filename does not matter)"""
+        return self.cache.make_key(content_hash(file_content), "enhanced_pdf", EXTRACTOR_VERSION)
     
     async def _load_from_cache(self, cache_key: str) -> Optional[Dict[str, Any]]:
         """Load extraction result from cache"""
-        cache_file = self.cache_dir / cache_key
-        
-        if cache_file.exists():
-            try:
-                with cache_file.open('r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.warning(f"Failed to load cache {cache_key}: {e}")
-        
-        return None
+        return await asyncio.to_thread(self.cache.get, cache_key)
     
     async def _save_to_cache(self, cache_key: str, data: Dict[str, Any]) -> None:
         """Save extraction result to cache"""
-        cache_file = self.cache_dir / cache_key
-        
-        try:
-            with cache_file.open('w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            logger.debug(f"Cached extraction result: {cache_key}")
-        except Exception as e:
-            logger.warning(f"Failed to save cache {cache_key}: {e}")
+        await asyncio.to_thread(self.cache.put, cache_key, data)
+        logger.debug(f"Cached extraction result: {cache_key}")
 
 # Convenience function for easy usage
 async def extract_pdf_data(
@@ -0,0 +1,197 @@
+"""
+Кеш результатов извлечения документов
+Ключ - хеш содержимого файла, вид экстрактора и его версия: тот же PDF под
+другим именем попадает в кеш, а новая версия экстрактора не получает
+устаревший результат. Записи хранятся сжатым JSON, общий объем ограничен,
+вытесняются давно не использованные записи. Кеш общий для всех экстракторов
+процесса (EnhancedPDFExtractor, TextExtractor, V3DocumentProcessor) и для
+процессов, использующих тот же каталог.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Параметры читаются из окружения: кеш общий для Documents Service и монолита
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "/tmp/pdf_cache")
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+ENTRY_SUFFIX = ".json.z"
+# Временный файл старше этого срока - остаток прерванной записи (процесс упал до os.replace)
+STALE_TEMP_SECONDS = 3600
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_hash(path: Union[str, os.PathLike]) -> str:
+    """Хеш содержимого файла без чтения целиком в память"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Дисковый кеш результатов извлечения с LRU вытеснением по объему.
+
+    Индекс (ключ -> размер записи в порядке использования) строится по
+    каталогу; время последнего использования хранится в mtime файла,
+    поэтому порядок вытеснения общий для процессов с одним каталогом.
+    Перед вытеснением индекс перестраивается заново: записи других
+    процессов (воркеры uvicorn, Documents Service) тоже учитываются, и
+    max_bytes - предел всего каталога. Запись атомарная: временный файл и
+    os.replace; брошенные временные файлы удаляются при построении индекса.
+    """
+
+    def __init__(self, cache_dir: Union[str, os.PathLike] = EXTRACTION_CACHE_DIR, max_bytes: int = EXTRACTION_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._bytes = 0
+        # Экстракторы вызывают кеш и из потоков
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(digest: str, kind: str, version: str) -> str:
+        """Ключ записи: хеш содержимого (content_hash/file_hash), вид экстрактора, версия"""
+        return hashlib.sha256(f"{kind}:{version}:{digest}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{ENTRY_SUFFIX}"
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            entries = []
+            if self.cache_dir.exists():
+                for path in self.cache_dir.glob(f"*/*{ENTRY_SUFFIX}"):
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, path.name[:-len(ENTRY_SUFFIX)], stat.st_size))
+                self._remove_stale_temp_files()
+            entries.sort()
+            self._index = OrderedDict((key, size) for _, key, size in entries)
+            self._bytes = sum(self._index.values())
+        return self._index
+
+    def _remove_stale_temp_files(self):
+        """Временные файлы записей, которые не дошли до os.replace"""
+        expired = time.time() - STALE_TEMP_SECONDS
+        for path in self.cache_dir.glob("*/*.tmp"):
+            try:
+                if path.stat().st_mtime < expired:
+                    path.unlink()
+            except OSError:
+                continue
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            index = self._load_index()
+            path = self._path(key)
+            try:
+                data = path.read_bytes()
+                value = json.loads(zlib.decompress(data))
+            except FileNotFoundError:
+                # Запись могла вытеснить другая копия кеша
+                self._forget(key)
+                self._misses += 1
+                return None
+            except (OSError, zlib.error, ValueError) as e:
+                logger.warning(f"Corrupted extraction cache entry {key}: {e}")
+                self._remove(key)
+                self._misses += 1
+                return None
+
+            if key not in index:
+                self._bytes += len(data)
+            index[key] = len(data)
+            index.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        data = zlib.compress(
+            json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        )
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            path = self._path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                temp_path.write_bytes(data)
+                os.replace(temp_path, path)
+            except OSError as e:
+                logger.warning(f"Failed to save extraction cache entry {key}: {e}")
+                return
+
+            # Объем каталога - по всем процессам, а не только по своим записям
+            self._index = None
+            self._load_index()
+            self._evict()
+
+    def _forget(self, key: str):
+        size = self._index.pop(key, None)
+        if size is not None:
+            self._bytes -= size
+
+    def _remove(self, key: str):
+        self._forget(key)
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self):
+        """Удалить давно не использованные записи каталога сверх max_bytes"""
+        while self._bytes > self.max_bytes and self._index:
+            key = next(iter(self._index))
+            self._remove(key)
+            self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._load_index()):
+                self._remove(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+            return {
+                "entries": len(index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+
+_extraction_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Общий кеш извлечения процесса"""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache()
+    return _extraction_cache
@@ -0,0 +1,61 @@
+"""
+Prometheus метрики извлечения документов
+Очередь пула извлечения и заполнение кеша: сборщик регистрируется там, где
+отдается /metrics (Documents Service, монолит, core/monitoring)
+"""
+from typing import Optional, Tuple
+
+from .extraction_pool import get_extraction_pool
+from .extraction_cache import get_extraction_cache
+
+try:
+    from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+
+class ExtractionPoolCollector:
+    """Метрики пула и кеша извлечения документов"""
+
+    def collect(self):
+        stats = get_extraction_pool().get_stats()
+        yield GaugeMetricFamily('document_extraction_queue_depth', 'Extraction jobs waiting for a worker', value=stats["queued"])
+        yield GaugeMetricFamily('document_extraction_running', 'Extraction jobs running in worker processes', value=stats["running"])
+        for field, description in (
+            ("completed", "Extraction jobs completed"),
+            ("failed", "Extraction jobs failed by worker crash"),
+            ("timeouts", "Extraction jobs killed by timeout")
+        ):
+            yield CounterMetricFamily(f'document_extraction_{field}', description, value=stats[field])
+
+        cache_stats = get_extraction_cache().get_stats()
+        yield GaugeMetricFamily('document_extraction_cache_bytes', 'Extraction cache size on disk', value=cache_stats["bytes"])
+        for field, description in (
+            ("hits", "Extraction cache hits"),
+            ("misses", "Extraction cache misses"),
+            ("evictions", "Extraction cache entries evicted by size")
+        ):
+            yield CounterMetricFamily(f'document_extraction_cache_{field}', description, value=cache_stats[field])
+
+
+_registered = False
+
+
+def register_extraction_metrics() -> bool:
+    """Зарегистрировать сборщик (один раз на процесс); False - prometheus_client не установлен"""
+    global _registered
+    if not PROMETHEUS_AVAILABLE:
+        return False
+    if not _registered:
+        REGISTRY.register(ExtractionPoolCollector())
+        _registered = True
+    return True
+
+
+def render_metrics() -> Optional[Tuple[bytes, str]]:
+    """Метрики реестра в формате Prometheus и их content type (None без prometheus_client)"""
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,184 @@
+"""
+Пул процессов для извлечения данных из документов
+Разбор PDF (PyMuPDF, pdfplumber, camelot, OCR) занимает процессор на секунды
+и минуты - в event loop он останавливает все остальные запросы. Задачи
+выполняются в отдельных процессах с таймаутом и ограничением памяти, а
+глубина очереди доступна для метрик.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, Callable
+
+try:
+    import resource
+except ImportError:  # Windows - ограничение памяти недоступно
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Параметры читаются из окружения: пул общий для Documents Service и монолита
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0")) or os.cpu_count() or 1
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "180"))
+EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv("EXTRACTION_MEMORY_LIMIT_MB", "2048"))
+# Воркер перезапускается после N задач - утечки памяти C-библиотек не копятся
+EXTRACTION_MAX_TASKS_PER_WORKER = int(os.getenv("EXTRACTION_MAX_TASKS_PER_WORKER", "50"))
+
+
+class ExtractionTimeout(Exception):
+    """Задача извлечения не уложилась в таймаут"""
+    pass
+
+
+class ExtractionFailed(Exception):
+    """Процесс воркера завершился аварийно (например, по лимиту памяти)"""
+    pass
+
+
+def _init_worker(memory_limit_mb: int):
+    """Лимит адресного пространства процесса: большой документ получит MemoryError, а не OOM killer"""
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logger.warning(f"Extraction worker memory limit not applied: {e}")
+
+
+class ExtractionPool:
+    """
+    Пул процессов для CPU-bound разбора документов.
+
+    Одновременно выполняется не больше workers задач, остальные ждут в
+    очереди (queued). Зависшая задача по таймауту прерывается перезапуском
+    пула; задачи, прерванные вместе с ней, повторяются один раз.
+    func и аргументы должны сериализоваться pickle (функции уровня модуля
+    или методы объектов без несериализуемого состояния).
+    """
+
+    def __init__(
+        self,
+        workers: int = EXTRACTION_WORKERS,
+        timeout: float = EXTRACTION_TIMEOUT,
+        memory_limit_mb: int = EXTRACTION_MEMORY_LIMIT_MB,
+        max_tasks_per_worker: int = EXTRACTION_MAX_TASKS_PER_WORKER
+    ):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Поколение пула: задача, прерванная чужим перезапуском, повторяется
+        self._generation = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._restarts = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: воркер не наследует потоки и event loop родителя
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.memory_limit_mb,),
+                max_tasks_per_child=self.max_tasks_per_worker or None
+            )
+        return self._executor
+
+    def _restart(self, generation: int):
+        """Убить процессы пула; следующая задача создаст новый"""
+        if generation != self._generation or self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        self._generation += 1
+        self._restarts += 1
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            if process.is_alive():
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Выполнить func(*args) в процессе пула
+
+        Raises:
+            ExtractionTimeout: задача выполнялась дольше timeout
+            ExtractionFailed: процесс воркера упал
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        timeout = self.timeout if timeout is None else timeout
+
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+
+        self._running += 1
+        started = time.monotonic()
+        try:
+            for attempt in range(2):
+                generation = self._generation
+                loop = asyncio.get_running_loop()
+                try:
+                    result = await asyncio.wait_for(
+                        loop.run_in_executor(self._get_executor(), func, *args),
+                        timeout=timeout
+                    )
+                    self._completed += 1
+                    return result
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    self._restart(generation)
+                    raise ExtractionTimeout(f"Extraction exceeded {timeout:.0f}s")
+                except BrokenProcessPool as e:
+                    if generation != self._generation and attempt == 0:
+                        # Пул перезапущен из-за другой задачи - повторяем
+                        continue
+                    self._failed += 1
+                    self._restart(generation)
+                    raise ExtractionFailed(f"Extraction worker crashed: {e}")
+        finally:
+            self._running -= 1
+            self._slots.release()
+            logger.debug(f"Extraction job {getattr(func, '__name__', func)} took {time.monotonic() - started:.2f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Глубина очереди и счетчики задач"""
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "timeouts": self._timeouts,
+            "restarts": self._restarts
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_extraction_pool: Optional[ExtractionPool] = None
+
+
+def get_extraction_pool() -> ExtractionPool:
+    """Общий пул извлечения процесса"""
+    global _extraction_pool
+    if _extraction_pool is None:
+        _extraction_pool = ExtractionPool()
+    return _extraction_pool
@@ -0,0 +1,173 @@
+"""
+Распознавание (OCR) страниц без текстового слоя
+Распознаются только страницы, которые разбор PyMuPDF отнес к сканам
+(page_sharding.classify_text_layer): страницы с текстом не растеризуются.
+Разрешение выбирается по размеру страницы, страницы распознаются
+параллельно в пуле извлечения, результат кешируется по хешу изображения
+страницы - повторная загрузка того же скана не запускает tesseract.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from .extraction_pool import get_extraction_pool, ExtractionTimeout, ExtractionFailed
+from .page_sharding import PdfSource, IMAGE_ONLY, open_pdf
+
+logger = logging.getLogger(__name__)
+
+OCR_LANG = os.getenv("OCR_LANG", "rus+eng")
+OCR_CONFIG = os.getenv("OCR_CONFIG", "--psm 3")
+# Разрешение растеризации; для больших листов (чертежи A1/A0) снижается до OCR_MAX_PIXELS
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", "40000000"))
+# Пустая строка - без кеша
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "/tmp/ocr_cache")
+
+
+def ocr_zoom(width: float, height: float, dpi: int = OCR_DPI, max_pixels: int = OCR_MAX_PIXELS) -> float:
+    """Масштаб растеризации страницы width x height (pt): dpi, но не больше max_pixels точек"""
+    zoom = dpi / 72
+    area = width * height
+    if area > 0 and area * zoom * zoom > max_pixels:
+        zoom = math.sqrt(max_pixels / area)
+    return zoom
+
+
+def ocr_cache_key(samples: bytes, width: int, height: int, lang: str = OCR_LANG, config: str = OCR_CONFIG) -> str:
+    """Ключ кеша: хеш точек изображения страницы и настроек tesseract"""
+    digest = hashlib.sha256(samples)
+    digest.update(f"{width}x{height}:{lang}:{config}".encode())
+    return digest.hexdigest()
+
+
+def _cache_path(key: str) -> Optional[Path]:
+    return Path(OCR_CACHE_DIR) / key[:2] / f"{key}.txt" if OCR_CACHE_DIR else None
+
+
+def _load_cached(key: str) -> Optional[str]:
+    path = _cache_path(key)
+    if path is None or not path.exists():
+        return None
+    try:
+        return path.read_text(encoding="utf-8")
+    except OSError as e:
+        logger.warning(f"OCR cache read failed: {e}")
+        return None
+
+
+def _save_cached(key: str, text: str):
+    path = _cache_path(key)
+    if path is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Запись через временный файл: воркеры пула пишут одновременно
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_text(text, encoding="utf-8")
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"OCR cache write failed: {e}")
+
+
+def ocr_document_page(page) -> Dict[str, Any]:
+    """Распознать страницу fitz; результат с номером страницы (с единицы), временем и разрешением"""
+    import fitz  # PyMuPDF
+    import pytesseract
+    from PIL import Image
+
+    started = time.perf_counter()
+    zoom = ocr_zoom(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+
+    key = ocr_cache_key(pix.samples, pix.width, pix.height)
+    text = _load_cached(key)
+    cached = text is not None
+    if not cached:
+        img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+        text = pytesseract.image_to_string(img, lang=OCR_LANG, config=OCR_CONFIG).strip()
+        _save_cached(key, text)
+
+    return {
+        "page": page.number + 1,
+        "text": text,
+        "dpi": round(zoom * 72),
+        "cached": cached,
+        "seconds": time.perf_counter() - started
+    }
+
+
+def ocr_job(source: PdfSource, page_numbers: List[int]) -> List[Dict[str, Any]]:
+    """
+    Распознать страницы (номера с нуля) одного документа.
+    Функция уровня модуля: выполняется в пуле процессов.
+    """
+    try:
+        import pytesseract  # noqa: F401
+    except ImportError:
+        logger.warning("pytesseract not installed, OCR skipped")
+        return []
+
+    # Параллельность дают процессы пула, а не потоки самого tesseract
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    results = []
+    document = open_pdf(source)
+    try:
+        for page_num in page_numbers:
+            try:
+                results.append(ocr_document_page(document.load_page(page_num)))
+            except Exception as e:
+                logger.warning(f"⚠️ OCR failed on page {page_num + 1}: {e}")
+    finally:
+        document.close()
+    return results
+
+
+async def ocr_pages(source: PdfSource, page_numbers: List[int]) -> List[Dict[str, Any]]:
+    """Распознать страницы (номера с нуля), распределив их по воркерам пула извлечения"""
+    if not page_numbers:
+        return []
+    pool = get_extraction_pool()
+    # Через одну страницу по группам: сканы обычно идут подряд, группы выходят равными
+    groups = [page_numbers[index::pool.workers] for index in range(min(pool.workers, len(page_numbers)))]
+    results = await asyncio.gather(
+        *[pool.run(ocr_job, source, group) for group in groups], return_exceptions=True
+    )
+
+    pages = []
+    for result in results:
+        if isinstance(result, (ExtractionTimeout, ExtractionFailed)):
+            # Страницы группы остаются без текста, остальные группы не теряются
+            logger.warning(f"⚠️ OCR job failed: {result}")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            pages.extend(result)
+    return pages
+
+
+def apply_ocr(pages: List[Dict[str, Any]], ocr_results: List[Dict[str, Any]]) -> int:
+    """Заменить текст распознанных страниц результатом OCR; возвращает число таких страниц"""
+    by_page = {result["page"]: result for result in ocr_results}
+    applied = 0
+    for page in pages:
+        result = by_page.get(page["page"])
+        if result is None:
+            continue
+        page["processing_time"] = round(page["processing_time"] + result["seconds"], 4)
+        page["ocr_dpi"] = result["dpi"]
+        page["ocr_cached"] = result["cached"]
+        if result["text"]:
+            page.update(text=result["text"], method="ocr", chars=len(result["text"]))
+            applied += 1
+    return applied
+
+
+def image_only_pages(pages: List[Dict[str, Any]]) -> List[int]:
+    """Номера (с нуля) страниц-сканов из результатов постраничного разбора"""
+    return [page["page"] - 1 for page in pages if page.get("text_layer") == IMAGE_ONLY]
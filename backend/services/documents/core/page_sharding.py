@@ -0,0 +1,299 @@
+"""
+Постраничное шардирование извлечения PDF
+Документ делится на диапазоны страниц, диапазоны разбираются параллельно в
+пуле процессов (extraction_pool), результаты собираются в порядке страниц с
+происхождением: каким методом получен текст страницы, сколько символов и
+сколько это заняло времени.
+
+Страница разбирается PyMuPDF один раз: текст, блоки и линии разметки берутся
+из этого разбора, а по ним определяется, на каких страницах есть таблицы и
+у каких страниц нет текстового слоя (сканы - им нужен OCR, см. page_ocr).
+"""
+import logging
+import math
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Страниц в одном диапазоне не больше этого числа
+PAGE_BATCH_SIZE = int(os.getenv("EXTRACTION_PAGE_BATCH_SIZE", "16"))
+# Документы короче не шардируются: запуск задачи в пуле дороже разбора
+MIN_PAGES_TO_SHARD = int(os.getenv("EXTRACTION_MIN_PAGES_TO_SHARD", "8"))
+
+PdfSource = Union[bytes, str, os.PathLike]
+
+
+def open_pdf(source: PdfSource):
+    """fitz документ из байтов или пути"""
+    import fitz  # PyMuPDF
+
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(str(source))
+
+
+def count_pages(source: PdfSource) -> int:
+    """
+    Число страниц (только таблица xref - быстро); 0, если PDF не открылся.
+    У поврежденного PDF открытие восстанавливает xref чтением всего файла -
+    из async кода вызывать в потоке
+    """
+    try:
+        document = open_pdf(source)
+        try:
+            return document.page_count
+        finally:
+            document.close()
+    except Exception as e:
+        logger.warning(f"Could not count PDF pages: {e}")
+        return 0
+
+
+def page_batches(
+    page_count: int,
+    workers: int,
+    batch_size: int = PAGE_BATCH_SIZE,
+    min_pages: int = MIN_PAGES_TO_SHARD
+) -> List[Tuple[int, int]]:
+    """
+    Диапазоны страниц [start, end): не меньше workers диапазонов, чтобы
+    заняты были все ядра, и не больше batch_size страниц в каждом
+    """
+    if page_count <= 0:
+        return []
+    if page_count < min_pages:
+        return [(0, page_count)]
+    size = max(1, min(batch_size, math.ceil(page_count / max(1, workers))))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def page_record(page: int, text: str, method: Optional[str], started: float) -> Dict[str, Any]:
+    """Результат страницы с происхождением (page - номер с единицы)"""
+    return {
+        "page": page,
+        "text": text or "",
+        "method": method,
+        "chars": len(text or ""),
+        "processing_time": round(time.perf_counter() - started, 4)
+    }
+
+
+def merge_page_results(batches: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Страницы всех диапазонов в порядке документа (диапазоны завершаются в любом порядке)"""
+    pages = [page for batch in batches for page in batch]
+    pages.sort(key=lambda page: page["page"])
+    return pages
+
+
+def summarize_pages(pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводка происхождения: сколько страниц каким методом и пустые страницы"""
+    methods: Dict[str, int] = {}
+    for page in pages:
+        if page["method"]:
+            methods[page["method"]] = methods.get(page["method"], 0) + 1
+    return {
+        "page_count": len(pages),
+        "methods": methods,
+        "empty_pages": [page["page"] for page in pages if not page["text"].strip()],
+        "total_chars": sum(page["chars"] for page in pages),
+        "processing_time": round(sum(page["processing_time"] for page in pages), 4)
+    }
+
+
+def extract_text_from_dict(text_dict):
+    """Extract text from PyMuPDF dictionary"""
+    text_parts = []
+    try:
+        for block in text_dict.get("blocks", []):
+            if "lines" in block:
+                for line in block["lines"]:
+                    for span in line.get("spans", []):
+                        text = span.get("text", "")
+                        if text.strip():
+                            text_parts.append(text)
+    except:
+        pass
+    return "\n".join(text_parts)
+
+
+def _line_text(line: Dict[str, Any]) -> str:
+    return "".join(span.get("text", "") for span in line.get("spans", []))
+
+
+def _text_blocks(layout: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [block for block in layout.get("blocks", []) if "lines" in block]
+
+
+# Представления текста страницы - все из одного разбора get_text("dict"):
+# lines - как get_text(), spans - фрагмент шрифта на строку, blocks - абзацы без отступов
+TEXT_VIEWS = [
+    ("lines", lambda layout: "\n".join(
+        "\n".join(_line_text(line) for line in block["lines"]) for block in _text_blocks(layout)
+    )),
+    ("spans", extract_text_from_dict),
+    ("blocks", lambda layout: "\n".join(
+        text for text in (
+            "\n".join(_line_text(line) for line in block["lines"]).strip() for block in _text_blocks(layout)
+        ) if text
+    )),
+]
+
+
+def text_score(text: str) -> int:
+    """Оценка качества текста: больше кириллических символов = лучше"""
+    cyrillic_count = sum(1 for c in text if '\u0400' <= c <= '\u04FF')
+    return cyrillic_count * 2 + len(text.strip())
+
+
+def best_text_view(layout: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """Текст страницы с лучшей оценкой среди представлений разбора"""
+    best_text, best_view, best_score = "", None, 0
+    for view, render in TEXT_VIEWS:
+        text = render(layout)
+        if text and text.strip():
+            score = text_score(text)
+            if score > best_score:
+                best_text, best_view, best_score = text, view, score
+    return best_text, best_view
+
+
+# Линия разметки короче этого (pt) - оформление, а не граница ячейки
+RULING_MIN_LENGTH = 20.0
+# Строка таблицы без линий: фрагменты текста на одной высоте с промежутками шире этого (pt)
+COLUMN_GAP = 15.0
+
+
+def count_rulings(drawings: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """Горизонтальные и вертикальные линии векторной графики страницы (page.get_drawings())"""
+    horizontal = vertical = 0
+    for drawing in drawings:
+        for item in drawing.get("items", []):
+            if item[0] == "l":
+                start, end = item[1], item[2]
+                if abs(start.y - end.y) < 1 and abs(start.x - end.x) >= RULING_MIN_LENGTH:
+                    horizontal += 1
+                elif abs(start.x - end.x) < 1 and abs(start.y - end.y) >= RULING_MIN_LENGTH:
+                    vertical += 1
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.height < 2 and rect.width >= RULING_MIN_LENGTH:
+                    horizontal += 1
+                elif rect.width < 2 and rect.height >= RULING_MIN_LENGTH:
+                    vertical += 1
+                elif rect.width >= RULING_MIN_LENGTH and rect.height >= 8:
+                    # Рамка ячейки
+                    horizontal += 2
+                    vertical += 2
+    return horizontal, vertical
+
+
+def aligned_rows(layout: Dict[str, Any]) -> int:
+    """Строки из трех и более фрагментов текста с колоночными промежутками (таблицы без линий)"""
+    rows: Dict[int, List[Tuple[float, float]]] = {}
+    for block in _text_blocks(layout):
+        for line in block["lines"]:
+            if not _line_text(line).strip():
+                continue
+            x0, y0, x1, _ = line["bbox"]
+            rows.setdefault(round(y0 / 3), []).append((x0, x1))
+    count = 0
+    for fragments in rows.values():
+        fragments.sort()
+        gaps = sum(1 for left, right in zip(fragments, fragments[1:]) if right[0] - left[1] > COLUMN_GAP)
+        if gaps >= 2:
+            count += 1
+    return count
+
+
+def table_hint(layout: Dict[str, Any], horizontal: int, vertical: int) -> Optional[str]:
+    """ruled - таблица с линиями, aligned - колонки без линий, None - таблиц не видно"""
+    if horizontal >= 3 and vertical >= 3:
+        return "ruled"
+    if aligned_rows(layout) >= 3:
+        return "aligned"
+    return None
+
+
+# Текстовый слой страницы
+TEXT_LAYER = "text"
+IMAGE_ONLY = "image"
+BLANK = "blank"
+
+# Меньше символов - текстового слоя нет
+MIN_TEXT_CHARS = 20
+# Скан с редким текстом (штамп, колонтитул поверх изображения) - тоже распознается
+SPARSE_TEXT_CHARS = 200
+IMAGE_COVERAGE = 0.5
+
+
+def image_coverage(layout: Dict[str, Any]) -> float:
+    """Доля площади страницы под изображениями (блоки type=1 разбора get_text("dict"))"""
+    page_area = layout.get("width", 0) * layout.get("height", 0)
+    if page_area <= 0:
+        return 0.0
+    area = 0.0
+    for block in layout.get("blocks", []):
+        if block.get("type") == 1:
+            x0, y0, x1, y1 = block["bbox"]
+            area += max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    return min(1.0, area / page_area)
+
+
+def classify_text_layer(text: str, coverage: float) -> str:
+    """text - текстовый слой есть, image - скан (нужен OCR), blank - пустая страница"""
+    chars = len(text.strip())
+    if chars >= SPARSE_TEXT_CHARS:
+        return TEXT_LAYER
+    if coverage >= IMAGE_COVERAGE:
+        return IMAGE_ONLY
+    if chars >= MIN_TEXT_CHARS:
+        return TEXT_LAYER
+    return IMAGE_ONLY if coverage > 0 else BLANK
+
+
+def page_layout(page, detect_tables: bool = True) -> Dict[str, Any]:
+    """
+    Один разбор страницы PyMuPDF: текст, блоки и линии разметки берутся из
+    get_text("dict") и векторной графики, повторного разбора нет
+    """
+    layout = page.get_text("dict")
+    text, view = best_text_view(layout)
+    result = {
+        "text": text,
+        "view": view,
+        "blocks": len(_text_blocks(layout)),
+        "text_layer": classify_text_layer(text, image_coverage(layout)),
+        "table_hint": None
+    }
+    if detect_tables:
+        try:
+            horizontal, vertical = count_rulings(page.get_drawings())
+        except Exception as e:
+            logger.debug(f"Page drawings unavailable: {e}")
+            horizontal = vertical = 0
+        result["rulings"] = {"horizontal": horizontal, "vertical": vertical}
+        result["table_hint"] = table_hint(layout, horizontal, vertical)
+    return result
+
+
+def extract_best_text_pages(source: PdfSource, start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Страницы [start, end) - лучшее представление текста одного разбора PyMuPDF.
+    Функция уровня модуля: выполняется в пуле процессов.
+    """
+    document = open_pdf(source)
+    try:
+        end = document.page_count if end is None else min(end, document.page_count)
+        pages = []
+        for page_num in range(start, end):
+            started = time.perf_counter()
+            layout = page_layout(document.load_page(page_num), detect_tables=False)
+            method = f"pymupdf:{layout['view']}" if layout["view"] else None
+            record = page_record(page_num + 1, layout["text"], method, started)
+            record["text_layer"] = layout["text_layer"]
+            pages.append(record)
+        return pages
+    finally:
+        document.close()
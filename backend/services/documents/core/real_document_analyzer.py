@@ -6,21 +6,24 @@ import asyncio
 import logging
 import httpx
 import json
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from pathlib import Path
 from datetime import datetime
 import uuid
 
 from .text_extractor import TextExtractor
+from .document_chunker import split_into_chunks, needs_chunking, analyze_in_chunks
 
 logger = logging.getLogger(__name__)
 
 class RealDocumentAnalyzer:
     """Реальный анализатор документов с AI интеграцией"""
     
-    def __init__(self, llm_service_url: str = "http://localhost:8002"):
+    def __init__(self, llm_service_url: str = "http://localhost:8002", model: Optional[str] = None):
         self.text_extractor = TextExtractor()
         self.llm_service_url = llm_service_url
+        # None - модель, которую /api/llm/analyze выбирает по своему маппингу
+        self.model = model
         self.http_client = httpx.AsyncClient(timeout=120.0)  # 2 минуты timeout
         
     async def analyze_document(self, document_path: Path, document_type: str = "kp") -> Dict[str, Any]:
@@ -52,7 +55,10 @@ class RealDocumentAnalyzer:
             
             # 3. AI анализ через LLM Service
             logger.info("Step 2: Sending to AI analysis")
-            ai_result = await self._perform_ai_analysis(extracted_text, document_type, analysis_id)
+            pages, tables = None, None
+            if needs_chunking(extracted_text) and document_path.suffix.lower() == ".pdf":
+                pages, tables = await self._extract_pdf_structure(document_path)
+            ai_result = await self._perform_ai_analysis(extracted_text, document_type, analysis_id, pages, tables)
             
             # 4. Формирование результата
             result = {
@@ -77,8 +83,32 @@ class RealDocumentAnalyzer:
                 "analyzed_at": datetime.now().isoformat()
             }
     
-    async def _perform_ai_analysis(self, text: str, document_type: str, analysis_id: str) -> Dict[str, Any]:
+    async def _extract_pdf_structure(self, document_path: Path):
+        """Страницы и таблицы PDF для разбиения большого документа по структуре"""
+        try:
+            from .enhanced_pdf_extractor import EnhancedPDFExtractor
+            
+            extraction = await EnhancedPDFExtractor().extract_comprehensive_data(
+                document_path.read_bytes(), document_path.name
+            )
+            return extraction.get("pages") or None, extraction.get("tables") or None
+            
+        except Exception as e:
+            logger.warning(f"PDF structure extraction unavailable, chunking plain text: {e}")
+            return None, None
+    
+    async def _perform_ai_analysis(
+        self, 
+        text: str, 
+        document_type: str, 
+        analysis_id: str,
+        pages: Optional[List[str]] = None,
+        tables: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
         """Отправка текста на AI анализ"""
+        if needs_chunking(text):
+            return await self._perform_chunked_analysis(text, document_type, analysis_id, pages, tables)
+        
         try:
             # Подготовка запроса для LLM Service
             ai_request = {
@@ -88,7 +118,7 @@ class RealDocumentAnalyzer:
                 "organization_id": 1,
                 "system_prompt": self._get_system_prompt(document_type),
                 "user_prompt": self._get_user_prompt(document_type),
-                "model_override": None,  # Использовать модель по умолчанию
+                "model_override": self.model,  # None - модель по умолчанию
                 "temperature": 0.1,  # Низкая температура для точности
                 "max_tokens": 2000,
                 "metadata": {
@@ -97,34 +127,101 @@ class RealDocumentAnalyzer:
                 }
             }
             
-            logger.info(f"Sending AI request to {self.llm_service_url}/generate")
-            
+            ai_response = await self._post_analysis(
+                ai_request["content"],
+                model=ai_request["model_override"],
+                max_tokens=ai_request.get("max_tokens", 2000),
+                temperature=ai_request.get("temperature", 0.1)
+            )
+            logger.info("AI analysis completed successfully")
+            return self._process_ai_response(ai_response, document_type)
+                
+        except Exception as e:
+            logger.error(f"AI analysis error: {str(e)}")
+            raise Exception(f"AI analysis failed: {str(e)}")
+    
+    async def _post_analysis(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        max_tokens: int = 2000,
+        temperature: float = 0.1
+    ) -> Dict[str, Any]:
+        """Запрос к LLM Service"""
+        logger.info(f"Sending AI request to {self.llm_service_url}/generate")
+        
+        payload = {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        if model:
+            payload["model"] = model
+        
+        try:
             # Отправка запроса к LLM Service (используем прямой endpoint)
             response = await self.http_client.post(
                 "http://localhost:8000/api/llm/analyze", 
-                json={
-                    "prompt": ai_request["content"],
-                    "model": ai_request.get("model_override", "claude-3-haiku-20240307"),
-                    "max_tokens": ai_request.get("max_tokens", 2000),
-                    "temperature": ai_request.get("temperature", 0.1)
-                },
+                json=payload,
                 headers={"Content-Type": "application/json"}
             )
-            
-            if response.status_code == 200:
-                ai_response = response.json()
-                logger.info("AI analysis completed successfully")
-                return self._process_ai_response(ai_response, document_type)
-            else:
-                logger.error(f"AI service error: {response.status_code} - {response.text}")
-                raise Exception(f"AI service failed: {response.status_code} - {response.text}")
-                
         except httpx.TimeoutException:
             logger.error("AI service timeout")
             raise Exception("AI service timeout - real analysis unavailable")
+        
+        if response.status_code != 200:
+            logger.error(f"AI service error: {response.status_code} - {response.text}")
+            raise Exception(f"AI service failed: {response.status_code} - {response.text}")
+        
+        return response.json()
+    
+    async def _perform_chunked_analysis(
+        self, 
+        text: str, 
+        document_type: str, 
+        analysis_id: str,
+        pages: Optional[List[str]] = None,
+        tables: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """Map-reduce анализ документа, не помещающегося в один запрос"""
+        chunks = split_into_chunks(text, pages=pages, tables=tables)
+        logger.info(f"Document {analysis_id} is too large for one request, split into {len(chunks)} chunks")
+        
+        user_prompt = self._get_user_prompt(document_type)
+        usage = {"tokens_used": 0, "cost_usd": 0.0, "model_used": "unknown"}
+        
+        async def analyze_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+            pages_note = f", стр. {', '.join(map(str, chunk['pages']))}" if chunk["pages"] else ""
+            prompt = (
+                f"{user_prompt}\n\n"
+                f"Это фрагмент {chunk['index'] + 1} из {len(chunks)} большого документа{pages_note}. "
+                f"Извлеки только данные, присутствующие во фрагменте; для отсутствующих полей верни null.\n\n"
+                f"{chunk['text']}"
+            )
+            ai_response = await self._post_analysis(prompt, model=self.model)
+            processed = self._process_ai_response(ai_response, document_type)
+            
+            usage["tokens_used"] += processed.get("tokens_used", 0)
+            usage["cost_usd"] += processed.get("cost_usd", 0.0)
+            usage["model_used"] = processed.get("model_used", usage["model_used"])
+            
+            if processed.get("analysis_quality") != "high":
+                raise ValueError("chunk response is not valid JSON")
+            return processed["structured_data"]
+        
+        try:
+            merged = await analyze_in_chunks(chunks, analyze_chunk)
         except Exception as e:
-            logger.error(f"AI analysis error: {str(e)}")
+            logger.error(f"Chunked AI analysis error: {str(e)}")
             raise Exception(f"AI analysis failed: {str(e)}")
+        
+        return {
+            "structured_data": merged,
+            "raw_response": None,
+            **usage,
+            "analysis_quality": "high" if not merged["chunks"]["failed"] else "medium",
+            "chunked": True
+        }
     
     def _get_system_prompt(self, document_type: str) -> str:
         """Получить системный промпт для типа документа"""
@@ -12,8 +12,14 @@ import docx
 from io import BytesIO
 import aiofiles
 
+from .extraction_pool import get_extraction_pool
+from .extraction_cache import get_extraction_cache, file_hash
+
 logger = logging.getLogger(__name__)
 
+# Версия результата для ключа кеша извлечения
+TEXT_EXTRACTOR_VERSION = "1"
+
 class TextExtractor:
     """Класс для извлечения текста из документов"""
     
@@ -36,10 +42,23 @@ class TextExtractor:
             raise ValueError(f"Unsupported file format: {file_extension}")
         
         try:
-            if file_extension == ".pdf":
-                return await self._extract_from_pdf(file_path)
-            elif file_extension == ".docx":
-                return await self._extract_from_docx(file_path)
+            if file_extension in (".pdf", ".docx"):
+                # Повторная загрузка того же файла (под любым именем) не разбирается заново
+                cache = get_extraction_cache()
+                cache_key = cache.make_key(
+                    await asyncio.to_thread(file_hash, file_path), f"text{file_extension}", TEXT_EXTRACTOR_VERSION
+                )
+                cached_text = await asyncio.to_thread(cache.get, cache_key)
+                if cached_text is not None:
+                    return cached_text
+                
+                if file_extension == ".pdf":
+                    text = await self._extract_from_pdf(file_path)
+                else:
+                    text = await self._extract_from_docx(file_path)
+                if text:
+                    await asyncio.to_thread(cache.put, cache_key, text)
+                return text
             elif file_extension == ".txt":
                 return await self._extract_from_txt(file_path)
             else:
@@ -72,12 +91,8 @@ class TextExtractor:
             return ""
     
     async def _extract_from_pdf(self, file_path: Path) -> str:
-        """Асинхронное извлечение текста из PDF"""
-        def extract_pdf():
-            return self._extract_text_from_pdf_sync(file_path)
-        
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, extract_pdf)
+        """Асинхронное извлечение текста из PDF (в пуле процессов - разбор не держит GIL event loop)"""
+        return await get_extraction_pool().run(self._extract_text_from_pdf_sync, file_path)
     
     async def _extract_from_docx(self, file_path: Path) -> str:
         """Асинхронное извлечение текста из DOCX"""
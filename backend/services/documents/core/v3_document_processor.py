@@ -14,8 +14,13 @@ import docx
 import pdfplumber
 import re
 
+from .extraction_cache import get_extraction_cache, content_hash
+
 logger = logging.getLogger(__name__)
 
+# Версия результата для ключа кеша извлечения
+V3_PROCESSOR_VERSION = "1"
+
 class V3DocumentProcessor:
     """Продвинутый процессор документов с поддержкой структурированных данных"""
     
@@ -45,6 +50,16 @@ class V3DocumentProcessor:
     async def extract_advanced_content(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """Расширенное извлечение контента с поддержкой таблиц и валют"""
         try:
+            # Тот же файл (под любым именем) уже разбирался - результат из общего кеша
+            cache = get_extraction_cache()
+            file_ext = filename.lower().split('.')[-1]
+            cache_key = cache.make_key(content_hash(file_content), f"v3.{file_ext}", V3_PROCESSOR_VERSION)
+            cached_result = await asyncio.to_thread(cache.get, cache_key)
+            if cached_result is not None:
+                logger.info(f"📦 Using cached extraction for {filename}")
+                cached_result["metadata"]["filename"] = filename
+                return cached_result
+            
             logger.info(f"🔍 Starting advanced extraction for {filename}")
             
             extraction_result = {
@@ -60,8 +75,6 @@ class V3DocumentProcessor:
             }
             
             # Определяем тип файла и обрабатываем соответственно
-            file_ext = filename.lower().split('.')[-1]
-            
             if file_ext == 'pdf':
                 extraction_result = await self._process_pdf_advanced(file_content, extraction_result)
             elif file_ext in ['docx', 'doc']:
@@ -84,6 +97,9 @@ class V3DocumentProcessor:
             
             logger.info(f"✅ Advanced extraction complete: {len(extraction_result['text'])} chars, {len(extraction_result['tables'])} tables, {len(extraction_result['currencies'])} currencies")
             
+            if not extraction_result["metadata"].get("error"):
+                await asyncio.to_thread(cache.put, cache_key, extraction_result)
+            
             return extraction_result
             
         except Exception as e:
@@ -9,7 +9,7 @@ from typing import Dict, Any, List, Optional, Union
 from datetime import datetime
 from pathlib import Path
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import uvicorn
@@ -19,6 +19,9 @@ import hashlib
 from .core.document_processor import DocumentProcessor
 from .core.text_extractor import TextExtractor  
 from .core.document_analyzer import DocumentAnalyzer
+from .core.extraction_pool import get_extraction_pool
+from .core.extraction_cache import get_extraction_cache
+from .core.extraction_metrics import register_extraction_metrics, render_metrics
 from ..shared.models import DocumentMetadata, DocumentAnalysis
 from ..shared.schemas import (
     DocumentUploadResponse, DocumentListResponse, DocumentContentResponse,
@@ -29,6 +32,9 @@ from ..shared.schemas import (
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Очередь пула извлечения и кеш в /metrics
+register_extraction_metrics()
+
 # Глобальные экземпляры сервисов
 document_processor: Optional[DocumentProcessor] = None
 text_extractor: Optional[TextExtractor] = None
@@ -55,6 +61,7 @@ async def lifespan(app: FastAPI):
     yield
     
     logger.info("Shutting down Documents Service...")
+    get_extraction_pool().shutdown()
 
 # Создание FastAPI приложения
 app = FastAPI(
@@ -100,6 +107,20 @@ async def health_check():
         timestamp=datetime.now()
     )
 
+@app.get("/extraction/stats")
+async def extraction_stats():
+    """Очередь и счетчики пула извлечения текста, заполнение кеша извлечения"""
+    return {**get_extraction_pool().get_stats(), "cache": get_extraction_cache().get_stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики Prometheus: очередь пула извлечения и заполнение кеша"""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    payload, content_type = rendered
+    return Response(content=payload, media_type=content_type)
+
 @app.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
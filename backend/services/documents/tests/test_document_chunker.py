@@ -0,0 +1,140 @@
+"""
+Тесты для разбиения больших документов и map-reduce анализа
+"""
+import asyncio
+
+import pytest
+
+from ..core.document_chunker import (
+    split_into_chunks, merge_partial_results, analyze_in_chunks, needs_chunking
+)
+
+
+class TestSplitIntoChunks:
+    """Тесты разбиения по структурным границам"""
+
+    def test_small_document_single_chunk(self):
+        chunks = split_into_chunks("1. Общие положения\nТекст раздела")
+
+        assert len(chunks) == 1
+        assert chunks[0]["kind"] == "text"
+        assert chunks[0]["pages"] == []
+        assert not needs_chunking("Короткий текст")
+
+    def test_split_on_headings_within_limit(self):
+        """Границы фрагментов совпадают с заголовками разделов"""
+        sections = [f"{i}. Раздел {i}\n" + "текст " * 40 for i in range(1, 6)]
+        chunks = split_into_chunks("\n".join(sections), max_tokens=150)
+
+        assert len(chunks) > 1
+        for chunk in chunks:
+            assert chunk["text"].lstrip().split(".")[0].isdigit()
+            assert len(chunk["text"]) <= 150 * 3
+
+    def test_pages_and_tables(self):
+        pages = ["ТЕХНИЧЕСКОЕ ЗАДАНИЕ\nОбщие требования", "Приложение 1\nСмета"]
+        tables = [{"page": 2, "data": [["Этап", "Стоимость"], ["Монтаж", "100 000"]]}]
+
+        chunks = split_into_chunks(pages=pages, tables=tables)
+
+        assert [chunk["kind"] for chunk in chunks] == ["text", "table"]
+        assert chunks[0]["pages"] == [1, 2]
+        assert chunks[1]["pages"] == [2]
+        assert "Монтаж | 100 000" in chunks[1]["text"]
+
+    def test_table_text_not_repeated_in_page_chunk(self):
+        """Строки таблицы из текстового слоя страницы не дублируют табличный фрагмент"""
+        pages = ["Смета\nЭтап\nСтоимость\nМонтаж 100 000\nИтого по смете указано в приложении"]
+        tables = [{"page": 1, "data": [["Этап", "Стоимость"], ["Монтаж", "100 000"]]}]
+
+        chunks = split_into_chunks(pages=pages, tables=tables)
+
+        assert [chunk["kind"] for chunk in chunks] == ["text", "table"]
+        assert chunks[0]["text"] == "Смета\nИтого по смете указано в приложении"
+        assert "Монтаж | 100 000" in chunks[1]["text"]
+
+    def test_oversized_section_split(self):
+        chunks = split_into_chunks("строка текста\n" * 500, max_tokens=100)
+
+        assert len(chunks) > 1
+        assert all(len(chunk["text"]) <= 300 for chunk in chunks)
+
+
+class TestMergePartialResults:
+    """Тесты свода частичных результатов"""
+
+    def test_merge_with_source_pages(self):
+        partials = [
+            {"data": {"total_cost": 1000, "materials": ["бетон"], "warranty": None}, "pages": [1, 2]},
+            {"data": {"total_cost": 1200, "materials": ["бетон", "сталь"], "warranty": "2 года"}, "pages": [7]}
+        ]
+
+        merged = merge_partial_results(partials)
+
+        assert merged["total_cost"] == 1000
+        assert merged["materials"] == ["бетон", "сталь"]
+        assert merged["warranty"] == "2 года"
+        assert merged["source_pages"] == {"total_cost": [1, 2, 7], "materials": [1, 2, 7], "warranty": [7]}
+        assert merged["conflicts"] == {"total_cost": [1000, 1200]}
+
+    def test_nested_dicts_merged(self):
+        partials = [
+            {"data": {"contractor_details": {"name": "ООО Строй"}}, "pages": [1]},
+            {"data": {"contractor_details": {"contact": "+7 900"}}, "pages": [3]}
+        ]
+
+        merged = merge_partial_results(partials)
+
+        assert merged["contractor_details"] == {"name": "ООО Строй", "contact": "+7 900"}
+        assert partials[0]["data"]["contractor_details"] == {"name": "ООО Строй"}
+
+
+class TestAnalyzeInChunks:
+    """Тесты map-reduce анализа"""
+
+    @pytest.mark.asyncio
+    async def test_failed_chunks_reported(self):
+        chunks = [
+            {"index": 0, "kind": "text", "text": "Итого 100", "pages": [1]},
+            {"index": 1, "kind": "text", "text": "не JSON", "pages": [2]},
+            {"index": 2, "kind": "table", "text": "Гарантия | 2 года", "pages": [3]}
+        ]
+
+        async def analyze_chunk(chunk):
+            if chunk["index"] == 1:
+                raise ValueError("bad json")
+            return {"found": chunk["text"]}
+
+        result = await analyze_in_chunks(chunks, analyze_chunk)
+
+        assert result["chunks"] == {"total": 3, "failed": [1]}
+        assert result["found"] == "Итого 100"
+        assert result["source_pages"]["found"] == [1, 3]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_bounded(self):
+        chunks = [{"index": i, "kind": "text", "text": str(i), "pages": [i + 1]} for i in range(6)]
+        running = {"now": 0, "max": 0}
+
+        async def analyze_chunk(chunk):
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+            return {"pages_seen": chunk["pages"]}
+
+        result = await analyze_in_chunks(chunks, analyze_chunk, concurrency=2)
+
+        assert running["max"] == 2
+        assert result["pages_seen"] == [1, 2, 3, 4, 5, 6]
+        assert result["chunks"]["failed"] == []
+
+    @pytest.mark.asyncio
+    async def test_all_failed_raises(self):
+        chunks = [{"index": 0, "kind": "text", "text": "x", "pages": []}]
+
+        async def analyze_chunk(chunk):
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await analyze_in_chunks(chunks, analyze_chunk)
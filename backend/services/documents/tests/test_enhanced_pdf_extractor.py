@@ -0,0 +1,60 @@
+"""
+Тесты для расширенного экстрактора PDF (через пул процессов)
+"""
+import pytest
+
+fitz = pytest.importorskip("fitz")
+pytest.importorskip("pdfplumber")
+pytest.importorskip("PyPDF2")
+
+from ..core import extraction_pool
+from ..core.extraction_pool import ExtractionPool
+from ..core.enhanced_pdf_extractor import EnhancedPDFExtractor
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = ExtractionPool(workers=2, timeout=60, memory_limit_mb=0)
+    monkeypatch.setattr(extraction_pool, "_extraction_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+def make_pdf(pages):
+    document = fitz.open()
+    for index in range(pages):
+        document.new_page().insert_text(
+            (72, 72), f"Commercial proposal page {index + 1}: total budget 1 500 000 USD"
+        )
+    return document.tobytes()
+
+
+@pytest.mark.asyncio
+async def test_extraction_through_pool(pool, tmp_path):
+    content = make_pdf(3)
+    extractor = EnhancedPDFExtractor(cache_dir=tmp_path)
+
+    result = await extractor.extract_comprehensive_data(content, "kp.pdf")
+
+    assert result["metadata"]["extraction_success"] is True
+    assert "Commercial proposal page 3" in result["text"]
+    assert [page["page"] for page in result["page_details"]] == [1, 2, 3]
+    assert "pymupdf" in result["extraction_methods"]
+    assert pool.get_stats()["completed"] >= 1
+    assert pool.get_stats()["failed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_same_content_other_name_from_cache(pool, tmp_path):
+    content = make_pdf(1)
+    extractor = EnhancedPDFExtractor(cache_dir=tmp_path)
+    await extractor.extract_comprehensive_data(content, "kp.pdf")
+    completed = pool.get_stats()["completed"]
+
+    result = await extractor.extract_comprehensive_data(content, "kp_copy.pdf")
+
+    assert result["filename"] == "kp_copy.pdf"
+    assert "Commercial proposal page 1" in result["text"]
+    # Повторная загрузка не запускает извлечение
+    assert pool.get_stats()["completed"] == completed
+    assert extractor.cache.get_stats()["hits"] == 1
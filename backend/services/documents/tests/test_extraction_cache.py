@@ -0,0 +1,112 @@
+"""
+Тесты для кеша результатов извлечения
+"""
+import os
+import time
+
+import pytest
+
+from ..core.extraction_cache import ExtractionCache, content_hash, file_hash
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(tmp_path, max_bytes=10 * 1024 * 1024)
+
+
+def key(cache, content, kind="enhanced_pdf", version="1"):
+    return cache.make_key(content_hash(content), kind, version)
+
+
+class TestExtractionCache:
+    """Тесты ключей, хранения и вытеснения"""
+
+    def test_key_by_content_kind_and_version(self, cache, tmp_path):
+        path = tmp_path / "kp.pdf"
+        path.write_bytes(b"%PDF-1.7 content")
+
+        assert file_hash(path) == content_hash(b"%PDF-1.7 content")
+        assert key(cache, b"a") == key(cache, b"a")
+        assert key(cache, b"a") != key(cache, b"b")
+        assert key(cache, b"a") != key(cache, b"a", kind="text.pdf")
+        assert key(cache, b"a") != key(cache, b"a", version="2")
+
+    def test_roundtrip_compressed(self, cache):
+        value = {"text": "Коммерческое предложение " * 200, "tables": [{"page": 1}]}
+        cache.put(key(cache, b"a"), value)
+
+        assert cache.get(key(cache, b"a")) == value
+        assert cache.get(key(cache, b"b")) is None
+        stats = cache.get_stats()
+        assert stats["entries"] == 1
+        assert stats["bytes"] < len(value["text"])
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    def test_lru_eviction_by_bytes(self, tmp_path):
+        cache = ExtractionCache(tmp_path)
+        cache.put(key(cache, b"a"), os.urandom(500).hex())
+        # Места на три записи
+        cache.max_bytes = int(cache.get_stats()["bytes"] * 3.5)
+        for name in (b"b", b"c"):
+            cache.put(key(cache, name), os.urandom(500).hex())
+        # a использован последним - вытесняется b
+        cache.get(key(cache, b"a"))
+        cache.put(key(cache, b"d"), os.urandom(500).hex())
+
+        assert cache.get(key(cache, b"b")) is None
+        assert cache.get(key(cache, b"a")) is not None
+        assert cache.get_stats()["bytes"] <= cache.max_bytes
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_index_shared_through_directory(self, cache, tmp_path):
+        cache.put(key(cache, b"a"), "text")
+        time.sleep(0.01)
+        cache.put(key(cache, b"b"), "text")
+
+        other = ExtractionCache(tmp_path)
+        assert other.get(key(other, b"a")) == "text"
+        assert other.get_stats()["entries"] == 2
+
+        other.clear()
+        # Запись удалена другой копией кеша - промах, а не ошибка
+        assert cache.get(key(cache, b"b")) is None
+        assert cache.get_stats()["entries"] == 1
+
+    def test_limit_covers_entries_of_other_processes(self, tmp_path):
+        first = ExtractionCache(tmp_path, max_bytes=3000)
+        second = ExtractionCache(tmp_path, max_bytes=3000)
+        # Оба индекса построены до записей друг друга
+        first.get_stats()
+        second.get_stats()
+
+        for index in range(6):
+            cache = first if index % 2 else second
+            cache.put(key(cache, str(index).encode()), os.urandom(400).hex())
+
+        on_disk = sum(path.stat().st_size for path in tmp_path.glob("*/*.json.z"))
+        assert on_disk <= 3000
+        assert first.get_stats()["bytes"] == on_disk
+
+    def test_stale_temp_files_removed(self, cache, tmp_path):
+        cache.put(key(cache, b"a"), "text")
+        directory = cache._path(key(cache, b"a")).parent
+        stale = directory / "entry.json.z.1.1.tmp"
+        fresh = directory / "entry.json.z.2.2.tmp"
+        stale.write_bytes(b"partial")
+        fresh.write_bytes(b"partial")
+        old = time.time() - 2 * 3600
+        os.utime(stale, (old, old))
+
+        ExtractionCache(tmp_path).get_stats()
+
+        assert not stale.exists()
+        # Запись другого процесса может быть еще в процессе
+        assert fresh.exists()
+
+    def test_corrupted_entry_removed(self, cache):
+        cache.put(key(cache, b"a"), "text")
+        path = cache._path(key(cache, b"a"))
+        path.write_bytes(b"not zlib")
+
+        assert cache.get(key(cache, b"a")) is None
+        assert not path.exists()
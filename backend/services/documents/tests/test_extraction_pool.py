@@ -0,0 +1,74 @@
+"""
+Тесты для пула процессов извлечения
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from ..core.extraction_pool import ExtractionPool, ExtractionTimeout, ExtractionFailed
+
+
+@pytest.fixture
+def pool():
+    pool = ExtractionPool(workers=1, timeout=30, memory_limit_mb=0)
+    yield pool
+    pool.shutdown()
+
+
+class TestExtractionPool:
+    """Тесты выполнения, таймаутов и аварий воркеров"""
+
+    @pytest.mark.asyncio
+    async def test_runs_in_worker_process(self, pool):
+        assert await pool.run(os.getpid) != os.getpid()
+        assert await pool.run(pow, 2, 10) == 1024
+        assert pool.get_stats()["completed"] == 2
+
+    @pytest.mark.asyncio
+    async def test_event_loop_not_blocked(self, pool):
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.05)
+
+        ticking = asyncio.ensure_future(ticker())
+        await pool.run(time.sleep, 1)
+        ticking.cancel()
+
+        # Пока воркер занят, event loop продолжает обслуживать другие задачи
+        assert len(ticks) >= 10
+
+    @pytest.mark.asyncio
+    async def test_timeout_restarts_pool(self, pool):
+        with pytest.raises(ExtractionTimeout):
+            await pool.run(time.sleep, 10, timeout=0.5)
+
+        assert await pool.run(pow, 3, 2) == 9
+        stats = pool.get_stats()
+        assert stats["timeouts"] == 1
+        assert stats["restarts"] == 1
+
+    @pytest.mark.asyncio
+    async def test_crashed_worker_reported(self, pool):
+        with pytest.raises(ExtractionFailed):
+            await pool.run(os._exit, 1)
+
+        assert await pool.run(pow, 2, 3) == 8
+        assert pool.get_stats()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queue_depth(self, pool):
+        first = asyncio.ensure_future(pool.run(time.sleep, 0.5))
+        second = asyncio.ensure_future(pool.run(time.sleep, 0))
+        await asyncio.sleep(0.1)
+
+        stats = pool.get_stats()
+        assert stats["running"] == 1
+        assert stats["queued"] == 1
+
+        await asyncio.gather(first, second)
+        assert pool.get_stats()["queued"] == 0
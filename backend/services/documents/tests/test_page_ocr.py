@@ -0,0 +1,77 @@
+"""
+Тесты для OCR страниц без текстового слоя
+"""
+from ..core import page_ocr
+from ..core.page_ocr import ocr_zoom, ocr_cache_key, apply_ocr, image_only_pages
+
+
+def page(number, text, text_layer):
+    return {"page": number, "text": text, "method": "pymupdf" if text else None,
+            "chars": len(text), "processing_time": 0.01, "text_layer": text_layer}
+
+
+def ocr_result(number, text, cached=False):
+    return {"page": number, "text": text, "dpi": 300, "cached": cached, "seconds": 1.5}
+
+
+class TestZoom:
+    """Тесты выбора разрешения по размеру страницы"""
+
+    def test_regular_page_at_target_dpi(self):
+        # A4: 595 x 842 pt
+        assert ocr_zoom(595, 842, dpi=300) == 300 / 72
+
+    def test_large_sheet_capped_by_pixels(self):
+        # A0: 2384 x 3370 pt
+        zoom = ocr_zoom(2384, 3370, dpi=300, max_pixels=40_000_000)
+
+        assert zoom < 300 / 72
+        assert 2384 * 3370 * zoom * zoom <= 40_000_000 * 1.0001
+
+
+class TestCache:
+    """Тесты кеша по хешу изображения страницы"""
+
+    def test_key_depends_on_image_and_settings(self):
+        key = ocr_cache_key(b"\x00\xff" * 10, 4, 5, "rus+eng", "--psm 3")
+
+        assert key == ocr_cache_key(b"\x00\xff" * 10, 4, 5, "rus+eng", "--psm 3")
+        assert key != ocr_cache_key(b"\x00\xfe" * 10, 4, 5, "rus+eng", "--psm 3")
+        assert key != ocr_cache_key(b"\x00\xff" * 10, 4, 5, "eng", "--psm 3")
+
+    def test_roundtrip(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(page_ocr, "OCR_CACHE_DIR", str(tmp_path))
+        key = ocr_cache_key(b"scan", 2, 2)
+
+        assert page_ocr._load_cached(key) is None
+        page_ocr._save_cached(key, "Акт приемки")
+        assert page_ocr._load_cached(key) == "Акт приемки"
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(page_ocr, "OCR_CACHE_DIR", "")
+        page_ocr._save_cached("ab" * 32, "text")
+
+        assert page_ocr._load_cached("ab" * 32) is None
+
+
+class TestApply:
+    """Тесты замены текста распознанных страниц"""
+
+    def test_only_image_pages_selected(self):
+        pages = [page(1, "Коммерческое предложение", "text"), page(2, "", "image"), page(3, "", "blank")]
+
+        assert image_only_pages(pages) == [1]
+
+    def test_apply_ocr(self):
+        pages = [page(1, "Коммерческое предложение", "text"), page(2, "", "image"), page(3, "", "image")]
+
+        applied = apply_ocr(pages, [ocr_result(2, "Подпись", cached=True), ocr_result(3, "")])
+
+        assert applied == 1
+        assert pages[0]["method"] == "pymupdf"
+        assert pages[1]["method"] == "ocr"
+        assert pages[1]["chars"] == len("Подпись")
+        assert pages[1]["ocr_cached"] is True
+        # Пустой результат OCR оставляет страницу пустой, но время учитывается
+        assert pages[2]["method"] is None
+        assert pages[2]["processing_time"] == 1.51
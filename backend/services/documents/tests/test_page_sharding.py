@@ -0,0 +1,135 @@
+"""
+Тесты для постраничного шардирования извлечения PDF
+"""
+import pytest
+
+from types import SimpleNamespace
+
+from ..core.page_sharding import (
+    page_batches, merge_page_results, summarize_pages, text_score, extract_best_text_pages,
+    best_text_view, count_rulings, aligned_rows, table_hint, image_coverage, classify_text_layer
+)
+
+
+def page(number, text, method="pymupdf"):
+    return {"page": number, "text": text, "method": method if text else None,
+            "chars": len(text), "processing_time": 0.01}
+
+
+class TestPageBatches:
+    """Тесты разбиения на диапазоны страниц"""
+
+    def test_spread_across_workers(self):
+        batches = page_batches(300, workers=8, batch_size=16)
+
+        assert len(batches) >= 8
+        assert batches[0] == (0, 16)
+        assert batches[-1][1] == 300
+        # Диапазоны покрывают документ без пропусков и пересечений
+        assert all(prev[1] == nxt[0] for prev, nxt in zip(batches, batches[1:]))
+
+    def test_small_document_not_sharded(self):
+        assert page_batches(5, workers=8) == [(0, 5)]
+        assert page_batches(0, workers=8) == []
+
+    def test_fewer_pages_per_batch_for_many_workers(self):
+        batches = page_batches(40, workers=8, batch_size=16)
+
+        assert len(batches) == 8
+        assert max(end - start for start, end in batches) == 5
+
+
+class TestMerge:
+    """Тесты сборки результатов в порядке страниц"""
+
+    def test_merge_in_page_order(self):
+        # Диапазоны завершаются в произвольном порядке
+        merged = merge_page_results([
+            [page(3, "три"), page(4, "")],
+            [page(1, "один"), page(2, "два", "ocr")]
+        ])
+
+        assert [item["page"] for item in merged] == [1, 2, 3, 4]
+
+        summary = summarize_pages(merged)
+        assert summary["methods"] == {"pymupdf": 2, "ocr": 1}
+        assert summary["empty_pages"] == [4]
+        assert summary["total_chars"] == len("одиндватри")
+
+    def test_cyrillic_text_preferred(self):
+        assert text_score("Бюджет проекта") > text_score("Budget plan xx")
+
+
+def line(text, x0, y0, x1):
+    return {"bbox": (x0, y0, x1, y0 + 10), "spans": [{"text": text}]}
+
+
+def layout(*lines):
+    return {"blocks": [{"lines": [item]} for item in lines]}
+
+
+class TestLayout:
+    """Тесты разбора страницы: представление текста и признаки таблиц"""
+
+    def test_best_text_view(self):
+        text, view = best_text_view(layout(line("Смета", 72, 72, 120), line("итого", 72, 90, 120)))
+
+        assert view == "lines"
+        assert text == "Смета\nитого"
+        assert best_text_view(layout()) == ("", None)
+
+    def test_count_rulings(self):
+        point = lambda x, y: SimpleNamespace(x=x, y=y)
+        drawings = [{"items": [
+            ("l", point(0, 10), point(200, 10)),
+            ("l", point(0, 10), point(0, 110)),
+            ("l", point(0, 10), point(5, 10)),  # Короткий штрих - не линия таблицы
+            ("re", SimpleNamespace(width=100, height=20)),
+        ]}]
+
+        assert count_rulings(drawings) == (3, 3)
+
+    def test_ruled_table(self):
+        assert table_hint(layout(), 4, 3) == "ruled"
+        assert table_hint(layout(), 4, 0) is None
+
+    def test_aligned_columns(self):
+        rows = [
+            fragment
+            for y in (100, 120, 140)
+            for fragment in (line("Работы", 50, y, 150), line("10", 200, y, 220), line("5000", 300, y, 340))
+        ]
+
+        assert aligned_rows(layout(*rows)) == 3
+        assert table_hint(layout(*rows), 0, 0) == "aligned"
+        # Обычный текст - одна строка на высоту
+        assert table_hint(layout(line("Текст", 50, 100, 500), line("абзаца", 50, 120, 500)), 0, 0) is None
+
+    def test_image_coverage(self):
+        scan = {"width": 100, "height": 200, "blocks": [{"type": 1, "bbox": (0, 0, 100, 150)}]}
+
+        assert image_coverage(scan) == 0.75
+        assert image_coverage(layout()) == 0.0
+
+    def test_classify_text_layer(self):
+        assert classify_text_layer("Коммерческое предложение " * 10, 1.0) == "text"
+        # Скан со штампом поверх изображения
+        assert classify_text_layer("Копия верна", 0.9) == "image"
+        assert classify_text_layer("Коммерческое предложение", 0.0) == "text"
+        assert classify_text_layer("", 0.1) == "image"
+        assert classify_text_layer("", 0.0) == "blank"
+
+
+def test_extract_best_text_pages():
+    fitz = pytest.importorskip("fitz")
+    document = fitz.open()
+    for index in range(3):
+        document.new_page().insert_text((72, 72), f"Page {index + 1}")
+    content = document.tobytes()
+
+    pages = extract_best_text_pages(content, 1, 3)
+
+    assert [item["page"] for item in pages] == [2, 3]
+    assert "Page 2" in pages[0]["text"]
+    assert pages[0]["method"] == "pymupdf:lines"
+    assert pages[0]["text_layer"] == "blank"  # "Page 2" - меньше MIN_TEXT_CHARS
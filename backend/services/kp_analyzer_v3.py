@@ -14,7 +14,7 @@ from io import BytesIO
 from pathlib import Path
 
 from ..shared.models import User, Document, V3Analysis, V3AnalysisDocument
-from ..services.llm.orchestrator import LLMOrchestrator
+from ..services.llm.orchestrator import get_orchestrator
 from .documents.core.v3_document_processor import V3DocumentProcessor
 from .reports.core.kp_pdf_exporter import KPAnalysisPDFExporter
 from ..api.v3.schemas import V3AnalysisRequest, CriteriaWeight
@@ -26,7 +26,8 @@ class V3AnalyzerService:
     
     def __init__(self, db: Session):
         self.db = db
-        self.llm_orchestrator = LLMOrchestrator()
+        # Общий оркестратор процесса - провайдеры не переинициализируются на каждый запрос
+        self.llm_orchestrator = get_orchestrator()
         self.document_processor = V3DocumentProcessor()
         self.pdf_exporter = KPAnalysisPDFExporter()
         
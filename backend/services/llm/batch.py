@@ -0,0 +1,569 @@
+"""
+Пакетное выполнение LLM запросов для DevAssist Pro
+Batch API провайдеров для массовой переоценки КП: дешевле и вне интерактивных лимитов
+"""
+import asyncio
+import json
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+import httpx
+
+from .config import settings
+from .providers.base import BaseAIProvider, AIProviderError
+from .scheduler import get_scheduler, PRIORITY_BULK, SchedulerOverloaded
+from ..shared.database import get_db_session
+from ..shared.llm_models import AIBatchJob, AIBatchItem, AIProviderEnum, TaskTypeEnum
+from ..shared.llm_schemas import AIRequest
+
+logger = logging.getLogger(__name__)
+
+# Нормализованные статусы заданий у провайдера
+REMOTE_IN_PROGRESS = "in_progress"
+REMOTE_ENDED = "ended"
+REMOTE_FAILED = "failed"
+REMOTE_CANCELLED = "cancelled"
+
+
+def _build_messages(item: Dict[str, Any]) -> List[Dict[str, str]]:
+    messages = []
+    if item.get("system_prompt"):
+        messages.append({"role": "system", "content": item["system_prompt"]})
+    messages.append({"role": "user", "content": item["user_prompt"]})
+    return messages
+
+
+def parse_anthropic_result(line: Dict[str, Any]) -> Dict[str, Any]:
+    """Строка результатов Anthropic Message Batches -> результат элемента"""
+    result = line.get("result") or {}
+    if result.get("type") != "succeeded":
+        error = result.get("error") or {}
+        return {"error": error.get("message") or result.get("type", "unknown")}
+
+    message = result.get("message") or {}
+    usage = message.get("usage") or {}
+    return {
+        "content": "".join(block.get("text", "") for block in message.get("content", []) if block.get("type") == "text"),
+        "prompt_tokens": usage.get("input_tokens", 0),
+        "completion_tokens": usage.get("output_tokens", 0)
+    }
+
+
+def parse_openai_result(line: Dict[str, Any]) -> Dict[str, Any]:
+    """Строка выходного файла OpenAI Batch API -> результат элемента"""
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        error = line.get("error") or (response.get("body") or {}).get("error") or {}
+        return {"error": error.get("message") or f"status {response.get('status_code')}"}
+
+    body = response.get("body") or {}
+    choices = body.get("choices") or [{}]
+    usage = body.get("usage") or {}
+    return {
+        "content": (choices[0].get("message") or {}).get("content") or "",
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0)
+    }
+
+
+class BatchBackend(ABC):
+    """Backend пакетного выполнения для одного провайдера"""
+
+    # Множитель стоимости относительно синхронных запросов
+    cost_factor: float = 1.0
+
+    @abstractmethod
+    async def submit(self, model: str, items: List[Dict[str, Any]]) -> str:
+        """Отправить элементы, вернуть идентификатор задания у провайдера"""
+        pass
+
+    @abstractmethod
+    async def get_status(self, remote_id: str) -> str:
+        """Нормализованный статус задания (REMOTE_*)"""
+        pass
+
+    @abstractmethod
+    async def fetch_results(self, remote_id: str) -> Dict[str, Dict[str, Any]]:
+        """Результаты по custom_id: content/prompt_tokens/completion_tokens или error"""
+        pass
+
+    @abstractmethod
+    async def cancel(self, remote_id: str):
+        pass
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """Anthropic Message Batches API"""
+
+    BASE_URL = "https://api.anthropic.com/v1/messages/batches"
+
+    def __init__(self, api_key: str, cost_factor: float = None):
+        self.api_key = api_key
+        self.cost_factor = settings.BATCH_COST_DISCOUNT if cost_factor is None else cost_factor
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01",
+            "content-type": "application/json"
+        }
+
+    async def submit(self, model: str, items: List[Dict[str, Any]]) -> str:
+        requests = []
+        for item in items:
+            params = {
+                "model": model,
+                "max_tokens": item["max_tokens"],
+                "temperature": item["temperature"],
+                "messages": [{"role": "user", "content": item["user_prompt"]}]
+            }
+            if item.get("system_prompt"):
+                params["system"] = item["system_prompt"]
+            requests.append({"custom_id": item["custom_id"], "params": params})
+
+        async with httpx.AsyncClient(timeout=120) as client:
+            response = await client.post(self.BASE_URL, headers=self._headers(), json={"requests": requests})
+            response.raise_for_status()
+            return response.json()["id"]
+
+    async def get_status(self, remote_id: str) -> str:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.get(f"{self.BASE_URL}/{remote_id}", headers=self._headers())
+            response.raise_for_status()
+            return REMOTE_ENDED if response.json().get("processing_status") == "ended" else REMOTE_IN_PROGRESS
+
+    async def fetch_results(self, remote_id: str) -> Dict[str, Dict[str, Any]]:
+        async with httpx.AsyncClient(timeout=300) as client:
+            response = await client.get(f"{self.BASE_URL}/{remote_id}/results", headers=self._headers())
+            response.raise_for_status()
+            lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+        return {line["custom_id"]: parse_anthropic_result(line) for line in lines}
+
+    async def cancel(self, remote_id: str):
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.post(f"{self.BASE_URL}/{remote_id}/cancel", headers=self._headers())
+            response.raise_for_status()
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API (JSONL файл + задание на /v1/chat/completions)"""
+
+    BASE_URL = "https://api.openai.com/v1"
+
+    def __init__(self, api_key: str, cost_factor: float = None):
+        self.api_key = api_key
+        self.cost_factor = settings.BATCH_COST_DISCOUNT if cost_factor is None else cost_factor
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    async def submit(self, model: str, items: List[Dict[str, Any]]) -> str:
+        lines = [
+            json.dumps({
+                "custom_id": item["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": _build_messages(item),
+                    "max_tokens": item["max_tokens"],
+                    "temperature": item["temperature"]
+                }
+            }, ensure_ascii=False)
+            for item in items
+        ]
+
+        async with httpx.AsyncClient(timeout=300) as client:
+            upload = await client.post(
+                f"{self.BASE_URL}/files",
+                headers=self._headers(),
+                data={"purpose": "batch"},
+                files={"file": ("batch.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")}
+            )
+            upload.raise_for_status()
+
+            response = await client.post(
+                f"{self.BASE_URL}/batches",
+                headers=self._headers(),
+                json={
+                    "input_file_id": upload.json()["id"],
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": "24h"
+                }
+            )
+            response.raise_for_status()
+            return response.json()["id"]
+
+    async def _get_batch(self, remote_id: str) -> Dict[str, Any]:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.get(f"{self.BASE_URL}/batches/{remote_id}", headers=self._headers())
+            response.raise_for_status()
+            return response.json()
+
+    async def get_status(self, remote_id: str) -> str:
+        status = (await self._get_batch(remote_id)).get("status")
+        if status in ("completed", "expired"):
+            # У просроченного задания доступны результаты выполненной части
+            return REMOTE_ENDED
+        if status == "failed":
+            return REMOTE_FAILED
+        if status == "cancelled":
+            return REMOTE_CANCELLED
+        return REMOTE_IN_PROGRESS
+
+    async def fetch_results(self, remote_id: str) -> Dict[str, Dict[str, Any]]:
+        batch = await self._get_batch(remote_id)
+        results: Dict[str, Dict[str, Any]] = {}
+
+        async with httpx.AsyncClient(timeout=300) as client:
+            for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+                if not file_id:
+                    continue
+                response = await client.get(f"{self.BASE_URL}/files/{file_id}/content", headers=self._headers())
+                response.raise_for_status()
+                for raw_line in response.text.splitlines():
+                    if raw_line.strip():
+                        line = json.loads(raw_line)
+                        results[line["custom_id"]] = parse_openai_result(line)
+        return results
+
+    async def cancel(self, remote_id: str):
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.post(f"{self.BASE_URL}/batches/{remote_id}/cancel", headers=self._headers())
+            response.raise_for_status()
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Локальное выполнение пакета обычными запросами провайдера с ограниченной
+    параллельностью. Для тестов и провайдеров без Batch API; скидки нет.
+    Запросы идут через отдельный бакет rate limiter (BATCH_RATE_LIMIT_SHARE
+    квоты, интерактивным остается остаток) и не расходуют бакет
+    интерактивных запросов.
+    """
+
+    def __init__(self, provider: BaseAIProvider, concurrency: int = None):
+        self.provider = provider
+        self.concurrency = concurrency or settings.BATCH_LOCAL_CONCURRENCY
+        self._jobs: Dict[str, asyncio.Task] = {}
+
+    async def _run(self, remote_id: str, model: str, items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        scheduler = get_scheduler()
+
+        async def run_item(item: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    # Низший приоритет: пакет не занимает слоты интерактивных запросов
+                    result = await scheduler.run(
+                        lambda: self.provider.generate_text(
+                            model=model,
+                            prompt=item["user_prompt"],
+                            system_prompt=item.get("system_prompt"),
+                            max_tokens=item["max_tokens"],
+                            temperature=item["temperature"],
+                            bulk=True
+                        ),
+                        priority=PRIORITY_BULK,
+                        tenant=remote_id
+                    )
+                except (AIProviderError, SchedulerOverloaded) as e:
+                    return {"error": str(e)}
+                return {
+                    "content": result["content"],
+                    "prompt_tokens": result["prompt_tokens"],
+                    "completion_tokens": result["completion_tokens"]
+                }
+
+        results = await asyncio.gather(*(run_item(item) for item in items))
+        return {item["custom_id"]: result for item, result in zip(items, results)}
+
+    async def submit(self, model: str, items: List[Dict[str, Any]]) -> str:
+        remote_id = f"local_{uuid.uuid4().hex[:12]}"
+        self._jobs[remote_id] = asyncio.ensure_future(self._run(remote_id, model, items))
+        return remote_id
+
+    async def get_status(self, remote_id: str) -> str:
+        task = self._jobs.get(remote_id)
+        if task is None:
+            # Задание потеряно при перезапуске процесса
+            return REMOTE_FAILED
+        if not task.done():
+            return REMOTE_IN_PROGRESS
+        if task.cancelled():
+            return REMOTE_CANCELLED
+        return REMOTE_FAILED if task.exception() else REMOTE_ENDED
+
+    async def fetch_results(self, remote_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._jobs.pop(remote_id).result()
+
+    async def cancel(self, remote_id: str):
+        task = self._jobs.get(remote_id)
+        if task is not None:
+            task.cancel()
+
+
+class BatchManager:
+    """
+    Пакетные задания: сохранение в БД, отправка в Batch API провайдера,
+    опрос статуса и запись результатов по элементам. Элемент может быть
+    привязан к анализу (analysis_id) - по нему результаты сопоставляются
+    с переоцениваемыми КП.
+    """
+
+    def __init__(
+        self,
+        providers: Dict[str, BaseAIProvider],
+        backends: Optional[Dict[str, BatchBackend]] = None,
+        session_factory: Callable = get_db_session
+    ):
+        self.providers = providers
+        self.backends = backends if backends is not None else self._default_backends()
+        self.session_factory = session_factory
+
+    def _default_backends(self) -> Dict[str, BatchBackend]:
+        backends: Dict[str, BatchBackend] = {}
+        for provider_name, provider in self.providers.items():
+            if settings.BATCH_BACKEND == "provider" and provider_name == "anthropic":
+                backends[provider_name] = AnthropicBatchBackend(provider.api_key)
+            elif settings.BATCH_BACKEND == "provider" and provider_name == "openai":
+                backends[provider_name] = OpenAIBatchBackend(provider.api_key)
+            else:
+                backends[provider_name] = LocalBatchBackend(provider)
+        return backends
+
+    def _resolve_model(self, model: str) -> str:
+        for provider_name, provider in self.providers.items():
+            if model in provider.models:
+                return provider_name
+        raise AIProviderError(f"Model {model} not available for batch", "batch", model)
+
+    async def create_job(
+        self,
+        requests: List[AIRequest],
+        model: str,
+        analysis_ids: Optional[List[Optional[int]]] = None,
+        user_id: Optional[int] = None,
+        organization_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Сохранить задание и отправить его провайдеру"""
+        if not requests:
+            raise ValueError("Batch must contain at least one request")
+        if len(requests) > settings.BATCH_MAX_ITEMS:
+            raise ValueError(f"Batch exceeds {settings.BATCH_MAX_ITEMS} requests")
+        if analysis_ids is not None and len(analysis_ids) != len(requests):
+            raise ValueError("analysis_ids must match requests")
+
+        provider_name = self._resolve_model(model)
+        backend = self.backends[provider_name]
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+
+        items = [
+            {
+                "custom_id": f"{batch_id}-{index}",
+                "analysis_id": analysis_ids[index] if analysis_ids else None,
+                "task_type": request.task_type,
+                "system_prompt": request.system_prompt,
+                "user_prompt": request.content,
+                "max_tokens": request.max_tokens if request.max_tokens is not None else 1000,
+                "temperature": request.temperature if request.temperature is not None else 0.7
+            }
+            for index, request in enumerate(requests)
+        ]
+
+        with self.session_factory() as db:
+            job = AIBatchJob(
+                batch_id=batch_id,
+                provider=AIProviderEnum(provider_name),
+                model_name=model,
+                backend="local" if isinstance(backend, LocalBatchBackend) else "provider",
+                status="pending",
+                total_items=len(items),
+                user_id=user_id,
+                organization_id=organization_id
+            )
+            job.items = [
+                AIBatchItem(
+                    custom_id=item["custom_id"],
+                    analysis_id=item["analysis_id"],
+                    task_type=TaskTypeEnum(item["task_type"].value),
+                    system_prompt=item["system_prompt"],
+                    user_prompt=item["user_prompt"],
+                    temperature=item["temperature"],
+                    max_tokens=item["max_tokens"]
+                )
+                for item in items
+            ]
+            db.add(job)
+
+        try:
+            remote_id = await backend.submit(model, items)
+        except Exception as e:
+            logger.error(f"Batch {batch_id} submission failed: {e}")
+            self._update_job(batch_id, status="failed", error_message=str(e))
+            raise AIProviderError(f"Batch submission failed: {e}", provider_name, model)
+
+        self._update_job(batch_id, status="submitted", provider_batch_id=remote_id, submitted_at=datetime.now())
+        logger.info(f"Batch {batch_id} submitted to {provider_name}/{model}: {len(items)} requests")
+        return self.get_job(batch_id)
+
+    def _update_job(self, batch_id: str, **fields):
+        with self.session_factory() as db:
+            job = db.query(AIBatchJob).filter(AIBatchJob.batch_id == batch_id).one()
+            for name, value in fields.items():
+                setattr(job, name, value)
+
+    async def poll(self, batch_id: str) -> Dict[str, Any]:
+        """Проверить задание у провайдера и записать результаты, если оно завершено"""
+        with self.session_factory() as db:
+            job = db.query(AIBatchJob).filter(AIBatchJob.batch_id == batch_id).one()
+            provider_name = job.provider.value
+            model = job.model_name
+            remote_id = job.provider_batch_id
+            status = job.status
+
+        if status != "submitted":
+            return self.get_job(batch_id)
+
+        backend = self.backends[provider_name]
+        remote_status = await backend.get_status(remote_id)
+        if remote_status == REMOTE_IN_PROGRESS:
+            return self.get_job(batch_id)
+        if remote_status in (REMOTE_FAILED, REMOTE_CANCELLED):
+            self._update_job(
+                batch_id,
+                status="failed" if remote_status == REMOTE_FAILED else "cancelled",
+                completed_at=datetime.now()
+            )
+            return self.get_job(batch_id)
+
+        results = await backend.fetch_results(remote_id)
+        self._store_results(batch_id, provider_name, model, results, backend.cost_factor)
+        return self.get_job(batch_id)
+
+    def _store_results(
+        self,
+        batch_id: str,
+        provider_name: str,
+        model: str,
+        results: Dict[str, Dict[str, Any]],
+        cost_factor: float
+    ):
+        provider = self.providers[provider_name]
+
+        with self.session_factory() as db:
+            job = db.query(AIBatchJob).filter(AIBatchJob.batch_id == batch_id).one()
+            completed = failed = prompt_tokens = completion_tokens = 0
+            total_cost = 0.0
+
+            for item in job.items:
+                result = results.get(item.custom_id) or {"error": "No result returned"}
+                if "error" in result:
+                    item.status = "failed"
+                    item.error_message = result["error"]
+                    failed += 1
+                    continue
+
+                item.status = "completed"
+                item.response_content = result["content"]
+                item.prompt_tokens = result["prompt_tokens"]
+                item.completion_tokens = result["completion_tokens"]
+                item.cost_usd = provider._calculate_cost(model, item.prompt_tokens, item.completion_tokens) * cost_factor
+
+                completed += 1
+                prompt_tokens += item.prompt_tokens
+                completion_tokens += item.completion_tokens
+                total_cost += item.cost_usd
+
+            job.status = "completed"
+            job.completed_at = datetime.now()
+            job.completed_items = completed
+            job.failed_items = failed
+            job.prompt_tokens = prompt_tokens
+            job.completion_tokens = completion_tokens
+            job.total_cost = round(total_cost, 6)
+
+        logger.info(f"Batch {batch_id} completed: {completed} ok, {failed} failed, ${total_cost:.4f}")
+
+    async def poll_pending(self):
+        """Опросить все отправленные задания"""
+        with self.session_factory() as db:
+            batch_ids = [
+                batch_id for (batch_id,) in
+                db.query(AIBatchJob.batch_id).filter(AIBatchJob.status == "submitted").all()
+            ]
+
+        for batch_id in batch_ids:
+            try:
+                await self.poll(batch_id)
+            except Exception as e:
+                logger.error(f"Batch {batch_id} poll failed: {e}")
+
+    async def run_poller(self, interval: int = None):
+        """Фоновый опрос заданий (запускается в lifespan сервиса)"""
+        interval = interval or settings.BATCH_POLL_INTERVAL
+        while True:
+            await self.poll_pending()
+            await asyncio.sleep(interval)
+
+    async def cancel(self, batch_id: str) -> Dict[str, Any]:
+        with self.session_factory() as db:
+            job = db.query(AIBatchJob).filter(AIBatchJob.batch_id == batch_id).one()
+            provider_name = job.provider.value
+            remote_id = job.provider_batch_id
+            status = job.status
+
+        if status == "submitted":
+            await self.backends[provider_name].cancel(remote_id)
+            self._update_job(batch_id, status="cancelled", completed_at=datetime.now())
+        return self.get_job(batch_id)
+
+    def get_job(self, batch_id: str) -> Dict[str, Any]:
+        with self.session_factory() as db:
+            job = db.query(AIBatchJob).filter(AIBatchJob.batch_id == batch_id).one()
+            return {
+                "batch_id": job.batch_id,
+                "provider": job.provider.value,
+                "model": job.model_name,
+                "backend": job.backend,
+                "status": job.status,
+                "total_items": job.total_items,
+                "completed_items": job.completed_items,
+                "failed_items": job.failed_items,
+                "prompt_tokens": job.prompt_tokens,
+                "completion_tokens": job.completion_tokens,
+                "total_cost": job.total_cost,
+                "submitted_at": job.submitted_at,
+                "completed_at": job.completed_at,
+                "error_message": job.error_message
+            }
+
+    def get_results(self, batch_id: str) -> Dict[str, Any]:
+        """Результаты элементов; для привязанных к анализам - по analysis_id"""
+        with self.session_factory() as db:
+            job = db.query(AIBatchJob).filter(AIBatchJob.batch_id == batch_id).one()
+            items = [
+                {
+                    "custom_id": item.custom_id,
+                    "analysis_id": item.analysis_id,
+                    "status": item.status,
+                    "content": item.response_content,
+                    "prompt_tokens": item.prompt_tokens,
+                    "completion_tokens": item.completion_tokens,
+                    "cost_usd": item.cost_usd,
+                    "error": item.error_message
+                }
+                for item in job.items
+            ]
+
+        return {
+            "batch_id": batch_id,
+            "items": items,
+            "by_analysis": {
+                item["analysis_id"]: item
+                for item in items if item["analysis_id"] is not None
+            }
+        }
@@ -0,0 +1,173 @@
+"""
+Бенчмарк оркестратора LLM на записанных ответах (см. providers/replay_provider)
+Пропускная способность и хвостовые задержки оркестрации и разбора JSON
+без сети и расхода токенов.
+
+Запуск:
+    python -m services.llm.benchmark --store replay/llm_recordings.jsonl.gz \
+        --requests 1000 --concurrency 50 --latency lognormal:1.5:0.6 --rate-limit-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from typing import Dict, Any, List, Optional
+
+from .config import settings
+from .json_stream import parse_json_response
+from .orchestrator import LLMOrchestrator
+from .providers.replay_provider import ReplayStore, REPLAY_REPLAY
+from .scheduler import SchedulerOverloaded, DeadlineExceeded
+from ..shared.llm_schemas import AIRequest, TaskType
+
+logger = logging.getLogger(__name__)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Сводка задержек в миллисекундах"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "mean": round(statistics.fmean(ordered) * 1000, 2),
+        "p50": round(pick(0.50) * 1000, 2),
+        "p90": round(pick(0.90) * 1000, 2),
+        "p95": round(pick(0.95) * 1000, 2),
+        "p99": round(pick(0.99) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2)
+    }
+
+
+def requests_from_store(
+    store: ReplayStore,
+    count: int,
+    task_type: TaskType = TaskType.TEXT_ANALYSIS,
+    coalesce: bool = False
+) -> List[AIRequest]:
+    """
+    Запросы бенчмарка - записанные запросы по кругу. Одинаковые запросы
+    идут одновременно, поэтому объединение (single-flight) по умолчанию
+    выключено: иначе замер показывает один вызов на группу повторов.
+    """
+    records = [store.records[key] for key in sorted(store.records) if store.records[key].get("messages")]
+    if not records:
+        raise ValueError(f"No recorded requests in {store.path}")
+
+    requests = []
+    for index in range(count):
+        record = records[index % len(records)]
+        params = record.get("params", {})
+        messages = record["messages"]
+        metadata = {"coalesce": coalesce}
+        if params.get("cached_context"):
+            metadata["cached_context"] = params["cached_context"]
+        requests.append(AIRequest(
+            task_type=task_type,
+            content=messages[-1]["content"],
+            system_prompt=next((m["content"] for m in messages if m["role"] == "system"), None),
+            model_override=record["model"],
+            max_tokens=params.get("max_tokens"),
+            temperature=params.get("temperature"),
+            metadata=metadata
+        ))
+    return requests
+
+
+async def run_benchmark(
+    orchestrator,
+    requests: List[AIRequest],
+    concurrency: int = 10,
+    parse_json: bool = False
+) -> Dict[str, Any]:
+    """Прогон запросов через orchestrator.generate_text с ограничением параллелизма"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    parse_times: List[float] = []
+    errors: Dict[str, int] = {}
+    shared = {"coalesced": 0, "cached": 0}
+
+    async def run_one(request: AIRequest):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await orchestrator.generate_text(request)
+            except (SchedulerOverloaded, DeadlineExceeded) as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+        if response.error:
+            kind = response.error.split(":")[0][:80]
+            errors[kind] = errors.get(kind, 0) + 1
+            return
+        # Ответ чужого вызова или кеша: провайдер для этого запроса не вызывался
+        for kind in shared:
+            if (response.metadata or {}).get(kind):
+                shared[kind] += 1
+        if parse_json:
+            started = time.perf_counter()
+            parse_json_response(response.content)
+            parse_times.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(request) for request in requests))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(requests),
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(requests) / elapsed, 2) if elapsed else 0.0,
+        "errors": sum(errors.values()),
+        "error_types": errors,
+        "coalesced": shared["coalesced"],
+        "cached": shared["cached"],
+        "latency_ms": percentiles(latencies),
+        "parse_ms": percentiles(parse_times)
+    }
+
+
+async def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="LLM orchestrator benchmark on recorded responses")
+    parser.add_argument("--store", default=settings.REPLAY_PATH)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", default="recorded")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lenient", action="store_true", help="Промах по записи - ответ другой записи той же модели")
+    parser.add_argument("--cache", action="store_true", help="Включить кеш ответов")
+    parser.add_argument("--coalesce", action="store_true", help="Объединять одинаковые одновременные запросы")
+    parser.add_argument("--rate-limiter", action="store_true", help="Включить token bucket провайдеров")
+    parser.add_argument("--parse-json", action="store_true", help="Замерить разбор JSON ответов")
+    args = parser.parse_args(argv)
+
+    # До создания оркестратора: провайдеры строятся из записей
+    settings.REPLAY_MODE = REPLAY_REPLAY
+    settings.REPLAY_PATH = args.store
+    settings.REPLAY_LATENCY = args.latency
+    settings.REPLAY_LATENCY_SCALE = args.latency_scale
+    settings.REPLAY_RATE_LIMIT_RATE = args.rate_limit_rate
+    settings.REPLAY_TIMEOUT_RATE = args.timeout_rate
+    settings.REPLAY_SEED = args.seed
+    settings.REPLAY_STRICT = not args.lenient
+    settings.ENABLE_CACHING = args.cache
+    settings.RATE_LIMIT_ENABLED = args.rate_limiter
+
+    orchestrator = LLMOrchestrator()
+    requests = requests_from_store(ReplayStore(args.store), args.requests, coalesce=args.coalesce)
+    result = await run_benchmark(orchestrator, requests, args.concurrency, args.parse_json)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
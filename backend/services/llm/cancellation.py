@@ -0,0 +1,154 @@
+"""
+Отмена LLM работы ушедшего клиента
+Токен отмены привязан к запросу (HTTP, WebSocket, фоновый анализ) и через
+contextvars доступен оркестратору и провайдерам: незавершенные вызовы
+прерываются, а уже израсходованные на них токены учитываются.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+_current_token: contextvars.ContextVar = contextvars.ContextVar("llm_cancellation_token", default=None)
+
+
+class RequestCancelled(Exception):
+    """Работа отменена: клиент отключился или анализ брошен"""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"Request cancelled: {reason}")
+
+
+class CancellationToken:
+    """
+    Токен отмены запроса.
+
+    token.run(coro) выполняет работу в контексте токена; при отмене задача
+    прерывается (вместе с HTTP вызовами провайдеров), а вызывающий получает
+    RequestCancelled. Провайдеры сообщают о частично израсходованных токенах
+    через record_usage - on_usage получает каждую такую запись.
+    """
+
+    def __init__(self, on_usage: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self._event = asyncio.Event()
+        self.reason: Optional[str] = None
+        self.cancelled_at: Optional[float] = None
+        self.partial_usage: List[Dict[str, Any]] = []
+        self.on_usage = on_usage
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        if self.cancelled:
+            return
+        self.reason = reason
+        self.cancelled_at = time.time()
+        self._event.set()
+        logger.info(f"LLM work cancelled: {reason}")
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+    def record_usage(self, provider: str, model: str, prompt_tokens: int, completion_tokens: int, cost_usd: float):
+        """Расход прерванного вызова провайдера"""
+        usage = {
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": cost_usd
+        }
+        self.partial_usage.append(usage)
+        if self.on_usage:
+            try:
+                self.on_usage(usage)
+            except Exception as e:
+                logger.error(f"Failed to record partial usage: {e}")
+
+    @property
+    def partial_cost(self) -> float:
+        return sum(usage["cost_usd"] for usage in self.partial_usage)
+
+    async def bind(self, coro: Awaitable[Any]) -> Any:
+        """Выполнить coro с этим токеном в контексте (для create_task)"""
+        _current_token.set(self)
+        return await coro
+
+    async def run(self, coro: Awaitable[Any]) -> Any:
+        """
+        Выполнить coro до завершения или отмены токена
+
+        Raises:
+            RequestCancelled: токен отменен раньше, чем работа завершилась
+        """
+        self.raise_if_cancelled()
+        task = asyncio.ensure_future(self.bind(coro))
+        waiter = asyncio.ensure_future(self._event.wait())
+        interrupted = False
+        try:
+            await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not task.done():
+                interrupted = True
+                task.cancel()
+                # Дожидаемся прерывания: провайдеры успевают учесть расход
+                await asyncio.wait({task})
+        if interrupted:
+            if not task.cancelled():
+                # Исключение прерванной работы не интересно вызывающему
+                task.exception()
+            raise RequestCancelled(self.reason or "cancelled")
+        return task.result()
+
+    def watch(
+        self,
+        is_disconnected: Callable[[], Awaitable[bool]],
+        poll_interval: float = 0.5,
+        reason: str = "client disconnected"
+    ) -> asyncio.Task:
+        """Отменить токен, когда клиент отключится (например, Request.is_disconnected)"""
+
+        async def poll():
+            while not self.cancelled:
+                if await is_disconnected():
+                    self.cancel(reason)
+                    return
+                await asyncio.sleep(poll_interval)
+
+        return asyncio.ensure_future(poll())
+
+    def watch_idle(
+        self,
+        is_idle: Callable[[], bool],
+        grace: float,
+        poll_interval: float = 1.0,
+        reason: str = "abandoned by client"
+    ) -> asyncio.Task:
+        """Отменить токен, если работа никому не нужна (is_idle) дольше grace секунд"""
+
+        async def poll():
+            idle_since = None
+            while not self.cancelled:
+                if not is_idle():
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= grace:
+                    self.cancel(reason)
+                    return
+                await asyncio.sleep(poll_interval)
+
+        return asyncio.ensure_future(poll())
+
+
+def current_token() -> Optional[CancellationToken]:
+    """Токен отмены текущего запроса (None вне token.run)"""
+    return _current_token.get()
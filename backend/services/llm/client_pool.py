@@ -0,0 +1,257 @@
+"""
+Пул клиентов AI провайдеров для DevAssist Pro
+Процессный реестр async клиентов с keep-alive соединениями
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Параметры HTTP пула (читаются из окружения, чтобы пул был доступен
+# и монолиту, где настройки LLM Service не инициализируются)
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+CLIENT_IDLE_TIMEOUT = float(os.getenv("LLM_CLIENT_IDLE_TIMEOUT", "900"))
+CLIENT_SWEEP_INTERVAL = float(os.getenv("LLM_CLIENT_SWEEP_INTERVAL", "60"))
+
+
+class _PooledClient:
+    """Запись реестра: клиент провайдера и его состояние"""
+
+    def __init__(self, provider: str, client: Any, http_client: Any):
+        self.provider = provider
+        self.client = client
+        self.http_client = http_client
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.healthy = True
+        self.last_error: Optional[str] = None
+
+    def touch(self):
+        self.last_used = time.time()
+        self.uses += 1
+
+    async def aclose(self):
+        if self.http_client is not None:
+            try:
+                await self.http_client.aclose()
+            except Exception as e:
+                logger.warning(f"Failed to close HTTP client for {self.provider}: {e}")
+
+
+class ProviderClientPool:
+    """
+    Реестр async клиентов AI провайдеров.
+
+    Клиенты создаются лениво, по одному на пару (провайдер, API ключ),
+    и разделяют httpx пул соединений с keep-alive. Простаивающие и
+    помеченные нездоровыми клиенты закрываются и пересоздаются при
+    следующем обращении.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+        timeout: float = HTTP_TIMEOUT,
+        idle_timeout: float = CLIENT_IDLE_TIMEOUT
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        self._clients: Dict[Tuple[str, str], _PooledClient] = {}
+        self._providers: Dict[Tuple[str, str], Any] = {}
+        self._sweeper_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(provider: str, api_key: str) -> Tuple[str, str]:
+        return provider, hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    def _create_http_client(self):
+        """Создать httpx клиент с пулом соединений"""
+        import httpx
+
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=10.0)
+        )
+
+    def _create_client(self, provider: str, api_key: str) -> _PooledClient:
+        """Создать SDK клиент провайдера поверх общего HTTP пула"""
+        if provider == "anthropic":
+            from anthropic import AsyncAnthropic
+
+            http_client = self._create_http_client()
+            client = AsyncAnthropic(api_key=api_key, http_client=http_client)
+        elif provider == "openai":
+            from openai import AsyncOpenAI
+
+            http_client = self._create_http_client()
+            client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+        else:
+            raise ValueError(f"Unsupported pooled provider: {provider}")
+
+        logger.info(f"Created pooled {provider} client")
+        return _PooledClient(provider, client, http_client)
+
+    def get_client(self, provider: str, api_key: str) -> Any:
+        """Получить (или лениво создать) клиент провайдера"""
+        api_key = api_key.strip()
+        key = self._key(provider, api_key)
+
+        entry = self._clients.get(key)
+        if entry is not None and not entry.healthy:
+            # Нездоровый клиент пересоздаем, старый закрываем в фоне
+            self._schedule_close(self._clients.pop(key))
+            entry = None
+
+        if entry is None:
+            entry = self._create_client(provider, api_key)
+            self._clients[key] = entry
+
+        entry.touch()
+        return entry.client
+
+    def get_anthropic(self, api_key: Optional[str] = None) -> Any:
+        """Общий AsyncAnthropic клиент"""
+        api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise ValueError("ANTHROPIC_API_KEY не настроен")
+        return self.get_client("anthropic", api_key)
+
+    def get_openai(self, api_key: Optional[str] = None) -> Any:
+        """Общий AsyncOpenAI клиент"""
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY не настроен")
+        return self.get_client("openai", api_key)
+
+    def get_provider(self, provider: str, api_key: str) -> Any:
+        """
+        Получить общий экземпляр BaseAIProvider.
+        Провайдеры переиспользуются между оркестраторами и берут клиент из
+        пула на каждый вызов: закрытый пулом (простой, ошибка) клиент
+        пересоздается, а провайдеры, уже сохраненные оркестраторами, не
+        остаются с закрытым клиентом.
+        """
+        key = self._key(provider, api_key.strip())
+        instance = self._providers.get(key)
+        if instance is not None:
+            return instance
+
+        if provider == "anthropic":
+            from .providers.anthropic_provider import AnthropicProvider
+            instance = AnthropicProvider(api_key, client_factory=lambda: self.get_client(provider, api_key))
+        elif provider == "openai":
+            from .providers.openai_provider import OpenAIProvider
+            instance = OpenAIProvider(api_key, client_factory=lambda: self.get_client(provider, api_key))
+        elif provider == "google":
+            from .providers.google_provider import GoogleProvider
+            instance = GoogleProvider(api_key)
+        else:
+            raise ValueError(f"Unknown provider: {provider}")
+
+        self._providers[key] = instance
+        return instance
+
+    def mark_unhealthy(self, provider: str, api_key: str, error: Optional[str] = None):
+        """Пометить клиент нездоровым - при следующем запросе он будет пересоздан"""
+        key = self._key(provider, api_key.strip())
+        entry = self._clients.get(key)
+        if entry is not None:
+            entry.healthy = False
+            entry.last_error = error
+            logger.warning(f"Pooled {provider} client marked unhealthy: {error}")
+
+    def _schedule_close(self, entry: _PooledClient):
+        try:
+            asyncio.get_running_loop().create_task(entry.aclose())
+        except RuntimeError:
+            # Нет активного event loop - соединения закроются вместе с процессом
+            pass
+
+    async def close_idle(self) -> int:
+        """Закрыть клиенты, не использовавшиеся дольше idle_timeout"""
+        now = time.time()
+        idle_keys = [
+            key for key, entry in self._clients.items()
+            if now - entry.last_used > self.idle_timeout
+        ]
+
+        for key in idle_keys:
+            entry = self._clients.pop(key)
+            await entry.aclose()
+            logger.info(f"Closed idle {entry.provider} client after {int(now - entry.last_used)}s")
+
+        return len(idle_keys)
+
+    async def _sweep_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.close_idle()
+            except Exception as e:
+                logger.warning(f"Client pool sweep failed: {e}")
+
+    def start(self, interval: float = CLIENT_SWEEP_INTERVAL):
+        """Запустить фоновую очистку простаивающих клиентов"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.get_running_loop().create_task(self._sweep_loop(interval))
+
+    async def aclose(self):
+        """Закрыть все клиенты (при остановке приложения)"""
+        if self._sweeper_task is not None:
+            self._sweeper_task.cancel()
+            self._sweeper_task = None
+
+        entries = list(self._clients.values())
+        self._clients.clear()
+        self._providers.clear()
+        for entry in entries:
+            await entry.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Состояние пула для health endpoints"""
+        now = time.time()
+        return {
+            "clients": [
+                {
+                    "provider": entry.provider,
+                    "healthy": entry.healthy,
+                    "uses": entry.uses,
+                    "age_seconds": round(now - entry.created_at, 1),
+                    "idle_seconds": round(now - entry.last_used, 1),
+                    "last_error": entry.last_error
+                }
+                for entry in self._clients.values()
+            ],
+            "shared_providers": len(self._providers),
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections
+        }
+
+
+_client_pool: Optional[ProviderClientPool] = None
+
+
+def get_client_pool() -> ProviderClientPool:
+    """Процессный экземпляр пула клиентов"""
+    global _client_pool
+    if _client_pool is None:
+        _client_pool = ProviderClientPool()
+    return _client_pool
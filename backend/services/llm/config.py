@@ -36,6 +36,8 @@ class Settings(BaseSettings):
     DEFAULT_TIMEOUT: int = 30
     MAX_RETRIES: int = 3
     MAX_TOKENS_PER_REQUEST: int = 4096
+    GOOGLE_SDK_WORKERS: int = 16  # Потоки для синхронного SDK Gemini
+    GOOGLE_STREAM_BUFFER: int = 32  # Чанков в очереди стрима до приостановки чтения
     DAILY_COST_LIMIT: float = 100.0
     MONTHLY_COST_LIMIT: float = 1000.0
     
@@ -47,6 +49,52 @@ class Settings(BaseSettings):
     ENABLE_METRICS: bool = True
     METRICS_PORT: int = 8012
     
+    # Rate limiting (token bucket на провайдер/модель)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_DEFAULT_RPM: int = 60
+    RATE_LIMIT_DEFAULT_TPM: int = 100000
+    RATE_LIMIT_MIN_FACTOR: float = 0.1  # Минимальная доля квоты после 429
+    RATE_LIMIT_RECOVERY_STEP: float = 0.05  # Восстановление доли квоты за успешный запрос
+    RATE_LIMIT_PREFIX: str = "llm_ratelimit:"
+    
+    # Маршрутизация по здоровью провайдеров (скользящее окно + circuit breaker)
+    ROUTER_WINDOW_SIZE: int = 50  # Последних запросов в статистике модели
+    ROUTER_FAILURE_THRESHOLD: int = 3  # Ошибок подряд до размыкания цепи
+    ROUTER_OPEN_SECONDS: float = 30.0  # Время до пробного запроса
+    ROUTER_ATTEMPT_TIMEOUT: float = 60.0  # Таймаут одной попытки
+    ROUTER_DEFAULT_LATENCY: float = 5.0  # Оценка задержки модели без статистики
+    ROUTER_RANK_PENALTY: float = 0.5  # Штраф за удаленность от предпочтительной модели
+    ROUTER_ERROR_PENALTY: float = 4.0  # Штраф за долю ошибок
+    
+    # Hedged requests для интерактивных задач (политики в HEDGE_POLICIES)
+    HEDGING_ENABLED: bool = False
+    
+    # Пакетное выполнение через Batch API провайдеров (массовая переоценка КП)
+    BATCH_BACKEND: str = "provider"  # provider - Batch API, local - локальное выполнение
+    BATCH_POLL_INTERVAL: int = 60  # Секунд между опросами статуса заданий
+    BATCH_MAX_ITEMS: int = 10000
+    BATCH_COST_DISCOUNT: float = 0.5  # Batch API тарифицируется со скидкой 50%
+    BATCH_LOCAL_CONCURRENCY: int = 4
+    # Локальное пакетное выполнение идет через отдельный бакет rate limiter с этой долей квоты;
+    # интерактивный бакет получает остаток (0 - вся квота интерактивным запросам)
+    BATCH_RATE_LIMIT_SHARE: float = 0.25
+    
+    # Буфер учета использования (пакетная запись в Redis и БД)
+    USAGE_FLUSH_INTERVAL: float = 5.0  # Секунд между записями буфера
+    USAGE_FLUSH_BATCH_SIZE: int = 500  # Событий в буфере до внеочередной записи
+    USAGE_BUFFER_MAX_KEYS: int = 10000  # Ключей агрегации в буфере, сверх - события отбрасываются
+    USAGE_RESERVATION_LEASE: float = 900.0  # Секунд до автоматического снятия неснятого резерва бюджета
+    
+    # Запись и воспроизведение ответов провайдеров (нагрузочные тесты, бенчмарки без сети)
+    REPLAY_MODE: str = "off"  # off; record - запись реальных ответов; replay - ответы из записей
+    REPLAY_PATH: str = "replay/llm_recordings.jsonl.gz"
+    REPLAY_LATENCY: str = "recorded"  # recorded, fixed:<сек>, uniform:<от>:<до>, lognormal:<медиана>:<sigma>
+    REPLAY_LATENCY_SCALE: float = 1.0
+    REPLAY_RATE_LIMIT_RATE: float = 0.0  # Доля ответов 429
+    REPLAY_TIMEOUT_RATE: float = 0.0  # Доля таймаутов
+    REPLAY_STRICT: bool = True  # Нет записи - ошибка; иначе ответ другой записи той же модели
+    REPLAY_SEED: int = 0
+    
     # Fallback настройки согласно ТЗ
     FALLBACK_ENABLED: bool = True
     FALLBACK_ORDER: List[str] = ["openai", "anthropic", "google", "yandex"]
@@ -172,6 +220,34 @@ DEFAULT_MODELS_CONFIG = {
     }
 }
 
+# Квоты провайдеров (запросов и токенов в минуту) для rate limiter.
+# Ключ "default" применяется к моделям провайдера без явной квоты.
+PROVIDER_RATE_LIMITS = {
+    "openai": {
+        "default": {"rpm": 500, "tpm": 30000},
+        "gpt-4": {"rpm": 500, "tpm": 10000},
+        "gpt-4-turbo": {"rpm": 500, "tpm": 30000},
+        "gpt-3.5-turbo": {"rpm": 3500, "tpm": 60000}
+    },
+    "anthropic": {
+        "default": {"rpm": 50, "tpm": 40000},
+        "claude-3-opus-20240229": {"rpm": 50, "tpm": 20000},
+        "claude-3-sonnet-20240229": {"rpm": 50, "tpm": 40000},
+        "claude-3-haiku-20240307": {"rpm": 50, "tpm": 50000}
+    },
+    "google": {
+        "default": {"rpm": 60, "tpm": 32000}
+    }
+}
+
+# Дублирование медленных запросов по типам задач (при HEDGING_ENABLED).
+# percentile - перцентиль задержки основной модели, после которого запрос
+# дублируется; budget_ratio - максимальная доля дублируемых запросов.
+HEDGE_POLICIES = {
+    "data_extraction": {"percentile": 0.9, "min_delay": 2.0, "budget_ratio": 0.1, "burst": 5},
+    "search": {"percentile": 0.9, "min_delay": 1.0, "budget_ratio": 0.1, "burst": 5}
+}
+
 # Конфигурация задач по типам согласно ТЗ
 TASK_MODEL_MAPPING = {
     "text_analysis": {
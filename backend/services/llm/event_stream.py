@@ -0,0 +1,321 @@
+"""
+Потоки событий анализа для DevAssist Pro
+Частичные результаты (поля JSON, готовые разделы) доставляются клиенту по
+мере генерации через WebSocket или SSE. У событий сквозные номера, а
+ограниченный буфер позволяет переподключившемуся клиенту получить
+пропущенное по Last-Event-ID.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, AsyncIterator, AsyncGenerator, Tuple, Set
+
+logger = logging.getLogger(__name__)
+
+# Параметры читаются из окружения: потоки общие для LLM Service и монолита
+EVENT_BUFFER_SIZE = int(os.getenv("ANALYSIS_EVENT_BUFFER_SIZE", "500"))
+EVENT_RETENTION_SECONDS = float(os.getenv("ANALYSIS_EVENT_RETENTION", "300"))
+MAX_EVENT_STREAMS = int(os.getenv("ANALYSIS_EVENT_MAX_STREAMS", "1000"))
+# Незавершенный поток без подписчиков и событий дольше этого срока (производитель пропал) удаляется
+EVENT_IDLE_TTL = float(os.getenv("ANALYSIS_EVENT_IDLE_TTL", "1800"))
+# Сколько клиент, подключившийся до начала анализа, ждет появления потока
+EVENT_SUBSCRIBE_WAIT = float(os.getenv("ANALYSIS_EVENT_SUBSCRIBE_WAIT", "30"))
+
+# Завершающие события: после них поток закрывается
+TERMINAL_EVENTS = ("completed", "error", "cancelled")
+
+
+class StreamNotFound(Exception):
+    """Потока с таким идентификатором нет: анализ не начинался или поток удален"""
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        super().__init__(f"Event stream {stream_id} not found")
+
+
+class StreamInUse(Exception):
+    """Поток с таким идентификатором уже есть: идентификатор занят другим анализом"""
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        super().__init__(f"Event stream {stream_id} already exists")
+
+
+@dataclass
+class StreamEvent:
+    id: int
+    type: str
+    data: Dict[str, Any]
+    timestamp: float
+
+    def to_message(self) -> Dict[str, Any]:
+        """Сообщение WebSocket: поля события и его номер для возобновления"""
+        return {"type": self.type, "event_id": self.id, **self.data}
+
+
+class _Subscriber:
+    """Подписчик с ограниченной очередью: отстающий отключается и догоняет из буфера"""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.lagged = False
+
+    def deliver(self, event: Optional[StreamEvent]):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventStream:
+    """События одного анализа: буфер для переподключения и активные подписчики"""
+
+    def __init__(self, stream_id: str, buffer_size: int):
+        self.stream_id = stream_id
+        self.events: deque = deque(maxlen=buffer_size)
+        self.subscribers: Set[_Subscriber] = set()
+        self.last_id = 0
+        self.closed = False
+        self.updated_at = time.time()
+        self.detached_at = time.time()
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> StreamEvent:
+        self.last_id += 1
+        event = StreamEvent(self.last_id, event_type, data, time.time())
+        self.events.append(event)
+        self.updated_at = event.timestamp
+        for subscriber in self.subscribers:
+            subscriber.deliver(event)
+        return event
+
+    def close(self):
+        self.closed = True
+        self.updated_at = time.time()
+        for subscriber in self.subscribers:
+            subscriber.deliver(None)
+
+
+class EventBroker:
+    """
+    Потоки событий по идентификатору анализа.
+
+    Поток создает только производитель (create/open/publish/pump); подписка на
+    неизвестный идентификатор - StreamNotFound, а клиент, подключившийся
+    до начала анализа, ждет поток через wait_for. После обрыва соединения
+    события после last_event_id отдаются из буфера, затем поступают
+    вживую. Завершенные потоки хранятся EVENT_RETENTION_SECONDS для
+    переподключений, брошенные незавершенные - EVENT_IDLE_TTL.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = EVENT_BUFFER_SIZE,
+        retention: float = EVENT_RETENTION_SECONDS,
+        max_streams: int = MAX_EVENT_STREAMS,
+        idle_ttl: float = EVENT_IDLE_TTL
+    ):
+        self.buffer_size = buffer_size
+        self.retention = retention
+        self.max_streams = max_streams
+        self.idle_ttl = idle_ttl
+        self._streams: "OrderedDict[str, EventStream]" = OrderedDict()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+
+    def _expired(self, stream: EventStream, now: float) -> bool:
+        if stream.subscribers:
+            return False
+        ttl = self.retention if stream.closed else self.idle_ttl
+        return now - stream.updated_at > ttl
+
+    def _evict(self):
+        now = time.time()
+        for stream_id, stream in list(self._streams.items()):
+            if self._expired(stream, now):
+                if not stream.closed:
+                    logger.info(f"Event stream {stream_id} idle for {now - stream.updated_at:.0f}s, removed")
+                del self._streams[stream_id]
+        # Сверх лимита - сначала самые старые завершенные
+        while len(self._streams) > self.max_streams:
+            stream_id = next((key for key, value in self._streams.items() if value.closed), None)
+            if stream_id is None:
+                break
+            del self._streams[stream_id]
+
+    def open(self, stream_id: str) -> EventStream:
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            self._evict()
+            stream = self._streams[stream_id] = EventStream(stream_id, self.buffer_size)
+            for waiter in self._waiters.pop(stream_id, []):
+                if not waiter.done():
+                    waiter.set_result(stream)
+        return stream
+
+    def create(self, stream_id: str) -> EventStream:
+        """
+        Поток нового анализа. Идентификатор может прийти от клиента (подписка
+        до начала анализа), поэтому существующий поток - незавершенный или
+        хранимый для переподключений - не переиспользуется: события и буфер
+        чужого анализа не смешиваются с новыми.
+
+        Raises:
+            StreamInUse: поток с этим идентификатором уже есть
+        """
+        if stream_id in self._streams:
+            raise StreamInUse(stream_id)
+        return self.open(stream_id)
+
+    def get(self, stream_id: str) -> Optional[EventStream]:
+        return self._streams.get(stream_id)
+
+    async def wait_for(self, stream_id: str, timeout: float = EVENT_SUBSCRIBE_WAIT) -> Optional[EventStream]:
+        """Поток по идентификатору; если его еще нет - ждать открытия не дольше timeout"""
+        stream = self._streams.get(stream_id)
+        if stream is not None or timeout <= 0:
+            return stream
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(stream_id, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(stream_id)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[stream_id]
+
+    def publish(self, stream_id: str, event_type: str, data: Optional[Dict[str, Any]] = None) -> StreamEvent:
+        """Опубликовать событие; завершающее событие закрывает поток"""
+        stream = self.open(stream_id)
+        if stream.closed:
+            # Повторный анализ с тем же идентификатором - новый поток
+            del self._streams[stream_id]
+            stream = self.open(stream_id)
+        event = stream.publish(event_type, data or {})
+        if event_type in TERMINAL_EVENTS:
+            stream.close()
+        return event
+
+    async def subscribe(
+        self,
+        stream_id: str,
+        last_event_id: int = 0,
+        heartbeat: Optional[float] = None
+    ) -> AsyncIterator[Optional[StreamEvent]]:
+        """
+        События после last_event_id: из буфера, затем новые до закрытия потока.
+        С heartbeat отдает None при простое - для keepalive соединения.
+        Поток должен существовать (см. wait_for), иначе StreamNotFound.
+        """
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            raise StreamNotFound(stream_id)
+        subscriber = _Subscriber(self.buffer_size)
+
+        # Буфер и регистрация без await между ними - события не теряются и не дублируются
+        backlog = [event for event in stream.events if event.id > last_event_id]
+        if backlog and backlog[0].id > last_event_id + 1:
+            # Часть событий вытеснена из буфера
+            yield StreamEvent(last_event_id, "gap", {"missed_until": backlog[0].id - 1}, time.time())
+        if stream.closed:
+            for event in backlog:
+                yield event
+            return
+
+        stream.subscribers.add(subscriber)
+        try:
+            for event in backlog:
+                yield event
+                last_event_id = event.id
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                if event.id > last_event_id:
+                    yield event
+        finally:
+            stream.subscribers.discard(subscriber)
+            if not stream.subscribers:
+                stream.detached_at = time.time()
+
+    async def pump(
+        self,
+        stream_id: str,
+        events: AsyncGenerator[Tuple[str, Dict[str, Any]], None],
+        idle_timeout: float = 30.0,
+        token=None
+    ):
+        """
+        Опубликовать события генератора. Если у потока нет подписчиков
+        дольше idle_timeout (клиент ушел и не вернулся), генерация прерывается;
+        token (CancellationToken) отменяется до закрытия генератора, чтобы
+        провайдер учел частичный расход.
+        """
+        stream = self.open(stream_id)
+        try:
+            async for event_type, data in events:
+                self.publish(stream_id, event_type, data)
+                if not stream.subscribers and time.time() - stream.detached_at > idle_timeout:
+                    logger.info(f"Event stream {stream_id} abandoned by clients, cancelling")
+                    if token is not None:
+                        token.cancel("no subscribers")
+                    self.publish(stream_id, "cancelled", {"reason": "no subscribers"})
+                    return
+        except Exception as e:
+            logger.error(f"Event stream {stream_id} producer failed: {e}")
+            self.publish(stream_id, "error", {"error": str(e)})
+        finally:
+            await events.aclose()
+            if not stream.closed:
+                stream.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "waiting_subscribers": sum(len(waiters) for waiters in self._waiters.values()),
+            "open_streams": sum(1 for stream in self._streams.values() if not stream.closed),
+            "subscribers": sum(len(stream.subscribers) for stream in self._streams.values())
+        }
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """Номер последнего полученного события (заголовок Last-Event-ID или параметр)"""
+    try:
+        return max(0, int(value)) if value else 0
+    except ValueError:
+        return 0
+
+
+def format_sse(event: Optional[StreamEvent]) -> str:
+    """Событие в формате text/event-stream; None - комментарий keepalive"""
+    if event is None:
+        return ": keepalive\n\n"
+    data = json.dumps({"timestamp": event.timestamp, **event.data}, ensure_ascii=False)
+    return f"id: {event.id}\nevent: {event.type}\ndata: {data}\n\n"
+
+
+_event_broker: Optional[EventBroker] = None
+
+
+def get_event_broker() -> EventBroker:
+    """Процессный брокер потоков событий"""
+    global _event_broker
+    if _event_broker is None:
+        _event_broker = EventBroker()
+    return _event_broker
@@ -0,0 +1,98 @@
+"""
+Hedged requests для интерактивных задач DevAssist Pro
+Дублирование медленного запроса на следующего по качеству провайдера
+"""
+import logging
+from typing import Dict, Any, Optional
+
+from .config import settings, HEDGE_POLICIES
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeBudget:
+    """
+    Бюджет дублирующих запросов для одного типа задачи.
+
+    Каждый запрос добавляет budget_ratio единицы бюджета (не больше burst),
+    каждый дубль расходует единицу - дублируется не больше budget_ratio
+    доли запросов, даже если провайдер деградировал целиком.
+    """
+
+    def __init__(self, budget_ratio: float, burst: float):
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.balance = burst
+
+        self.requests = 0
+        self.hedged = 0
+        self.denied = 0
+        self.backup_wins = 0
+
+    def on_request(self):
+        self.requests += 1
+        self.balance = min(self.burst, self.balance + self.budget_ratio)
+
+    def try_acquire(self) -> bool:
+        if self.balance < 1:
+            self.denied += 1
+            return False
+        self.balance -= 1
+        self.hedged += 1
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "denied": self.denied,
+            "backup_wins": self.backup_wins,
+            "balance": round(self.balance, 2)
+        }
+
+
+class HedgingManager:
+    """Политики дублирования по типам задач (HEDGE_POLICIES) и их бюджеты"""
+
+    def __init__(self, enabled: bool = None, policies: Dict[str, Dict[str, Any]] = None):
+        self.enabled = settings.HEDGING_ENABLED if enabled is None else enabled
+        self.policies = HEDGE_POLICIES if policies is None else policies
+        self._budgets: Dict[str, HedgeBudget] = {}
+
+    def policy(self, task_type: Any) -> Optional[Dict[str, Any]]:
+        """Политика для типа задачи (None - дублирование выключено)"""
+        if not self.enabled:
+            return None
+        return self.policies.get(getattr(task_type, "value", task_type))
+
+    def budget(self, task_type: Any) -> HedgeBudget:
+        key = getattr(task_type, "value", task_type)
+        budget = self._budgets.get(key)
+        if budget is None:
+            policy = self.policies.get(key, {})
+            budget = HedgeBudget(policy.get("budget_ratio", 0.1), policy.get("burst", 5))
+            self._budgets[key] = budget
+        return budget
+
+    @staticmethod
+    def hedge_delay(policy: Dict[str, Any], observed_latency: Optional[float]) -> float:
+        """Через сколько секунд дублировать: перцентиль задержки основной модели"""
+        delay = observed_latency if observed_latency is not None else settings.ROUTER_DEFAULT_LATENCY
+        return max(policy.get("min_delay", 1.0), delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "task_types": {key: budget.get_stats() for key, budget in self._budgets.items()}
+        }
+
+
+_hedging: Optional[HedgingManager] = None
+
+
+def get_hedging() -> HedgingManager:
+    """Процессный экземпляр политики дублирования"""
+    global _hedging
+    if _hedging is None:
+        _hedging = HedgingManager()
+    return _hedging
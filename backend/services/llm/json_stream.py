@@ -0,0 +1,147 @@
+"""
+Инкрементальный разбор JSON из ответа модели
+Поля верхнего уровня (оценки, рекомендации) отдаются по мере закрытия, не
+дожидаясь конца генерации. Обрамление ```json и текст после объекта
+игнорируются, оборванный или испорченный вывод проходит ограниченный ремонт
+вместо повторного запроса к модели.
+"""
+import json
+import logging
+import re
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_CLOSERS = {"{": "}", "[": "]"}
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+class StreamingJSONParser:
+    """Разбор JSON-объекта по частям потока"""
+
+    def __init__(self):
+        self.result: Dict[str, Any] = {}
+        self.done = False
+        self.repaired = False
+
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._member_start = 0
+        self._malformed = 0
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        """Добавить часть ответа; возвращает поля верхнего уровня, закрывшиеся в ней"""
+        if self.done or not chunk:
+            return {}
+
+        if not self._started:
+            # Все до первой скобки (```json, вступление модели) пропускается
+            start = chunk.find("{")
+            if start == -1:
+                return {}
+            chunk = chunk[start:]
+            self._started = True
+
+        self._buffer += chunk
+        completed: Dict[str, Any] = {}
+        buffer = self._buffer
+
+        while self._pos < len(buffer):
+            char = buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+                if len(self._stack) == 1:
+                    self._member_start = self._pos + 1
+            elif char in "}]":
+                if len(self._stack) == 1:
+                    self._emit(buffer[self._member_start:self._pos], completed)
+                    self._stack.pop()
+                    self._pos += 1
+                    # Текст после объекта (пояснения, закрывающий ```) не нужен
+                    self.done = True
+                    break
+                if self._stack:
+                    self._stack.pop()
+            elif char == "," and len(self._stack) == 1:
+                self._emit(buffer[self._member_start:self._pos], completed)
+                self._member_start = self._pos + 1
+
+            self._pos += 1
+
+        return completed
+
+    def _emit(self, member: str, completed: Dict[str, Any]):
+        """Разобрать один член объекта верхнего уровня"""
+        member = member.strip()
+        if not member:
+            return
+
+        try:
+            field = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            self._malformed += 1
+            logger.debug(f"Malformed JSON member skipped until repair: {member[:80]}")
+            return
+
+        self.result.update(field)
+        completed.update(field)
+
+    def close(self) -> Dict[str, Any]:
+        """Конец потока: объект целиком; оборванный или испорченный - после ремонта"""
+        if self._started and (not self.done or self._malformed):
+            repaired = self._repair()
+            if repaired is not None:
+                # Поля, разобранные без ремонта, надежнее
+                self.result = {**repaired, **self.result}
+                self.repaired = True
+        return self.result
+
+    def _repair(self) -> Optional[Dict[str, Any]]:
+        """
+        Ограниченный ремонт: закрыть оборванную строку и скобки, убрать
+        висячие запятые. Если не помогло - остаются поля, разобранные по ходу.
+        """
+        candidate = self._buffer[:self._pos]
+
+        if not self.done:
+            if self._in_string:
+                if self._escape:
+                    candidate = candidate[:-1]
+                candidate += '"'
+            candidate = candidate.rstrip()
+            if candidate.endswith(","):
+                candidate = candidate[:-1]
+            elif candidate.endswith(":"):
+                candidate += " null"
+            candidate += "".join(_CLOSERS[bracket] for bracket in reversed(self._stack))
+
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                value = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            return value if isinstance(value, dict) else None
+
+        logger.warning("JSON repair failed, keeping fields parsed so far")
+        return None
+
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    """Разобрать JSON-объект из полного ответа модели (с ремонтом); {} если объекта нет"""
+    parser = StreamingJSONParser()
+    parser.feed(text)
+    return parser.close()
@@ -5,55 +5,78 @@ LLM Service для DevAssist Pro
 import asyncio
 import logging
 import time
+import uuid
 from typing import Dict, Any, List, Optional
 from datetime import datetime, date
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, aclosing
+from sqlalchemy.exc import NoResultFound
 import uvicorn
-import json
 
-from .orchestrator import LLMOrchestrator
+from .orchestrator import LLMOrchestrator, get_orchestrator
+from .batch import BatchManager
+from .client_pool import get_client_pool
 from .prompt_manager import PromptManager
-from .usage_tracker import UsageTracker
+from .usage_tracker import UsageTracker, UsageLimitExceeded
+from .event_stream import get_event_broker, format_sse, parse_last_event_id, StreamInUse
+from .scheduler import (
+    get_scheduler, parse_deadline, PRIORITIES, PRIORITY_INTERACTIVE,
+    SchedulerOverloaded, DeadlineExceeded
+)
+from .cancellation import CancellationToken, RequestCancelled
+from .metrics import register_scheduler_metrics, render_metrics
 from .config import settings
+from ..shared.database import get_db_session
 from ..shared.llm_schemas import (
-    AIRequest, AIResponse, StreamChunk, TaskType, AIProvider,
+    AIRequest, AIResponse, TaskType, AIProvider,
     KPAnalysisRequest, KPAnalysisResponse, LLMHealth, UsageStatistics,
-    PromptTemplate, ErrorResponse
+    PromptTemplate, ErrorResponse, BatchJobRequest
 )
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Очереди планировщика в /metrics
+register_scheduler_metrics()
+
 # Глобальные экземпляры сервисов
 orchestrator: Optional[LLMOrchestrator] = None
 prompt_manager: Optional[PromptManager] = None
 usage_tracker: Optional[UsageTracker] = None
+batch_manager: Optional[BatchManager] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifecycle events для FastAPI приложения"""
-    global orchestrator, prompt_manager, usage_tracker
+    global orchestrator, prompt_manager, usage_tracker, batch_manager
     
     logger.info("Starting LLM Service...")
     
     # Инициализация сервисов
-    orchestrator = LLMOrchestrator()
+    orchestrator = get_orchestrator()
     await orchestrator.init_redis()
+    get_client_pool().start()
     
     prompt_manager = PromptManager()
     
     usage_tracker = UsageTracker()
     await usage_tracker.init_redis()
+    usage_tracker.start()
+    
+    batch_manager = BatchManager(orchestrator.providers)
+    batch_poller = asyncio.create_task(batch_manager.run_poller())
     
     logger.info("LLM Service started successfully")
     
     yield
     
     logger.info("Shutting down LLM Service...")
+    batch_poller.cancel()
+    await usage_tracker.aclose()
+    await get_client_pool().aclose()
 
 # Создание FastAPI приложения
 app = FastAPI(
@@ -109,10 +132,30 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail=str(e))
 
+def partial_usage_recorder(request: AIRequest, start_time: float):
+    """Учет расхода прерванных вызовов провайдеров (клиент отключился)"""
+    def record(usage: Dict[str, Any]):
+        if not usage_tracker:
+            return
+        asyncio.ensure_future(usage_tracker.track_request(
+            user_id=request.user_id,
+            organization_id=request.organization_id,
+            provider=AIProvider(usage["provider"]),
+            model=usage["model"],
+            task_type=request.task_type,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            cost_usd=usage["cost_usd"],
+            response_time=time.time() - start_time,
+            success=False
+        ))
+    return record
+
 @app.post("/generate", response_model=AIResponse)
 async def generate_text(
     request: AIRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    http_request: Request
 ):
     """Основной endpoint для генерации текста согласно ТЗ"""
     if not orchestrator:
@@ -120,8 +163,33 @@ async def generate_text(
     
     start_time = time.time()
     
+    # Приоритет и дедлайн вызывающего: по умолчанию синхронный вызов - интерактивный
+    metadata = dict(request.metadata or {})
+    metadata.setdefault("priority", http_request.headers.get("x-llm-priority", PRIORITY_INTERACTIVE))
+    if metadata["priority"] not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {metadata['priority']}")
+    if "deadline" not in metadata:
+        metadata["deadline"] = parse_deadline(http_request.headers)
+    request.metadata = metadata
+    
+    # Бюджеты пользователя и организации проверяются до вызова провайдера
+    reservation = None
+    if usage_tracker and (request.user_id or request.organization_id):
+        try:
+            reservation = await usage_tracker.reserve(
+                request.user_id,
+                request.organization_id,
+                orchestrator.estimate_request_cost(request)
+            )
+        except UsageLimitExceeded as e:
+            raise HTTPException(status_code=429, detail=str(e))
+    
+    # Клиент ушел - вызов провайдера прерывается вместе с местом в очереди
+    token = CancellationToken(on_usage=partial_usage_recorder(request, start_time))
+    watcher = token.watch(http_request.is_disconnected)
+    
     try:
-        response = await orchestrator.generate_text(request)
+        response = await token.run(orchestrator.generate_text(request))
         
         # Отслеживание использования в фоне
         if usage_tracker and not response.error:
@@ -136,11 +204,45 @@ async def generate_text(
                 completion_tokens=response.completion_tokens,
                 cost_usd=response.cost_usd,
                 response_time=response.response_time,
-                success=True
+                success=True,
+                reservation=reservation
             )
+            
+            # Проигравший дубль hedged запроса тоже расходует квоту провайдера
+            hedge = (response.metadata or {}).get("hedge")
+            if hedge:
+                loser = hedge["loser"]
+                background_tasks.add_task(
+                    usage_tracker.track_request,
+                    user_id=request.user_id,
+                    organization_id=request.organization_id,
+                    provider=AIProvider(loser["provider"]),
+                    model=loser["model"],
+                    task_type=request.task_type,
+                    prompt_tokens=loser["prompt_tokens"],
+                    completion_tokens=0,
+                    cost_usd=loser["cost_usd"],
+                    response_time=response.response_time,
+                    success=False
+                )
+        elif usage_tracker:
+            usage_tracker.release(reservation)
         
         return response
         
+    except SchedulerOverloaded as e:
+        if usage_tracker:
+            usage_tracker.release(reservation)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        if usage_tracker:
+            usage_tracker.release(reservation)
+        raise HTTPException(status_code=504, detail=str(e))
+    except RequestCancelled as e:
+        if usage_tracker:
+            usage_tracker.release(reservation)
+        logger.info(f"Text generation cancelled, partial cost ${token.partial_cost:.4f}: {e}")
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
         logger.error(f"Text generation failed: {e}")
         
@@ -157,44 +259,124 @@ async def generate_text(
                 completion_tokens=0,
                 cost_usd=0.0,
                 response_time=time.time() - start_time,
-                success=False
+                success=False,
+                reservation=reservation
             )
         
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
 
-@app.post("/generate/stream")
-async def generate_text_stream(request: AIRequest):
-    """Streaming endpoint для генерации текста согласно ТЗ"""
-    if not orchestrator:
-        raise HTTPException(status_code=503, detail="Service not initialized")
-    
-    async def stream_generator():
-        try:
-            async for chunk in orchestrator.generate_text_stream(request):
-                yield f"data: {json.dumps(chunk.dict())}\n\n"
-                
+# Генерации стримов: ссылки держим до завершения
+stream_producers = set()
+
+async def stream_events(request: AIRequest, reservation: Optional[Dict[str, Any]] = None, start_time: float = None):
+    """
+    Чанки оркестратора как события потока: chunk, затем completed или error.
+    Резерв бюджета закрывается фактическим расходом из последнего чанка;
+    при ошибке, отмене или уходе клиента он снимается (частичный расход
+    прерванного вызова учитывает partial_usage_recorder).
+    """
+    start_time = start_time or time.time()
+    settled = False
+    try:
+        async with aclosing(orchestrator.generate_text_stream(request)) as chunks:
+            async for chunk in chunks:
+                if chunk.error:
+                    yield "error", chunk.dict()
+                    break
+                if chunk.is_complete and chunk.usage and usage_tracker:
+                    await usage_tracker.track_request(
+                        user_id=request.user_id,
+                        organization_id=request.organization_id,
+                        provider=AIProvider(chunk.usage["provider"]),
+                        model=chunk.usage["model"],
+                        task_type=request.task_type,
+                        prompt_tokens=chunk.usage["prompt_tokens"],
+                        completion_tokens=chunk.usage["completion_tokens"],
+                        cost_usd=chunk.usage["cost_usd"],
+                        response_time=time.time() - start_time,
+                        success=True,
+                        reservation=reservation
+                    )
+                    settled = True
+                yield ("completed" if chunk.is_complete else "chunk"), chunk.dict()
                 if chunk.is_complete:
                     break
-                    
-        except Exception as e:
-            error_chunk = StreamChunk(
-                task_id="error",
-                chunk="",
-                is_complete=True,
-                error=str(e)
-            )
-            yield f"data: {json.dumps(error_chunk.dict())}\n\n"
+    finally:
+        if usage_tracker and not settled:
+            usage_tracker.release(reservation)
+
+def sse_response(stream_id: str, last_event_id: int = 0) -> StreamingResponse:
+    async def event_source():
+        async for event in get_event_broker().subscribe(stream_id, last_event_id, heartbeat=15.0):
+            yield format_sse(event)
     
     return StreamingResponse(
-        stream_generator(),
-        media_type="text/plain",
+        event_source(),
+        media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*"
+            "Access-Control-Allow-Origin": "*",
+            "X-Stream-Id": stream_id
         }
     )
 
+@app.post("/generate/stream")
+async def generate_text_stream(request: AIRequest):
+    """
+    Streaming endpoint для генерации текста согласно ТЗ (SSE).
+    События нумеруются; после обрыва соединения поток продолжается через
+    GET /generate/stream/{stream_id} с заголовком Last-Event-ID.
+    """
+    if not orchestrator:
+        raise HTTPException(status_code=503, detail="Service not initialized")
+    
+    stream_id = (request.metadata or {}).get("stream_id") or f"stream_{uuid.uuid4().hex}"
+    start_time = time.time()
+    
+    # Поток создается до ответа: подписка SSE не опережает задачу генерации.
+    # Занятый идентификатор отклоняется - события не попадают в чужой поток
+    try:
+        get_event_broker().create(stream_id)
+    except StreamInUse:
+        raise HTTPException(status_code=409, detail=f"Stream {stream_id} already exists")
+    
+    # Бюджеты пользователя и организации проверяются до начала генерации, как в /generate
+    reservation = None
+    if usage_tracker and (request.user_id or request.organization_id):
+        try:
+            reservation = await usage_tracker.reserve(
+                request.user_id,
+                request.organization_id,
+                orchestrator.estimate_request_cost(request)
+            )
+        except UsageLimitExceeded as e:
+            # Клиент, подписавшийся заранее, получает ошибку вместо ожидания
+            get_event_broker().publish(stream_id, "error", {"error": str(e)})
+            raise HTTPException(status_code=429, detail=str(e))
+    
+    # Генерация не привязана к соединению: переподключившийся клиент получит остаток
+    token = CancellationToken(on_usage=partial_usage_recorder(request, start_time))
+    events = stream_events(request, reservation, start_time)
+    producer = asyncio.create_task(token.bind(get_event_broker().pump(stream_id, events, token=token)))
+    stream_producers.add(producer)
+    producer.add_done_callback(stream_producers.discard)
+    
+    return sse_response(stream_id)
+
+@app.get("/generate/stream/{stream_id}")
+async def resume_text_stream(stream_id: str, http_request: Request, last_event_id: Optional[str] = None):
+    """Возобновление стрима: пропущенные события из буфера, затем новые"""
+    if get_event_broker().get(stream_id) is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    
+    return sse_response(
+        stream_id,
+        parse_last_event_id(http_request.headers.get("last-event-id") or last_event_id)
+    )
+
 @app.post("/analyze")
 async def analyze_text(request: dict):
     """Общий анализ текста с помощью AI - поддерживает любые промпты"""
@@ -264,6 +446,65 @@ async def analyze_kp_documents(
         logger.error(f"KP analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/batch")
+async def create_batch_job(request: BatchJobRequest):
+    """Пакетное задание через Batch API провайдера (переоценка архива КП)"""
+    if not batch_manager:
+        raise HTTPException(status_code=503, detail="Batch manager not initialized")
+    
+    try:
+        return await batch_manager.create_job(
+            request.requests,
+            request.model,
+            analysis_ids=request.analysis_ids,
+            user_id=request.user_id,
+            organization_id=request.organization_id
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch job creation failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/batch/{batch_id}")
+async def get_batch_job(batch_id: str, refresh: bool = False):
+    """Статус пакетного задания (refresh - опросить провайдера сейчас)"""
+    if not batch_manager:
+        raise HTTPException(status_code=503, detail="Batch manager not initialized")
+    
+    try:
+        if refresh:
+            return await batch_manager.poll(batch_id)
+        return batch_manager.get_job(batch_id)
+        
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+
+@app.get("/batch/{batch_id}/results")
+async def get_batch_results(batch_id: str):
+    """Результаты пакетного задания, в том числе по analysis_id"""
+    if not batch_manager:
+        raise HTTPException(status_code=503, detail="Batch manager not initialized")
+    
+    try:
+        return batch_manager.get_results(batch_id)
+        
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+
+@app.post("/batch/{batch_id}/cancel")
+async def cancel_batch_job(batch_id: str):
+    """Отмена пакетного задания"""
+    if not batch_manager:
+        raise HTTPException(status_code=503, detail="Batch manager not initialized")
+    
+    try:
+        return await batch_manager.cancel(batch_id)
+        
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+
 @app.get("/prompts/templates")
 async def list_prompt_templates(module: Optional[str] = None):
     """Получение списка доступных шаблонов промптов"""
@@ -295,6 +536,22 @@ async def get_prompt_template(module: str, template_name: str):
         logger.error(f"Failed to get template: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/prompts/reload")
+async def reload_prompt_templates():
+    """Перезагрузка и повторная компиляция шаблонов промптов"""
+    if not prompt_manager:
+        raise HTTPException(status_code=503, detail="Prompt manager not initialized")
+    
+    try:
+        with get_db_session() as db:
+            prompt_manager.reload(db)
+        
+        return {"versions": prompt_manager.registry.versions()}
+        
+    except Exception as e:
+        logger.error(f"Failed to reload templates: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/prompts/format")
 async def format_prompt(
     module: str,
@@ -312,7 +569,9 @@ async def format_prompt(
         
         return {
             "system_prompt": system_prompt,
-            "user_prompt": user_prompt
+            "user_prompt": user_prompt,
+            # Передается в metadata["prompt_version"] запроса - кеш ответов сбрасывается при изменении шаблона
+            "prompt_version": prompt_manager.prompt_version(module, template_name)
         }
         
     except ValueError as e:
@@ -327,7 +586,8 @@ async def get_usage_statistics(
     organization_id: Optional[int] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    provider: Optional[str] = None
+    provider: Optional[str] = None,
+    daily: bool = True
 ):
     """Получение статистики использования AI согласно ТЗ"""
     if not usage_tracker:
@@ -344,7 +604,8 @@ async def get_usage_statistics(
             organization_id=organization_id,
             start_date=start_dt,
             end_date=end_dt,
-            provider=provider_enum
+            provider=provider_enum,
+            daily=daily
         )
         
         return stats
@@ -369,6 +630,20 @@ async def get_realtime_metrics():
         logger.error(f"Failed to get realtime metrics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Очереди LLM запросов: глубина, занятые слоты, отклоненные и просроченные"""
+    return get_scheduler().get_stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики Prometheus: очереди планировщика по классам приоритета"""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    payload, content_type = rendered
+    return Response(content=payload, media_type=content_type)
+
 @app.post("/usage/limits/user/{user_id}")
 async def set_user_limits(
     user_id: int,
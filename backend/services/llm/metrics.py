@@ -0,0 +1,60 @@
+"""
+Prometheus метрики LLM Service
+Очереди планировщика по классам приоритета: сборщик регистрируется там, где
+отдается /metrics (LLM Service, монолит, core/monitoring)
+"""
+from typing import Optional, Tuple
+
+from .scheduler import get_scheduler
+
+try:
+    from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+
+class LLMSchedulerCollector:
+    """Метрики очередей LLM планировщика по классам приоритета"""
+
+    def collect(self):
+        classes = get_scheduler().get_stats()["classes"]
+        gauges = {
+            "queue_depth": GaugeMetricFamily('llm_queue_depth', 'LLM jobs waiting for a slot', labels=['priority']),
+            "active": GaugeMetricFamily('llm_active_jobs', 'LLM jobs holding a slot', labels=['priority']),
+            "wait_p50": GaugeMetricFamily('llm_queue_wait_p50_seconds', 'Median LLM queue wait', labels=['priority']),
+            "wait_p95": GaugeMetricFamily('llm_queue_wait_p95_seconds', 'p95 LLM queue wait', labels=['priority'])
+        }
+        counters = {
+            "admitted": CounterMetricFamily('llm_jobs_admitted', 'LLM jobs admitted to providers', labels=['priority']),
+            "shed": CounterMetricFamily('llm_jobs_shed', 'LLM jobs rejected by load shedding', labels=['priority']),
+            "expired": CounterMetricFamily('llm_jobs_expired', 'LLM jobs past caller deadline', labels=['priority']),
+            "abandoned": CounterMetricFamily('llm_jobs_abandoned', 'LLM jobs cancelled by caller while queued', labels=['priority'])
+        }
+        for priority, stats in classes.items():
+            for field, family in {**gauges, **counters}.items():
+                family.add_metric([priority], stats[field])
+        yield from gauges.values()
+        yield from counters.values()
+
+
+_registered = False
+
+
+def register_scheduler_metrics() -> bool:
+    """Зарегистрировать сборщик (один раз на процесс); False - prometheus_client не установлен"""
+    global _registered
+    if not PROMETHEUS_AVAILABLE:
+        return False
+    if not _registered:
+        REGISTRY.register(LLMSchedulerCollector())
+        _registered = True
+    return True
+
+
+def render_metrics() -> Optional[Tuple[bytes, str]]:
+    """Метрики реестра в формате Prometheus и их content type (None без prometheus_client)"""
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
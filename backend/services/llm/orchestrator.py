@@ -5,23 +5,32 @@ LLM Orchestrator для DevAssist Pro
 import asyncio
 import logging
 import time
-import hashlib
-import json
+from contextlib import aclosing
 from typing import Dict, Any, List, Optional, AsyncGenerator, Union
 from datetime import datetime, timedelta
 import aioredis
 from sqlalchemy.orm import Session
 
-from .providers.openai_provider import OpenAIProvider
-from .providers.anthropic_provider import AnthropicProvider
-from .providers.google_provider import GoogleProvider
-from .providers.base import BaseAIProvider, AIProviderError, RateLimitError, APIKeyError
-from .config import settings, TASK_MODEL_MAPPING
+from .providers.base import (
+    BaseAIProvider, AIProviderError, RateLimitError, APIKeyError, ContextLengthExceededError
+)
+from .config import settings
+from .client_pool import get_client_pool
+from .providers.replay_provider import build_replay_providers
+from .response_cache import build_cache_key, get_response_cache
+from .single_flight import get_single_flight
+from .rate_limiter import get_rate_limiter
+from .router import get_router
+from .hedging import get_hedging
+from .scheduler import get_scheduler, PRIORITY_STANDARD, SchedulerOverloaded, DeadlineExceeded
+from .cancellation import current_token, RequestCancelled
+from .json_stream import StreamingJSONParser
 from ..shared.llm_schemas import (
     AIRequest, AIResponse, StreamChunk, TaskType, AIProvider, 
     AIConfiguration, KPAnalysisRequest, KPAnalysisResponse, ErrorResponse
 )
 from ..shared.llm_models import AIRequest as AIRequestModel
+from ..shared.prompt_registry import get_prompt_registry
 
 logger = logging.getLogger(__name__)
 
@@ -33,35 +42,37 @@ class LLMOrchestrator:
         self.redis_client: Optional[aioredis.Redis] = None
         self.fallback_order = settings.FALLBACK_ORDER
         self.cache_ttl = settings.CACHE_TTL
+        self.response_cache = get_response_cache()
+        self.in_flight = get_single_flight()
+        self.router = get_router()
+        self.hedging = get_hedging()
         
         # Инициализация провайдеров согласно ТЗ раздел 4.3
         self._init_providers()
     
     def _init_providers(self):
-        """Инициализация AI провайдеров"""
-        if settings.OPENAI_API_KEY:
-            try:
-                self.providers["openai"] = OpenAIProvider(settings.OPENAI_API_KEY)
-                logger.info("OpenAI provider initialized")
-            except Exception as e:
-                logger.error(f"Failed to initialize OpenAI provider: {e}")
-        
-        if settings.ANTHROPIC_API_KEY:
+        """Инициализация AI провайдеров (экземпляры общие для процесса, см. client_pool)"""
+        client_pool = get_client_pool()
+        provider_keys = {
+            "openai": settings.OPENAI_API_KEY,
+            "anthropic": settings.ANTHROPIC_API_KEY,
+            "google": settings.GOOGLE_API_KEY,
+        }
+        
+        for provider_name, api_key in provider_keys.items():
+            if not api_key:
+                continue
             try:
-                self.providers["anthropic"] = AnthropicProvider(settings.ANTHROPIC_API_KEY)
-                logger.info("Anthropic provider initialized")
+                self.providers[provider_name] = client_pool.get_provider(provider_name, api_key)
+                logger.info(f"{provider_name} provider initialized")
             except Exception as e:
-                logger.error(f"Failed to initialize Anthropic provider: {e}")
-        
-        if settings.GOOGLE_API_KEY:
-            try:
-                self.providers["google"] = GoogleProvider(settings.GOOGLE_API_KEY)
-                logger.info("Google provider initialized")
-            except Exception as e:
-                logger.error(f"Failed to initialize Google provider: {e}")
+                logger.error(f"Failed to initialize {provider_name} provider: {e}")
         
         # TODO: Добавить YandexGPT и GigaChat провайдеры
         
+        # Нагрузочные тесты и бенчмарки: запись или воспроизведение ответов
+        self.providers = build_replay_providers(self.providers)
+        
         logger.info(f"Initialized {len(self.providers)} AI providers: {list(self.providers.keys())}")
     
     async def init_redis(self):
@@ -69,74 +80,217 @@ class LLMOrchestrator:
         try:
             self.redis_client = aioredis.from_url(settings.REDIS_URL)
             await self.redis_client.ping()
+            self.response_cache.set_redis(self.redis_client, self.cache_ttl)
+            get_rate_limiter().set_redis(self.redis_client)
             logger.info("Redis connection established for LLM caching")
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
             self.redis_client = None
     
+    @staticmethod
+    def _resolve_generation_params(request: AIRequest) -> tuple[int, float]:
+        """Параметры генерации с учетом значений по умолчанию (0.0 - валидная температура)"""
+        max_tokens = request.max_tokens if request.max_tokens is not None else 1000
+        temperature = request.temperature if request.temperature is not None else 0.7
+        return max_tokens, temperature
+    
     def _get_cache_key(self, request: AIRequest) -> str:
-        """Генерация ключа кеша для запроса"""
-        content_hash = hashlib.sha256(
-            f"{request.task_type}:{request.content}:{request.system_prompt}:{request.user_prompt}".encode()
-        ).hexdigest()[:16]
-        return f"{settings.CACHE_PREFIX}{content_hash}"
+        """Генерация ключа кеша по полному нормализованному запросу"""
+        max_tokens, temperature = self._resolve_generation_params(request)
+        return build_cache_key(
+            task_type=request.task_type,
+            content=request.content,
+            system_prompt=request.system_prompt,
+            user_prompt=request.user_prompt,
+            model=request.model_override,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_version=(
+                (request.metadata or {}).get("prompt_version")
+                or get_prompt_registry().version((request.metadata or {}).get("prompt_template"))
+            ),
+            context=(request.metadata or {}).get("cached_context"),
+            prefix=settings.CACHE_PREFIX
+        )
     
     async def _get_cached_response(self, cache_key: str) -> Optional[Dict[str, Any]]:
-        """Получить кешированный ответ"""
-        if not self.redis_client or not settings.ENABLE_CACHING:
+        """Получить кешированный ответ (память, затем Redis)"""
+        if not settings.ENABLE_CACHING:
             return None
         
-        try:
-            cached_data = await self.redis_client.get(cache_key)
-            if cached_data:
-                return json.loads(cached_data)
-        except Exception as e:
-            logger.warning(f"Cache retrieval failed: {e}")
-        
-        return None
+        return await self.response_cache.get(cache_key)
     
     async def _cache_response(self, cache_key: str, response: Dict[str, Any]):
         """Кешировать ответ"""
-        if not self.redis_client or not settings.ENABLE_CACHING:
+        if not settings.ENABLE_CACHING:
             return
         
-        try:
-            await self.redis_client.setex(
-                cache_key, 
-                self.cache_ttl, 
-                json.dumps(response, default=str)
-            )
-        except Exception as e:
-            logger.warning(f"Cache storage failed: {e}")
+        await self.response_cache.set(cache_key, response)
     
-    def _select_model(self, task_type: TaskType, model_override: Optional[str] = None) -> tuple[str, str]:
+    def _select_candidates(
+        self,
+        task_type: TaskType,
+        model_override: Optional[str] = None,
+        tier: str = "default"
+    ) -> List[tuple[str, str]]:
+        """Кандидаты (провайдер, модель) от лучшего к худшему с учетом здоровья"""
+        return self.router.candidates(
+            task_type,
+            self.providers,
+            self.fallback_order,
+            model_override=model_override,
+            tier=tier
+        )
+    
+    def _select_model(
+        self,
+        task_type: TaskType,
+        model_override: Optional[str] = None,
+        tier: str = "default"
+    ) -> tuple[str, str]:
         """Выбор модели и провайдера для задачи согласно ТЗ"""
+        candidates = self._select_candidates(task_type, model_override, tier)
+        if not candidates:
+            raise AIProviderError("No suitable model found for task", "orchestrator")
+        return candidates[0]
+    
+    async def _attempt(self, task_func, provider_name: str, model: str) -> Dict[str, Any]:
+        """
+        Одна попытка запроса к модели с записью результата в статистику маршрутизатора.
+        
+        Таймаут попытки провайдер отсчитывает после ожидания своего rate
+        limiter: локальное ограничение скорости не ошибка и не задержка модели.
+        """
+        provider = self.providers[provider_name]
+        health = self.router.health(provider_name, model)
+        health.on_attempt()
+        started = time.monotonic()
+        try:
+            result = await task_func(provider, model, settings.ROUTER_ATTEMPT_TIMEOUT)
+        except (RateLimitError, ContextLengthExceededError):
+            # 429 - исчерпана квота, а не поломка модели: цепь не размыкаем
+            raise
+        except AIProviderError:
+            self.router.record_failure(provider_name, model, time.monotonic() - started)
+            raise
+        finally:
+            # Проба half-open завершена при любом исходе (отмена дубля, 429, RequestCancelled):
+            # иначе модель навсегда считается занятой пробой
+            health.probe_in_flight = False
+        
+        # response_time провайдера - без ожидания rate limiter
+        self.router.record_success(
+            provider_name, model, result.get("response_time", time.monotonic() - started)
+        )
+        return result
+    
+    def _hedge_loser_usage(self, request: AIRequest, provider_name: str, model: str, status: str) -> Dict[str, Any]:
+        """Оценка расхода проигравшего дубля: промпт уже отправлен провайдеру"""
+        provider = self.providers[provider_name]
+        messages = []
+        if request.system_prompt:
+            messages.append({"role": "system", "content": request.system_prompt})
+        messages.append({"role": "user", "content": request.content})
+        prompt_tokens = provider.estimate_prompt_tokens(model, messages)
+        return {
+            "provider": provider_name,
+            "model": model,
+            "status": status,
+            "prompt_tokens": prompt_tokens,
+            "cost_usd": provider._calculate_cost(model, prompt_tokens, 0)
+        }
+    
+    def estimate_request_cost(self, request: AIRequest) -> float:
+        """Оценка стоимости до вызова (промпт + max_tokens ответа) для резерва бюджета"""
+        tier = (request.metadata or {}).get("tier", "default")
+        candidates = self._select_candidates(request.task_type, request.model_override, tier)
+        if not candidates:
+            return 0.0
+        
+        provider_name, model = candidates[0]
+        provider = self.providers[provider_name]
+        messages = []
+        if request.system_prompt:
+            messages.append({"role": "system", "content": request.system_prompt})
+        messages.append({"role": "user", "content": request.content})
+        prompt_tokens = provider.estimate_prompt_tokens(model, messages) + sum(
+            provider._count_tokens(block, model)
+            for block in (request.metadata or {}).get("cached_context") or [] if block
+        )
+        max_tokens, _ = self._resolve_generation_params(request)
+        return provider._calculate_cost(model, prompt_tokens, max_tokens)
+    
+    async def _execute_hedged(
+        self,
+        task_func,
+        request: AIRequest,
+        policy: Dict[str, Any],
+        primary: tuple[str, str],
+        backup: tuple[str, str],
+        launched: List[tuple[str, str]]
+    ) -> Dict[str, Any]:
+        """
+        Запрос к основной модели; если он дольше перцентиля ее задержки,
+        тот же запрос уходит в резервную модель. Берется первый успешный
+        ответ, проигравший отменяется. В launched добавляются кандидаты,
+        которым запрос действительно отправлен.
+        """
+        budget = self.hedging.budget(request.task_type)
+        budget.on_request()
+        delay = self.hedging.hedge_delay(
+            policy, self.router.health(*primary).latency(policy.get("percentile", 0.9))
+        )
         
-        if model_override:
-            # Пользователь указал конкретную модель
-            for provider_name, provider in self.providers.items():
-                if model_override in provider.models:
-                    return provider_name, model_override
-        
-        # Выбор по типу задачи согласно конфигурации
-        task_models = TASK_MODEL_MAPPING.get(task_type.value, {})
-        
-        # Попробовать модель по умолчанию
-        default_model = task_models.get("default")
-        if default_model:
-            for provider_name, provider in self.providers.items():
-                if default_model in provider.models:
-                    return provider_name, default_model
-        
-        # Fallback к первому доступному провайдеру
-        for provider_name in self.fallback_order:
-            if provider_name in self.providers:
-                provider = self.providers[provider_name]
-                models = list(provider.models.keys())
-                if models:
-                    return provider_name, models[0]
-        
-        raise AIProviderError("No suitable model found for task", "orchestrator")
+        tasks = {asyncio.ensure_future(self._attempt(task_func, *primary)): primary}
+        launched.append(primary)
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not budget.try_acquire():
+                return await next(iter(tasks))
+            
+            logger.info(f"Hedging {primary[0]}/{primary[1]} after {delay:.1f}s with {backup[0]}/{backup[1]}")
+            tasks[asyncio.ensure_future(self._attempt(task_func, *backup))] = backup
+            launched.append(backup)
+            
+            pending = set(tasks)
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    
+                    winner = tasks[task]
+                    loser = backup if winner == primary else primary
+                    loser_task = next(t for t, candidate in tasks.items() if candidate == loser)
+                    if winner == backup:
+                        budget.backup_wins += 1
+                    
+                    if loser_task.done():
+                        status = "failed" if loser_task.exception() is not None else "completed"
+                    else:
+                        status = "cancelled"
+                    
+                    result = task.result()
+                    result["metadata"] = {
+                        **(result.get("metadata") or {}),
+                        "hedge": {
+                            "winner": {"provider": winner[0], "model": winner[1]},
+                            "loser": self._hedge_loser_usage(request, loser[0], loser[1], status),
+                            "delay": round(delay, 3)
+                        }
+                    }
+                    return result
+            
+            raise errors[0]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Исключение проигравшего уже учтено; гасим "exception was never retrieved"
+                    task.exception()
     
     async def _execute_with_fallback(
         self,
@@ -144,56 +298,120 @@ class LLMOrchestrator:
         request: AIRequest,
         max_retries: int = None
     ) -> Dict[str, Any]:
-        """Выполнение запроса с fallback логикой согласно ТЗ"""
+        """
+        Выполнение запроса с fallback логикой согласно ТЗ.
+        
+        Кандидаты перебираются в порядке маршрутизатора; задержка и ошибки
+        каждой попытки попадают в его статистику, поэтому деградировавший
+        провайдер перестает выбираться первым после нескольких ошибок.
+        """
         
         max_retries = max_retries or settings.MAX_RETRIES
-        provider_name, model = self._select_model(request.task_type, request.model_override)
+        tier = (request.metadata or {}).get("tier", "default")
+        candidates = self._select_candidates(request.task_type, request.model_override, tier)
+        if not candidates:
+            raise AIProviderError("No suitable model found for task", "orchestrator")
+        if not settings.FALLBACK_ENABLED:
+            candidates = candidates[:1]
         
         last_error = None
         
-        # Попробовать основной провайдер
-        for attempt in range(max_retries):
+        # Для интерактивных задач медленный запрос дублируется на другого провайдера
+        policy = self.hedging.policy(request.task_type)
+        backup = next((c for c in candidates[1:] if c[0] != candidates[0][0]), None)
+        if policy and backup:
+            launched = []
             try:
-                provider = self.providers[provider_name]
-                return await task_func(provider, model)
-                
-            except RateLimitError as e:
-                logger.warning(f"Rate limit hit for {provider_name}/{model}, attempt {attempt + 1}")
+                return await self._execute_hedged(task_func, request, policy, candidates[0], backup, launched)
+            except AIProviderError as e:
+                logger.warning(f"Hedged request failed, continuing with fallback: {e}")
                 last_error = e
-                
-                if e.retry_after:
-                    await asyncio.sleep(min(e.retry_after, 60))  # Макс 60 сек
-                else:
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                    
-            except (APIKeyError, AIProviderError) as e:
-                logger.error(f"Provider error for {provider_name}/{model}: {e}")
-                last_error = e
-                break  # Не повторяем при ошибках API ключа
-        
-        # Fallback к другим провайдерам согласно ТЗ
-        if settings.FALLBACK_ENABLED:
-            for fallback_provider_name in self.fallback_order:
-                if fallback_provider_name == provider_name or fallback_provider_name not in self.providers:
-                    continue
-                
+                # Резерв, до которого дублирование не дошло, остается в списке
+                candidates = [c for c in candidates if c not in launched]
+        
+        token = current_token()
+        for index, (provider_name, model) in enumerate(candidates):
+            if token:
+                # Клиент ушел - следующий провайдер и повторы уже не нужны
+                token.raise_if_cancelled()
+            if index > 0 or last_error:
+                logger.info(f"Falling back to {provider_name}/{model}")
+            
+            for attempt in range(max_retries):
                 try:
-                    fallback_provider = self.providers[fallback_provider_name]
-                    fallback_models = list(fallback_provider.models.keys())
+                    return await self._attempt(task_func, provider_name, model)
                     
-                    if fallback_models:
-                        fallback_model = fallback_models[0]  # Первая доступная модель
-                        logger.info(f"Falling back to {fallback_provider_name}/{fallback_model}")
-                        
-                        return await task_func(fallback_provider, fallback_model)
-                        
-                except Exception as e:
-                    logger.warning(f"Fallback failed for {fallback_provider_name}: {e}")
-                    continue
+                except RateLimitError as e:
+                    logger.warning(f"Rate limit hit for {provider_name}/{model}, attempt {attempt + 1}")
+                    last_error = e
+                    
+                    if settings.RATE_LIMIT_ENABLED:
+                        # Паузу до retry_after выдерживает rate limiter провайдера
+                        continue
+                    if e.retry_after:
+                        await asyncio.sleep(min(e.retry_after, 60))  # Макс 60 сек
+                    else:
+                        await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                    
+                except ContextLengthExceededError as e:
+                    # Промпт не помещается в эту модель - пробуем модель с большим контекстом
+                    last_error = e
+                    break
+                    
+                except (APIKeyError, AIProviderError) as e:
+                    logger.error(f"Provider error for {provider_name}/{model}: {e}")
+                    last_error = e
+                    break  # Не повторяем при ошибках API ключа
         
         # Все попытки провалились
         raise last_error or AIProviderError("All providers failed", "orchestrator")
     
+    @staticmethod
+    async def _within_deadline(awaitable, deadline: Optional[float]):
+        """Ожидание с дедлайном вызывающего (абсолютное время), как в планировщике"""
+        if deadline is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(0.0, deadline - time.time()))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline passed waiting for in-flight LLM call")
+    
+    def _build_response(
+        self,
+        task_id: str,
+        result: Dict[str, Any],
+        start_time: float,
+        cached: bool = False,
+        coalesced: bool = False
+    ) -> AIResponse:
+        """Собрать AIResponse из результата провайдера (из кеша или чужого запроса)"""
+        metadata = dict(result.get("metadata") or {})
+        shared = cached or coalesced
+        if shared:
+            # Ответ из кеша или общего запроса не расходует токены провайдера повторно
+            metadata.pop("hedge", None)
+            metadata["cached"] = cached
+            metadata["coalesced"] = coalesced
+            metadata["cached_usage"] = {
+                "prompt_tokens": result.get("prompt_tokens", 0),
+                "completion_tokens": result.get("completion_tokens", 0),
+                "cost_usd": result.get("cost_usd", 0.0)
+            }
+        
+        return AIResponse(
+            task_id=task_id,
+            content=result["content"],
+            model_used=result["model"],
+            provider_used=AIProvider(result["provider"]),
+            prompt_tokens=0 if shared else result.get("prompt_tokens", 0),
+            completion_tokens=0 if shared else result.get("completion_tokens", 0),
+            total_tokens=0 if shared else result.get("total_tokens", 0),
+            cost_usd=0.0 if shared else result.get("cost_usd", 0.0),
+            response_time=time.time() - start_time,
+            created_at=datetime.now(),
+            metadata=metadata
+        )
+    
     async def generate_text(self, request: AIRequest) -> AIResponse:
         """Основной метод генерации текста согласно ТЗ"""
         
@@ -206,46 +424,66 @@ class LLMOrchestrator:
         
         if cached_response:
             logger.info(f"Cache hit for task {task_id}")
-            return AIResponse(
-                task_id=task_id,
-                **cached_response,
-                created_at=datetime.now()
-            )
+            return self._build_response(task_id, cached_response, start_time, cached=True)
         
         # Выполнение запроса
-        async def task_func(provider: BaseAIProvider, model: str):
+        max_tokens, temperature = self._resolve_generation_params(request)
+        
+        async def task_func(provider: BaseAIProvider, model: str, timeout: float):
             return await provider.generate_text(
                 model=model,
                 prompt=request.content,
                 system_prompt=request.system_prompt,
-                max_tokens=request.max_tokens or 1000,
-                temperature=request.temperature or 0.7
+                max_tokens=max_tokens,
+                temperature=temperature,
+                # Общий для серии запросов контекст (ТЗ) - кешируемый префикс
+                cached_context=(request.metadata or {}).get("cached_context"),
+                timeout=timeout
             )
         
-        try:
+        metadata = request.metadata or {}
+        deadline = metadata.get("deadline")
+        
+        async def execute_and_cache():
             result = await self._execute_with_fallback(task_func, request)
             
             # Кеширование результата
             await self._cache_response(cache_key, result)
+            return result
+        
+        async def shared_call():
+            return await self.in_flight.do(cache_key, execute_and_cache)
+        
+        try:
+            # Одинаковые одновременные запросы ждут один вызов провайдера
+            # (metadata["coalesce"] = False - например, в бенчмарке - каждый запрос вызывает провайдера).
+            # Слот планировщика каждый вызывающий получает сам, по своему приоритету и дедлайну:
+            # вызов провайдера регистрируется для объединения только после допуска
+            coalesce = metadata.get("coalesce", True)
+            if coalesce and self.in_flight.running(cache_key):
+                # Такой же запрос уже выполняется - слот не нужен, ждем в пределах своего дедлайна
+                result, coalesced = await self._within_deadline(shared_call(), deadline)
+            else:
+                # Справедливость по организации/пользователю
+                scheduled = await get_scheduler().run(
+                    shared_call if coalesce else execute_and_cache,
+                    priority=metadata.get("priority", PRIORITY_STANDARD),
+                    tenant=request.organization_id or request.user_id or metadata.get("tenant"),
+                    deadline=deadline
+                )
+                result, coalesced = scheduled if coalesce else (scheduled, False)
+            if coalesced:
+                logger.info(f"Task {task_id} joined in-flight identical request")
             
-            response = AIResponse(
-                task_id=task_id,
-                content=result["content"],
-                model_used=result["model"],
-                provider_used=AIProvider(result["provider"]),
-                prompt_tokens=result.get("prompt_tokens", 0),
-                completion_tokens=result.get("completion_tokens", 0),
-                total_tokens=result.get("total_tokens", 0),
-                cost_usd=result.get("cost_usd", 0.0),
-                response_time=time.time() - start_time,
-                created_at=datetime.now(),
-                metadata=result.get("metadata", {})
-            )
+            response = self._build_response(task_id, result, start_time, coalesced=coalesced)
             
             # TODO: Сохранить в базу данных для статистики
             
             return response
             
+        except (SchedulerOverloaded, DeadlineExceeded, RequestCancelled):
+            # Решение о допуске отдает вызывающий (503/504), а не ответ с ошибкой
+            raise
         except Exception as e:
             logger.error(f"Text generation failed for task {task_id}: {e}")
             return AIResponse(
@@ -262,26 +500,56 @@ class LLMOrchestrator:
         """Streaming генерация текста согласно ТЗ"""
         
         task_id = f"stream_{int(time.time() * 1000)}"
-        provider_name, model = self._select_model(request.task_type, request.model_override)
+        metadata = request.metadata or {}
+        provider_name, model = self._select_model(
+            request.task_type,
+            request.model_override,
+            metadata.get("tier", "default")
+        )
+        
+        max_tokens, temperature = self._resolve_generation_params(request)
+        
+        # JSON-ответ разбирается по ходу генерации - клиент показывает первые критерии сразу
+        json_parser = StreamingJSONParser() if metadata.get("response_format") == "json" else None
         
         try:
             provider = self.providers[provider_name]
             
-            async for chunk_data in provider.generate_text_stream(
-                model=model,
-                prompt=request.content,
-                system_prompt=request.system_prompt,
-                max_tokens=request.max_tokens or 1000,
-                temperature=request.temperature or 0.7
+            # Стрим занимает слот планировщика на все время генерации
+            async with get_scheduler().slot(
+                metadata.get("priority", PRIORITY_STANDARD),
+                request.organization_id or request.user_id or metadata.get("tenant"),
+                metadata.get("deadline")
             ):
-                yield StreamChunk(
-                    task_id=task_id,
-                    chunk=chunk_data.get("chunk", ""),
-                    is_complete=chunk_data.get("is_complete", False),
-                    tokens_used=chunk_data.get("tokens_used", 0),
-                    error=chunk_data.get("error")
-                )
-                
+                async with aclosing(provider.generate_text_stream(
+                    model=model,
+                    prompt=request.content,
+                    system_prompt=request.system_prompt,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    cached_context=metadata.get("cached_context")
+                )) as stream:
+                    async for chunk_data in stream:
+                        text = chunk_data.get("chunk", "")
+                        is_complete = chunk_data.get("is_complete", False)
+                        
+                        fields, parsed = None, None
+                        if json_parser:
+                            fields = json_parser.feed(text) or None
+                            if is_complete:
+                                parsed = json_parser.close()
+                        
+                        yield StreamChunk(
+                            task_id=task_id,
+                            chunk=text,
+                            is_complete=is_complete,
+                            tokens_used=chunk_data.get("tokens_used", 0),
+                            error=chunk_data.get("error"),
+                            usage=chunk_data.get("usage"),
+                            fields=fields,
+                            parsed=parsed
+                        )
+                    
         except Exception as e:
             logger.error(f"Streaming generation failed for task {task_id}: {e}")
             yield StreamChunk(
@@ -369,7 +637,11 @@ class LLMOrchestrator:
             try:
                 status = await provider.check_health()
                 providers_status[provider_name] = status
+                if status.get("status") != "healthy":
+                    # Клиент пересоздается при следующем запросе
+                    get_client_pool().mark_unhealthy(provider_name, provider.api_key, status.get("error"))
             except Exception as e:
+                get_client_pool().mark_unhealthy(provider_name, provider.api_key, str(e))
                 providers_status[provider_name] = {
                     "provider": provider_name,
                     "status": "unhealthy",
@@ -398,5 +670,21 @@ class LLMOrchestrator:
             ],
             "total_providers": total_count,
             "healthy_providers": healthy_count,
+            "client_pool": get_client_pool().get_stats(),
+            "cache": self.response_cache.get_stats(),
+            "in_flight": self.in_flight.get_stats(),
+            "rate_limits": get_rate_limiter().get_stats(),
+            "routing": self.router.get_stats(),
+            "hedging": self.hedging.get_stats(),
             "last_updated": datetime.now()
-        }
\ No newline at end of file
+        }
+
+
+_orchestrator: Optional[LLMOrchestrator] = None
+
+def get_orchestrator() -> LLMOrchestrator:
+    """Процессный экземпляр оркестратора (создается лениво)"""
+    global _orchestrator
+    if _orchestrator is None:
+        _orchestrator = LLMOrchestrator()
+    return _orchestrator
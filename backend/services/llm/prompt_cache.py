@@ -0,0 +1,56 @@
+"""
+Кеширование промптов на стороне провайдера (Anthropic prompt caching)
+Стабильный префикс - системный промпт и общий контекст (ТЗ) - помечается
+cache_control и идет первым, переменная часть запроса - последней.
+"""
+import os
+from typing import Dict, Any, List, Optional, Union
+
+# Используется и монолитом, поэтому настройки из окружения
+PROMPT_CACHE_ENABLED = os.getenv("LLM_PROMPT_CACHE_ENABLED", "true").lower() == "true"
+
+# Тарифы относительно обычных входных токенов: запись в кеш дороже, чтение - в 10 раз дешевле
+CACHE_WRITE_COST_FACTOR = 1.25
+CACHE_READ_COST_FACTOR = 0.1
+
+_EPHEMERAL = {"type": "ephemeral"}
+
+
+def cacheable_system(system_prompt: Optional[str]) -> Union[str, List[Dict[str, Any]], None]:
+    """Системный промпт в виде блока с cache_control"""
+    if not system_prompt or not PROMPT_CACHE_ENABLED:
+        return system_prompt
+    return [{"type": "text", "text": system_prompt, "cache_control": _EPHEMERAL}]
+
+
+def build_user_content(
+    prompt: str,
+    cached_context: Optional[List[str]] = None
+) -> Union[str, List[Dict[str, Any]]]:
+    """
+    Контент сообщения пользователя: стабильные блоки контекста первыми
+    (последний из них - граница кешируемого префикса), затем сам запрос.
+    """
+    context = [block for block in (cached_context or []) if block]
+    if not context:
+        return prompt
+
+    blocks: List[Dict[str, Any]] = [{"type": "text", "text": block} for block in context]
+    if PROMPT_CACHE_ENABLED:
+        blocks[-1]["cache_control"] = _EPHEMERAL
+    blocks.append({"type": "text", "text": prompt})
+    return blocks
+
+
+def join_context(prompt: str, cached_context: Optional[List[str]] = None) -> str:
+    """Для провайдеров без явной разметки: контекст в начало промпта (префиксный кеш OpenAI)"""
+    context = [block for block in (cached_context or []) if block]
+    return "\n\n".join(context + [prompt])
+
+
+def cache_usage(usage: Any) -> Dict[str, int]:
+    """Токены записи и чтения кеша из usage ответа Anthropic"""
+    return {
+        "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "cache_read_tokens": getattr(usage, "cache_read_input_tokens", None) or 0
+    }
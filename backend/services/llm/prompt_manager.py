@@ -10,6 +10,7 @@ from pathlib import Path
 from sqlalchemy.orm import Session
 from ..shared.llm_models import PromptTemplate
 from ..shared.llm_schemas import TaskType
+from ..shared.prompt_registry import get_prompt_registry, CompiledTemplate, PromptTemplateError
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +20,38 @@ class PromptManager:
     def __init__(self, prompts_dir: str = None):
         self.prompts_dir = Path(prompts_dir) if prompts_dir else Path(__file__).parent.parent.parent.parent / "prompts"
         self.templates_cache: Dict[str, Dict[str, Any]] = {}
+        self.registry = get_prompt_registry()
         self._load_builtin_prompts()
+        self._compile_templates()
+    
+    def _compile(self, module: str, template: Dict[str, Any]) -> CompiledTemplate:
+        """Скомпилировать шаблон в общем реестре (плейсхолдеры сверяются с variables)"""
+        return self.registry.register(
+            f"{module}/{template['name']}",
+            template["user_prompt_template"],
+            template.get("variables")
+        )
+    
+    def _compile_templates(self):
+        """Компиляция всех шаблонов один раз - при запуске и перезагрузке"""
+        for module, templates in self.templates_cache.items():
+            for template in templates.values():
+                try:
+                    self._compile(module, template)
+                except PromptTemplateError as e:
+                    logger.error(f"Invalid prompt template: {e}")
+    
+    def reload(self, db: Optional[Session] = None):
+        """Перезагрузка шаблонов: встроенные и (если передана сессия) из базы данных"""
+        self.templates_cache = {}
+        self._load_builtin_prompts()
+        if db is not None:
+            self.load_templates_from_db(db)
+        self._compile_templates()
+    
+    def prompt_version(self, module: str, template_name: str) -> Optional[str]:
+        """Версия шаблона (хеш содержимого) для ключа кеша ответов"""
+        return self.registry.version(f"{module}/{template_name}")
     
     def _load_builtin_prompts(self):
         """Загрузка встроенных промптов согласно ТЗ раздел 4.2.2"""
@@ -220,8 +252,9 @@ class PromptManager:
             raise ValueError(f"Template {module}/{template_name} not found")
         
         try:
+            compiled = self.registry.get(f"{module}/{template_name}") or self._compile(module, template)
             system_prompt = template["system_prompt"]
-            user_prompt = template["user_prompt_template"].format(**variables)
+            user_prompt = compiled.render(variables)
             return system_prompt, user_prompt
             
         except KeyError as e:
@@ -253,8 +286,11 @@ class PromptManager:
             declared_vars = set(template["variables"])
             
             # Найти все переменные в шаблоне
-            import re
-            found_vars = set(re.findall(r'{(\w+)}', template_text))
+            try:
+                found_vars = set(CompiledTemplate(template.get("name", ""), template_text).placeholders)
+            except PromptTemplateError as e:
+                errors.append(str(e))
+                found_vars = declared_vars
             
             # Проверить соответствие
             missing_vars = found_vars - declared_vars
@@ -303,6 +339,7 @@ class PromptManager:
                 self.templates_cache[module] = {}
             
             self.templates_cache[module][template["name"]] = template
+            self._compile(module, template)
             
             logger.info(f"Added custom template {module}/{template['name']}")
             return True
@@ -339,6 +376,11 @@ class PromptManager:
                     "description": template.description,
                     "examples": template.examples
                 }
+                
+                try:
+                    self._compile(module, self.templates_cache[module][template.name])
+                except PromptTemplateError as e:
+                    logger.error(f"Invalid prompt template in database: {e}")
             
             logger.info(f"Loaded {len(templates)} templates from database")
             
@@ -4,19 +4,40 @@ Anthropic Provider для LLM Service DevAssist Pro
 """
 import asyncio
 import logging
-from typing import Dict, Any, List, Optional, AsyncGenerator
+from typing import Dict, Any, List, Optional, AsyncGenerator, Callable
 import anthropic
 from anthropic import AsyncAnthropic
 from .base import BaseAIProvider, AIProviderError, RateLimitError, APIKeyError
+from ..prompt_cache import cacheable_system, build_user_content, cache_usage
 
 logger = logging.getLogger(__name__)
 
 class AnthropicProvider(BaseAIProvider):
     """Провайдер для Anthropic Claude API согласно ТЗ"""
     
-    def __init__(self, api_key: str, **kwargs):
+    supports_prompt_caching = True
+    
+    def __init__(
+        self,
+        api_key: str,
+        client: Optional[AsyncAnthropic] = None,
+        client_factory: Optional[Callable[[], AsyncAnthropic]] = None,
+        **kwargs
+    ):
         super().__init__(api_key, **kwargs)
-        self.client = AsyncAnthropic(api_key=api_key)
+        # Клиент общего пула запрашивается на каждый вызов (см. client_pool):
+        # пул закрывает простаивающие и нездоровые клиенты и создает новые
+        self._client_factory = client_factory
+        self._client = client if client or client_factory else AsyncAnthropic(api_key=api_key)
+    
+    @property
+    def client(self) -> AsyncAnthropic:
+        return self._client_factory() if self._client_factory else self._client
+    
+    @client.setter
+    def client(self, client: AsyncAnthropic):
+        self._client_factory = None
+        self._client = client
         
     def _get_available_models(self) -> Dict[str, Dict[str, Any]]:
         """Модели Anthropic согласно ТЗ раздел 4.3"""
@@ -76,6 +97,12 @@ class AnthropicProvider(BaseAIProvider):
         try:
             system_prompt, converted_messages = self._convert_messages(messages)
             
+            # Стабильный префикс (системный промпт, общий контекст) помечается для кеша
+            cached_context = kwargs.pop("cached_context", None)
+            if cached_context:
+                last_message = converted_messages[-1]
+                last_message["content"] = build_user_content(last_message["content"], cached_context)
+            
             request_params = {
                 "model": model,
                 "messages": converted_messages,
@@ -83,25 +110,33 @@ class AnthropicProvider(BaseAIProvider):
             }
             
             if system_prompt:
-                request_params["system"] = system_prompt
+                request_params["system"] = cacheable_system(system_prompt)
             
             response = await self.client.messages.create(**request_params)
             
+            usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            if response.usage:
+                cached = cache_usage(response.usage)
+                # input_tokens Anthropic не включает токены, записанные в кеш и прочитанные из него
+                prompt_tokens = response.usage.input_tokens + cached["cache_write_tokens"] + cached["cache_read_tokens"]
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": response.usage.output_tokens,
+                    "total_tokens": prompt_tokens + response.usage.output_tokens,
+                    **cached
+                }
+            
             return {
                 "content": response.content[0].text if response.content else "",
                 "metadata": {
                     "stop_reason": response.stop_reason,
-                    "usage": {
-                        "prompt_tokens": response.usage.input_tokens if response.usage else 0,
-                        "completion_tokens": response.usage.output_tokens if response.usage else 0,
-                        "total_tokens": (response.usage.input_tokens + response.usage.output_tokens) if response.usage else 0,
-                    }
+                    "usage": usage
                 }
             }
             
         except anthropic.RateLimitError as e:
             logger.warning(f"Anthropic rate limit exceeded: {e}")
-            raise RateLimitError(str(e), "anthropic", model, retry_after=60)
+            raise RateLimitError(str(e), "anthropic", model, retry_after=self._parse_retry_after(e))
             
         except anthropic.AuthenticationError as e:
             logger.error(f"Anthropic authentication failed: {e}")
@@ -125,6 +160,11 @@ class AnthropicProvider(BaseAIProvider):
         try:
             system_prompt, converted_messages = self._convert_messages(messages)
             
+            cached_context = kwargs.pop("cached_context", None)
+            if cached_context:
+                last_message = converted_messages[-1]
+                last_message["content"] = build_user_content(last_message["content"], cached_context)
+            
             request_params = {
                 "model": model,
                 "messages": converted_messages,
@@ -133,7 +173,7 @@ class AnthropicProvider(BaseAIProvider):
             }
             
             if system_prompt:
-                request_params["system"] = system_prompt
+                request_params["system"] = cacheable_system(system_prompt)
             
             async with self.client.messages.stream(**request_params) as stream:
                 async for text in stream.text_stream:
@@ -141,7 +181,7 @@ class AnthropicProvider(BaseAIProvider):
                     
         except anthropic.RateLimitError as e:
             logger.warning(f"Anthropic streaming rate limit exceeded: {e}")
-            raise RateLimitError(str(e), "anthropic", model, retry_after=60)
+            raise RateLimitError(str(e), "anthropic", model, retry_after=self._parse_retry_after(e))
             
         except anthropic.AuthenticationError as e:
             logger.error(f"Anthropic streaming authentication failed: {e}")
@@ -3,12 +3,19 @@
 Согласно ТЗ Этап 4: AI Integrations
 """
 from abc import ABC, abstractmethod
+from contextlib import aclosing
 from typing import Dict, Any, List, Optional, AsyncGenerator
 from datetime import datetime
 import time
 import asyncio
 import logging
 
+from ..config import settings
+from ..rate_limiter import get_rate_limiter, ModelRateLimiter
+from ..tokenizer import count_tokens, count_message_tokens, usage_from_metadata
+from ..prompt_cache import join_context, CACHE_WRITE_COST_FACTOR, CACHE_READ_COST_FACTOR
+from ..cancellation import current_token
+
 logger = logging.getLogger(__name__)
 
 class AIProviderError(Exception):
@@ -32,15 +39,23 @@ class ModelNotFoundError(AIProviderError):
     """Модель не найдена"""
     pass
 
+class ContextLengthExceededError(AIProviderError):
+    """Промпт не помещается в контекст модели - нужно разбить на части"""
+    def __init__(self, message: str, provider: str, model: str = None, estimated_tokens: int = 0, context_window: int = 0):
+        super().__init__(message, provider, model)
+        self.estimated_tokens = estimated_tokens
+        self.context_window = context_window
+
 class BaseAIProvider(ABC):
     """Базовый класс для всех AI провайдеров согласно ТЗ"""
     
+    # Провайдер принимает кешируемый контекст отдельными блоками (cache_control)
+    supports_prompt_caching = False
+    
     def __init__(self, api_key: str = None, **kwargs):
         self.api_key = api_key
         self.name = self.__class__.__name__.lower().replace('provider', '')
         self.models = self._get_available_models()
-        self.rate_limits = {}
-        self.last_request_time = {}
         
     @abstractmethod
     def _get_available_models(self) -> Dict[str, Dict[str, Any]]:
@@ -71,34 +86,86 @@ class BaseAIProvider(ABC):
         """Проверить, что модель поддерживается провайдером"""
         return model in self.models
     
-    def _calculate_cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
-        """Рассчитать стоимость запроса"""
+    def _calculate_cost(
+        self,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        cache_write_tokens: int = 0,
+        cache_read_tokens: int = 0
+    ) -> float:
+        """Рассчитать стоимость запроса (input_tokens включает токены кеша промпта)"""
         if model not in self.models:
             return 0.0
             
         model_config = self.models[model]
-        input_cost = (input_tokens / 1000) * model_config.get('cost_per_1k_input', 0)
+        uncached_tokens = max(0, input_tokens - cache_write_tokens - cache_read_tokens)
+        billed_input_tokens = (
+            uncached_tokens
+            + cache_write_tokens * CACHE_WRITE_COST_FACTOR
+            + cache_read_tokens * CACHE_READ_COST_FACTOR
+        )
+        input_cost = (billed_input_tokens / 1000) * model_config.get('cost_per_1k_input', 0)
         output_cost = (output_tokens / 1000) * model_config.get('cost_per_1k_output', 0)
         return input_cost + output_cost
     
-    def _count_tokens(self, text: str) -> int:
-        """Приблизительный подсчет токенов (для более точного нужен tokenizer)"""
-        # Простая аппроксимация: 1 токен ≈ 4 символа для латиницы, 2 символа для кириллицы
-        return len(text) // 3
+    def _count_tokens(self, text: str, model: Optional[str] = None) -> int:
+        """Подсчет токенов токенизатором семейства модели (см. tokenizer)"""
+        return count_tokens(text, model, self.name)
     
-    async def _handle_rate_limit(self, model: str):
-        """Обработка rate limits согласно ТЗ"""
-        current_time = time.time()
-        last_request = self.last_request_time.get(model, 0)
-        
-        # Минимальная пауза между запросами (100ms)
-        min_interval = 0.1
-        elapsed = current_time - last_request
-        
-        if elapsed < min_interval:
-            await asyncio.sleep(min_interval - elapsed)
+    def estimate_prompt_tokens(self, model: str, messages: List[Dict[str, str]]) -> int:
+        """Pre-flight оценка токенов промпта до отправки"""
+        return count_message_tokens(messages, model, self.name)
+    
+    def _check_context_window(self, model: str, prompt_tokens: int, max_tokens: int):
+        """Проверить, что промпт и ответ помещаются в контекст модели"""
+        context_window = self.models.get(model, {}).get("context_window")
+        if context_window and prompt_tokens + max_tokens > context_window:
+            raise ContextLengthExceededError(
+                f"Prompt (~{prompt_tokens} tokens) + max_tokens ({max_tokens}) exceeds "
+                f"{model} context window ({context_window})",
+                self.name, model,
+                estimated_tokens=prompt_tokens,
+                context_window=context_window
+            )
+    
+    @staticmethod
+    def _parse_retry_after(error: Exception, default: int = 60) -> int:
+        """Retry-After из ответа провайдера (если SDK его передал)"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            return max(1, int(float(headers.get("retry-after"))))
+        except (TypeError, ValueError):
+            return default
+    
+    def _record_cancelled(self, model: str, prompt_tokens: int, completion_tokens: int = 0):
+        """
+        Вызов прерван отменой запроса: промпт уже отправлен и оплачивается,
+        расход записывается в токен отмены (после ответа провайдера его не узнать)
+        """
+        token = current_token()
+        if token is None or not token.cancelled:
+            # Например, отмена проигравшего дубля hedged запроса - учитывается оркестратором
+            return
+        token.record_usage(
+            self.name,
+            model,
+            prompt_tokens,
+            completion_tokens,
+            self._calculate_cost(model, prompt_tokens, completion_tokens)
+        )
+    
+    async def _handle_rate_limit(
+        self, model: str, estimated_tokens: int = 0, bulk: bool = False
+    ) -> Optional[ModelRateLimiter]:
+        """Обработка rate limits согласно ТЗ: ожидание бюджета запросов и токенов"""
+        if not settings.RATE_LIMIT_ENABLED:
+            return None
         
-        self.last_request_time[model] = time.time()
+        limiter = get_rate_limiter().get(self.name, model, bulk=bulk)
+        await limiter.acquire(estimated_tokens)
+        return limiter
     
     async def check_health(self) -> Dict[str, Any]:
         """Проверить состояние провайдера"""
@@ -139,41 +206,88 @@ class BaseAIProvider(ABC):
         system_prompt: Optional[str] = None,
         max_tokens: int = 1000,
         temperature: float = 0.7,
+        cached_context: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        bulk: bool = False,
         **kwargs
     ) -> Dict[str, Any]:
-        """Основной метод для генерации текста согласно ТЗ"""
+        """
+        Основной метод для генерации текста согласно ТЗ.
+        
+        cached_context - стабильные для серии запросов блоки (например, ТЗ),
+        которые идут перед промптом и кешируются провайдером.
+        timeout - таймаут запроса к API; ожидание rate limiter в него не входит.
+        bulk - фоновый пакетный запрос: отдельный бакет rate limiter.
+        """
         
         if not self._validate_model(model):
             raise ModelNotFoundError(f"Model {model} not available", self.name, model)
         
+        cached_context = [block for block in (cached_context or []) if block]
+        if cached_context and not self.supports_prompt_caching:
+            # Контекст в начале промпта - работает автоматический префиксный кеш
+            prompt = join_context(prompt, cached_context)
+            cached_context = []
+        if cached_context:
+            kwargs["cached_context"] = cached_context
+        
         # Подготовка сообщений
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
         messages.append({"role": "user", "content": prompt})
         
-        # Обработка rate limits
-        await self._handle_rate_limit(model)
+        # Pre-flight оценка: слишком большой промпт вызывающий должен разбить на части
+        estimated_prompt_tokens = self.estimate_prompt_tokens(model, messages) + sum(
+            self._count_tokens(block, model) for block in cached_context
+        )
+        self._check_context_window(model, estimated_prompt_tokens, max_tokens)
+        
+        # Обработка rate limits: резервируем оценку prompt + max_tokens
+        reserved_tokens = estimated_prompt_tokens + max_tokens
+        limiter = await self._handle_rate_limit(model, reserved_tokens, bulk=bulk)
         
         start_time = time.time()
         
         try:
             # Выполнение запроса
-            response = await self._make_request(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                **kwargs
+            response = await asyncio.wait_for(
+                self._make_request(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    **kwargs
+                ),
+                timeout=timeout
             )
             
             response_time = time.time() - start_time
             
-            # Подсчет токенов и стоимости
-            input_tokens = self._count_tokens(prompt + (system_prompt or ""))
-            output_tokens = self._count_tokens(response.get('content', ''))
+            # Подсчет токенов и стоимости: usage провайдера, иначе локальный токенизатор
+            metadata = response.get('metadata', {})
+            usage = usage_from_metadata(metadata)
+            if usage:
+                input_tokens = usage["prompt_tokens"]
+                output_tokens = usage["completion_tokens"]
+                metadata["token_source"] = "provider"
+            else:
+                input_tokens = estimated_prompt_tokens
+                output_tokens = self._count_tokens(response.get('content', ''), model)
+                metadata["token_source"] = "estimate"
             total_tokens = input_tokens + output_tokens
-            cost = self._calculate_cost(model, input_tokens, output_tokens)
+            provider_usage = metadata.get("usage") or {}
+            cost = self._calculate_cost(
+                model,
+                input_tokens,
+                output_tokens,
+                cache_write_tokens=provider_usage.get("cache_write_tokens", 0) if usage else 0,
+                cache_read_tokens=provider_usage.get("cache_read_tokens", 0) if usage else 0
+            )
+            
+            if limiter:
+                await limiter.settle(reserved_tokens, total_tokens)
+                await limiter.on_success()
             
             return {
                 "content": response.get('content', ''),
@@ -184,11 +298,43 @@ class BaseAIProvider(ABC):
                 "total_tokens": total_tokens,
                 "cost_usd": cost,
                 "response_time": response_time,
-                "metadata": response.get('metadata', {})
+                "metadata": metadata
             }
             
+        except asyncio.CancelledError:
+            self._record_cancelled(model, estimated_prompt_tokens)
+            if limiter:
+                await limiter.settle(reserved_tokens, estimated_prompt_tokens)
+            raise
+            
+        except asyncio.TimeoutError:
+            # Промпт уже отправлен: в квоте остается его оценка, как при отмене
+            if limiter:
+                await limiter.settle(reserved_tokens, estimated_prompt_tokens)
+            raise AIProviderError(f"Request timed out after {timeout}s", self.name, model)
+            
+        except RateLimitError as e:
+            # Запрос отклонен до обработки: резерв возвращается в квоту целиком
+            if limiter:
+                await limiter.settle(reserved_tokens, 0)
+                await limiter.on_rate_limited(e.retry_after)
+            raise
+            
+        except (APIKeyError, ModelNotFoundError, ContextLengthExceededError):
+            if limiter:
+                await limiter.settle(reserved_tokens, 0)
+            raise
+            
+        except AIProviderError:
+            # Ошибка могла случиться после обработки промпта: остается его оценка
+            if limiter:
+                await limiter.settle(reserved_tokens, estimated_prompt_tokens)
+            raise
+            
         except Exception as e:
             logger.error(f"Request failed for {self.name}/{model}: {e}")
+            if limiter:
+                await limiter.settle(reserved_tokens, estimated_prompt_tokens)
             raise AIProviderError(str(e), self.name, model)
     
     async def generate_text_stream(
@@ -198,9 +344,10 @@ class BaseAIProvider(ABC):
         system_prompt: Optional[str] = None,
         max_tokens: int = 1000,
         temperature: float = 0.7,
+        cached_context: Optional[List[str]] = None,
         **kwargs
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Streaming генерация текста согласно ТЗ"""
+        """Streaming генерация текста согласно ТЗ (cached_context - как в generate_text)"""
         
         if not self._validate_model(model):
             raise ModelNotFoundError(f"Model {model} not available", self.name, model)
@@ -208,17 +355,32 @@ class BaseAIProvider(ABC):
         if not self.models[model].get('supports_streaming', False):
             # Fallback к обычной генерации
             result = await self.generate_text(
-                model, prompt, system_prompt, max_tokens, temperature, **kwargs
+                model, prompt, system_prompt, max_tokens, temperature,
+                cached_context=cached_context, **kwargs
             )
             yield {
                 "chunk": result["content"],
                 "is_complete": True,
                 "tokens_used": result["total_tokens"],
+                "usage": {
+                    "provider": self.name,
+                    "model": model,
+                    "prompt_tokens": result["prompt_tokens"],
+                    "completion_tokens": result["completion_tokens"],
+                    "cost_usd": result["cost_usd"]
+                },
                 "model": model,
                 "provider": self.name
             }
             return
         
+        cached_context = [block for block in (cached_context or []) if block]
+        if cached_context and not self.supports_prompt_caching:
+            prompt = join_context(prompt, cached_context)
+            cached_context = []
+        if cached_context:
+            kwargs["cached_context"] = cached_context
+        
         # Подготовка сообщений
         messages = []
         if system_prompt:
@@ -226,32 +388,59 @@ class BaseAIProvider(ABC):
         messages.append({"role": "user", "content": prompt})
         
         # Обработка rate limits
-        await self._handle_rate_limit(model)
+        estimated_prompt_tokens = self.estimate_prompt_tokens(model, messages) + sum(
+            self._count_tokens(block, model) for block in cached_context
+        )
+        reserved_tokens = estimated_prompt_tokens + max_tokens
+        limiter = await self._handle_rate_limit(model, reserved_tokens)
         
+        streamed = []
         try:
-            async for chunk in self._make_streaming_request(
+            # aclosing: при отмене HTTP стрим провайдера закрывается сразу, а не сборщиком мусора
+            async with aclosing(self._make_streaming_request(
                 model=model,
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 **kwargs
-            ):
-                yield {
-                    "chunk": chunk,
-                    "is_complete": False,
-                    "model": model,
-                    "provider": self.name
-                }
+            )) as chunks:
+                async for chunk in chunks:
+                    streamed.append(chunk)
+                    yield {
+                        "chunk": chunk,
+                        "is_complete": False,
+                        "model": model,
+                        "provider": self.name
+                    }
             
-            # Финальный чанк
+            if limiter:
+                await limiter.on_success()
+            
+            # Финальный чанк: расход по оценке промпта и подсчету сгенерированного
+            completion_tokens = self._count_tokens("".join(streamed), model)
             yield {
                 "chunk": "",
                 "is_complete": True,
+                "tokens_used": estimated_prompt_tokens + completion_tokens,
+                "usage": {
+                    "provider": self.name,
+                    "model": model,
+                    "prompt_tokens": estimated_prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "cost_usd": self._calculate_cost(model, estimated_prompt_tokens, completion_tokens)
+                },
                 "model": model,
                 "provider": self.name
             }
             
+        except (asyncio.CancelledError, GeneratorExit):
+            # Клиент ушел посреди стрима: оплачены промпт и уже сгенерированное
+            self._record_cancelled(model, estimated_prompt_tokens, self._count_tokens("".join(streamed), model))
+            raise
+            
         except Exception as e:
+            if limiter and isinstance(e, RateLimitError):
+                await limiter.on_rate_limited(e.retry_after)
             logger.error(f"Streaming request failed for {self.name}/{model}: {e}")
             yield {
                 "chunk": "",
@@ -260,6 +449,14 @@ class BaseAIProvider(ABC):
                 "model": model,
                 "provider": self.name
             }
+        
+        finally:
+            # Резерв prompt + max_tokens заменяется фактическим расходом: промпт и сгенерированное
+            if limiter:
+                await limiter.settle(
+                    reserved_tokens,
+                    estimated_prompt_tokens + self._count_tokens("".join(streamed), model)
+                )
     
     def get_model_info(self, model: str) -> Dict[str, Any]:
         """Получить информацию о модели"""
@@ -3,14 +3,107 @@ Google Provider для LLM Service DevAssist Pro
 Согласно ТЗ Этап 4: AI Integrations раздел 4.3
 """
 import asyncio
+import concurrent.futures
 import logging
-from typing import Dict, Any, List, Optional, AsyncGenerator
+import threading
+from typing import Dict, Any, List, Optional, AsyncGenerator, Callable, Iterable
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from .base import BaseAIProvider, AIProviderError, RateLimitError, APIKeyError
+from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Синхронный SDK Gemini работает в отдельном пуле потоков, чтобы долгие
+# стримы не занимали общий executor и не блокировали event loop
+_sdk_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _get_sdk_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _sdk_executor
+    if _sdk_executor is None:
+        _sdk_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=settings.GOOGLE_SDK_WORKERS,
+            thread_name_prefix="gemini-sdk"
+        )
+    return _sdk_executor
+
+
+class _StreamEnd:
+    """Маркер конца стрима в очереди"""
+
+
+class _StreamError:
+    """Исключение потока-читателя, передаваемое через очередь"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _StreamStopped(Exception):
+    """Потребитель стрима завершился - поток-читатель останавливается"""
+
+
+async def _run_sdk(func: Callable, *args, **kwargs) -> Any:
+    """Вызов синхронного SDK в пуле потоков Gemini"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_sdk_executor(), lambda: func(*args, **kwargs))
+
+
+async def _iterate_off_loop(start_stream: Callable[[], Iterable[Any]], buffer_size: int) -> AsyncGenerator[Any, None]:
+    """
+    Итерация синхронного стрима в потоке пула с передачей элементов
+    через asyncio.Queue. Очередь ограничена: пока потребитель не забрал
+    чанки, поток-читатель ждет (backpressure). При выходе потребителя
+    поток-читатель останавливается на следующем чанке.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+    stopped = threading.Event()
+    
+    def put(item: Any):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=1.0)
+            except concurrent.futures.TimeoutError:
+                if stopped.is_set():
+                    future.cancel()
+                    raise _StreamStopped()
+    
+    def pump():
+        try:
+            for item in start_stream():
+                if stopped.is_set():
+                    return
+                put(item)
+            put(_StreamEnd)
+        except _StreamStopped:
+            return
+        except Exception as e:
+            if not stopped.is_set():
+                try:
+                    put(_StreamError(e))
+                except _StreamStopped:
+                    pass
+    
+    reader = loop.run_in_executor(_get_sdk_executor(), pump)
+    try:
+        while True:
+            item = await queue.get()
+            if item is _StreamEnd:
+                break
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+        await reader
+    finally:
+        stopped.set()
+        # Освободить поток-читатель, ожидающий места в очереди
+        while not queue.empty():
+            queue.get_nowait()
+
+
 class GoogleProvider(BaseAIProvider):
     """Провайдер для Google Gemini API согласно ТЗ"""
     
@@ -85,7 +178,7 @@ class GoogleProvider(BaseAIProvider):
             )
             
             # Выполнение запроса
-            response = await asyncio.to_thread(
+            response = await _run_sdk(
                 gemini_model.generate_content,
                 prompt,
                 generation_config=generation_config,
@@ -163,9 +256,8 @@ class GoogleProvider(BaseAIProvider):
                     stream=True
                 )
             
-            response_stream = await asyncio.to_thread(generate_stream)
-            
-            for chunk in response_stream:
+            # Чанки читаются в потоке пула и передаются через очередь
+            async for chunk in _iterate_off_loop(generate_stream, settings.GOOGLE_STREAM_BUFFER):
                 if chunk.candidates and chunk.candidates[0].content:
                     text = chunk.candidates[0].content.parts[0].text
                     yield text
@@ -190,7 +282,7 @@ class GoogleProvider(BaseAIProvider):
         try:
             # Простой тест с минимальным промптом
             model = genai.GenerativeModel("gemini-pro")
-            response = await asyncio.to_thread(
+            response = await _run_sdk(
                 model.generate_content,
                 "Test",
                 generation_config=genai.types.GenerationConfig(max_output_tokens=1)
@@ -238,7 +330,7 @@ class GoogleProvider(BaseAIProvider):
                 image = PIL.Image.open(io.BytesIO(image_data))
                 content_parts.append(image)
             
-            response = await asyncio.to_thread(
+            response = await _run_sdk(
                 model.generate_content,
                 content_parts,
                 safety_settings=self.safety_settings
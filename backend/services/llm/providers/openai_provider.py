@@ -4,7 +4,7 @@ OpenAI Provider для LLM Service DevAssist Pro
 """
 import asyncio
 import logging
-from typing import Dict, Any, List, Optional, AsyncGenerator
+from typing import Dict, Any, List, Optional, AsyncGenerator, Callable
 import openai
 from openai import AsyncOpenAI
 from .base import BaseAIProvider, AIProviderError, RateLimitError, APIKeyError
@@ -14,9 +14,27 @@ logger = logging.getLogger(__name__)
 class OpenAIProvider(BaseAIProvider):
     """Провайдер для OpenAI API согласно ТЗ"""
     
-    def __init__(self, api_key: str, **kwargs):
+    def __init__(
+        self,
+        api_key: str,
+        client: Optional[AsyncOpenAI] = None,
+        client_factory: Optional[Callable[[], AsyncOpenAI]] = None,
+        **kwargs
+    ):
         super().__init__(api_key, **kwargs)
-        self.client = AsyncOpenAI(api_key=api_key)
+        # Клиент общего пула запрашивается на каждый вызов (см. client_pool):
+        # пул закрывает простаивающие и нездоровые клиенты и создает новые
+        self._client_factory = client_factory
+        self._client = client if client or client_factory else AsyncOpenAI(api_key=api_key)
+    
+    @property
+    def client(self) -> AsyncOpenAI:
+        return self._client_factory() if self._client_factory else self._client
+    
+    @client.setter
+    def client(self, client: AsyncOpenAI):
+        self._client_factory = None
+        self._client = client
         
     def _get_available_models(self) -> Dict[str, Dict[str, Any]]:
         """Модели OpenAI согласно ТЗ раздел 4.3"""
@@ -78,7 +96,7 @@ class OpenAIProvider(BaseAIProvider):
             
         except openai.RateLimitError as e:
             logger.warning(f"OpenAI rate limit exceeded: {e}")
-            raise RateLimitError(str(e), "openai", model, retry_after=60)
+            raise RateLimitError(str(e), "openai", model, retry_after=self._parse_retry_after(e))
             
         except openai.AuthenticationError as e:
             logger.error(f"OpenAI authentication failed: {e}")
@@ -113,7 +131,7 @@ class OpenAIProvider(BaseAIProvider):
                     
         except openai.RateLimitError as e:
             logger.warning(f"OpenAI streaming rate limit exceeded: {e}")
-            raise RateLimitError(str(e), "openai", model, retry_after=60)
+            raise RateLimitError(str(e), "openai", model, retry_after=self._parse_retry_after(e))
             
         except openai.AuthenticationError as e:
             logger.error(f"OpenAI streaming authentication failed: {e}")
@@ -123,16 +141,6 @@ class OpenAIProvider(BaseAIProvider):
             logger.error(f"OpenAI streaming request failed: {e}")
             raise AIProviderError(str(e), "openai", model)
     
-    def _count_tokens(self, text: str) -> int:
-        """Более точный подсчет токенов для OpenAI с помощью tiktoken"""
-        try:
-            import tiktoken
-            encoding = tiktoken.get_encoding("cl100k_base")  # GPT-4/3.5 encoding
-            return len(encoding.encode(text))
-        except ImportError:
-            # Fallback к базовому методу
-            return super()._count_tokens(text)
-    
     async def check_health(self) -> Dict[str, Any]:
         """Проверить состояние OpenAI API"""
         try:
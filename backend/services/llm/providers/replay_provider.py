@@ -0,0 +1,330 @@
+"""
+Replay Provider для LLM Service DevAssist Pro
+Запись реальных пар запрос/ответ (с таймингом чанков стрима) и их
+детерминированное воспроизведение - нагрузочные тесты и бенчмарки
+оркестратора без сети и расхода токенов.
+"""
+import asyncio
+import copy
+import gzip
+import json
+import logging
+import math
+import os
+import random
+import time
+from typing import Dict, Any, List, Optional, AsyncGenerator, Callable
+
+from .base import BaseAIProvider, AIProviderError, RateLimitError
+from ..config import settings
+from ..prompt_cache import join_context
+from ..response_cache import build_cache_key
+
+logger = logging.getLogger(__name__)
+
+REPLAY_OFF = "off"
+REPLAY_RECORD = "record"
+REPLAY_REPLAY = "replay"
+
+
+def request_key(model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+    """Ключ записи - ключ кеша LLM по сообщениям и параметрам генерации"""
+    system_prompt = next((m["content"] for m in messages if m["role"] == "system"), None)
+    content = "\n".join(m["content"] for m in messages if m["role"] != "system")
+    return build_cache_key(
+        task_type="replay",
+        content=content,
+        system_prompt=system_prompt,
+        model=model,
+        temperature=kwargs.get("temperature"),
+        max_tokens=kwargs.get("max_tokens"),
+        context=kwargs.get("cached_context"),
+        prefix=""
+    )
+
+
+class ReplayStore:
+    """
+    Записи в JSON Lines (.gz - со сжатием), дописываются по одной строке.
+    Повторная запись того же ключа дополняет предыдущую (например,
+    стрим после обычного ответа).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with self._open("r") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.setdefault(record["key"], {}).update(record)
+        logger.info(f"Loaded {len(self.records)} LLM recordings from {self.path}")
+
+    def add(self, record: Dict[str, Any]):
+        self.records.setdefault(record["key"], {}).update(record)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._open("a") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.records.get(key)
+
+    def for_model(self, model: str) -> List[Dict[str, Any]]:
+        return [self.records[key] for key in sorted(self.records) if self.records[key]["model"] == model]
+
+    def models(self, provider: str) -> Dict[str, Dict[str, Any]]:
+        """Конфигурации моделей провайдера (цены, контекст), сохраненные при записи"""
+        return {
+            record["model"]: record.get("model_info", {})
+            for record in self.records.values()
+            if record["provider"] == provider
+        }
+
+    def providers(self) -> List[str]:
+        return sorted({record["provider"] for record in self.records.values()})
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+def parse_latency(spec: str) -> Callable[[Dict[str, Any], random.Random], float]:
+    """
+    Распределение задержки ответа:
+    recorded, fixed:<сек>, uniform:<от>:<до>, lognormal:<медиана>:<sigma>
+    """
+    name, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":")] if params else []
+
+    if name == "recorded":
+        return lambda record, rng: record.get("latency", 0.0)
+    if name == "fixed" and len(values) == 1:
+        return lambda record, rng: values[0]
+    if name == "uniform" and len(values) == 2:
+        return lambda record, rng: rng.uniform(values[0], values[1])
+    if name == "lognormal" and len(values) == 2:
+        return lambda record, rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unsupported latency distribution: {spec}")
+
+
+class ReplayProvider(BaseAIProvider):
+    """
+    Провайдер записи/воспроизведения.
+
+    С upstream - проксирует запросы реальному провайдеру и записывает
+    ответы; без него - воспроизводит записи с заданной задержкой и
+    внедрением ошибок (429, таймауты). Случайность детерминирована seed.
+    """
+
+    # Кешируемый контекст входит в ключ записи
+    supports_prompt_caching = True
+
+    def __init__(
+        self,
+        name: str,
+        store: ReplayStore,
+        upstream: Optional[BaseAIProvider] = None,
+        latency: str = "recorded",
+        latency_scale: float = 1.0,
+        rate_limit_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_delay: float = 0.0,
+        strict: bool = True,
+        seed: int = 0,
+        **kwargs
+    ):
+        self.store = store
+        self.upstream = upstream
+        self._provider_name = name
+        super().__init__(api_key=None, **kwargs)
+        self.name = name
+
+        self.latency = parse_latency(latency)
+        self.latency_scale = latency_scale
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self.strict = strict
+        self.random = random.Random(seed)
+
+        self.replayed = 0
+        self.misses = 0
+        self.injected_errors = 0
+
+    def _get_available_models(self) -> Dict[str, Dict[str, Any]]:
+        if self.upstream is not None:
+            return self.upstream.models
+        return self.store.models(self._provider_name)
+
+    def _lookup(self, key: str, model: str) -> Dict[str, Any]:
+        record = self.store.get(key)
+        if record is not None:
+            return record
+
+        self.misses += 1
+        candidates = self.store.for_model(model)
+        if self.strict or not candidates:
+            raise AIProviderError(f"No recorded response for request {key[:12]}", self.name, model)
+        # Нестрогий режим: детерминированно выбранная запись той же модели
+        return candidates[int(key[:8], 16) % len(candidates)]
+
+    async def _inject_errors(self, model: str):
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.injected_errors += 1
+            raise RateLimitError("Rate limit exceeded (injected)", self.name, model, retry_after=1)
+        if roll < self.rate_limit_rate + self.timeout_rate:
+            self.injected_errors += 1
+            await asyncio.sleep(self.timeout_delay)
+            raise AIProviderError("Request timed out (injected)", self.name, model)
+
+    def _delay(self, record: Dict[str, Any]) -> float:
+        return max(0.0, self.latency(record, self.random) * self.latency_scale)
+
+    def _upstream_call(self, messages: List[Dict[str, str]], kwargs: Dict[str, Any]):
+        """Кешируемый контекст - блоками или в начале промпта, как принимает upstream"""
+        cached_context = kwargs.pop("cached_context", None)
+        if cached_context:
+            if self.upstream.supports_prompt_caching:
+                kwargs["cached_context"] = cached_context
+            else:
+                messages = messages[:-1] + [{
+                    **messages[-1], "content": join_context(messages[-1]["content"], cached_context)
+                }]
+        return messages, kwargs
+
+    def _record(self, key: str, model: str, messages: List[Dict[str, str]], kwargs: Dict[str, Any], **fields):
+        self.store.add({
+            "key": key,
+            "provider": self.name,
+            "model": model,
+            "model_info": self.models.get(model, {}),
+            "messages": messages,
+            "params": {
+                name: kwargs[name] for name in ("max_tokens", "temperature", "cached_context") if name in kwargs
+            },
+            **fields
+        })
+
+    async def _make_request(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Запрос: запись ответа upstream или воспроизведение записи"""
+        key = request_key(model, messages, **kwargs)
+
+        if self.upstream is not None:
+            upstream_messages, upstream_kwargs = self._upstream_call(messages, dict(kwargs))
+            started = time.monotonic()
+            response = await self.upstream._make_request(model, upstream_messages, **upstream_kwargs)
+            self._record(
+                key, model, messages, kwargs,
+                content=response.get("content", ""),
+                metadata=response.get("metadata", {}),
+                latency=round(time.monotonic() - started, 4)
+            )
+            return response
+
+        record = self._lookup(key, model)
+        await self._inject_errors(model)
+        await asyncio.sleep(self._delay(record))
+        self.replayed += 1
+
+        if "content" not in record:
+            # Записан только стрим
+            return {"content": "".join(text for _, text in record["chunks"]), "metadata": {}}
+        return {"content": record["content"], "metadata": copy.deepcopy(record.get("metadata", {}))}
+
+    async def _make_streaming_request(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """Стрим: запись чанков со смещением от начала запроса или воспроизведение"""
+        key = request_key(model, messages, **kwargs)
+
+        if self.upstream is not None:
+            upstream_messages, upstream_kwargs = self._upstream_call(messages, dict(kwargs))
+            started = time.monotonic()
+            chunks = []
+            async for chunk in self.upstream._make_streaming_request(model, upstream_messages, **upstream_kwargs):
+                chunks.append([round(time.monotonic() - started, 4), chunk])
+                yield chunk
+            self._record(key, model, messages, kwargs, chunks=chunks)
+            return
+
+        record = self._lookup(key, model)
+        await self._inject_errors(model)
+        chunks = record.get("chunks") or [[record.get("latency", 0.0), record.get("content", "")]]
+
+        # Записанные смещения чанков масштабируются под задержку из распределения
+        recorded_total = chunks[-1][0]
+        total = self._delay({**record, "latency": recorded_total})
+        factor = total / recorded_total if recorded_total else 0.0
+
+        started = time.monotonic()
+        for offset, text in chunks:
+            wait = offset * factor - (time.monotonic() - started)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield text
+        self.replayed += 1
+
+    async def check_health(self) -> Dict[str, Any]:
+        if self.upstream is not None:
+            return await self.upstream.check_health()
+        return {
+            "provider": self.name,
+            "status": "healthy",
+            "response_time": 0.0,
+            "models_available": list(self.models.keys()),
+            "recordings": len(self.store)
+        }
+
+
+def build_replay_providers(
+    providers: Dict[str, BaseAIProvider],
+    mode: Optional[str] = None,
+    store: Optional[ReplayStore] = None
+) -> Dict[str, BaseAIProvider]:
+    """
+    Провайдеры оркестратора с учетом REPLAY_MODE: record - реальные
+    провайдеры с записью ответов, replay - провайдеры из записей
+    (API ключи не нужны)
+    """
+    mode = mode or settings.REPLAY_MODE
+    if mode == REPLAY_OFF:
+        return providers
+
+    store = store or ReplayStore(settings.REPLAY_PATH)
+    if mode == REPLAY_RECORD:
+        return {name: ReplayProvider(name, store, upstream=provider) for name, provider in providers.items()}
+    if mode == REPLAY_REPLAY:
+        return {
+            name: ReplayProvider(
+                name,
+                store,
+                latency=settings.REPLAY_LATENCY,
+                latency_scale=settings.REPLAY_LATENCY_SCALE,
+                rate_limit_rate=settings.REPLAY_RATE_LIMIT_RATE,
+                timeout_rate=settings.REPLAY_TIMEOUT_RATE,
+                strict=settings.REPLAY_STRICT,
+                seed=settings.REPLAY_SEED
+            )
+            for name in store.providers()
+        }
+    raise ValueError(f"Unsupported replay mode: {mode}")
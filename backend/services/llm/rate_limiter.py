@@ -0,0 +1,326 @@
+"""
+Rate limiter для AI провайдеров DevAssist Pro
+Token bucket на пару провайдер/модель с бюджетами запросов и токенов
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from .config import settings, PROVIDER_RATE_LIMITS
+
+logger = logging.getLogger(__name__)
+
+# Атомарная проверка и резервирование обоих бюджетов в Redis.
+# KEYS[1] - hash бакета; ARGV: now, req_capacity, req_rate, tok_capacity, tok_rate, tokens
+# Возвращает время ожидания в секундах (0 - резерв выполнен).
+_ACQUIRE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts', 'blocked_until')
+local now = tonumber(ARGV[1])
+local req_cap = tonumber(ARGV[2])
+local req_rate = tonumber(ARGV[3])
+local tok_cap = tonumber(ARGV[4])
+local tok_rate = tonumber(ARGV[5])
+local need = math.min(tonumber(ARGV[6]), tok_cap)
+
+local req = tonumber(state[1]) or req_cap
+local tok = tonumber(state[2]) or tok_cap
+local ts = tonumber(state[3]) or now
+local blocked_until = tonumber(state[4]) or 0
+
+local elapsed = math.max(0, now - ts)
+req = math.min(req_cap, req + elapsed * req_rate)
+tok = math.min(tok_cap, tok + elapsed * tok_rate)
+
+local wait = 0
+if blocked_until > now then
+    wait = blocked_until - now
+else
+    if req < 1 then wait = (1 - req) / req_rate end
+    if tok < need then wait = math.max(wait, (need - tok) / tok_rate) end
+end
+
+if wait <= 0 then
+    req = req - 1
+    tok = tok - need
+end
+
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 300)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """Классический token bucket (in-process)"""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Сколько ждать до возможности списать amount (0 - можно сейчас)"""
+        self._refill(now)
+        # Запрос больше емкости бакета ждет полного бакета, а не вечно
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Досписать (delta > 0) или вернуть (delta < 0) токены после ответа"""
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0.0)
+
+    def rescale(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = min(self.tokens, capacity)
+
+
+class ModelRateLimiter:
+    """
+    Лимитер для одной пары провайдер/модель.
+
+    Запрос резервирует 1 единицу бюджета запросов и оценку токенов
+    (prompt + max_tokens); после ответа резерв уточняется по фактическому
+    расходу. Ожидающие корутины обслуживаются по очереди (FIFO).
+    При 429 доля квоты уменьшается вдвое и восстанавливается постепенно
+    с каждым успешным запросом (AIMD).
+
+    Если подключен Redis, бакеты общие для всех воркеров; при ошибках
+    Redis лимитер переходит на in-process бакеты.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        rpm: int,
+        tpm: int,
+        min_factor: float = 0.1,
+        recovery_step: float = 0.05,
+        redis_client=None,
+        redis_prefix: str = "llm_ratelimit:"
+    ):
+        self.provider = provider
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_factor = min_factor
+        self.recovery_step = recovery_step
+        self.redis_client = redis_client
+        self.redis_key = f"{redis_prefix}{provider}:{model}"
+
+        self.factor = 1.0
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+        self.acquired = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+
+    def _limits(self) -> Tuple[float, float]:
+        return max(1.0, self.rpm * self.factor), max(1.0, self.tpm * self.factor)
+
+    def _apply_factor(self):
+        rpm, tpm = self._limits()
+        self.requests.rescale(rpm, rpm / 60.0)
+        self.tokens.rescale(tpm, tpm / 60.0)
+
+    async def _redis_wait_time(self, tokens: int) -> float:
+        rpm, tpm = self._limits()
+        wait = await self.redis_client.eval(
+            _ACQUIRE_SCRIPT, 1, self.redis_key,
+            time.time(), rpm, rpm / 60.0, tpm, tpm / 60.0, tokens
+        )
+        return float(wait)
+
+    def _local_wait_time(self, tokens: int) -> float:
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait <= 0:
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+        return wait
+
+    async def _wait_time(self, tokens: int) -> float:
+        if self.redis_client is not None:
+            try:
+                return await self._redis_wait_time(tokens)
+            except Exception as e:
+                logger.warning(f"Redis rate limiter unavailable for {self.redis_key}, using in-process: {e}")
+                self.redis_client = None
+        return self._local_wait_time(tokens)
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Дождаться бюджета на запрос; возвращает время ожидания"""
+        started = time.monotonic()
+        # asyncio.Lock будит ожидающих в порядке очереди - это и дает справедливость
+        async with self._lock:
+            while True:
+                wait = await self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        if waited > 1:
+            logger.info(f"Rate limiter delayed {self.provider}/{self.model} request by {waited:.1f}s")
+        return waited
+
+    async def settle(self, reserved_tokens: int, actual_tokens: int):
+        """Уточнить резерв токенов по фактическому расходу"""
+        delta = actual_tokens - reserved_tokens
+        if not delta:
+            return
+
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.hincrbyfloat(self.redis_key, "tok", -delta)
+                return
+            except Exception as e:
+                logger.warning(f"Rate limiter settle failed in Redis: {e}")
+        self.tokens.adjust(delta)
+
+    async def on_success(self):
+        """Постепенное восстановление квоты после снижения"""
+        if self.factor < 1.0:
+            self.factor = min(1.0, self.factor + self.recovery_step)
+            self._apply_factor()
+
+    async def on_rate_limited(self, retry_after: Optional[float] = None):
+        """Обратная связь от 429: пауза и уменьшение квоты"""
+        self.rate_limited += 1
+        self.factor = max(self.min_factor, self.factor / 2)
+        self._apply_factor()
+
+        pause = float(retry_after) if retry_after else 60.0 / max(1.0, self._limits()[0])
+        self.blocked_until = time.monotonic() + pause
+        self.requests.drain()
+        self.tokens.drain()
+
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.hset(self.redis_key, mapping={
+                    "blocked_until": time.time() + pause,
+                    "req": 0,
+                    "tok": 0
+                })
+            except Exception as e:
+                logger.warning(f"Rate limiter penalty failed in Redis: {e}")
+
+        logger.warning(
+            f"Rate limited by {self.provider}/{self.model}: pausing {pause:.1f}s, "
+            f"quota factor {self.factor:.2f}"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        rpm, tpm = self._limits()
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "backend": "redis" if self.redis_client is not None else "local",
+            "effective_rpm": round(rpm, 1),
+            "effective_tpm": round(tpm, 1),
+            "quota_factor": round(self.factor, 3),
+            "acquired": self.acquired,
+            "rate_limited": self.rate_limited,
+            "total_wait_seconds": round(self.total_wait, 2)
+        }
+
+
+class RateLimiterRegistry:
+    """Лимитеры по парам провайдер/модель, квоты из PROVIDER_RATE_LIMITS"""
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], ModelRateLimiter] = {}
+        # Фоновые пакетные запросы: свои бакеты, интерактивные не ждут за ними
+        self._bulk_limiters: Dict[Tuple[str, str], ModelRateLimiter] = {}
+        self.redis_client = None
+
+    def set_redis(self, redis_client):
+        """Сделать бакеты общими для воркеров через Redis"""
+        self.redis_client = redis_client
+        for limiter in [*self._limiters.values(), *self._bulk_limiters.values()]:
+            limiter.redis_client = redis_client
+
+    def _quota(self, provider: str, model: str) -> Dict[str, int]:
+        provider_limits = PROVIDER_RATE_LIMITS.get(provider, {})
+        return provider_limits.get(model) or provider_limits.get("default") or {
+            "rpm": settings.RATE_LIMIT_DEFAULT_RPM,
+            "tpm": settings.RATE_LIMIT_DEFAULT_TPM
+        }
+
+    @staticmethod
+    def _share(bulk: bool) -> float:
+        # Квота провайдера делится между бакетами: вместе они не превышают RPM/TPM,
+        # иначе 429 от пакетных запросов урезали бы квоту интерактивных
+        bulk_share = min(1.0, max(0.0, settings.BATCH_RATE_LIMIT_SHARE))
+        return bulk_share if bulk else 1.0 - bulk_share
+
+    def get(self, provider: str, model: str, bulk: bool = False) -> ModelRateLimiter:
+        """
+        Лимитер модели; bulk - бакет пакетных запросов с долей квоты
+        BATCH_RATE_LIMIT_SHARE, интерактивному бакету остается остальное
+        """
+        limiters = self._bulk_limiters if bulk else self._limiters
+        key = (provider, model)
+        limiter = limiters.get(key)
+        if limiter is None:
+            quota = self._quota(provider, model)
+            share = self._share(bulk)
+            limiter = ModelRateLimiter(
+                provider,
+                model,
+                rpm=max(1, int(quota["rpm"] * share)),
+                tpm=max(1, int(quota["tpm"] * share)),
+                min_factor=settings.RATE_LIMIT_MIN_FACTOR,
+                recovery_step=settings.RATE_LIMIT_RECOVERY_STEP,
+                redis_client=self.redis_client,
+                redis_prefix=f"{settings.RATE_LIMIT_PREFIX}bulk:" if bulk else settings.RATE_LIMIT_PREFIX
+            )
+            limiters[key] = limiter
+        return limiter
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            f"{provider}/{model}": limiter.get_stats()
+            for (provider, model), limiter in self._limiters.items()
+        }
+        stats.update({
+            f"{provider}/{model}/bulk": limiter.get_stats()
+            for (provider, model), limiter in self._bulk_limiters.items()
+        })
+        return stats
+
+
+_registry: Optional[RateLimiterRegistry] = None
+
+
+def get_rate_limiter() -> RateLimiterRegistry:
+    """Процессный реестр лимитеров"""
+    global _registry
+    if _registry is None:
+        _registry = RateLimiterRegistry()
+    return _registry
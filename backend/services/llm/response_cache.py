@@ -0,0 +1,232 @@
+"""
+Кеш ответов LLM для DevAssist Pro
+Двухуровневый кеш: in-process LRU перед Redis
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Параметры in-process уровня (из окружения - кеш используется и монолитом)
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv("LLM_MEMORY_CACHE_MAX_ENTRIES", "512"))
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("LLM_MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MEMORY_CACHE_TTL = int(os.getenv("LLM_MEMORY_CACHE_TTL", "3600"))
+REDIS_CACHE_TTL = int(os.getenv("LLM_REDIS_CACHE_TTL", "3600"))
+
+# Версия формата ключа - меняется при изменении состава ключа
+CACHE_KEY_VERSION = 3
+
+
+def _normalize_text(text: Optional[str]) -> Optional[str]:
+    """Нормализация текста для ключа: переводы строк и хвостовые пробелы"""
+    if text is None:
+        return None
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def build_cache_key(
+    task_type: Any,
+    content: str,
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    prompt_version: Optional[str] = None,
+    context: Optional[List[str]] = None,
+    prefix: str = "llm_cache:"
+) -> str:
+    """Ключ кеша по полному нормализованному запросу"""
+    payload = {
+        "v": CACHE_KEY_VERSION,
+        "task_type": getattr(task_type, "value", task_type),
+        "content": _normalize_text(content),
+        "system_prompt": _normalize_text(system_prompt),
+        "user_prompt": _normalize_text(user_prompt),
+        "model": model or "auto",
+        "temperature": round(float(temperature), 3) if temperature is not None else None,
+        "max_tokens": int(max_tokens) if max_tokens is not None else None,
+        "prompt_version": prompt_version,
+        "context": [_normalize_text(block) for block in context or []]
+    }
+    digest = hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    return f"{prefix}{digest}"
+
+
+class LRUCache:
+    """In-process LRU с ограничением по числу записей, объему и TTL"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (expires_at, serialized_value, размер в байтах UTF-8)
+        self._data: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _remove(self, key: str):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value, _ = item
+        if expires_at < time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None):
+        # Кириллица в UTF-8 - два байта на символ: лимит считается в байтах, а не символах
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            # Ответ больше всего кеша - не кешируем
+            return
+
+        if key in self._data:
+            self._remove(key)
+
+        self._data[key] = (time.time() + (ttl or self.ttl), value, size)
+        self._bytes += size
+
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class LLMResponseCache:
+    """
+    Двухуровневый кеш ответов LLM.
+
+    Первый уровень - in-process LRU, работает и без Redis (монолит).
+    Второй уровень - Redis (setex), общий для воркеров; попадания
+    во второй уровень поднимаются в первый.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MEMORY_CACHE_MAX_ENTRIES,
+        max_bytes: int = MEMORY_CACHE_MAX_BYTES,
+        memory_ttl: int = MEMORY_CACHE_TTL,
+        redis_ttl: int = REDIS_CACHE_TTL
+    ):
+        self.memory = LRUCache(max_entries, max_bytes, memory_ttl)
+        self.redis_client = None
+        self.redis_ttl = redis_ttl
+
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    def set_redis(self, redis_client, ttl: Optional[int] = None):
+        """Подключить Redis как второй уровень кеша"""
+        self.redis_client = redis_client
+        if ttl:
+            self.redis_ttl = ttl
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить ответ из кеша (сначала память, затем Redis)"""
+        value = self.memory.get(key)
+        if value is not None:
+            return json.loads(value)
+
+        if not self.redis_client:
+            return None
+
+        try:
+            value = await self.redis_client.get(key)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Cache retrieval failed: {e}")
+            return None
+
+        if not value:
+            self.redis_misses += 1
+            return None
+
+        self.redis_hits += 1
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        self.memory.set(key, value)
+        return json.loads(value)
+
+    async def set(self, key: str, response: Dict[str, Any]):
+        """Сохранить ответ в оба уровня кеша"""
+        value = json.dumps(response, default=str, ensure_ascii=False)
+        self.memory.set(key, value)
+
+        if not self.redis_client:
+            return
+
+        try:
+            await self.redis_client.setex(key, self.redis_ttl, value)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Cache storage failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счетчики кеша для health endpoints"""
+        return {
+            "memory": self.memory.get_stats(),
+            "redis": {
+                "enabled": self.redis_client is not None,
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "errors": self.redis_errors
+            }
+        }
+
+
+_response_cache: Optional[LLMResponseCache] = None
+
+
+def get_response_cache() -> LLMResponseCache:
+    """Процессный экземпляр кеша ответов"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = LLMResponseCache()
+    return _response_cache
@@ -0,0 +1,253 @@
+"""
+Маршрутизация запросов между AI провайдерами DevAssist Pro
+Скользящая статистика задержек и ошибок и circuit breaker на пару провайдер/модель
+"""
+import logging
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .config import settings, TASK_MODEL_MAPPING
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Порядок перебора уровней модели из TASK_MODEL_MAPPING
+TIER_ORDER = {
+    "default": ["default", "quality", "fast"],
+    "fast": ["fast", "default", "quality"],
+    "quality": ["quality", "default", "fast"]
+}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ModelHealth:
+    """
+    Скользящее окно последних запросов к одной модели и circuit breaker.
+
+    После ROUTER_FAILURE_THRESHOLD ошибок подряд цепь размыкается на
+    ROUTER_OPEN_SECONDS: модель не выбирается, пока есть здоровые
+    альтернативы. Затем один пробный запрос (half-open) решает, замкнуть
+    цепь или разомкнуть снова.
+    """
+
+    def __init__(self, provider: str, model: str, window_size: int, failure_threshold: int, open_seconds: float):
+        self.provider = provider
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        # (успех, задержка в секундах)
+        self.window: deque = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def _update_state(self, now: float):
+        if self.state == CIRCUIT_OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = CIRCUIT_HALF_OPEN
+            self.probe_in_flight = False
+
+    def is_available(self, now: Optional[float] = None) -> bool:
+        """Можно ли отправить запрос в модель сейчас"""
+        self._update_state(now or time.monotonic())
+        if self.state == CIRCUIT_OPEN:
+            return False
+        if self.state == CIRCUIT_HALF_OPEN:
+            return not self.probe_in_flight
+        return True
+
+    def on_attempt(self):
+        if self.state == CIRCUIT_HALF_OPEN:
+            self.probe_in_flight = True
+
+    def record_success(self, latency: float):
+        self.window.append((True, latency))
+        self.consecutive_failures = 0
+        if self.state != CIRCUIT_CLOSED:
+            logger.info(f"Circuit closed for {self.provider}/{self.model}")
+        self.state = CIRCUIT_CLOSED
+        self.probe_in_flight = False
+
+    def record_failure(self, latency: float, now: Optional[float] = None):
+        self.window.append((False, latency))
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+
+        if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                logger.warning(
+                    f"Circuit opened for {self.provider}/{self.model} "
+                    f"after {self.consecutive_failures} consecutive failures"
+                )
+            self.state = CIRCUIT_OPEN
+            self.opened_at = now or time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        if not self.window:
+            return 0.0
+        return sum(1 for success, _ in self.window if not success) / len(self.window)
+
+    def latency(self, percentile: float) -> Optional[float]:
+        latencies = [latency for success, latency in self.window if success]
+        if not latencies:
+            return None
+        return _percentile(latencies, percentile)
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50 = self.latency(0.5)
+        p95 = self.latency(0.95)
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "circuit": self.state,
+            "requests": len(self.window),
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "p50_latency": round(p50, 3) if p50 is not None else None,
+            "p95_latency": round(p95, 3) if p95 is not None else None
+        }
+
+
+class ModelRouter:
+    """
+    Выбор модели для задачи с учетом здоровья провайдеров.
+
+    Кандидаты - модели уровня из TASK_MODEL_MAPPING (затем остальных
+    уровней) и модели провайдеров в порядке FALLBACK_ORDER. Кандидаты с
+    разомкнутой цепью отбрасываются; остальные сортируются по p95
+    задержке, умноженной на штраф за ошибки и за удаленность от
+    предпочтительного уровня.
+    """
+
+    def __init__(
+        self,
+        window_size: int = None,
+        failure_threshold: int = None,
+        open_seconds: float = None,
+        default_latency: float = None,
+        rank_penalty: float = None,
+        error_penalty: float = None
+    ):
+        self.window_size = window_size or settings.ROUTER_WINDOW_SIZE
+        self.failure_threshold = failure_threshold or settings.ROUTER_FAILURE_THRESHOLD
+        self.open_seconds = open_seconds if open_seconds is not None else settings.ROUTER_OPEN_SECONDS
+        self.default_latency = default_latency or settings.ROUTER_DEFAULT_LATENCY
+        self.rank_penalty = rank_penalty if rank_penalty is not None else settings.ROUTER_RANK_PENALTY
+        self.error_penalty = error_penalty if error_penalty is not None else settings.ROUTER_ERROR_PENALTY
+        self._health: Dict[Tuple[str, str], ModelHealth] = {}
+
+    def health(self, provider: str, model: str) -> ModelHealth:
+        key = (provider, model)
+        health = self._health.get(key)
+        if health is None:
+            health = ModelHealth(provider, model, self.window_size, self.failure_threshold, self.open_seconds)
+            self._health[key] = health
+        return health
+
+    @staticmethod
+    def _resolve_model(name: str, providers: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        """Найти модель у провайдеров (в маппинге имена без даты версии: claude-3-opus)"""
+        for provider_name, provider in providers.items():
+            if name in provider.models:
+                return provider_name, name
+        for provider_name, provider in providers.items():
+            for model in provider.models:
+                if model.startswith(f"{name}-"):
+                    return provider_name, model
+        return None
+
+    def _preference_list(
+        self,
+        task_type: Any,
+        providers: Dict[str, Any],
+        fallback_order: List[str],
+        tier: str
+    ) -> List[Tuple[str, str]]:
+        task_models = TASK_MODEL_MAPPING.get(getattr(task_type, "value", task_type), {})
+        candidates: List[Tuple[str, str]] = []
+
+        for tier_name in TIER_ORDER.get(tier, TIER_ORDER["default"]):
+            model_name = task_models.get(tier_name)
+            resolved = self._resolve_model(model_name, providers) if model_name else None
+            if resolved and resolved not in candidates:
+                candidates.append(resolved)
+
+        for provider_name in fallback_order:
+            provider = providers.get(provider_name)
+            if provider is None:
+                continue
+            for model in provider.models:
+                if (provider_name, model) not in candidates:
+                    candidates.append((provider_name, model))
+
+        return candidates
+
+    def _score(self, health: ModelHealth, rank: int) -> float:
+        latency = health.latency(0.95) or self.default_latency
+        return latency * (1 + self.error_penalty * health.error_rate) * (1 + self.rank_penalty * rank)
+
+    def candidates(
+        self,
+        task_type: Any,
+        providers: Dict[str, Any],
+        fallback_order: List[str],
+        model_override: Optional[str] = None,
+        tier: str = "default"
+    ) -> List[Tuple[str, str]]:
+        """Кандидаты (провайдер, модель) от лучшего к худшему"""
+        if model_override:
+            resolved = self._resolve_model(model_override, providers)
+            if resolved:
+                # Явно указанная модель всегда первая, даже с разомкнутой цепью
+                rest = [c for c in self.candidates(task_type, providers, fallback_order, tier=tier) if c != resolved]
+                return [resolved] + rest
+
+        preferred = self._preference_list(task_type, providers, fallback_order, tier)
+        now = time.monotonic()
+        available = []
+        unavailable = []
+        for rank, (provider_name, model) in enumerate(preferred):
+            health = self.health(provider_name, model)
+            if health.is_available(now):
+                available.append((self._score(health, rank), rank, (provider_name, model)))
+            else:
+                unavailable.append((health.opened_at, (provider_name, model)))
+
+        ordered = [candidate for _, _, candidate in sorted(available)]
+        # Если разомкнуто все - пробуем начиная с давно разомкнутых
+        ordered.extend(candidate for _, candidate in sorted(unavailable))
+        return ordered
+
+    def record_success(self, provider: str, model: str, latency: float):
+        self.health(provider, model).record_success(latency)
+
+    def record_failure(self, provider: str, model: str, latency: float):
+        self.health(provider, model).record_failure(latency)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            f"{provider}/{model}": health.get_stats()
+            for (provider, model), health in self._health.items()
+        }
+
+
+_router: Optional[ModelRouter] = None
+
+
+def get_router() -> ModelRouter:
+    """Процессный экземпляр маршрутизатора"""
+    global _router
+    if _router is None:
+        _router = ModelRouter()
+    return _router
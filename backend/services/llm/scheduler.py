@@ -0,0 +1,314 @@
+"""
+Планировщик LLM запросов для DevAssist Pro
+Классы приоритета, справедливая очередь по арендаторам, сброс нагрузки по
+глубине очереди и дедлайны: интерактивные вызовы не ждут за пакетными
+анализами, а работа ушедшего клиента не расходует квоту провайдера.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, Callable, Awaitable, Mapping, Deque
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_STANDARD = "standard"
+PRIORITY_BACKGROUND = "background"
+PRIORITY_BULK = "bulk"
+
+# От высшего к низшему
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_STANDARD, PRIORITY_BACKGROUND, PRIORITY_BULK)
+
+# Параметры читаются из окружения: планировщик общий для LLM Service и монолита
+MAX_CONCURRENCY = int(os.getenv("LLM_SCHEDULER_CONCURRENCY", "16"))
+
+# Доля слотов, доступная классу: остаток всегда свободен для более приоритетных
+CLASS_SHARE = {
+    PRIORITY_INTERACTIVE: 1.0,
+    PRIORITY_STANDARD: 0.9,
+    PRIORITY_BACKGROUND: 0.6,
+    PRIORITY_BULK: 0.4
+}
+
+# Глубина очереди класса, сверх которой запросы сразу отклоняются (503)
+QUEUE_LIMITS = {
+    PRIORITY_INTERACTIVE: int(os.getenv("LLM_QUEUE_LIMIT_INTERACTIVE", "100")),
+    PRIORITY_STANDARD: int(os.getenv("LLM_QUEUE_LIMIT_STANDARD", "200")),
+    PRIORITY_BACKGROUND: int(os.getenv("LLM_QUEUE_LIMIT_BACKGROUND", "500")),
+    PRIORITY_BULK: int(os.getenv("LLM_QUEUE_LIMIT_BULK", "5000"))
+}
+
+MAX_RETRY_AFTER = 120
+# Окно времен ожидания для перцентилей в метриках
+WAIT_WINDOW = 1000
+
+
+class SchedulerOverloaded(Exception):
+    """Очередь класса переполнена - запрос отклонен без ожидания"""
+
+    def __init__(self, priority: str, retry_after: int):
+        self.priority = priority
+        self.retry_after = retry_after
+        super().__init__(f"LLM queue '{priority}' is full, retry after {retry_after}s")
+
+
+class DeadlineExceeded(Exception):
+    """Дедлайн вызывающего истек до или во время выполнения"""
+    pass
+
+
+def parse_deadline(headers: Mapping[str, str], default_timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Дедлайн (unix time) из заголовков: X-Request-Deadline - абсолютный,
+    X-Request-Timeout - секунды от текущего момента
+    """
+    try:
+        if headers.get("x-request-deadline"):
+            return float(headers["x-request-deadline"])
+        if headers.get("x-request-timeout"):
+            return time.time() + float(headers["x-request-timeout"])
+    except ValueError:
+        logger.warning("Invalid request deadline header ignored")
+    return time.time() + default_timeout if default_timeout else None
+
+
+class _Job:
+    __slots__ = ("priority", "tenant", "deadline", "future", "enqueued_at", "cancelled")
+
+    def __init__(self, priority: str, tenant: str, deadline: Optional[float]):
+        self.priority = priority
+        self.tenant = tenant
+        self.deadline = deadline
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.cancelled = False
+
+
+class _ClassQueue:
+    """Очередь класса приоритета: round-robin по арендаторам"""
+
+    def __init__(self):
+        self.tenants: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self.depth = 0
+
+    def push(self, job: _Job):
+        self.tenants.setdefault(job.tenant, deque()).append(job)
+        self.depth += 1
+
+    def pop(self) -> Optional[_Job]:
+        """Следующая живая задача; арендатор уходит в конец очереди"""
+        while self.tenants:
+            tenant, jobs = next(iter(self.tenants.items()))
+            job = jobs.popleft()
+            if jobs:
+                self.tenants.move_to_end(tenant)
+            else:
+                del self.tenants[tenant]
+            if not job.cancelled:
+                self.depth -= 1
+                return job
+        return None
+
+
+class LLMScheduler:
+    """
+    Допуск LLM работы к провайдерам.
+
+    Слот выдается задаче с наивысшим приоритетом, внутри класса - по
+    очереди арендаторов (организация/пользователь/сессия), поэтому один
+    большой пакет не вытесняет остальных. Класс не занимает больше своей
+    доли слотов; при переполнении очереди класса запрос сразу отклоняется
+    с оценкой Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        queue_limits: Optional[Dict[str, int]] = None,
+        class_share: Optional[Dict[str, float]] = None
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_limits = {**QUEUE_LIMITS, **(queue_limits or {})}
+        class_share = {**CLASS_SHARE, **(class_share or {})}
+        self.class_limits = {
+            priority: max(1, math.floor(self.max_concurrency * class_share[priority]))
+            for priority in PRIORITIES
+        }
+
+        self._queues = {priority: _ClassQueue() for priority in PRIORITIES}
+        self._active = {priority: 0 for priority in PRIORITIES}
+        self._active_total = 0
+
+        self._admitted = {priority: 0 for priority in PRIORITIES}
+        self._shed = {priority: 0 for priority in PRIORITIES}
+        self._expired = {priority: 0 for priority in PRIORITIES}
+        self._abandoned = {priority: 0 for priority in PRIORITIES}
+        self._waits = {priority: deque(maxlen=WAIT_WINDOW) for priority in PRIORITIES}
+        # Среднее время выполнения (EWMA) - для оценки Retry-After
+        self._service_time = {priority: 5.0 for priority in PRIORITIES}
+
+    def _can_start(self, priority: str) -> bool:
+        return (
+            self._active_total < self.max_concurrency
+            and self._active[priority] < self.class_limits[priority]
+        )
+
+    def _start(self, job: _Job):
+        self._active[job.priority] += 1
+        self._active_total += 1
+        self._admitted[job.priority] += 1
+        self._waits[job.priority].append(time.monotonic() - job.enqueued_at)
+        job.future.set_result(None)
+
+    def _dispatch(self):
+        """Выдать освободившиеся слоты ожидающим задачам по приоритету"""
+        while self._active_total < self.max_concurrency:
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                if not queue.depth or not self._can_start(priority):
+                    continue
+                job = queue.pop()
+                if job is None:
+                    continue
+                if job.deadline is not None and job.deadline <= time.time():
+                    # Вызывающий уже не ждет результат
+                    self._expired[priority] += 1
+                    job.future.set_exception(DeadlineExceeded(f"Deadline passed in '{priority}' queue"))
+                    break
+                self._start(job)
+                break
+            else:
+                return
+
+    def _retry_after(self, priority: str) -> int:
+        """Оценка времени до освобождения места в очереди класса"""
+        depth = self._queues[priority].depth
+        estimate = depth * self._service_time[priority] / self.class_limits[priority]
+        return int(min(MAX_RETRY_AFTER, max(1, math.ceil(estimate))))
+
+    async def acquire(self, priority: str = PRIORITY_STANDARD, tenant: Any = None, deadline: Optional[float] = None):
+        """Дождаться слота (см. slot)"""
+        if priority not in self._queues:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        if deadline is not None and deadline <= time.time():
+            self._expired[priority] += 1
+            raise DeadlineExceeded("Deadline passed before scheduling")
+
+        job = _Job(priority, str(tenant) if tenant is not None else "-", deadline)
+        queue = self._queues[priority]
+
+        # Без очереди, если слот свободен и никто того же или высшего класса не ждет
+        waiting_ahead = any(self._queues[p].depth for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if not waiting_ahead and self._can_start(priority):
+            self._start(job)
+            return
+
+        if queue.depth >= self.queue_limits[priority]:
+            self._shed[priority] += 1
+            raise SchedulerOverloaded(priority, self._retry_after(priority))
+
+        queue.push(job)
+        # Ждущие высших классов могут упираться в свою долю слотов - тогда задача
+        # стартует сразу, а не с ближайшим release
+        self._dispatch()
+        timeout = deadline - time.time() if deadline is not None else None
+        try:
+            await asyncio.wait({job.future}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(job)
+            raise
+
+        if not job.future.done():
+            self._abandon(job)
+            self._expired[priority] += 1
+            raise DeadlineExceeded(f"Deadline passed in '{priority}' queue")
+        job.future.result()
+
+    def _abandon(self, job: _Job):
+        """Вызывающий ушел: убрать задачу из очереди или вернуть выданный слот"""
+        if job.future.done():
+            if job.future.exception() is None:
+                self.release(job.priority)
+            return
+        job.cancelled = True
+        job.future.cancel()
+        self._queues[job.priority].depth -= 1
+        self._abandoned[job.priority] += 1
+
+    def release(self, priority: str, service_time: Optional[float] = None):
+        self._active[priority] -= 1
+        self._active_total -= 1
+        if service_time is not None:
+            self._service_time[priority] = 0.8 * self._service_time[priority] + 0.2 * service_time
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: str = PRIORITY_STANDARD, tenant: Any = None, deadline: Optional[float] = None):
+        """
+        Слот на время вызова провайдера
+
+        Raises:
+            SchedulerOverloaded: очередь класса переполнена
+            DeadlineExceeded: дедлайн истек в очереди
+        """
+        await self.acquire(priority, tenant, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(priority, time.monotonic() - started)
+
+    async def run(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        priority: str = PRIORITY_STANDARD,
+        tenant: Any = None,
+        deadline: Optional[float] = None
+    ) -> Any:
+        """Выполнить func в слоте; по дедлайну выполнение отменяется"""
+        async with self.slot(priority, tenant, deadline):
+            if deadline is None:
+                return await func()
+            try:
+                return await asyncio.wait_for(func(), timeout=max(0.0, deadline - time.time()))
+            except asyncio.TimeoutError:
+                self._expired[priority] += 1
+                raise DeadlineExceeded("Deadline passed during LLM call")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Глубина очередей, занятые слоты и счетчики по классам"""
+        classes = {}
+        for priority in PRIORITIES:
+            waits = sorted(self._waits[priority])
+            classes[priority] = {
+                "queue_depth": self._queues[priority].depth,
+                "queue_limit": self.queue_limits[priority],
+                "active": self._active[priority],
+                "slot_limit": self.class_limits[priority],
+                "admitted": self._admitted[priority],
+                "shed": self._shed[priority],
+                "expired": self._expired[priority],
+                "abandoned": self._abandoned[priority],
+                "wait_p50": round(waits[len(waits) // 2], 4) if waits else 0.0,
+                "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active_total,
+            "classes": classes
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    """Общий планировщик процесса"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
@@ -0,0 +1,127 @@
+"""
+Объединение одинаковых одновременных LLM запросов (single-flight)
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .cancellation import CancellationToken, current_token
+
+logger = logging.getLogger(__name__)
+
+
+class _InFlightCall:
+    """
+    Выполняющийся запрос и его ожидающие.
+
+    Запрос выполняется под собственным токеном отмены: он отменяется, только
+    когда ушли все ожидающие, а частичный расход прерванного вызова
+    передается в токен последнего ушедшего - того, чья отмена его прервала.
+    """
+
+    def __init__(self):
+        self.token = CancellationToken(on_usage=self._forward_usage)
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.caller_tokens: List[CancellationToken] = []
+        self.last_token: Optional[CancellationToken] = None
+
+    def _forward_usage(self, usage: Dict[str, Any]):
+        token = self.caller_tokens[-1] if self.caller_tokens else self.last_token
+        if token is not None:
+            token.record_usage(**usage)
+
+
+class SingleFlight:
+    """
+    Дедупликация одновременных запросов с одинаковым ключом.
+
+    Первый вызывающий запускает выполнение, остальные ожидают тот же
+    результат. Ошибка выполнения получают все ожидающие. Отмена одного
+    ожидающего не отменяет запрос для остальных; запрос отменяется,
+    только когда его перестали ждать все: токен отмены первого вызывающего
+    на общий запрос не действует, но расход прерванного вызова учитывается.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _InFlightCall] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def _forget(self, key: str, call: _InFlightCall):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    @staticmethod
+    def _consume_result(task: asyncio.Task):
+        # Исключение уже передано ожидающим; гасим "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполнить func() один раз для всех одновременных вызовов с ключом key.
+        Возвращает (результат, coalesced), где coalesced=True для вызывающих,
+        получивших результат чужого запроса.
+        """
+        call = self._calls.get(key)
+        coalesced = call is not None
+
+        if call is None:
+            call = _InFlightCall()
+            # Под своим токеном: отмена лидера не должна прерывать запрос остальных
+            call.task = asyncio.ensure_future(call.token.bind(func()))
+            call.task.add_done_callback(lambda task, key=key, call=call: self._forget(key, call))
+            call.task.add_done_callback(self._consume_result)
+            self._calls[key] = call
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"Coalesced in-flight LLM request {key[-12:]} ({call.waiters} waiting)")
+
+        caller_token = current_token()
+        call.waiters += 1
+        if caller_token is not None:
+            call.caller_tokens.append(caller_token)
+        try:
+            return await asyncio.shield(call.task), coalesced
+        finally:
+            call.waiters -= 1
+            if caller_token is not None:
+                call.caller_tokens.remove(caller_token)
+                call.last_token = caller_token
+            if call.waiters == 0 and not call.task.done():
+                # Результат больше никому не нужен - освобождаем квоту провайдера
+                self._forget(key, call)
+                call.token.cancel((caller_token and caller_token.reason) or "no waiters")
+                call.task.cancel()
+                self.cancelled += 1
+                # Дожидаемся прерывания: провайдер успевает учесть расход
+                await asyncio.wait({call.task})
+
+    def running(self, key: str) -> bool:
+        """Выполняется ли запрос с ключом key"""
+        return key in self._calls
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled
+        }
+
+
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """Процессный экземпляр single-flight"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,119 @@
+"""
+Тесты для пакетного выполнения запросов
+"""
+import asyncio
+
+import pytest
+
+from ..batch import (
+    LocalBatchBackend, parse_anthropic_result, parse_openai_result,
+    REMOTE_ENDED, REMOTE_IN_PROGRESS
+)
+from ..providers.base import AIProviderError
+
+
+class FakeProvider:
+    """Провайдер, отвечающий эхом промпта"""
+
+    name = "fake"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.bulk_calls = 0
+
+    async def generate_text(self, model, prompt, system_prompt=None, max_tokens=1000, temperature=0.7, bulk=False):
+        self.calls += 1
+        self.bulk_calls += bulk
+        await asyncio.sleep(self.delay)
+        if prompt == "fail":
+            raise AIProviderError("boom", self.name, model)
+        return {"content": f"echo: {prompt}", "prompt_tokens": 10, "completion_tokens": 5}
+
+
+def make_items(*prompts):
+    return [
+        {"custom_id": f"batch-{index}", "user_prompt": prompt, "system_prompt": None, "max_tokens": 100, "temperature": 0.1}
+        for index, prompt in enumerate(prompts)
+    ]
+
+
+class TestResultParsing:
+    """Тесты разбора результатов Batch API"""
+
+    def test_anthropic_succeeded(self):
+        line = {
+            "custom_id": "batch-0",
+            "result": {
+                "type": "succeeded",
+                "message": {
+                    "content": [{"type": "text", "text": "Оценка: 7"}],
+                    "usage": {"input_tokens": 120, "output_tokens": 8}
+                }
+            }
+        }
+
+        assert parse_anthropic_result(line) == {"content": "Оценка: 7", "prompt_tokens": 120, "completion_tokens": 8}
+
+    def test_anthropic_errored(self):
+        line = {"custom_id": "batch-0", "result": {"type": "expired"}}
+
+        assert parse_anthropic_result(line) == {"error": "expired"}
+
+    def test_openai_succeeded(self):
+        line = {
+            "custom_id": "batch-1",
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "choices": [{"message": {"content": "Оценка: 8"}}],
+                    "usage": {"prompt_tokens": 100, "completion_tokens": 4}
+                }
+            },
+            "error": None
+        }
+
+        assert parse_openai_result(line) == {"content": "Оценка: 8", "prompt_tokens": 100, "completion_tokens": 4}
+
+    def test_openai_failed_request(self):
+        line = {
+            "custom_id": "batch-1",
+            "response": {"status_code": 400, "body": {"error": {"message": "bad request"}}},
+            "error": None
+        }
+
+        assert parse_openai_result(line) == {"error": "bad request"}
+
+
+class TestLocalBatchBackend:
+    """Тесты локального выполнения пакета"""
+
+    @pytest.mark.asyncio
+    async def test_results_by_custom_id(self):
+        provider = FakeProvider()
+        backend = LocalBatchBackend(provider, concurrency=2)
+
+        remote_id = await backend.submit("fake-model", make_items("КП 1", "fail", "КП 3"))
+        while await backend.get_status(remote_id) == REMOTE_IN_PROGRESS:
+            await asyncio.sleep(0.01)
+
+        assert await backend.get_status(remote_id) == REMOTE_ENDED
+        results = await backend.fetch_results(remote_id)
+
+        assert results["batch-0"]["content"] == "echo: КП 1"
+        assert "error" in results["batch-1"]
+        assert results["batch-2"]["prompt_tokens"] == 10
+        # Пакет идет через бакет rate limiter пакетных запросов
+        assert provider.bulk_calls == 3
+
+    @pytest.mark.asyncio
+    async def test_concurrency_bounded(self):
+        """Одновременно выполняется не больше concurrency запросов"""
+        provider = FakeProvider(delay=0.05)
+        backend = LocalBatchBackend(provider, concurrency=2)
+
+        remote_id = await backend.submit("fake-model", make_items(*[f"КП {i}" for i in range(6)]))
+        await asyncio.sleep(0.02)
+
+        assert provider.calls == 2
+        await backend.cancel(remote_id)
@@ -0,0 +1,102 @@
+"""
+Тесты для токенов отмены LLM работы
+"""
+import asyncio
+
+import pytest
+
+from ..cancellation import CancellationToken, RequestCancelled, current_token
+
+
+class TestCancellationToken:
+    """Тесты прерывания работы и учета частичного расхода"""
+
+    @pytest.mark.asyncio
+    async def test_run_returns_result_with_token_in_context(self):
+        token = CancellationToken()
+
+        async def work():
+            return current_token()
+
+        assert await token.run(work()) is token
+        assert current_token() is None
+
+    @pytest.mark.asyncio
+    async def test_cancel_interrupts_work(self):
+        token = CancellationToken()
+        interrupted = []
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                interrupted.append(True)
+                raise
+
+        runner = asyncio.ensure_future(token.run(work()))
+        await asyncio.sleep(0)
+        token.cancel("client disconnected")
+
+        with pytest.raises(RequestCancelled) as error:
+            await runner
+        assert error.value.reason == "client disconnected"
+        assert interrupted == [True]
+
+    @pytest.mark.asyncio
+    async def test_partial_usage_recorded_on_interrupt(self):
+        recorded = []
+        token = CancellationToken(on_usage=recorded.append)
+
+        async def provider_call():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                current_token().record_usage("anthropic", "claude-3-haiku", 1200, 40, 0.002)
+                raise
+
+        runner = asyncio.ensure_future(token.run(provider_call()))
+        await asyncio.sleep(0)
+        token.cancel()
+
+        with pytest.raises(RequestCancelled):
+            await runner
+        assert recorded[0]["prompt_tokens"] == 1200
+        assert token.partial_cost == pytest.approx(0.002)
+
+    @pytest.mark.asyncio
+    async def test_watch_cancels_on_disconnect(self):
+        token = CancellationToken()
+        polls = []
+
+        async def is_disconnected():
+            polls.append(True)
+            return len(polls) > 2
+
+        with pytest.raises(RequestCancelled):
+            watcher = token.watch(is_disconnected, poll_interval=0.01)
+            await token.run(asyncio.sleep(10))
+        await watcher
+        assert token.reason == "client disconnected"
+
+    @pytest.mark.asyncio
+    async def test_watch_idle_waits_for_grace(self):
+        token = CancellationToken()
+        idle = {"value": False}
+
+        watcher = token.watch_idle(lambda: idle["value"], grace=0.05, poll_interval=0.01)
+        await asyncio.sleep(0.1)
+        assert not token.cancelled
+
+        idle["value"] = True
+        await asyncio.wait_for(watcher, timeout=1)
+        assert token.cancelled
+
+    @pytest.mark.asyncio
+    async def test_cancelled_token_rejects_new_work(self):
+        token = CancellationToken()
+        token.cancel()
+
+        coro = asyncio.sleep(0)
+        with pytest.raises(RequestCancelled):
+            await token.run(coro)
+        coro.close()
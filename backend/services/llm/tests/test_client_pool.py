@@ -0,0 +1,67 @@
+"""
+Тесты для пула клиентов AI провайдеров
+"""
+import httpx
+import pytest
+
+from .. import tokenizer
+from ..client_pool import ProviderClientPool
+
+
+MODEL = "gpt-3.5-turbo"
+
+
+def completion(request):
+    return httpx.Response(200, json={
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": MODEL,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "Ответ"},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+    })
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Без сети: словарь tiktoken не загружается, токены оцениваются
+    monkeypatch.setattr(tokenizer, "_get_tiktoken_encoding", lambda model: None)
+    pool = ProviderClientPool(idle_timeout=0)
+    monkeypatch.setattr(
+        pool, "_create_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(completion))
+    )
+    return pool
+
+
+class TestClientPool:
+    """Тесты пересоздания клиентов под общими провайдерами"""
+
+    @pytest.mark.asyncio
+    async def test_request_after_close_idle(self, pool):
+        provider = pool.get_provider("openai", "sk-test")
+        first = await provider.generate_text(MODEL, "Вопрос", max_tokens=10)
+        old_client = provider.client
+
+        assert await pool.close_idle() == 1
+
+        # Провайдер, сохраненный оркестратором, получает новый клиент пула
+        result = await provider.generate_text(MODEL, "Вопрос", max_tokens=10)
+        assert first["content"] == result["content"] == "Ответ"
+        assert provider.client is not old_client
+        assert pool.get_provider("openai", "sk-test") is provider
+        await pool.aclose()
+
+    @pytest.mark.asyncio
+    async def test_unhealthy_client_replaced(self, pool):
+        provider = pool.get_provider("openai", "sk-test")
+        old_client = provider.client
+
+        pool.mark_unhealthy("openai", "sk-test", "connection reset")
+
+        assert provider.client is not old_client
+        assert pool.get_stats()["clients"][0]["healthy"] is True
+        await pool.aclose()
@@ -0,0 +1,164 @@
+"""
+Тесты для потоков событий анализа
+"""
+import asyncio
+
+import pytest
+
+from ..event_stream import EventBroker, StreamNotFound, StreamInUse, format_sse, parse_last_event_id
+
+
+async def collect(broker, stream_id, last_event_id=0):
+    return [event async for event in broker.subscribe(stream_id, last_event_id)]
+
+
+class TestEventBroker:
+    """Тесты буфера переподключения и живой доставки"""
+
+    @pytest.mark.asyncio
+    async def test_live_events_until_completed(self):
+        broker = EventBroker()
+        broker.open("a1")
+        subscriber = asyncio.ensure_future(collect(broker, "a1"))
+        await asyncio.sleep(0)
+
+        broker.publish("a1", "partial", {"fields": {"company_name": "ООО Ромашка"}})
+        broker.publish("a1", "section", {"section": "budget"})
+        broker.publish("a1", "completed", {"result": {}})
+
+        events = await asyncio.wait_for(subscriber, timeout=1)
+        assert [event.type for event in events] == ["partial", "section", "completed"]
+        assert [event.id for event in events] == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_reconnect_resumes_after_last_event(self):
+        broker = EventBroker()
+        for index in range(4):
+            broker.publish("a1", "partial", {"index": index})
+
+        subscriber = asyncio.ensure_future(collect(broker, "a1", last_event_id=2))
+        await asyncio.sleep(0)
+        broker.publish("a1", "completed", {})
+
+        events = await asyncio.wait_for(subscriber, timeout=1)
+        assert [event.id for event in events] == [3, 4, 5]
+
+    @pytest.mark.asyncio
+    async def test_late_subscriber_gets_finished_stream(self):
+        broker = EventBroker()
+        broker.publish("a1", "progress", {"progress": 50})
+        broker.publish("a1", "completed", {"result": {"score": 80}})
+
+        events = await collect(broker, "a1")
+
+        assert events[-1].type == "completed"
+        assert events[-1].data["result"] == {"score": 80}
+
+    @pytest.mark.asyncio
+    async def test_gap_when_buffer_overflowed(self):
+        broker = EventBroker(buffer_size=3)
+        for index in range(6):
+            broker.publish("a1", "partial", {"index": index})
+        broker.publish("a1", "completed", {})
+
+        events = await collect(broker, "a1", last_event_id=1)
+
+        assert events[0].type == "gap"
+        assert events[0].data["missed_until"] == 4
+        assert [event.id for event in events[1:]] == [5, 6, 7]
+
+    @pytest.mark.asyncio
+    async def test_abandoned_producer_cancelled(self):
+        broker = EventBroker()
+        produced = []
+
+        async def chunks():
+            for index in range(100):
+                produced.append(index)
+                yield "chunk", {"index": index}
+                await asyncio.sleep(0)
+
+        await broker.pump("s1", chunks(), idle_timeout=0)
+
+        assert len(produced) == 1
+        assert broker.get("s1").closed
+        assert list(broker.get("s1").events)[-1].type == "cancelled"
+
+    @pytest.mark.asyncio
+    async def test_finished_streams_evicted(self):
+        broker = EventBroker(retention=0)
+        broker.publish("a1", "completed", {})
+        broker.open("a2")
+
+        assert broker.get("a1") is None
+
+    @pytest.mark.asyncio
+    async def test_idle_open_streams_evicted(self):
+        """Незавершенный поток без событий и подписчиков дольше idle_ttl удаляется"""
+        broker = EventBroker(idle_ttl=0)
+        broker.publish("a1", "progress", {})
+        broker.open("a2")
+
+        assert broker.get("a1") is None
+
+    @pytest.mark.asyncio
+    async def test_unknown_stream_not_created(self):
+        broker = EventBroker()
+
+        with pytest.raises(StreamNotFound):
+            await collect(broker, "missing")
+        assert await broker.wait_for("missing", timeout=0.01) is None
+        assert broker.get("missing") is None
+        assert broker.get_stats()["waiting_subscribers"] == 0
+
+    @pytest.mark.asyncio
+    async def test_subscriber_waits_for_stream(self):
+        """Клиент подключился до начала анализа и получает события с первого"""
+        broker = EventBroker()
+
+        async def subscribe_early():
+            await broker.wait_for("a1", timeout=1)
+            return await collect(broker, "a1")
+
+        subscriber = asyncio.ensure_future(subscribe_early())
+        await asyncio.sleep(0)
+        broker.publish("a1", "progress", {"progress": 10})
+        broker.publish("a1", "completed", {})
+
+        events = await asyncio.wait_for(subscriber, timeout=1)
+        assert [event.type for event in events] == ["progress", "completed"]
+
+    @pytest.mark.asyncio
+    async def test_reused_id_rejected(self):
+        """Второй анализ с тем же идентификатором не пишет в чужой поток"""
+        broker = EventBroker()
+
+        async def subscribe_early():
+            await broker.wait_for("a1", timeout=1)
+            return await collect(broker, "a1")
+
+        subscriber = asyncio.ensure_future(subscribe_early())
+        await asyncio.sleep(0)
+        broker.create("a1")
+        broker.publish("a1", "progress", {"progress": 10})
+
+        with pytest.raises(StreamInUse):
+            broker.create("a1")
+
+        broker.publish("a1", "completed", {})
+        events = await asyncio.wait_for(subscriber, timeout=1)
+        assert [event.type for event in events] == ["progress", "completed"]
+
+        # Завершенный поток хранится для переподключений - его буфер тоже не отдается
+        with pytest.raises(StreamInUse):
+            broker.create("a1")
+
+
+def test_sse_format():
+    broker = EventBroker()
+    event = broker.publish("a1", "section", {"section": "budget"})
+
+    assert format_sse(event).startswith('id: 1\nevent: section\ndata: {"timestamp"')
+    assert format_sse(None) == ": keepalive\n\n"
+    assert parse_last_event_id("7") == 7
+    assert parse_last_event_id("abc") == 0
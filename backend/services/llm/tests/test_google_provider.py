@@ -0,0 +1,60 @@
+"""
+Тесты для чтения синхронного стрима Gemini в потоке пула
+"""
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+from ..providers.google_provider import _iterate_off_loop
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+@pytest.mark.asyncio
+async def test_iterates_all_chunks():
+    chunks = await collect(_iterate_off_loop(lambda: iter(range(10)), buffer_size=2))
+
+    assert chunks == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_error_mid_stream_raised_after_received_chunks():
+    def start_stream():
+        yield "a"
+        yield "b"
+        raise ValueError("stream broken")
+
+    received = []
+    with pytest.raises(ValueError, match="stream broken"):
+        async for chunk in _iterate_off_loop(start_stream, buffer_size=1):
+            received.append(chunk)
+
+    assert received == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_consumer_exit_stops_reader_thread():
+    closed = threading.Event()
+    produced = []
+
+    def start_stream():
+        try:
+            for index in itertools.count():
+                produced.append(index)
+                yield index
+        finally:
+            closed.set()
+
+    stream = _iterate_off_loop(start_stream, buffer_size=1)
+    async for chunk in stream:
+        if chunk == 2:
+            break
+    await stream.aclose()
+
+    # Поток-читатель, ожидавший места в очереди, завершается, а не читает бесконечный стрим
+    assert await asyncio.to_thread(closed.wait, 5)
+    assert len(produced) < 10
@@ -0,0 +1,83 @@
+"""
+Тесты для дублирования медленных запросов
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from ..hedging import HedgeBudget, HedgingManager
+from ..orchestrator import LLMOrchestrator
+from ..providers.base import AIProviderError
+
+
+class TestHedgeBudget:
+    """Тесты бюджета дублей"""
+
+    def test_burst_then_ratio(self):
+        """После исчерпания burst дублируется не больше budget_ratio запросов"""
+        budget = HedgeBudget(budget_ratio=0.1, burst=2)
+
+        granted = 0
+        for _ in range(100):
+            budget.on_request()
+            if budget.try_acquire():
+                granted += 1
+
+        assert granted <= 2 + 10
+        assert budget.denied == 100 - granted
+        assert budget.get_stats()["hedged"] == granted
+
+    def test_balance_capped_by_burst(self):
+        budget = HedgeBudget(budget_ratio=0.5, burst=3)
+        for _ in range(100):
+            budget.on_request()
+
+        assert budget.balance == 3
+
+
+class TestHedgingManager:
+    """Тесты политик по типам задач"""
+
+    def test_disabled_by_default_flag(self):
+        manager = HedgingManager(enabled=False, policies={"search": {"percentile": 0.9}})
+
+        assert manager.policy("search") is None
+
+    def test_policy_per_task_type(self):
+        manager = HedgingManager(enabled=True, policies={"search": {"percentile": 0.9}})
+
+        assert manager.policy("search") == {"percentile": 0.9}
+        assert manager.policy("report_generation") is None
+
+    def test_hedge_delay_respects_min_delay(self):
+        policy = {"min_delay": 2.0}
+
+        assert HedgingManager.hedge_delay(policy, 0.5) == 2.0
+        assert HedgingManager.hedge_delay(policy, 7.5) == 7.5
+
+
+@pytest.mark.asyncio
+async def test_backup_not_hedged_stays_in_fallback():
+    """Основная модель упала до задержки дубля: резерв пробуется как обычный fallback"""
+    primary = ("anthropic", "claude-3-sonnet-20240229")
+    backup = ("openai", "gpt-4o")
+    last = ("anthropic", "claude-3-haiku-20240307")
+
+    orchestrator = LLMOrchestrator()
+    orchestrator.providers = {"anthropic": SimpleNamespace(), "openai": SimpleNamespace()}
+    orchestrator.hedging = HedgingManager(enabled=True, policies={"search": {"min_delay": 30.0}})
+    orchestrator._select_candidates = lambda *args, **kwargs: [primary, backup, last]
+
+    calls = []
+
+    async def task_func(provider, model, timeout):
+        calls.append(model)
+        if model == primary[1]:
+            raise AIProviderError("503 Service Unavailable", "anthropic", model)
+        return {"content": model}
+
+    request = SimpleNamespace(task_type="search", model_override=None, metadata=None)
+    result = await orchestrator._execute_with_fallback(task_func, request, max_retries=1)
+
+    assert result["content"] == backup[1]
+    assert calls == [primary[1], backup[1]]
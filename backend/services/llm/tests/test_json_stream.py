@@ -0,0 +1,62 @@
+"""
+Тесты для инкрементального разбора JSON из ответа модели
+"""
+from ..json_stream import StreamingJSONParser, parse_json_response
+
+
+class TestStreamingJSONParser:
+    """Тесты потокового разбора"""
+
+    def test_fields_emitted_as_they_close(self):
+        parser = StreamingJSONParser()
+
+        assert parser.feed('```json\n{"overall_score": 8') == {}
+        assert parser.feed('5, "criteria": {"budget": {"score": 7}') == {"overall_score": 85}
+        assert parser.feed('}, "recommendations": ["уточнить сроки"]') == {"criteria": {"budget": {"score": 7}}}
+        assert parser.feed('}\n```\nГотово!') == {"recommendations": ["уточнить сроки"]}
+
+        assert parser.done
+        assert parser.close() == {
+            "overall_score": 85,
+            "criteria": {"budget": {"score": 7}},
+            "recommendations": ["уточнить сроки"]
+        }
+        assert not parser.repaired
+
+    def test_brackets_inside_strings_ignored(self):
+        parser = StreamingJSONParser()
+
+        fields = parser.feed('{"summary": "см. раздел {2}, пункт \\"3]\\"", "score": 5}')
+
+        assert fields == {"summary": 'см. раздел {2}, пункт "3]"', "score": 5}
+
+    def test_truncated_output_repaired(self):
+        parser = StreamingJSONParser()
+        parser.feed('{"score": 70, "risks": ["сроки", "бюдж')
+
+        result = parser.close()
+
+        assert parser.repaired
+        assert result == {"score": 70, "risks": ["сроки", "бюдж"]}
+
+    def test_unrepairable_keeps_parsed_fields(self):
+        parser = StreamingJSONParser()
+        parser.feed('{"score": 70, "summ')
+
+        assert parser.close() == {"score": 70}
+
+
+class TestParseJsonResponse:
+    """Тесты разбора полного ответа"""
+
+    def test_nested_json_in_prose(self):
+        """Вложенный объект не обрезается на первой закрывающей скобке"""
+        text = 'Вот анализ:\n{"company": {"name": "ООО Строй"}, "score": 80}\nСпасибо.'
+
+        assert parse_json_response(text) == {"company": {"name": "ООО Строй"}, "score": 80}
+
+    def test_trailing_comma_repaired(self):
+        assert parse_json_response('{"a": [1, 2,], "b": 3,}') == {"a": [1, 2], "b": 3}
+
+    def test_no_json(self):
+        assert parse_json_response("Не удалось проанализировать документ") == {}
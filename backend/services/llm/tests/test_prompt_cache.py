@@ -0,0 +1,35 @@
+"""
+Тесты для кеширования промптов на стороне провайдера
+"""
+from types import SimpleNamespace
+
+from ..prompt_cache import cacheable_system, build_user_content, join_context, cache_usage
+
+
+class TestPromptCache:
+    """Тесты разметки стабильного префикса"""
+
+    def test_system_prompt_marked(self):
+        blocks = cacheable_system("Ты эксперт по анализу КП")
+
+        assert blocks == [{"type": "text", "text": "Ты эксперт по анализу КП", "cache_control": {"type": "ephemeral"}}]
+        assert cacheable_system(None) is None
+
+    def test_context_goes_first(self):
+        """ТЗ идет перед переменной частью, граница кеша - на последнем блоке контекста"""
+        content = build_user_content("Оцени КП", ["ТЗ", "Критерии"])
+
+        assert [block["text"] for block in content] == ["ТЗ", "Критерии", "Оцени КП"]
+        assert "cache_control" not in content[0]
+        assert content[1]["cache_control"] == {"type": "ephemeral"}
+        assert "cache_control" not in content[2]
+
+    def test_without_context_plain_prompt(self):
+        assert build_user_content("Оцени КП") == "Оцени КП"
+        assert join_context("Оцени КП", ["ТЗ"]) == "ТЗ\n\nОцени КП"
+
+    def test_cache_usage(self):
+        usage = SimpleNamespace(input_tokens=20, cache_creation_input_tokens=0, cache_read_input_tokens=3000)
+
+        assert cache_usage(usage) == {"cache_write_tokens": 0, "cache_read_tokens": 3000}
+        assert cache_usage(SimpleNamespace(input_tokens=20)) == {"cache_write_tokens": 0, "cache_read_tokens": 0}
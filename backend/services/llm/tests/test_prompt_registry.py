@@ -0,0 +1,48 @@
+"""
+Тесты для реестра скомпилированных шаблонов промптов
+"""
+import pytest
+
+from ..shared.prompt_registry import PromptRegistry, PromptTemplateError
+
+
+class TestPromptRegistry:
+    """Тесты компиляции, подстановки и версий шаблонов"""
+
+    def test_render_matches_str_format(self):
+        registry = PromptRegistry()
+        text = "ТЗ:\n{tz_content}\n\nКП:\n{kp_content}\nОценка {score:.1f}, JSON: {{\"ok\": true}}"
+        variables = {"tz_content": "требования", "kp_content": "предложение" * 1000, "score": 7.25}
+
+        registry.register("kp_analyzer/compare", text)
+
+        assert registry.render("kp_analyzer/compare", variables) == text.format(**variables)
+
+    def test_missing_variable(self):
+        registry = PromptRegistry()
+        registry.register("kp_analyzer/extract", "КП: {kp_content}")
+
+        with pytest.raises(KeyError):
+            registry.render("kp_analyzer/extract", {})
+
+    def test_placeholders_validated_at_registration(self):
+        registry = PromptRegistry()
+
+        with pytest.raises(PromptTemplateError):
+            registry.register("kp_analyzer/extract", "КП: {kp_content}", variables=["kp_content", "tz_content"])
+        with pytest.raises(PromptTemplateError):
+            registry.register("kp_analyzer/broken", "КП: {kp_content")
+        with pytest.raises(PromptTemplateError):
+            registry.register("kp_analyzer/positional", "КП: {0}")
+
+    def test_version_changes_with_content(self):
+        registry = PromptRegistry()
+
+        first = registry.register("general/summarize", "Резюмируй: {document_content}").version
+        same = registry.register("general/summarize", "Резюмируй: {document_content}").version
+        changed = registry.register("general/summarize", "Кратко резюмируй: {document_content}").version
+
+        assert first == same
+        assert first != changed
+        assert registry.version("general/summarize") == changed
+        assert registry.version("general/unknown") is None
@@ -0,0 +1,168 @@
+"""
+Тесты для rate limiter провайдеров
+"""
+import asyncio
+import pytest
+
+from .. import rate_limiter, tokenizer
+from ..config import settings
+from ..providers.base import BaseAIProvider, AIProviderError, APIKeyError
+from ..rate_limiter import TokenBucket, ModelRateLimiter
+
+
+class TestTokenBucket:
+    """Тесты token bucket"""
+    
+    def test_consume_and_refill(self):
+        bucket = TokenBucket(capacity=10, refill_per_second=5)
+        now = bucket.updated
+        
+        assert bucket.wait_time(10, now) == 0
+        bucket.consume(10)
+        assert bucket.wait_time(5, now) == pytest.approx(1.0)
+        assert bucket.wait_time(5, now + 1.0) == 0
+    
+    def test_oversized_request_waits_for_full_bucket(self):
+        bucket = TokenBucket(capacity=10, refill_per_second=10)
+        now = bucket.updated
+        bucket.consume(10)
+        
+        assert bucket.wait_time(1000, now) == pytest.approx(1.0)
+    
+    def test_adjust_refunds_unused_reservation(self):
+        bucket = TokenBucket(capacity=100, refill_per_second=1)
+        bucket.consume(80)
+        bucket.adjust(-50)
+        
+        assert bucket.tokens == pytest.approx(70, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_limiter_serves_waiters_in_order():
+    """Ожидающие корутины получают бюджет в порядке очереди"""
+    limiter = ModelRateLimiter("openai", "gpt-4", rpm=600, tpm=1_000_000)
+    limiter.requests.tokens = 0
+    order = []
+    
+    async def request(index):
+        await limiter.acquire(10)
+        order.append(index)
+    
+    await asyncio.gather(*(request(i) for i in range(3)))
+    
+    assert order == [0, 1, 2]
+    assert limiter.acquired == 3
+
+
+def test_bulk_limiter_separate_from_interactive(monkeypatch):
+    """Пакетные запросы получают свой бакет с долей квоты, вместе бакеты не превышают квоту"""
+    monkeypatch.setattr(settings, "BATCH_RATE_LIMIT_SHARE", 0.25)
+    registry = rate_limiter.RateLimiterRegistry()
+    quota = registry._quota("openai", "gpt-4")
+    
+    interactive = registry.get("openai", "gpt-4")
+    bulk = registry.get("openai", "gpt-4", bulk=True)
+    
+    assert bulk is not interactive
+    assert bulk.rpm == max(1, int(quota["rpm"] * 0.25))
+    assert interactive.rpm == int(quota["rpm"] * 0.75)
+    assert interactive.rpm + bulk.rpm <= quota["rpm"]
+    assert interactive.tpm + bulk.tpm <= quota["tpm"]
+    assert bulk.redis_key != interactive.redis_key
+    assert set(registry.get_stats()) == {"openai/gpt-4", "openai/gpt-4/bulk"}
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_feedback_shrinks_quota():
+    """429 уменьшает квоту вдвое, успехи постепенно ее возвращают"""
+    limiter = ModelRateLimiter("anthropic", "claude-3-haiku-20240307", rpm=60, tpm=60000, recovery_step=0.25)
+    
+    await limiter.on_rate_limited(retry_after=0.01)
+    assert limiter.factor == 0.5
+    assert limiter.get_stats()["effective_rpm"] == 30
+    
+    await limiter.on_success()
+    await limiter.on_success()
+    assert limiter.factor == 1.0
+
+
+class StreamingProvider(BaseAIProvider):
+    """Отдает ответ тремя чанками"""
+
+    def _get_available_models(self):
+        return {"model-a": {"supports_streaming": True}}
+
+    async def _make_request(self, model, messages, **kwargs):
+        return {"content": "один два три", "metadata": {}}
+
+    async def _make_streaming_request(self, model, messages, **kwargs):
+        for chunk in ("один", " два", " три"):
+            yield chunk
+
+
+@pytest.fixture
+def stream_limiter(monkeypatch):
+    monkeypatch.setattr(tokenizer, "_get_tiktoken_encoding", lambda model: None)
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    registry = rate_limiter.RateLimiterRegistry()
+    limiter = ModelRateLimiter("streaming", "model-a", rpm=600, tpm=6000)
+    registry._limiters[("streaming", "model-a")] = limiter
+    monkeypatch.setattr(rate_limiter, "_registry", registry)
+    return limiter
+
+
+@pytest.mark.asyncio
+async def test_stream_settles_reservation(stream_limiter):
+    """После стрима резерв max_tokens заменяется фактическим расходом"""
+    provider = StreamingProvider()
+    
+    chunks = [chunk async for chunk in provider.generate_text_stream("model-a", "Вопрос", max_tokens=1000)]
+    
+    assert chunks[-1]["is_complete"]
+    # Расход для учета бюджета: промпт и сгенерированное
+    assert chunks[-1]["usage"]["provider"] == "streaming"
+    assert chunks[-1]["usage"]["completion_tokens"] > 0
+    # Списаны промпт и ответ (десятки токенов), а не 1000 зарезервированных
+    assert stream_limiter.tokens.tokens > 6000 - 100
+
+
+@pytest.mark.asyncio
+async def test_stream_settles_reservation_on_close(stream_limiter):
+    """Клиент ушел посреди стрима: неиспользованный резерв тоже возвращается"""
+    provider = StreamingProvider()
+    
+    stream = provider.generate_text_stream("model-a", "Вопрос", max_tokens=1000)
+    await stream.__anext__()
+    await stream.aclose()
+    
+    assert stream_limiter.tokens.tokens > 6000 - 100
+
+
+class FailingProvider(StreamingProvider):
+    """Запрос завершается ошибкой провайдера"""
+
+    def __init__(self, error: Exception):
+        super().__init__()
+        self.name = "streaming"
+        self.error = error
+
+    async def _make_request(self, model, messages, **kwargs):
+        raise self.error
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error, max_spent", [
+    # Отклонен до обработки - резерв возвращается целиком
+    (APIKeyError("401", "streaming", "model-a"), 0),
+    # Мог быть обработан - в квоте остается только оценка промпта
+    (AIProviderError("500", "streaming", "model-a"), 100),
+    (RuntimeError("connection reset"), 100)
+])
+async def test_failed_request_settles_reservation(stream_limiter, error, max_spent):
+    """Ошибка запроса не оставляет в квоте резерв max_tokens"""
+    provider = FailingProvider(error)
+    
+    with pytest.raises(AIProviderError):
+        await provider.generate_text("model-a", "Вопрос", max_tokens=1000)
+    
+    assert stream_limiter.tokens.tokens >= 6000 - max_spent
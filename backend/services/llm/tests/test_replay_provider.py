@@ -0,0 +1,138 @@
+"""
+Тесты для записи и воспроизведения ответов провайдеров
+"""
+import time
+
+import pytest
+
+from ..providers.base import AIProviderError, RateLimitError
+from ..providers.replay_provider import ReplayProvider, ReplayStore, parse_latency
+
+
+class FakeUpstream:
+    """Реальный провайдер: ответ с usage и стрим из трех чанков"""
+
+    name = "anthropic"
+    supports_prompt_caching = False
+    models = {"claude-3-haiku-20240307": {"cost_per_1k_input": 0.00025, "cost_per_1k_output": 0.00125}}
+
+    def __init__(self):
+        self.calls = []
+
+    async def _make_request(self, model, messages, **kwargs):
+        self.calls.append((messages, kwargs))
+        usage = {"prompt_tokens": 120, "completion_tokens": 8, "total_tokens": 128}
+        return {"content": '{"score": 7}', "metadata": {"stop_reason": "end_turn", "usage": usage}}
+
+    async def _make_streaming_request(self, model, messages, **kwargs):
+        for chunk in ('{"score"', ": 7", "}"):
+            yield chunk
+
+
+MODEL = "claude-3-haiku-20240307"
+MESSAGES = [
+    {"role": "system", "content": "Ты эксперт по анализу КП"},
+    {"role": "user", "content": "Оцени КП"}
+]
+
+
+async def record(store):
+    recorder = ReplayProvider("anthropic", store, upstream=FakeUpstream())
+    await recorder._make_request(MODEL, MESSAGES, max_tokens=100, temperature=0.1, cached_context=["ТЗ"])
+    return [chunk async for chunk in recorder._make_streaming_request(MODEL, MESSAGES, max_tokens=100, temperature=0.1)]
+
+
+class TestReplayProvider:
+    """Тесты записи и детерминированного воспроизведения"""
+
+    @pytest.mark.asyncio
+    async def test_record_then_replay_from_disk(self, tmp_path):
+        path = str(tmp_path / "recordings.jsonl.gz")
+        chunks = await record(ReplayStore(path))
+
+        replay = ReplayProvider("anthropic", ReplayStore(path), latency="fixed:0")
+        response = await replay._make_request(MODEL, MESSAGES, max_tokens=100, temperature=0.1, cached_context=["ТЗ"])
+        replayed_chunks = [
+            chunk async for chunk in replay._make_streaming_request(MODEL, MESSAGES, max_tokens=100, temperature=0.1)
+        ]
+
+        assert response["content"] == '{"score": 7}'
+        assert response["metadata"]["usage"]["prompt_tokens"] == 120
+        assert replayed_chunks == chunks
+        assert replay.models[MODEL]["cost_per_1k_output"] == 0.00125
+        assert replay.replayed == 2
+
+    @pytest.mark.asyncio
+    async def test_context_joined_for_upstream_without_caching(self, tmp_path):
+        upstream = FakeUpstream()
+        recorder = ReplayProvider("anthropic", ReplayStore(str(tmp_path / "r.jsonl")), upstream=upstream)
+
+        await recorder._make_request(MODEL, MESSAGES, max_tokens=100, cached_context=["ТЗ"])
+
+        messages, kwargs = upstream.calls[0]
+        assert "cached_context" not in kwargs
+        assert messages[-1]["content"].startswith("ТЗ")
+
+    @pytest.mark.asyncio
+    async def test_strict_miss(self, tmp_path):
+        path = str(tmp_path / "recordings.jsonl")
+        await record(ReplayStore(path))
+
+        strict = ReplayProvider("anthropic", ReplayStore(path), latency="fixed:0")
+        lenient = ReplayProvider("anthropic", ReplayStore(path), latency="fixed:0", strict=False)
+        other = [{"role": "user", "content": "Другое КП"}]
+
+        with pytest.raises(AIProviderError):
+            await strict._make_request(MODEL, other, max_tokens=100)
+        assert (await lenient._make_request(MODEL, other, max_tokens=100))["content"] == '{"score": 7}'
+
+    @pytest.mark.asyncio
+    async def test_error_injection_deterministic(self, tmp_path):
+        path = str(tmp_path / "recordings.jsonl")
+        await record(ReplayStore(path))
+
+        async def outcomes(seed):
+            replay = ReplayProvider(
+                "anthropic", ReplayStore(path), latency="fixed:0",
+                rate_limit_rate=0.3, timeout_rate=0.2, seed=seed
+            )
+            result = []
+            for _ in range(20):
+                try:
+                    await replay._make_request(MODEL, MESSAGES, max_tokens=100, temperature=0.1, cached_context=["ТЗ"])
+                    result.append("ok")
+                except RateLimitError:
+                    result.append("429")
+                except AIProviderError:
+                    result.append("timeout")
+            return result
+
+        first = await outcomes(seed=42)
+
+        assert first == await outcomes(seed=42)
+        assert {"ok", "429", "timeout"} <= set(first)
+
+    @pytest.mark.asyncio
+    async def test_stream_timing_scaled(self, tmp_path):
+        store = ReplayStore(str(tmp_path / "recordings.jsonl"))
+        store.add({
+            "key": "x", "provider": "anthropic", "model": MODEL,
+            "chunks": [[0.02, "a"], [0.04, "b"], [0.1, "c"]]
+        })
+        replay = ReplayProvider("anthropic", store, latency_scale=0.5, strict=False)
+
+        started = time.monotonic()
+        chunks = [chunk async for chunk in replay._make_streaming_request(MODEL, MESSAGES)]
+
+        assert chunks == ["a", "b", "c"]
+        assert 0.04 <= time.monotonic() - started < 0.09
+
+
+class TestLatency:
+    """Тесты распределений задержки"""
+
+    def test_latency_distributions(self):
+        assert parse_latency("fixed:0.5")({}, None) == 0.5
+        assert parse_latency("recorded")({"latency": 1.2}, None) == 1.2
+        with pytest.raises(ValueError):
+            parse_latency("gamma:1")
@@ -0,0 +1,76 @@
+"""
+Тесты для кеша ответов LLM
+"""
+import pytest
+
+from ..response_cache import LRUCache, LLMResponseCache, build_cache_key
+
+
+class TestCacheKey:
+    """Тесты ключа кеша"""
+    
+    def test_key_depends_on_generation_params(self):
+        """Модель, температура и max_tokens входят в ключ"""
+        base = dict(task_type="text_analysis", content="КП", model="gpt-4", temperature=0.1, max_tokens=1000)
+        
+        assert build_cache_key(**base) == build_cache_key(**base)
+        assert build_cache_key(**base) != build_cache_key(**{**base, "model": "claude-3-opus"})
+        assert build_cache_key(**base) != build_cache_key(**{**base, "temperature": 0.2})
+        assert build_cache_key(**base) != build_cache_key(**{**base, "max_tokens": 2000})
+        assert build_cache_key(**base) != build_cache_key(**base, prompt_version="v2")
+    
+    def test_key_normalizes_whitespace(self):
+        """Переводы строк и хвостовые пробелы не меняют ключ"""
+        assert build_cache_key("text_analysis", "a \r\nb\n") == build_cache_key("text_analysis", "a\nb")
+
+
+class TestLRUCache:
+    """Тесты in-process уровня"""
+    
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2, max_bytes=1024, ttl=60)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        
+        assert cache.get("b") is None
+        assert cache.get("a") == "1"
+        assert cache.evictions == 1
+    
+    def test_evicts_by_size(self):
+        cache = LRUCache(max_entries=10, max_bytes=10, ttl=60)
+        cache.set("a", "x" * 6)
+        cache.set("b", "y" * 6)
+        
+        assert cache.get("a") is None
+        assert cache.get_stats()["bytes"] == 6
+    
+    def test_size_in_utf8_bytes(self):
+        """Объем считается в байтах: 6 символов кириллицы - 12 байт"""
+        cache = LRUCache(max_entries=10, max_bytes=10, ttl=60)
+        cache.set("a", "ответы")
+        
+        assert cache.get("a") is None
+        
+        cache.set("b", "отв")
+        assert cache.get_stats()["bytes"] == 6
+    
+    def test_expired_entry_is_miss(self):
+        cache = LRUCache(max_entries=10, max_bytes=1024, ttl=-1)
+        cache.set("a", "1")
+        
+        assert cache.get("a") is None
+        assert cache.expirations == 1
+
+
+@pytest.mark.asyncio
+async def test_response_cache_without_redis():
+    """Кеш работает без Redis (режим монолита)"""
+    cache = LLMResponseCache(max_entries=10, max_bytes=1024 * 1024, memory_ttl=60)
+    await cache.set("key", {"content": "ответ"})
+    
+    assert await cache.get("key") == {"content": "ответ"}
+    assert await cache.get("missing") is None
+    assert cache.get_stats()["memory"]["hits"] == 1
+    assert cache.get_stats()["redis"]["enabled"] is False
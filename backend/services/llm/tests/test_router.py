@@ -0,0 +1,211 @@
+"""
+Тесты для маршрутизации между провайдерами
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from .. import rate_limiter, tokenizer
+from ..config import settings
+from ..orchestrator import LLMOrchestrator
+from ..providers.base import BaseAIProvider, RateLimitError
+from ..router import ModelRouter, ModelHealth, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN, CIRCUIT_CLOSED
+
+
+PROVIDERS = {
+    "openai": SimpleNamespace(models={"gpt-4": {}, "gpt-3.5-turbo": {}}),
+    "anthropic": SimpleNamespace(models={"claude-3-opus-20240229": {}, "claude-3-haiku-20240307": {}})
+}
+FALLBACK_ORDER = ["openai", "anthropic"]
+
+
+def make_router(**kwargs) -> ModelRouter:
+    params = dict(
+        window_size=20,
+        failure_threshold=3,
+        open_seconds=30,
+        default_latency=5.0,
+        rank_penalty=0.5,
+        error_penalty=4.0
+    )
+    params.update(kwargs)
+    return ModelRouter(**params)
+
+
+class TestModelHealth:
+    """Тесты circuit breaker"""
+
+    def test_opens_after_consecutive_failures(self):
+        health = ModelHealth("anthropic", "claude", window_size=10, failure_threshold=3, open_seconds=30)
+
+        for _ in range(3):
+            health.record_failure(1.0, now=100.0)
+
+        assert health.state == CIRCUIT_OPEN
+        assert not health.is_available(now=110.0)
+
+    def test_half_open_allows_single_probe(self):
+        health = ModelHealth("anthropic", "claude", window_size=10, failure_threshold=1, open_seconds=30)
+        health.record_failure(1.0, now=100.0)
+
+        assert health.is_available(now=131.0)
+        assert health.state == CIRCUIT_HALF_OPEN
+
+        health.on_attempt()
+        assert not health.is_available(now=131.0)
+
+        health.record_success(0.5)
+        assert health.state == CIRCUIT_CLOSED
+        assert health.is_available(now=132.0)
+
+    def test_failed_probe_reopens(self):
+        health = ModelHealth("anthropic", "claude", window_size=10, failure_threshold=3, open_seconds=30)
+        for _ in range(3):
+            health.record_failure(1.0, now=100.0)
+
+        assert health.is_available(now=131.0)
+        health.on_attempt()
+        health.record_failure(1.0, now=131.0)
+
+        assert health.state == CIRCUIT_OPEN
+        assert not health.is_available(now=140.0)
+
+    def test_latency_percentiles(self):
+        health = ModelHealth("openai", "gpt-4", window_size=100, failure_threshold=3, open_seconds=30)
+        for latency in range(1, 101):
+            health.record_success(float(latency))
+
+        assert health.latency(0.5) == pytest.approx(50, abs=1)
+        assert health.latency(0.95) == pytest.approx(95, abs=1)
+        assert health.error_rate == 0.0
+
+
+class TestModelRouter:
+    """Тесты выбора модели"""
+
+    def test_tier_preference_without_stats(self):
+        """Без статистики порядок задается уровнем из TASK_MODEL_MAPPING"""
+        router = make_router()
+
+        default = router.candidates("text_analysis", PROVIDERS, FALLBACK_ORDER)
+        quality = router.candidates("text_analysis", PROVIDERS, FALLBACK_ORDER, tier="quality")
+
+        assert default[0] == ("openai", "gpt-4")
+        # В маппинге claude-3-opus без даты версии
+        assert quality[0] == ("anthropic", "claude-3-opus-20240229")
+
+    def test_model_override_first(self):
+        router = make_router()
+
+        candidates = router.candidates("text_analysis", PROVIDERS, FALLBACK_ORDER, model_override="claude-3-haiku-20240307")
+
+        assert candidates[0] == ("anthropic", "claude-3-haiku-20240307")
+        assert len(candidates) == len(set(candidates))
+
+    def test_open_circuit_moves_traffic(self):
+        """Модель с разомкнутой цепью уходит в конец списка"""
+        router = make_router()
+        for _ in range(3):
+            router.record_failure("openai", "gpt-4", 60.0)
+
+        candidates = router.candidates("text_analysis", PROVIDERS, FALLBACK_ORDER)
+
+        assert candidates[0] != ("openai", "gpt-4")
+        assert candidates[-1] == ("openai", "gpt-4")
+
+    def test_slow_model_loses_to_fast_alternative(self):
+        """Сильно выросшая задержка перевешивает предпочтение уровня"""
+        router = make_router()
+        for _ in range(10):
+            router.record_success("openai", "gpt-4", 40.0)
+            router.record_success("anthropic", "claude-3-opus-20240229", 3.0)
+
+        candidates = router.candidates("text_analysis", PROVIDERS, FALLBACK_ORDER)
+
+        assert candidates[0] == ("anthropic", "claude-3-opus-20240229")
+
+    def test_stats(self):
+        router = make_router()
+        router.record_success("openai", "gpt-4", 1.5)
+
+        stats = router.get_stats()
+
+        assert stats["openai/gpt-4"]["circuit"] == CIRCUIT_CLOSED
+        assert stats["openai/gpt-4"]["requests"] == 1
+
+
+class ThrottledProvider(BaseAIProvider):
+    """Первый запрос получает 429 с retry_after, следующие отвечают сразу"""
+
+    def __init__(self, retry_after: float):
+        super().__init__()
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def _get_available_models(self):
+        return {"model-a": {"context_window": 8000}}
+
+    async def _make_request(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise RateLimitError("429", self.name, model, retry_after=self.retry_after)
+        return {"content": "ok", "metadata": {}}
+
+    async def _make_streaming_request(self, model, messages, **kwargs):
+        yield "ok"
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_wait_not_counted_in_attempt_timeout(monkeypatch):
+    """Пауза rate limiter дольше таймаута попытки не превращается в ошибку модели"""
+    monkeypatch.setattr(tokenizer, "_get_tiktoken_encoding", lambda model: None)
+    monkeypatch.setattr(settings, "ROUTER_ATTEMPT_TIMEOUT", 0.5)
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    registry = rate_limiter.RateLimiterRegistry()
+    # Квота с запасом: ждать приходится только паузу после 429
+    registry._limiters[("throttled", "model-a")] = rate_limiter.ModelRateLimiter(
+        "throttled", "model-a", rpm=6000, tpm=10_000_000
+    )
+    monkeypatch.setattr(rate_limiter, "_registry", registry)
+
+    orchestrator = LLMOrchestrator()
+    orchestrator.providers = {"throttled": ThrottledProvider(retry_after=1)}
+    orchestrator.fallback_order = ["throttled"]
+    orchestrator.router = make_router()
+
+    async def task_func(provider, model, timeout):
+        return await provider.generate_text(model, "Вопрос", max_tokens=10, timeout=timeout)
+
+    request = SimpleNamespace(task_type="text_analysis", model_override=None, metadata=None)
+    result = await orchestrator._execute_with_fallback(task_func, request, max_retries=2)
+
+    assert result["content"] == "ok"
+    health = orchestrator.router.health("throttled", "model-a")
+    assert health.consecutive_failures == 0
+    assert health.error_rate == 0
+    # Задержка модели - время запроса, без секунды ожидания лимитера
+    assert health.latency(0.5) < 0.5
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_probe_releases_half_open(monkeypatch):
+    """429 на пробе half-open не оставляет модель навсегда занятой пробой"""
+    monkeypatch.setattr(tokenizer, "_get_tiktoken_encoding", lambda model: None)
+    orchestrator = LLMOrchestrator()
+    orchestrator.providers = {"throttled": ThrottledProvider(retry_after=1)}
+    orchestrator.fallback_order = ["throttled"]
+    orchestrator.router = make_router(failure_threshold=1, open_seconds=0)
+
+    health = orchestrator.router.health("throttled", "model-a")
+    health.record_failure(1.0)
+    assert health.is_available()
+    assert health.state == CIRCUIT_HALF_OPEN
+
+    async def task_func(provider, model, timeout):
+        raise RateLimitError("429", provider.name, model)
+
+    with pytest.raises(RateLimitError):
+        await orchestrator._attempt(task_func, "throttled", "model-a")
+
+    assert health.state == CIRCUIT_HALF_OPEN
+    assert health.is_available()
@@ -0,0 +1,192 @@
+"""
+Тесты для планировщика LLM запросов
+"""
+import asyncio
+import time
+
+import pytest
+
+from ..cancellation import CancellationToken, RequestCancelled
+from ..scheduler import LLMScheduler, SchedulerOverloaded, DeadlineExceeded, parse_deadline
+
+
+async def hold(scheduler, priority, tenant, started, gate, label):
+    async with scheduler.slot(priority, tenant):
+        started.append(label)
+        await gate.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestScheduling:
+    """Тесты порядка выдачи слотов"""
+
+    @pytest.mark.asyncio
+    async def test_priority_order(self):
+        scheduler = LLMScheduler(max_concurrency=1)
+        started, gate = [], asyncio.Event()
+
+        tasks = [asyncio.ensure_future(hold(scheduler, "standard", "a", started, gate, "first"))]
+        await settle()
+        for priority in ("bulk", "background", "standard", "interactive"):
+            tasks.append(asyncio.ensure_future(hold(scheduler, priority, "a", started, gate, priority)))
+        await settle()
+
+        gate.set()
+        await asyncio.gather(*tasks)
+
+        assert started == ["first", "interactive", "standard", "background", "bulk"]
+
+    @pytest.mark.asyncio
+    async def test_tenants_served_round_robin(self):
+        scheduler = LLMScheduler(max_concurrency=1)
+        started, gate = [], asyncio.Event()
+
+        tasks = [asyncio.ensure_future(hold(scheduler, "background", "big", started, gate, "first"))]
+        await settle()
+        for index in range(3):
+            tasks.append(asyncio.ensure_future(hold(scheduler, "background", "big", started, gate, f"big{index}")))
+        tasks.append(asyncio.ensure_future(hold(scheduler, "background", "small", started, gate, "small0")))
+        await settle()
+
+        gate.set()
+        await asyncio.gather(*tasks)
+
+        # Одна задача малого арендатора не ждет весь пакет большого
+        assert started == ["first", "big0", "small0", "big1", "big2"]
+
+    @pytest.mark.asyncio
+    async def test_class_share_leaves_room_for_interactive(self):
+        scheduler = LLMScheduler(max_concurrency=4)
+        started, gate = [], asyncio.Event()
+
+        tasks = [
+            asyncio.ensure_future(hold(scheduler, "bulk", "batch", started, gate, f"bulk{index}"))
+            for index in range(4)
+        ]
+        tasks.append(asyncio.ensure_future(hold(scheduler, "interactive", "user", started, gate, "interactive")))
+        await settle()
+
+        assert started == ["bulk0", "interactive"]
+        assert scheduler.get_stats()["classes"]["bulk"]["queue_depth"] == 3
+
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    @pytest.mark.asyncio
+    async def test_job_starts_when_higher_class_waits_at_share(self):
+        scheduler = LLMScheduler(max_concurrency=5)
+        started, gate = [], asyncio.Event()
+
+        # Фоновый класс занял свою долю (3 из 5 слотов), четвертая задача ждет
+        tasks = [
+            asyncio.ensure_future(hold(scheduler, "background", "reports", started, gate, f"background{index}"))
+            for index in range(4)
+        ]
+        await settle()
+        tasks.append(asyncio.ensure_future(hold(scheduler, "bulk", "batch", started, gate, "bulk")))
+        await settle()
+
+        assert started == ["background0", "background1", "background2", "bulk"]
+        assert scheduler.get_stats()["classes"]["background"]["queue_depth"] == 1
+
+        gate.set()
+        await asyncio.gather(*tasks)
+
+
+class TestAdmission:
+    """Тесты сброса нагрузки, дедлайнов и отмены"""
+
+    @pytest.mark.asyncio
+    async def test_shed_when_queue_full(self):
+        scheduler = LLMScheduler(max_concurrency=1, queue_limits={"background": 2})
+        started, gate = [], asyncio.Event()
+
+        tasks = [
+            asyncio.ensure_future(hold(scheduler, "background", "a", started, gate, index))
+            for index in range(3)
+        ]
+        await settle()
+
+        with pytest.raises(SchedulerOverloaded) as error:
+            await scheduler.acquire("background", "a")
+        assert error.value.retry_after >= 1
+        assert scheduler.get_stats()["classes"]["background"]["shed"] == 1
+
+        # Очередь другого класса не затронута
+        interactive = asyncio.ensure_future(hold(scheduler, "interactive", "b", started, gate, "interactive"))
+        await settle()
+        gate.set()
+        await asyncio.gather(interactive, *tasks)
+
+    @pytest.mark.asyncio
+    async def test_deadline_expires_in_queue(self):
+        scheduler = LLMScheduler(max_concurrency=1)
+        started, gate = [], asyncio.Event()
+        blocker = asyncio.ensure_future(hold(scheduler, "standard", "a", started, gate, "first"))
+        await settle()
+
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run(lambda: asyncio.sleep(0), "standard", "b", deadline=time.time() + 0.05)
+
+        stats = scheduler.get_stats()["classes"]["standard"]
+        assert stats["queue_depth"] == 0
+        assert stats["expired"] == 1
+
+        gate.set()
+        await blocker
+        assert scheduler.get_stats()["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_deadline_cancels_running_call(self):
+        scheduler = LLMScheduler(max_concurrency=1)
+
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run(lambda: asyncio.sleep(1), deadline=time.time() + 0.05)
+        assert scheduler.get_stats()["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_disconnected_caller_frees_queue(self):
+        scheduler = LLMScheduler(max_concurrency=1)
+        started, gate = [], asyncio.Event()
+        calls = []
+        blocker = asyncio.ensure_future(hold(scheduler, "standard", "a", started, gate, "first"))
+        await settle()
+
+        async def is_disconnected():
+            return True
+
+        token = CancellationToken()
+        watcher = token.watch(is_disconnected, poll_interval=0.01)
+        with pytest.raises(RequestCancelled):
+            await token.run(scheduler.run(lambda: asyncio.sleep(0, calls.append("called")), "standard", "b"))
+        await watcher
+        await settle()
+
+        gate.set()
+        await blocker
+        stats = scheduler.get_stats()
+        assert calls == []
+        assert stats["classes"]["standard"]["abandoned"] == 1
+        assert stats["active"] == 0
+
+    def test_parse_deadline(self):
+        assert parse_deadline({"x-request-deadline": "1700000000.5"}) == 1700000000.5
+        assert 9 < parse_deadline({"x-request-timeout": "10"}) - time.time() <= 10
+        assert parse_deadline({}) is None
+
+
+def test_queue_depth_in_prometheus_metrics():
+    pytest.importorskip("prometheus_client")
+    from ..metrics import register_scheduler_metrics, render_metrics
+
+    assert register_scheduler_metrics()
+    # Повторная регистрация (монолит, core/monitoring) не дублирует сборщик
+    assert register_scheduler_metrics()
+
+    payload, content_type = render_metrics()
+    assert content_type.startswith("text/plain")
+    assert b'llm_queue_depth{priority="interactive"}' in payload
@@ -0,0 +1,188 @@
+"""
+Тесты для объединения одинаковых LLM запросов
+"""
+import asyncio
+import time
+
+import pytest
+
+from .. import tokenizer
+from ..cancellation import CancellationToken, RequestCancelled, current_token
+from ..config import settings
+from ..orchestrator import LLMOrchestrator
+from ..providers.base import BaseAIProvider
+from ..scheduler import DeadlineExceeded
+from ..single_flight import SingleFlight
+from ...shared.llm_schemas import AIRequest, TaskType
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_call():
+    """Одновременные запросы с одним ключом выполняются один раз"""
+    flight = SingleFlight()
+    calls = 0
+    
+    async def provider_call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"content": "ответ"}
+    
+    results = await asyncio.gather(*(flight.do("key", provider_call) for _ in range(5)))
+    
+    assert calls == 1
+    assert [result for result, _ in results] == [{"content": "ответ"}] * 5
+    assert sum(coalesced for _, coalesced in results) == 4
+    assert flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_error_propagates_to_all_waiters():
+    """Ошибка провайдера получают все ожидающие"""
+    flight = SingleFlight()
+    
+    async def failing_call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+    
+    results = await asyncio.gather(
+        *(flight.do("key", failing_call) for _ in range(3)),
+        return_exceptions=True
+    )
+    
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelling_one_waiter_keeps_call_for_others():
+    """Отмена одного ожидающего не отменяет общий запрос"""
+    flight = SingleFlight()
+    
+    async def slow_call():
+        await asyncio.sleep(0.05)
+        return "ok"
+    
+    first = asyncio.create_task(flight.do("key", slow_call))
+    second = asyncio.create_task(flight.do("key", slow_call))
+    await asyncio.sleep(0)
+    first.cancel()
+    
+    assert await second == ("ok", True)
+    assert flight.cancelled == 0
+
+
+@pytest.mark.asyncio
+async def test_call_cancelled_when_all_waiters_gone():
+    """Запрос отменяется, когда его больше никто не ждет"""
+    flight = SingleFlight()
+    started = asyncio.Event()
+    
+    async def slow_call():
+        started.set()
+        await asyncio.sleep(10)
+    
+    waiter = asyncio.create_task(flight.do("key", slow_call))
+    await started.wait()
+    waiter.cancel()
+    
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert flight.cancelled == 1
+    assert flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_leader_cancellation_does_not_reach_followers():
+    """Отмена токена первого вызывающего прерывает только его ожидание"""
+    flight = SingleFlight()
+    
+    async def provider_call():
+        await asyncio.sleep(0.02)
+        # Как цикл fallback оркестратора между попытками
+        token = current_token()
+        if token:
+            token.raise_if_cancelled()
+        return "ok"
+    
+    leader_token = CancellationToken()
+    leader = asyncio.ensure_future(leader_token.run(flight.do("key", provider_call)))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flight.do("key", provider_call))
+    await asyncio.sleep(0)
+    leader_token.cancel("client gone")
+    
+    with pytest.raises(RequestCancelled):
+        await leader
+    assert await follower == ("ok", True)
+    assert flight.cancelled == 0
+
+
+class SlowProvider(BaseAIProvider):
+    """Отвечает через delay секунд"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.name = "openai"
+        self.delay = delay
+        self.calls = 0
+
+    def _get_available_models(self):
+        return {"gpt-4": {"context_window": 8000}}
+
+    async def _make_request(self, model, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"content": "ответ", "metadata": {}}
+
+    async def _make_streaming_request(self, model, messages, **kwargs):
+        yield "ответ"
+
+
+@pytest.mark.asyncio
+async def test_follower_keeps_own_deadline(monkeypatch):
+    """Истекший дедлайн первого запроса не обрывает объединенный с ним запрос без дедлайна"""
+    monkeypatch.setattr(tokenizer, "_get_tiktoken_encoding", lambda model: None)
+    monkeypatch.setattr(settings, "ENABLE_CACHING", False)
+    orchestrator = LLMOrchestrator()
+    provider = SlowProvider(delay=0.2)
+    orchestrator.providers = {"openai": provider}
+    orchestrator.fallback_order = ["openai"]
+    orchestrator.in_flight = SingleFlight()
+    
+    def request(metadata):
+        return AIRequest(task_type=TaskType.TEXT_ANALYSIS, content="Оцени КП", metadata=metadata)
+    
+    leader = asyncio.ensure_future(orchestrator.generate_text(request({"deadline": time.time() + 0.05})))
+    await asyncio.sleep(0.01)
+    follower = await orchestrator.generate_text(request({}))
+    
+    with pytest.raises(DeadlineExceeded):
+        await leader
+    assert follower.error is None
+    assert follower.content == "ответ"
+    assert follower.metadata["coalesced"]
+    assert provider.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_coalesced_call_records_partial_usage(monkeypatch):
+    """Прерванный отменой общий вызов учитывает отправленный промпт в токене вызывающего"""
+    monkeypatch.setattr(tokenizer, "_get_tiktoken_encoding", lambda model: None)
+    monkeypatch.setattr(settings, "ENABLE_CACHING", False)
+    orchestrator = LLMOrchestrator()
+    provider = SlowProvider(delay=1.0)
+    orchestrator.providers = {"openai": provider}
+    orchestrator.fallback_order = ["openai"]
+    orchestrator.in_flight = SingleFlight()
+    
+    token = CancellationToken()
+    request = AIRequest(task_type=TaskType.TEXT_ANALYSIS, content="Оцени КП", metadata={})
+    runner = asyncio.ensure_future(token.run(orchestrator.generate_text(request)))
+    await asyncio.sleep(0.1)
+    token.cancel("client disconnected")
+    
+    with pytest.raises(RequestCancelled):
+        await runner
+    assert orchestrator.in_flight.cancelled == 1
+    assert len(token.partial_usage) == 1
+    assert token.partial_usage[0]["prompt_tokens"] > 0
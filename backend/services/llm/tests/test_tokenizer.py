@@ -0,0 +1,77 @@
+"""
+Тесты для подсчета токенов
+"""
+from ..tokenizer import (
+    count_tokens, count_message_tokens, model_family,
+    split_text_by_tokens, usage_from_metadata
+)
+
+
+class TestCountTokens:
+    """Тесты подсчета токенов"""
+
+    def test_model_family(self):
+        """Семейство определяется по провайдеру или имени модели"""
+        assert model_family("gpt-4") == "openai"
+        assert model_family("claude-3-opus-20240229") == "anthropic"
+        assert model_family("gemini-pro") == "google"
+        assert model_family("unknown", provider="anthropic") == "anthropic"
+        assert model_family(None) == "default"
+
+    def test_cyrillic_costs_more_than_latin(self):
+        """Кириллица дает больше токенов на символ, чем латиница"""
+        russian = "Коммерческое предложение по строительству объекта"
+        english = "a" * len(russian)
+
+        assert count_tokens(russian, "claude-3-haiku-20240307") > count_tokens(english, "claude-3-haiku-20240307")
+
+    def test_empty_text(self):
+        assert count_tokens("", "gpt-4") == 0
+        assert count_message_tokens([], "gpt-4") == 0
+
+    def test_message_overhead(self):
+        """Каждое сообщение добавляет служебные токены"""
+        messages = [{"role": "user", "content": "Привет"}]
+
+        assert count_message_tokens(messages, "claude-3-haiku-20240307") > count_tokens("Привет", "claude-3-haiku-20240307")
+
+
+class TestUsageFromMetadata:
+    """Тесты usage провайдера"""
+
+    def test_provider_usage(self):
+        usage = usage_from_metadata({"usage": {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150}})
+
+        assert usage == {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150}
+
+    def test_missing_usage(self):
+        """Нулевой или отсутствующий usage - повод считать локально"""
+        assert usage_from_metadata(None) is None
+        assert usage_from_metadata({}) is None
+        assert usage_from_metadata({"usage": {"prompt_tokens": 0, "completion_tokens": 0}}) is None
+
+
+class TestSplitText:
+    """Тесты разбиения текста по токенам"""
+
+    def test_short_text_not_split(self):
+        assert split_text_by_tokens("Короткий текст", 100) == ["Короткий текст"]
+
+    def test_chunks_fit_budget(self):
+        """Все части укладываются в бюджет, текст не теряется"""
+        paragraphs = [f"Раздел {i}. " + "Требования к поставке оборудования. " * 20 for i in range(10)]
+        text = "\n\n".join(paragraphs)
+
+        chunks = split_text_by_tokens(text, 300, "claude-3-haiku-20240307")
+
+        assert len(chunks) > 1
+        assert all(count_tokens(chunk, "claude-3-haiku-20240307") <= 300 for chunk in chunks)
+        assert "\n\n".join(chunks) == text
+
+    def test_long_line_split_by_chars(self):
+        """Строка без переводов строк режется по символам"""
+        text = "Б" * 5000
+
+        chunks = split_text_by_tokens(text, 200)
+
+        assert "".join(chunks) == text
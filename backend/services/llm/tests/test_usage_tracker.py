@@ -0,0 +1,291 @@
+"""
+Тесты для буфера учета использования AI
+"""
+import asyncio
+from datetime import date
+
+import pytest
+
+from ..config import settings
+from ..usage_tracker import UsageTracker, UsageLimitExceeded, cover_range, week_period
+from ..shared.llm_schemas import AIProvider, TaskType
+
+
+class FakePipeline:
+    """Pipeline Redis, складывающий hincrby/hincrbyfloat в словарь"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def hincrby(self, key, field, amount):
+        self.commands.append((key, field, amount))
+
+    hincrbyfloat = hincrby
+
+    def expire(self, key, ttl):
+        self.commands.append(None)
+
+    def hgetall(self, key):
+        self.commands.append(("hgetall", key))
+
+    def eval(self, script, numkeys, *args):
+        self.commands.append(("release", args[:numkeys], args[numkeys:]))
+
+    async def execute(self):
+        if self.redis.fail:
+            raise ConnectionError("redis down")
+        self.redis.executions += 1
+        results = []
+        for command in self.commands:
+            if command is None:
+                results.append(True)
+                continue
+            if command[0] == "hgetall":
+                values = self.redis.data.get(command[1], {})
+                results.append({field.encode(): str(value).encode() for field, value in values.items()})
+                continue
+            if command[0] == "release":
+                results.append(self.redis.release(*command[1:]))
+                continue
+            key, field, amount = command
+            values = self.redis.data.setdefault(key, {})
+            values[field] = values.get(field, 0) + amount
+            results.append(values[field])
+        return results
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.executions = 0
+        self.fail = False
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        async def reserve(keys, args):
+            """Логика RESERVE_SCRIPT"""
+            count = len(keys) // 2
+            cost, limits = args[0], args[1:count + 1]
+            now, expires, lease = args[2 * count + 1:]
+            for index, (key, limit) in enumerate(zip(keys, limits), start=1):
+                values = self.data.setdefault(key, {})
+                leases = self.data.setdefault(keys[count + index - 1], {})
+                for member in [member for member, score in leases.items() if score <= now]:
+                    values["reserved"] = values.get("reserved", 0) - float(member.rsplit(":", 1)[1])
+                    del leases[member]
+                if values.get("cost", 0) + values.get("reserved", 0) + cost > limit:
+                    return index
+            for key, leases_key in zip(keys[:count], keys[count:]):
+                values = self.data.setdefault(key, {})
+                values["reserved"] = values.get("reserved", 0) + cost
+                self.data[leases_key][lease] = expires
+            return 0
+        return reserve
+
+    def release(self, keys, args):
+        """Логика RELEASE_SCRIPT"""
+        count = len(keys) // 2
+        lease, amount = args
+        for key, leases_key in zip(keys[:count], keys[count:]):
+            if self.data.get(leases_key, {}).pop(lease, None) is not None:
+                self.data[key]["reserved"] -= amount
+        return 0
+
+
+def make_tracker(**kwargs):
+    tracker = UsageTracker(session_factory=lambda: None, flush_interval=3600, **kwargs)
+    tracker.redis_client = FakeRedis()
+    tracker.written = []
+    tracker._write_db = tracker.written.append
+    return tracker
+
+
+async def track(tracker, user_id=1, organization_id=2, model="claude-3-haiku", cost=0.01, success=True, reservation=None):
+    await tracker.track_request(
+        user_id, organization_id, AIProvider.ANTHROPIC, model, TaskType.COMPARISON,
+        prompt_tokens=100, completion_tokens=20, cost_usd=cost, response_time=2.0, success=success,
+        reservation=reservation
+    )
+
+
+class TestUsageBuffer:
+    """Тесты объединения событий и пакетной записи"""
+
+    @pytest.mark.asyncio
+    async def test_events_coalesced_per_key(self):
+        tracker = make_tracker()
+
+        for _ in range(3):
+            await track(tracker)
+        await track(tracker, success=False)
+        await track(tracker, model="claude-3-5-sonnet")
+
+        stats = tracker.get_buffer_stats()
+        assert stats["db_buffered_keys"] == 2
+        assert stats["pending_events"] == 5
+        assert tracker.redis_client.executions == 0
+
+        assert await tracker.flush() == 2
+
+        batch = tracker.written[0]
+        bucket = next(value for key, value in batch.items() if key[3] == "claude-3-haiku")
+        assert bucket["requests"] == 4
+        assert bucket["errors"] == 1
+        assert bucket["prompt_tokens"] == 400
+        assert bucket["response_time"] == 8.0
+
+        redis = tracker.redis_client
+        assert redis.executions == 1
+        user_key = next(key for key in redis.data if key.startswith("usage:user:1:"))
+        assert redis.data[user_key]["requests"] == 5
+        assert redis.data[user_key]["tokens"] == 600
+        assert tracker.get_buffer_stats()["pending_events"] == 0
+
+    @pytest.mark.asyncio
+    async def test_flush_on_batch_size(self):
+        tracker = make_tracker(flush_batch_size=3)
+        tracker.start()
+
+        for _ in range(3):
+            await track(tracker)
+        await asyncio.sleep(0.05)
+
+        assert len(tracker.written) == 1
+        assert tracker.get_buffer_stats()["flushes"] == 1
+        await tracker.aclose()
+
+    @pytest.mark.asyncio
+    async def test_bounded_buffer_drops_new_keys(self):
+        tracker = make_tracker(max_keys=2)
+
+        await track(tracker, model="a")
+        await track(tracker, model="b")
+        await track(tracker, model="c")
+        await track(tracker, model="a")
+
+        stats = tracker.get_buffer_stats()
+        assert stats["db_buffered_keys"] == 2
+        assert stats["dropped_events"] == 2  # Событие "c" не попало ни в Redis, ни в БД
+
+    @pytest.mark.asyncio
+    async def test_failed_sink_requeued(self):
+        tracker = make_tracker()
+        tracker.redis_client.fail = True
+
+        await track(tracker)
+        await tracker.flush()
+
+        stats = tracker.get_buffer_stats()
+        assert len(tracker.written) == 1
+        assert stats["redis_buffered_keys"] == 1
+        assert stats["db_buffered_keys"] == 0
+        assert stats["failed_flushes"] == 1
+
+        tracker.redis_client.fail = False
+        await track(tracker)
+        await tracker.flush()
+
+        user_key = next(key for key in tracker.redis_client.data if key.startswith("usage:user:1:"))
+        assert tracker.redis_client.data[user_key]["requests"] == 2
+
+    @pytest.mark.asyncio
+    async def test_shutdown_flushes_buffer(self):
+        tracker = make_tracker()
+        tracker.start()
+
+        await track(tracker)
+        await tracker.aclose()
+
+        assert len(tracker.written) == 1
+        assert tracker.get_buffer_stats()["pending_events"] == 0
+
+
+
+class TestBudgets:
+    """Тесты резервирования бюджетов до вызова провайдера"""
+
+    @pytest.mark.asyncio
+    async def test_reserve_and_release(self):
+        tracker = make_tracker()
+        await tracker.set_user_limits(1, daily_cost_limit=0.05)
+        user_key = f"usage:user:1:{date.today().isoformat()}"
+
+        reservation = await tracker.reserve(1, 2, 0.03)
+        assert tracker.redis_client.data[user_key]["reserved"] == 0.03
+
+        # Резерв учитывается, пока запрос в работе
+        with pytest.raises(UsageLimitExceeded) as error:
+            await tracker.reserve(1, 2, 0.03)
+        assert error.value.scope == "user 1 daily"
+
+        await track(tracker, cost=0.02, reservation=reservation)
+        await tracker.flush()
+
+        assert tracker.redis_client.data[user_key]["cost"] == 0.02
+        assert tracker.redis_client.data[user_key]["reserved"] == 0
+        assert await tracker.reserve(1, 2, 0.03) is not None
+
+    @pytest.mark.asyncio
+    async def test_lost_release_expires_with_lease(self, monkeypatch):
+        """Резерв, снятие которого не дошло до Redis, не расходует бюджет навсегда"""
+        monkeypatch.setattr(settings, "USAGE_RESERVATION_LEASE", 0)
+        tracker = make_tracker()
+        await tracker.set_user_limits(1, daily_cost_limit=0.05)
+        user_key = f"usage:user:1:{date.today().isoformat()}"
+
+        # Процесс упал до записи буфера: release не вызван
+        assert await tracker.reserve(1, 2, 0.03) is not None
+
+        reservation = await tracker.reserve(1, 2, 0.03)
+        assert reservation is not None
+        assert tracker.redis_client.data[user_key]["reserved"] == pytest.approx(0.03)
+        assert list(tracker.redis_client.data[f"{user_key}:leases"]) == [reservation["lease"]]
+
+        # Снятие уже просроченного резерва не вычитает его второй раз
+        tracker.release(reservation)
+        await tracker.reserve(1, 2, 0.01)
+        await tracker.flush()
+        assert tracker.redis_client.data[user_key]["reserved"] == pytest.approx(0.01)
+
+    @pytest.mark.asyncio
+    async def test_in_memory_limits_without_redis(self):
+        tracker = make_tracker()
+        tracker.redis_client = None
+        await tracker.set_organization_limits(2, monthly_cost_limit=0.05)
+
+        await track(tracker, cost=0.04)
+
+        assert await tracker.reserve(1, 2, 0.01) is None
+        with pytest.raises(UsageLimitExceeded):
+            await tracker.reserve(1, 2, 0.02)
+
+
+class TestRollups:
+    """Тесты недельных и месячных сводок"""
+
+    def test_cover_range(self):
+        periods = cover_range(date(2024, 4, 30), date(2024, 6, 12))
+
+        assert periods == [
+            "2024-04-30", "month:2024-05", "2024-06-01", "2024-06-02",
+            "week:2024-W23", "2024-06-10", "2024-06-11", "2024-06-12"
+        ]
+
+    @pytest.mark.asyncio
+    async def test_stats_from_rollups(self):
+        tracker = make_tracker()
+        await track(tracker, cost=0.5)
+        await tracker.flush()
+        today = date.today()
+
+        stats = await tracker.get_usage_stats(
+            user_id=1, start_date=today.replace(day=1), end_date=today, daily=False
+        )
+
+        assert stats["summary"]["total_requests"] == 1
+        assert stats["summary"]["total_cost"] == 0.5
+        assert stats["daily_breakdown"] == []
+        assert f"usage:org:2:{week_period(today)}" in tracker.redis_client.data
@@ -0,0 +1,175 @@
+"""
+Подсчет токенов для LLM Service DevAssist Pro
+Токенизаторы по семействам моделей и калиброванная оценка для кириллицы
+"""
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Символов на токен по семействам моделей (калибровка на русскоязычных КП/ТЗ).
+# Кириллица токенизируется заметно хуже латиницы, поэтому считается отдельно.
+CHARS_PER_TOKEN = {
+    "openai": {"cyrillic": 2.6, "latin": 4.0, "digit": 2.8, "other": 1.6},
+    "anthropic": {"cyrillic": 2.3, "latin": 3.8, "digit": 2.5, "other": 1.5},
+    "google": {"cyrillic": 3.0, "latin": 4.2, "digit": 3.0, "other": 1.8},
+    "default": {"cyrillic": 2.3, "latin": 3.8, "digit": 2.5, "other": 1.5}
+}
+
+# Служебные токены на сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CYRILLIC_RE = re.compile(r"[Ѐ-ӿ]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_DIGIT_RE = re.compile(r"[0-9]")
+_SPACE_RE = re.compile(r"\s")
+
+
+def model_family(model: Optional[str], provider: Optional[str] = None) -> str:
+    """Семейство модели для выбора токенизатора"""
+    if provider in CHARS_PER_TOKEN:
+        return provider
+
+    name = (model or "").lower()
+    if name.startswith(("gpt-", "o1", "text-embedding")):
+        return "openai"
+    if name.startswith("claude"):
+        return "anthropic"
+    if name.startswith("gemini"):
+        return "google"
+    return "default"
+
+
+@lru_cache(maxsize=16)
+def _get_tiktoken_encoding(model: str):
+    """Кешированный tiktoken encoder (None, если tiktoken не установлен)"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def estimate_tokens_heuristic(text: str, family: str = "default") -> int:
+    """Оценка числа токенов по классам символов"""
+    if not text:
+        return 0
+
+    ratios = CHARS_PER_TOKEN.get(family, CHARS_PER_TOKEN["default"])
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    latin = len(_LATIN_RE.findall(text))
+    digits = len(_DIGIT_RE.findall(text))
+    spaces = len(_SPACE_RE.findall(text))
+    other = len(text) - cyrillic - latin - digits - spaces
+
+    estimate = (
+        cyrillic / ratios["cyrillic"]
+        + latin / ratios["latin"]
+        + digits / ratios["digit"]
+        + other / ratios["other"]
+    )
+    return max(1, int(round(estimate)))
+
+
+def count_tokens(text: str, model: Optional[str] = None, provider: Optional[str] = None) -> int:
+    """
+    Число токенов в тексте: точный токенизатор, где он доступен локально
+    (tiktoken для OpenAI), иначе калиброванная оценка.
+    """
+    if not text:
+        return 0
+
+    family = model_family(model, provider)
+    if family == "openai":
+        encoding = _get_tiktoken_encoding(model or "gpt-4")
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+
+    return estimate_tokens_heuristic(text, family)
+
+
+def count_message_tokens(
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    provider: Optional[str] = None
+) -> int:
+    """Оценка токенов промпта из списка сообщений"""
+    return sum(
+        count_tokens(message.get("content", ""), model, provider) + MESSAGE_OVERHEAD_TOKENS
+        for message in messages
+    )
+
+
+def usage_from_metadata(metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+    """Usage, сообщенный провайдером (None, если провайдер его не вернул)"""
+    usage = (metadata or {}).get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    if prompt_tokens <= 0 and completion_tokens <= 0:
+        return None
+
+    return {
+        "prompt_tokens": int(prompt_tokens),
+        "completion_tokens": int(completion_tokens),
+        "total_tokens": int(usage.get("total_tokens") or prompt_tokens + completion_tokens)
+    }
+
+
+def _pack_pieces(
+    pieces: List[str],
+    separator: str,
+    max_tokens: int,
+    model: Optional[str],
+    provider: Optional[str]
+) -> List[str]:
+    """Жадная упаковка частей текста в чанки не больше max_tokens"""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model, provider)
+
+        if piece_tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            if "\n" in piece:
+                chunks.extend(_pack_pieces(piece.split("\n"), "\n", max_tokens, model, provider))
+            else:
+                # Строка без переводов строк - режем по доле символов
+                chars_per_chunk = max(1, int(len(piece) * max_tokens / piece_tokens))
+                chunks.extend(piece[i:i + chars_per_chunk] for i in range(0, len(piece), chars_per_chunk))
+            continue
+
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_text_by_tokens(
+    text: str,
+    max_tokens: int,
+    model: Optional[str] = None,
+    provider: Optional[str] = None
+) -> List[str]:
+    """
+    Разбить текст на части не больше max_tokens по границам абзацев
+    (слишком длинные абзацы режутся по строкам, затем по символам).
+    """
+    if count_tokens(text, model, provider) <= max_tokens:
+        return [text]
+
+    return _pack_pieces(re.split(r"\n\s*\n", text), "\n\n", max_tokens, model, provider)
@@ -1,32 +1,202 @@
 """
 Отслеживание использования и затрат AI для LLM Service DevAssist Pro
 Согласно ТЗ Этап 4: Cost tracking и AI usage мониторинг
+
+track_request не выполняет I/O: события объединяются в памяти по
+(пользователь, организация, провайдер, модель, тип задачи, день) и
+записываются в Redis и БД пакетами - по размеру буфера или по таймеру.
+Бюджеты проверяются до вызова провайдера (reserve) одним Lua-скриптом
+по дневным и месячным счетчикам.
 """
 import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from datetime import datetime, timedelta, date
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
 import aioredis
 import json
 
+from ..shared.database import get_db_session
 from ..shared.llm_models import (
     AIRequest as AIRequestModel, UsageStatistics, AIModel, 
-    ProviderStatus, AIConfiguration
+    ProviderStatus, AIConfiguration, AIProviderEnum, TaskTypeEnum
 )
+from ..shared.models import AIUsage
 from ..shared.llm_schemas import AIProvider, TaskType
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
+# TTL счетчиков в Redis: дни, недели и месяцы (месячные - для годовых отчетов)
+DAILY_KEY_TTL = 30 * 24 * 3600
+WEEKLY_KEY_TTL = 120 * 24 * 3600
+MONTHLY_KEY_TTL = 400 * 24 * 3600
+
+# Атомарная проверка бюджетов и резервирование оценки стоимости.
+# KEYS - хеши счетчиков периодов, затем по sorted set аренд резервов на каждый;
+# ARGV - стоимость, лимиты и TTL по хешам, текущее время, срок аренды, аренда.
+# Поле reserved - оценка запросов в работе, снимается при записи фактической стоимости.
+# Аренда ("<id>:<сумма>" со сроком в score) снимает резерв сама, если release
+# не дошел до Redis (процесс упал до записи буфера): просроченные аренды
+# вычитаются из reserved при следующей проверке бюджета.
+RESERVE_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local count = #KEYS / 2
+local now = tonumber(ARGV[2 * count + 2])
+local expires = tonumber(ARGV[2 * count + 3])
+local lease = ARGV[2 * count + 4]
+for i = 1, count do
+    local leases = KEYS[count + i]
+    local expired = redis.call('ZRANGEBYSCORE', leases, '-inf', now)
+    if #expired > 0 then
+        local lost = 0
+        for _, member in ipairs(expired) do
+            lost = lost + tonumber(string.match(member, ':([^:]+)$'))
+        end
+        redis.call('HINCRBYFLOAT', KEYS[i], 'reserved', -lost)
+        redis.call('ZREMRANGEBYSCORE', leases, '-inf', now)
+    end
+    local values = redis.call('HMGET', KEYS[i], 'cost', 'reserved')
+    local spent = (tonumber(values[1]) or 0) + (tonumber(values[2]) or 0)
+    if spent + cost > tonumber(ARGV[i + 1]) then
+        return i
+    end
+end
+for i = 1, count do
+    local ttl = ARGV[count + i + 1]
+    redis.call('HINCRBYFLOAT', KEYS[i], 'reserved', cost)
+    redis.call('ZADD', KEYS[count + i], expires, lease)
+    redis.call('EXPIRE', KEYS[i], ttl)
+    redis.call('EXPIRE', KEYS[count + i], ttl)
+end
+return 0
+"""
+
+# Снятие резерва по аренде: только если она еще не просрочена и не снята
+# (повтор после сбоя записи не вычитает резерв дважды).
+# KEYS - как в RESERVE_SCRIPT; ARGV - аренда, сумма.
+RELEASE_SCRIPT = """
+local count = #KEYS / 2
+for i = 1, count do
+    if redis.call('ZREM', KEYS[count + i], ARGV[1]) == 1 then
+        redis.call('HINCRBYFLOAT', KEYS[i], 'reserved', -tonumber(ARGV[2]))
+    end
+end
+return 0
+"""
+
+# (user_id, organization_id, provider, model, task_type, день)
+BucketKey = Tuple[Optional[int], Optional[int], str, str, str, date]
+
+
+class UsageLimitExceeded(Exception):
+    """Исчерпан бюджет пользователя или организации"""
+
+    def __init__(self, scope: str, limit: float):
+        self.scope = scope
+        self.limit = limit
+        super().__init__(f"Usage limit exceeded for {scope} (${limit:.2f})")
+
+
+def week_period(day: date) -> str:
+    iso_year, iso_week, _ = day.isocalendar()
+    return f"week:{iso_year}-W{iso_week:02d}"
+
+
+def month_period(day: date) -> str:
+    return f"month:{day.strftime('%Y-%m')}"
+
+
+def cover_range(start_date: date, end_date: date) -> List[str]:
+    """
+    Минимальный набор периодов (месяцы, ISO-недели, дни), покрывающий
+    интервал: год статистики - 12 ключей вместо 365
+    """
+    periods = []
+    current = start_date
+    while current <= end_date:
+        next_month = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if current.day == 1 and next_month - timedelta(days=1) <= end_date:
+            periods.append(month_period(current))
+            current = next_month
+        elif current.weekday() == 0 and current + timedelta(days=6) <= end_date:
+            periods.append(week_period(current))
+            current += timedelta(days=7)
+        else:
+            periods.append(current.isoformat())
+            current += timedelta(days=1)
+    return periods
+
+
+def _new_bucket() -> Dict[str, Any]:
+    return {
+        "requests": 0,
+        "errors": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cost": 0.0,
+        "response_time": 0.0  # Сумма, среднее считается при записи
+    }
+
+
+def _merge_bucket(target: Dict[str, Any], source: Dict[str, Any]):
+    for field, value in source.items():
+        target[field] += value
+
+
+def _lease_keys(keys: List[str]) -> List[str]:
+    """Хеши счетчиков и sorted set аренд их резервов - KEYS скриптов бюджета"""
+    return keys + [f"{key}:leases" for key in keys]
+
+
+def _read_counters(data: Dict[bytes, bytes]) -> Tuple[int, int, float]:
+    return int(data.get(b'requests', 0)), int(data.get(b'tokens', 0)), float(data.get(b'cost', 0.0))
+
+
 class UsageTracker:
     """Трекер использования AI согласно ТЗ"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        session_factory: Optional[Callable] = get_db_session,
+        flush_interval: Optional[float] = None,
+        flush_batch_size: Optional[int] = None,
+        max_keys: Optional[int] = None
+    ):
         self.redis_client: Optional[aioredis.Redis] = None
         self.daily_limits = {}
         self.monthly_limits = {}
+        self.session_factory = session_factory
+        
+        self.flush_interval = flush_interval or settings.USAGE_FLUSH_INTERVAL
+        self.flush_batch_size = flush_batch_size or settings.USAGE_FLUSH_BATCH_SIZE
+        self.max_keys = max_keys or settings.USAGE_BUFFER_MAX_KEYS
+        
+        # Отдельные буферы для Redis и БД: при сбое одного приемника
+        # повторно ставятся в очередь только его данные
+        self._redis_pending: Dict[BucketKey, Dict[str, Any]] = {}
+        self._db_pending: Dict[BucketKey, Dict[str, Any]] = {}
+        self._pending_events = 0
+        
+        # Затраты текущего дня и месяца - проверка лимитов, когда Redis недоступен
+        self._spent: Dict[str, float] = {}
+        # Резервы бюджетов к снятию при следующей записи в Redis
+        self._releases: List[Dict[str, Any]] = []
+        self._reserve_script = None
+        
+        self._flush_event = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        
+        self._dropped_events = 0
+        self._dropping = False
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._last_flush: Optional[datetime] = None
+        self._last_flush_duration = 0.0
     
     async def init_redis(self):
         """Инициализация Redis для real-time трекинга"""
@@ -38,6 +208,28 @@ class UsageTracker:
             logger.error(f"Failed to connect to Redis for usage tracking: {e}")
             self.redis_client = None
     
+    def start(self):
+        """Запуск фоновой записи буфера (в lifespan сервиса)"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run_flusher())
+    
+    async def aclose(self):
+        """Остановка фоновой записи и сброс остатка буфера"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        
+        await self.flush()
+        if self._redis_pending or self._db_pending:
+            logger.error(
+                f"Usage buffer not persisted on shutdown: "
+                f"{len(self._db_pending)} DB buckets, {len(self._redis_pending)} Redis buckets"
+            )
+    
     async def track_request(
         self,
         user_id: Optional[int],
@@ -49,159 +241,342 @@ class UsageTracker:
         completion_tokens: int,
         cost_usd: float,
         response_time: float,
-        success: bool = True
+        success: bool = True,
+        reservation: Optional[Dict[str, Any]] = None
     ):
-        """Отслеживание запроса к AI согласно ТЗ"""
+        """Отслеживание запроса к AI согласно ТЗ (reservation - резерв из reserve)"""
         
-        current_time = datetime.now()
-        today = current_time.date()
+        today = date.today()
+        key = (user_id, organization_id, provider.value, model, task_type.value, today)
+        event = {
+            "requests": 1,
+            "errors": 0 if success else 1,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": cost_usd,
+            "response_time": response_time
+        }
         
-        # Обновление счетчиков в Redis для real-time мониторинга
         if self.redis_client:
-            await self._update_redis_counters(
-                user_id, organization_id, provider, task_type, 
-                prompt_tokens + completion_tokens, cost_usd, today
-            )
+            self._buffer(self._redis_pending, key, event)
+        if self.session_factory:
+            self._buffer(self._db_pending, key, event)
+        self._pending_events += 1
         
-        # Проверка лимитов
-        if user_id or organization_id:
-            limit_exceeded = await self._check_limits(user_id, organization_id, cost_usd, today)
-            if limit_exceeded:
-                logger.warning(f"Usage limit exceeded for user {user_id}/org {organization_id}")
-        
-        # Агрегация данных для записи в БД (выполняется асинхронно)
-        asyncio.create_task(self._aggregate_daily_stats(
-            user_id, organization_id, provider, task_type, 
-            prompt_tokens + completion_tokens, cost_usd, response_time, success, today
-        ))
+        self._spend(user_id, organization_id, cost_usd, today)
+        self.release(reservation)
+        
+        if self._pending_events >= self.flush_batch_size:
+            self._flush_event.set()
+    
+    def _buffer(
+        self,
+        pending: Dict[BucketKey, Dict[str, Any]],
+        key: BucketKey,
+        values: Dict[str, Any]
+    ) -> bool:
+        """Объединить событие с буфером; новый ключ сверх лимита отбрасывается"""
+        bucket = pending.get(key)
+        if bucket is None:
+            if len(pending) >= self.max_keys:
+                if not self._dropping:
+                    logger.warning(f"Usage buffer is full ({self.max_keys} keys), dropping events")
+                    self._dropping = True
+                self._dropped_events += values["requests"]
+                return False
+            bucket = pending[key] = _new_bucket()
+        _merge_bucket(bucket, values)
+        return True
     
-    async def _update_redis_counters(
+    def _budgets(
         self,
         user_id: Optional[int],
         organization_id: Optional[int],
-        provider: AIProvider,
-        task_type: TaskType,
-        total_tokens: int,
-        cost_usd: float,
         date_key: date
-    ):
-        """Обновление счетчиков в Redis"""
-        try:
-            pipe = self.redis_client.pipeline()
-            date_str = date_key.isoformat()
-            
-            # Глобальные счетчики
-            pipe.hincrby(f"usage:global:{date_str}", "requests", 1)
-            pipe.hincrby(f"usage:global:{date_str}", "tokens", total_tokens)
-            pipe.hincrbyfloat(f"usage:global:{date_str}", "cost", cost_usd)
+    ) -> List[Tuple[str, str, float, int]]:
+        """Бюджеты запроса: (ключ счетчика, описание, лимит, TTL)"""
+        budgets = []
+        day = date_key.isoformat()
+        month = month_period(date_key)
+        
+        if user_id:
+            budgets.append((
+                f"usage:user:{user_id}:{day}", f"user {user_id} daily",
+                self.daily_limits.get(f"user:{user_id}", settings.DAILY_COST_LIMIT), DAILY_KEY_TTL
+            ))
+            if f"user:{user_id}" in self.monthly_limits:
+                budgets.append((
+                    f"usage:user:{user_id}:{month}", f"user {user_id} monthly",
+                    self.monthly_limits[f"user:{user_id}"], MONTHLY_KEY_TTL
+                ))
+        
+        if organization_id:
+            if f"org:{organization_id}" in self.daily_limits:
+                budgets.append((
+                    f"usage:org:{organization_id}:{day}", f"organization {organization_id} daily",
+                    self.daily_limits[f"org:{organization_id}"], DAILY_KEY_TTL
+                ))
+            budgets.append((
+                f"usage:org:{organization_id}:{month}", f"organization {organization_id} monthly",
+                self.monthly_limits.get(f"org:{organization_id}", settings.MONTHLY_COST_LIMIT), MONTHLY_KEY_TTL
+            ))
+        
+        return budgets
+    
+    def _check_limits(self, budgets: List[Tuple[str, str, float, int]], cost_usd: float) -> Optional[int]:
+        """Проверка лимитов по счетчикам в памяти (без Redis); индекс превышенного бюджета"""
+        for index, (key, _, limit, _) in enumerate(budgets):
+            if self._spent.get(key, 0.0) + cost_usd > limit:
+                return index
+        return None
+    
+    async def reserve(
+        self,
+        user_id: Optional[int],
+        organization_id: Optional[int],
+        estimated_cost: float
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Проверка бюджетов до вызова провайдера: один атомарный round-trip
+        в Redis независимо от даты. Оценка стоимости резервируется и
+        снимается, когда track_request запишет фактическую стоимость, или
+        через USAGE_RESERVATION_LEASE секунд, если снятие потеряно.
+        
+        Returns:
+            Резерв для передачи в track_request (None - резервировать нечего)
+        
+        Raises:
+            UsageLimitExceeded: бюджет будет превышен
+        """
+        budgets = self._budgets(user_id, organization_id, date.today())
+        if not budgets:
+            return None
+        
+        if self.redis_client:
+            try:
+                if self._reserve_script is None:
+                    self._reserve_script = self.redis_client.register_script(RESERVE_SCRIPT)
+                keys = [key for key, _, _, _ in budgets]
+                lease = f"{uuid.uuid4().hex}:{estimated_cost!r}"
+                now = time.time()
+                exceeded = await self._reserve_script(
+                    keys=_lease_keys(keys),
+                    args=[estimated_cost]
+                    + [limit for _, _, limit, _ in budgets]
+                    + [ttl for _, _, _, ttl in budgets]
+                    + [now, now + settings.USAGE_RESERVATION_LEASE, lease]
+                )
+                exceeded = int(exceeded) - 1
+                if exceeded < 0:
+                    return {"keys": keys, "amount": estimated_cost, "lease": lease}
+                _, scope, limit, _ = budgets[exceeded]
+                raise UsageLimitExceeded(scope, limit)
+            except UsageLimitExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to reserve usage budget in Redis: {e}")
+        
+        # Без Redis - по счетчикам этого экземпляра
+        exceeded = self._check_limits(budgets, estimated_cost)
+        if exceeded is not None:
+            _, scope, limit, _ = budgets[exceeded]
+            raise UsageLimitExceeded(scope, limit)
+        return None
+    
+    def release(self, reservation: Optional[Dict[str, Any]]):
+        """Снять резерв (вместе со следующей записью буфера в Redis)"""
+        if not reservation:
+            return
+        self._releases.append(reservation)
+    
+    def _spend(self, user_id: Optional[int], organization_id: Optional[int], cost_usd: float, date_key: date):
+        """Учет затрат текущего дня и месяца в памяти"""
+        for scope in ([f"user:{user_id}"] if user_id else []) + ([f"org:{organization_id}"] if organization_id else []):
+            for period in (date_key.isoformat(), month_period(date_key)):
+                key = f"usage:{scope}:{period}"
+                self._spent[key] = self._spent.get(key, 0.0) + cost_usd
+    
+    async def _run_flusher(self):
+        """Запись буфера по таймеру или по заполнению"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+    
+    async def flush(self) -> int:
+        """
+        Записать буфер в Redis и БД
+        
+        Returns:
+            Количество записанных ключей агрегации
+        """
+        async with self._flush_lock:
+            redis_batch, self._redis_pending = self._redis_pending, {}
+            db_batch, self._db_pending = self._db_pending, {}
+            releases, self._releases = self._releases, []
+            self._pending_events = 0
+            self._dropping = False
             
-            # Счетчики по провайдерам
-            pipe.hincrby(f"usage:provider:{provider.value}:{date_str}", "requests", 1)
-            pipe.hincrby(f"usage:provider:{provider.value}:{date_str}", "tokens", total_tokens)
-            pipe.hincrbyfloat(f"usage:provider:{provider.value}:{date_str}", "cost", cost_usd)
+            if not redis_batch and not db_batch and not releases:
+                return 0
             
-            # Счетчики по пользователям
-            if user_id:
-                pipe.hincrby(f"usage:user:{user_id}:{date_str}", "requests", 1)
-                pipe.hincrby(f"usage:user:{user_id}:{date_str}", "tokens", total_tokens)
-                pipe.hincrbyfloat(f"usage:user:{user_id}:{date_str}", "cost", cost_usd)
+            started = time.monotonic()
+            failed = False
             
-            # Счетчики по организациям
-            if organization_id:
-                pipe.hincrby(f"usage:org:{organization_id}:{date_str}", "requests", 1)
-                pipe.hincrby(f"usage:org:{organization_id}:{date_str}", "tokens", total_tokens)
-                pipe.hincrbyfloat(f"usage:org:{organization_id}:{date_str}", "cost", cost_usd)
+            if redis_batch or releases:
+                try:
+                    await self._flush_redis(redis_batch, releases)
+                except Exception as e:
+                    failed = True
+                    logger.error(f"Failed to flush usage counters to Redis: {e}")
+                    self._requeue(self._redis_pending, redis_batch)
+                    self._releases.extend(releases)
             
-            # Установка TTL (30 дней)
-            for key in [
-                f"usage:global:{date_str}",
-                f"usage:provider:{provider.value}:{date_str}",
-                f"usage:user:{user_id}:{date_str}" if user_id else None,
-                f"usage:org:{organization_id}:{date_str}" if organization_id else None
-            ]:
-                if key:
-                    pipe.expire(key, 30 * 24 * 3600)  # 30 дней
+            if db_batch:
+                try:
+                    await asyncio.to_thread(self._write_db, db_batch)
+                except Exception as e:
+                    failed = True
+                    logger.error(f"Failed to persist usage statistics: {e}")
+                    self._requeue(self._db_pending, db_batch)
             
-            await pipe.execute()
+            self._flushes += 1
+            if failed:
+                self._failed_flushes += 1
+            self._last_flush = datetime.now()
+            self._last_flush_duration = time.monotonic() - started
+            self._prune_spent()
             
-        except Exception as e:
-            logger.error(f"Failed to update Redis counters: {e}")
+            return max(len(redis_batch), len(db_batch))
     
-    async def _check_limits(
-        self,
-        user_id: Optional[int],
-        organization_id: Optional[int],
-        cost_usd: float,
-        date_key: date
-    ) -> bool:
-        """Проверка лимитов использования"""
-        
-        if not self.redis_client:
-            return False
+    def _requeue(self, pending: Dict[BucketKey, Dict[str, Any]], batch: Dict[BucketKey, Dict[str, Any]]):
+        """Вернуть неудавшийся пакет в буфер; повтор - со следующей записью по таймеру"""
+        for key, bucket in batch.items():
+            self._buffer(pending, key, bucket)
+    
+    async def _flush_redis(self, batch: Dict[BucketKey, Dict[str, Any]], releases: List[Dict[str, Any]]):
+        """
+        Обновление счетчиков в Redis одной транзакцией на пакет: дневные
+        счетчики и недельные/месячные сводки, снятие резервов бюджетов
+        """
+        counters: Dict[str, List[float]] = {}
         
-        try:
-            date_str = date_key.isoformat()
-            month_str = date_key.strftime("%Y-%m")
-            
-            # Проверка дневных лимитов пользователя
+        for (user_id, organization_id, provider, _, _, date_key), bucket in batch.items():
+            scopes = ["global", f"provider:{provider}"]
             if user_id:
-                daily_cost = await self.redis_client.hget(f"usage:user:{user_id}:{date_str}", "cost")
-                daily_cost = float(daily_cost) if daily_cost else 0.0
-                
-                # Получение лимита пользователя
-                user_daily_limit = self.daily_limits.get(f"user:{user_id}", settings.DAILY_COST_LIMIT)
-                
-                if daily_cost + cost_usd > user_daily_limit:
-                    return True
-            
-            # Проверка месячных лимитов организации
+                scopes.append(f"user:{user_id}")
             if organization_id:
-                monthly_cost = 0.0
+                scopes.append(f"org:{organization_id}")
+            
+            tokens = bucket["prompt_tokens"] + bucket["completion_tokens"]
+            for scope in scopes:
+                for period in (date_key.isoformat(), week_period(date_key), month_period(date_key)):
+                    totals = counters.setdefault(f"usage:{scope}:{period}", [0, 0, 0.0])
+                    totals[0] += bucket["requests"]
+                    totals[1] += tokens
+                    totals[2] += bucket["cost"]
+        
+        pipe = self.redis_client.pipeline()
+        for key, (requests, tokens, cost) in counters.items():
+            pipe.hincrby(key, "requests", requests)
+            pipe.hincrby(key, "tokens", tokens)
+            pipe.hincrbyfloat(key, "cost", cost)
+            if ":month:" in key:
+                pipe.expire(key, MONTHLY_KEY_TTL)
+            elif ":week:" in key:
+                pipe.expire(key, WEEKLY_KEY_TTL)
+            else:
+                pipe.expire(key, DAILY_KEY_TTL)
+        for reservation in releases:
+            keys = _lease_keys(reservation["keys"])
+            pipe.eval(RELEASE_SCRIPT, len(keys), *keys, reservation["lease"], reservation["amount"])
+        
+        await pipe.execute()
+    
+    def _prune_spent(self):
+        """Счетчики прошедших дней и месяцев больше не нужны"""
+        today = date.today()
+        current = (today.isoformat(), today.strftime("%Y-%m"))
+        for key in [key for key in self._spent if key.rsplit(":", 1)[1] not in current]:
+            del self._spent[key]
+    
+    def _write_db(self, batch: Dict[BucketKey, Dict[str, Any]]):
+        """
+        Запись пакета в БД (в отдельном потоке): строка AIUsage на ключ
+        агрегации и upsert дневной статистики UsageStatistics
+        """
+        daily: Dict[Tuple, Dict[str, Any]] = {}
+        
+        with self.session_factory() as db:
+            for (user_id, organization_id, provider, model, task_type, date_key), bucket in batch.items():
+                # ai_usage требует пользователя и организацию
+                if user_id and organization_id:
+                    db.add(AIUsage(
+                        user_id=user_id,
+                        organization_id=organization_id,
+                        ai_provider=provider,
+                        ai_model=model,
+                        operation_type=task_type,
+                        tokens_input=bucket["prompt_tokens"],
+                        tokens_output=bucket["completion_tokens"],
+                        cost_usd=bucket["cost"],
+                        response_time=bucket["response_time"] / bucket["requests"]
+                    ))
                 
-                # Суммирование стоимости за месяц
-                for day in range(1, 32):
-                    try:
-                        day_date = date_key.replace(day=day)
-                        if day_date.month != date_key.month:
-                            break
-                        
-                        day_str = day_date.isoformat()
-                        day_cost = await self.redis_client.hget(f"usage:org:{organization_id}:{day_str}", "cost")
-                        monthly_cost += float(day_cost) if day_cost else 0.0
-                        
-                    except ValueError:
-                        # Недопустимый день месяца
-                        break
+                stats_key = (date_key, user_id, organization_id, provider, task_type)
+                _merge_bucket(daily.setdefault(stats_key, _new_bucket()), bucket)
+            
+            for (date_key, user_id, organization_id, provider, task_type), bucket in daily.items():
+                day_start = datetime.combine(date_key, datetime.min.time())
+                row = db.query(UsageStatistics).filter(
+                    UsageStatistics.date == day_start,
+                    UsageStatistics.user_id == user_id,
+                    UsageStatistics.organization_id == organization_id,
+                    UsageStatistics.provider == AIProviderEnum(provider),
+                    UsageStatistics.task_type == TaskTypeEnum(task_type)
+                ).with_for_update().first()
                 
-                org_monthly_limit = self.monthly_limits.get(f"org:{organization_id}", settings.MONTHLY_COST_LIMIT)
+                if row is None:
+                    row = UsageStatistics(
+                        date=day_start,
+                        user_id=user_id,
+                        organization_id=organization_id,
+                        provider=AIProviderEnum(provider),
+                        task_type=TaskTypeEnum(task_type),
+                        total_requests=0,
+                        total_tokens=0,
+                        total_cost=0.0,
+                        average_response_time=0.0,
+                        error_count=0
+                    )
+                    db.add(row)
                 
-                if monthly_cost + cost_usd > org_monthly_limit:
-                    return True
-            
-            return False
-            
-        except Exception as e:
-            logger.error(f"Failed to check limits: {e}")
-            return False
+                previous_requests = row.total_requests or 0
+                total_requests = previous_requests + bucket["requests"]
+                row.average_response_time = (
+                    (row.average_response_time or 0.0) * previous_requests + bucket["response_time"]
+                ) / total_requests
+                row.total_requests = total_requests
+                row.total_tokens = (row.total_tokens or 0) + bucket["prompt_tokens"] + bucket["completion_tokens"]
+                row.total_cost = (row.total_cost or 0.0) + bucket["cost"]
+                row.error_count = (row.error_count or 0) + bucket["errors"]
     
-    async def _aggregate_daily_stats(
-        self,
-        user_id: Optional[int],
-        organization_id: Optional[int],
-        provider: AIProvider,
-        task_type: TaskType,
-        total_tokens: int,
-        cost_usd: float,
-        response_time: float,
-        success: bool,
-        date_key: date
-    ):
-        """Агрегация дневной статистики для записи в БД"""
-        
-        # Эта функция будет вызываться периодически для агрегации данных
-        # Пока просто логируем для отладки
-        logger.debug(f"Aggregating stats: user={user_id}, org={organization_id}, "
-                    f"provider={provider.value}, tokens={total_tokens}, cost=${cost_usd:.4f}")
+    def get_buffer_stats(self) -> Dict[str, Any]:
+        """Метрики буфера использования"""
+        return {
+            "db_buffered_keys": len(self._db_pending),
+            "redis_buffered_keys": len(self._redis_pending),
+            "pending_events": self._pending_events,
+            "max_keys": self.max_keys,
+            "dropped_events": self._dropped_events,
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes,
+            "last_flush": self._last_flush.isoformat() if self._last_flush else None,
+            "last_flush_duration": round(self._last_flush_duration, 4)
+        }
     
     async def get_usage_stats(
         self,
@@ -209,9 +584,15 @@ class UsageTracker:
         organization_id: Optional[int] = None,
         start_date: Optional[date] = None,
         end_date: Optional[date] = None,
-        provider: Optional[AIProvider] = None
+        provider: Optional[AIProvider] = None,
+        daily: bool = True
     ) -> Dict[str, Any]:
-        """Получение статистики использования"""
+        """
+        Получение статистики использования
+        
+        Итоги считаются по месячным и недельным сводкам, разбивка по дням
+        (daily) - по дневным счетчикам; все чтения одним pipeline.
+        """
         
         if not start_date:
             start_date = date.today() - timedelta(days=30)
@@ -236,38 +617,45 @@ class UsageTracker:
         
         if self.redis_client:
             try:
-                # Получение данных из Redis
-                current_date = start_date
-                while current_date <= end_date:
-                    date_str = current_date.isoformat()
-                    
-                    # Определение ключа для запроса
-                    if user_id:
-                        key = f"usage:user:{user_id}:{date_str}"
-                    elif organization_id:
-                        key = f"usage:org:{organization_id}:{date_str}"
-                    else:
-                        key = f"usage:global:{date_str}"
-                    
-                    day_data = await self.redis_client.hgetall(key)
-                    
-                    if day_data:
-                        requests = int(day_data.get(b'requests', 0))
-                        tokens = int(day_data.get(b'tokens', 0))
-                        cost = float(day_data.get(b'cost', 0.0))
-                        
+                # Определение ключа для запроса
+                if user_id:
+                    scope = f"user:{user_id}"
+                elif organization_id:
+                    scope = f"org:{organization_id}"
+                elif provider:
+                    scope = f"provider:{provider.value}"
+                else:
+                    scope = "global"
+                
+                periods = cover_range(start_date, end_date)
+                days = []
+                if daily:
+                    current_date = start_date
+                    while current_date <= end_date:
+                        days.append(current_date.isoformat())
+                        current_date += timedelta(days=1)
+                
+                pipe = self.redis_client.pipeline()
+                for period in periods + days:
+                    pipe.hgetall(f"usage:{scope}:{period}")
+                results = await pipe.execute()
+                
+                for data in results[:len(periods)]:
+                    if data:
+                        requests, tokens, cost = _read_counters(data)
                         stats["summary"]["total_requests"] += requests
                         stats["summary"]["total_tokens"] += tokens
                         stats["summary"]["total_cost"] += cost
-                        
+                
+                for date_str, data in zip(days, results[len(periods):]):
+                    if data:
+                        requests, tokens, cost = _read_counters(data)
                         stats["daily_breakdown"].append({
                             "date": date_str,
                             "requests": requests,
                             "tokens": tokens,
                             "cost": cost
                         })
-                    
-                    current_date += timedelta(days=1)
                 
             except Exception as e:
                 logger.error(f"Failed to get usage stats from Redis: {e}")
@@ -285,6 +673,7 @@ class UsageTracker:
                 "cost": 0.0
             },
             "providers": {},
+            "buffer": self.get_buffer_stats(),
             "last_updated": datetime.now().isoformat()
         }
         
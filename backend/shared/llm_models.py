@@ -233,4 +233,66 @@ class PromptUsage(Base, TimestampMixin):
     
     # Связи
     template = relationship("PromptTemplate")
-    request = relationship("AIRequest")
\ No newline at end of file
+    request = relationship("AIRequest")
+
+class AIBatchJob(Base, TimestampMixin):
+    """Модель пакетного задания к Batch API провайдера"""
+    __tablename__ = "ai_batch_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String(50), unique=True, index=True, nullable=False)
+    provider = Column(Enum(AIProviderEnum), nullable=False)
+    model_name = Column(String(100), nullable=False)
+    backend = Column(String(20), nullable=False)  # provider, local
+    provider_batch_id = Column(String(100), nullable=True, index=True)
+    
+    # Статус
+    status = Column(String(20), default="pending")  # pending, submitted, completed, failed, cancelled
+    error_message = Column(Text, nullable=True)
+    submitted_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Итоги
+    total_items = Column(Integer, default=0)
+    completed_items = Column(Integer, default=0)
+    failed_items = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    total_cost = Column(Float, default=0.0)
+    
+    # Пользователь и организация
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=True)
+    
+    # Связи
+    items = relationship("AIBatchItem", back_populates="job", cascade="all, delete-orphan")
+    user = relationship("User")
+    organization = relationship("Organization")
+
+class AIBatchItem(Base, TimestampMixin):
+    """Модель отдельного запроса в пакетном задании"""
+    __tablename__ = "ai_batch_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("ai_batch_jobs.id"), nullable=False, index=True)
+    custom_id = Column(String(100), unique=True, index=True, nullable=False)
+    analysis_id = Column(Integer, ForeignKey("analyses.id"), nullable=True, index=True)
+    task_type = Column(Enum(TaskTypeEnum), nullable=False)
+    
+    # Запрос
+    system_prompt = Column(Text, nullable=True)
+    user_prompt = Column(Text, nullable=False)
+    temperature = Column(Float, nullable=True)
+    max_tokens = Column(Integer, nullable=True)
+    
+    # Результат
+    status = Column(String(20), default="pending")  # pending, completed, failed
+    response_content = Column(Text, nullable=True)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cost_usd = Column(Float, default=0.0)
+    error_message = Column(Text, nullable=True)
+    
+    # Связи
+    job = relationship("AIBatchJob", back_populates="items")
+    analysis = relationship("Analysis")
\ No newline at end of file
@@ -77,6 +77,12 @@ class StreamChunk(BaseModel):
     is_complete: bool = False
     tokens_used: int = 0
     error: Optional[str] = None
+    # metadata["response_format"] == "json": поля верхнего уровня, закрывшиеся в этом чанке,
+    # и разобранный объект целиком в последнем чанке
+    fields: Optional[Dict[str, Any]] = None
+    parsed: Optional[Dict[str, Any]] = None
+    # Последний чанк: провайдер, модель, токены и стоимость генерации
+    usage: Optional[Dict[str, Any]] = None
 
 class PromptTemplate(BaseModel):
     """Шаблон промпта согласно ТЗ раздел 4.2.2"""
@@ -164,6 +170,14 @@ class KPAnalysisResponse(BaseModel):
     total_cost: float
     created_at: datetime
 
+class BatchJobRequest(BaseModel):
+    """Пакетное задание к Batch API (массовая переоценка КП)"""
+    requests: List[AIRequest] = Field(min_length=1)
+    model: str
+    analysis_ids: Optional[List[Optional[int]]] = None  # Анализ для каждого запроса
+    user_id: Optional[int] = None
+    organization_id: Optional[int] = None
+
 class ErrorResponse(BaseModel):
     """Стандартизированный ответ об ошибке"""
     error_code: str
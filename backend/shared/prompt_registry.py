@@ -0,0 +1,163 @@
+"""
+Реестр скомпилированных шаблонов промптов
+Общий для PromptManager LLM сервиса и файлового менеджера prompts/:
+шаблон разбирается один раз при загрузке, плейсхолдеры проверяются заранее,
+хеш содержимого служит версией промпта в ключах кеша ответов LLM.
+"""
+import hashlib
+import logging
+import threading
+from string import Formatter
+from typing import Dict, Any, List, Optional, Iterable, Mapping, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Длина версии - префикс sha256 содержимого шаблона
+VERSION_LENGTH = 12
+
+_CONVERSIONS = {"r": repr, "s": str, "a": ascii}
+
+
+class PromptTemplateError(ValueError):
+    """Некорректный шаблон промпта"""
+    pass
+
+
+def content_version(*texts: Optional[str]) -> str:
+    """Версия промпта по его содержимому"""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update((text or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:VERSION_LENGTH]
+
+
+class CompiledTemplate:
+    """Шаблон, разобранный на литеральные части и плейсхолдеры"""
+
+    __slots__ = ("key", "text", "version", "placeholders", "_parts")
+
+    def __init__(self, key: str, text: str):
+        self.key = key
+        self.text = text
+        self.version = content_version(text)
+
+        parts: List[Tuple[str, Optional[str], str, Optional[str]]] = []
+        try:
+            parsed = list(Formatter().parse(text))
+        except ValueError as e:
+            raise PromptTemplateError(f"Template {key}: {e}")
+
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None and not field.isidentifier():
+                # {0}, {} и {obj.attr} в промптах не используются - скорее всего опечатка
+                raise PromptTemplateError(f"Template {key}: unsupported placeholder {{{field}}}")
+            parts.append((literal, field, format_spec or "", conversion))
+
+        self._parts = parts
+        self.placeholders = frozenset(field for _, field, _, _ in parts if field)
+
+    def render(self, variables: Mapping[str, Any]) -> str:
+        """
+        Подстановка переменных. Строковые значения (ТЗ, КП на сотни килобайт)
+        попадают в результат без промежуточных копий - одна сборка через join.
+        """
+        missing = self.placeholders - variables.keys()
+        if missing:
+            raise KeyError(sorted(missing)[0])
+
+        pieces: List[str] = []
+        for literal, field, format_spec, conversion in self._parts:
+            if literal:
+                pieces.append(literal)
+            if field is None:
+                continue
+            value = variables[field]
+            if conversion:
+                value = _CONVERSIONS[conversion](value)
+            if isinstance(value, str) and not format_spec:
+                pieces.append(value)
+            else:
+                pieces.append(format(value, format_spec))
+        return "".join(pieces)
+
+
+class PromptRegistry:
+    """Скомпилированные шаблоны по ключу "модуль/имя" """
+
+    def __init__(self):
+        self._templates: Dict[str, CompiledTemplate] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        key: str,
+        text: str,
+        variables: Optional[Iterable[str]] = None
+    ) -> CompiledTemplate:
+        """
+        Скомпилировать и зарегистрировать шаблон
+
+        Args:
+            key: Ключ шаблона ("kp_analyzer/compare_tz_with_kp")
+            text: Текст шаблона с плейсхолдерами {name}
+            variables: Объявленные переменные - должны совпадать с плейсхолдерами
+
+        Raises:
+            PromptTemplateError: синтаксическая ошибка или расхождение с variables
+        """
+        current = self._templates.get(key)
+        if current is not None and current.text == text:
+            compiled = current
+        else:
+            compiled = CompiledTemplate(key, text)
+
+        if variables is not None:
+            declared = set(variables)
+            if declared != compiled.placeholders:
+                raise PromptTemplateError(
+                    f"Template {key}: placeholders {sorted(compiled.placeholders)} "
+                    f"do not match declared variables {sorted(declared)}"
+                )
+
+        if compiled is not current:
+            with self._lock:
+                self._templates[key] = compiled
+            if current is not None:
+                logger.info(f"Prompt {key} changed: {current.version} -> {compiled.version}")
+
+        return compiled
+
+    def unregister_prefix(self, prefix: str):
+        """Удалить шаблоны модуля (при перезагрузке файла промптов)"""
+        with self._lock:
+            for key in [key for key in self._templates if key.startswith(prefix)]:
+                del self._templates[key]
+
+    def get(self, key: str) -> Optional[CompiledTemplate]:
+        return self._templates.get(key)
+
+    def version(self, key: Optional[str]) -> Optional[str]:
+        """Версия шаблона для ключа кеша; None - шаблон не зарегистрирован"""
+        compiled = self._templates.get(key) if key else None
+        return compiled.version if compiled else None
+
+    def render(self, key: str, variables: Mapping[str, Any]) -> str:
+        compiled = self._templates.get(key)
+        if compiled is None:
+            raise KeyError(f"Template {key} is not registered")
+        return compiled.render(variables)
+
+    def versions(self) -> Dict[str, str]:
+        return {key: compiled.version for key, compiled in self._templates.items()}
+
+
+_registry: Optional[PromptRegistry] = None
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """Общий реестр процесса"""
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
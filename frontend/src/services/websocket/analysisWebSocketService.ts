@@ -7,25 +7,37 @@
 import { getBackendApiUrl } from '../../config/app';
 
 export interface AnalysisProgressMessage {
-  type: 'progress' | 'completed' | 'error' | 'keepalive';
+  type: 'progress' | 'partial' | 'section' | 'completed' | 'error' | 'cancelled' | 'gap' | 'keepalive';
+  event_id?: number;
   stage?: string;
   message?: string;
   progress?: number;
+  fields?: Record<string, any>;
+  section?: string;
+  data?: any;
   result?: any;
   error?: string;
+  reason?: string;
   timestamp: string;
 }
 
 export interface AnalysisProgressCallbacks {
   onProgress?: (stage: string, message: string, progress: number) => void;
+  onPartial?: (stage: string, fields: Record<string, any>) => void;
+  onSection?: (section: string, data: any) => void;
   onCompleted?: (result: any) => void;
   onError?: (error: string) => void;
+  onCancelled?: (reason: string) => void;
   onDisconnected?: () => void;
 }
 
+const MAX_RECONNECT_ATTEMPTS = 5;
+
 class AnalysisWebSocketService {
   private connections: Map<string, WebSocket> = new Map();
   private callbacks: Map<string, AnalysisProgressCallbacks> = new Map();
+  // Last received event per analysis - reconnect resumes after it
+  private lastEventIds: Map<string, number> = new Map();
 
   /**
    * Start analysis with real-time progress updates
@@ -35,7 +47,10 @@ class AnalysisWebSocketService {
     callbacks: AnalysisProgressCallbacks,
     model: string = 'claude-3-5-sonnet-20241022'
   ): Promise<string> {
-    // Start the analysis
+    // Subscribe first so partial results arrive while the analysis is running
+    const analysisId = crypto.randomUUID();
+    this.connectToAnalysis(analysisId, callbacks);
+
     const response = await fetch(`${getBackendApiUrl()}/api/llm/analyze-with-progress`, {
       method: 'POST',
       headers: {
@@ -46,36 +61,30 @@ class AnalysisWebSocketService {
         model,
         max_tokens: 2000,
         temperature: 0.1,
+        analysis_id: analysisId,
       }),
     });
 
     if (!response.ok) {
+      this.disconnect(analysisId);
       throw new Error(`Failed to start analysis: ${response.status}`);
     }
 
-    const result = await response.json();
-    const analysisId = result.analysis_id;
-
-    if (!analysisId) {
-      throw new Error('No analysis ID returned from server');
-    }
-
-    // Connect to WebSocket for progress updates
-    this.connectToAnalysis(analysisId, callbacks);
-
     return analysisId;
   }
 
   /**
    * Connect to WebSocket for specific analysis
    */
-  private connectToAnalysis(analysisId: string, callbacks: AnalysisProgressCallbacks) {
+  private connectToAnalysis(analysisId: string, callbacks: AnalysisProgressCallbacks, attempt: number = 0) {
     const backendUrl = getBackendApiUrl();
     const wsUrl = backendUrl.replace('http', 'ws');
+    const lastEventId = this.lastEventIds.get(analysisId) ?? 0;
+    let finished = false;
     
     console.log(`🔌 Connecting to WebSocket: ${wsUrl}/ws/analysis/${analysisId}`);
     
-    const ws = new WebSocket(`${wsUrl}/ws/analysis/${analysisId}`);
+    const ws = new WebSocket(`${wsUrl}/ws/analysis/${analysisId}?last_event_id=${lastEventId}`);
     
     ws.onopen = () => {
       console.log(`✅ WebSocket connected for analysis ${analysisId}`);
@@ -87,6 +96,9 @@ class AnalysisWebSocketService {
     ws.onmessage = (event) => {
       try {
         const message: AnalysisProgressMessage = JSON.parse(event.data);
+        if (message.event_id !== undefined) {
+          this.lastEventIds.set(analysisId, message.event_id);
+        }
         
         switch (message.type) {
           case 'progress':
@@ -95,7 +107,20 @@ class AnalysisWebSocketService {
             }
             break;
             
+          case 'partial':
+            if (callbacks.onPartial && message.stage && message.fields) {
+              callbacks.onPartial(message.stage, message.fields);
+            }
+            break;
+            
+          case 'section':
+            if (callbacks.onSection && message.section) {
+              callbacks.onSection(message.section, message.data);
+            }
+            break;
+            
           case 'completed':
+            finished = true;
             if (callbacks.onCompleted && message.result) {
               callbacks.onCompleted(message.result);
             }
@@ -104,12 +129,22 @@ class AnalysisWebSocketService {
             break;
             
           case 'error':
+            finished = true;
             if (callbacks.onError && message.error) {
               callbacks.onError(message.error);
             }
             this.disconnect(analysisId);
             break;
             
+          case 'cancelled':
+            // Analysis aborted on the server (client left or cancel requested)
+            finished = true;
+            if (callbacks.onCancelled) {
+              callbacks.onCancelled(message.reason || 'cancelled');
+            }
+            this.disconnect(analysisId);
+            break;
+            
           case 'keepalive':
             // Send pong response to keep connection alive
             if (ws.readyState === WebSocket.OPEN) {
@@ -124,8 +159,21 @@ class AnalysisWebSocketService {
     
     ws.onclose = (event) => {
       console.log(`🔌 WebSocket closed for analysis ${analysisId}`, event.code);
+      
+      // Dropped mid-analysis: reconnect and receive missed events from the server buffer
+      const dropped = !finished && this.connections.get(analysisId) === ws;
+      if (dropped && attempt < MAX_RECONNECT_ATTEMPTS) {
+        setTimeout(() => this.connectToAnalysis(analysisId, callbacks, attempt + 1), 1000 * 2 ** attempt);
+        return;
+      }
+      
       this.connections.delete(analysisId);
       this.callbacks.delete(analysisId);
+      this.lastEventIds.delete(analysisId);
+      
+      if (dropped && callbacks.onError) {
+        callbacks.onError(`WebSocket connection failed`);
+      }
       
       if (callbacks.onDisconnected) {
         callbacks.onDisconnected();
@@ -134,10 +182,6 @@ class AnalysisWebSocketService {
     
     ws.onerror = (error) => {
       console.error(`❌ WebSocket error for analysis ${analysisId}:`, error);
-      if (callbacks.onError) {
-        callbacks.onError(`WebSocket connection failed`);
-      }
-      this.disconnect(analysisId);
     };
     
     // Store connection and callbacks
@@ -156,6 +200,7 @@ class AnalysisWebSocketService {
       }
       this.connections.delete(analysisId);
       this.callbacks.delete(analysisId);
+      this.lastEventIds.delete(analysisId);
     }
   }
 